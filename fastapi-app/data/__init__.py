@@ -1,2 +1,5 @@
-__all__ = ["database", "utils", "userbase", "dynamic_databases"]
-from . import *
\ No newline at end of file
+# utils has to be initialised first, as it imports the databases itself (e.g. for `python -m data.<module>`)
+import utils
+
+__all__ = ["database", "utils", "userbase", "dynamic_databases", "orders", "bars"]
+from . import *
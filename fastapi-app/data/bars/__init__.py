@@ -0,0 +1,2 @@
+__all__ = ["providers", "store"]
+from . import *
\ No newline at end of file
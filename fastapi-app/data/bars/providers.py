@@ -0,0 +1,71 @@
+from typing import Union
+from datetime import datetime
+from enum import Enum
+
+import numpy as np
+import yfinance as yf
+
+# A bar as stored on disk: the bar's opening time (UTC) and its prices and volume
+BAR_DTYPE = np.dtype([
+    ("time", "datetime64[s]"),
+    ("open", np.double),
+    ("high", np.double),
+    ("low", np.double),
+    ("close", np.double),
+    ("volume", np.double),
+])
+
+class BarIntervals(Enum):
+    """
+    Enumeration of the supported bar intervals, named as yfinance names them.
+
+    Attributes:
+        day (str): Daily bars.
+        hour (str): Hourly bars, yfinance serves the last 730 days of them.
+        minutes_15 (str): 15 minute bars, yfinance serves the last 60 days of them.
+        minutes_5 (str): 5 minute bars, yfinance serves the last 60 days of them.
+        minute (str): 1 minute bars, yfinance serves the last 7 days of them.
+    """
+    day = "1d"
+    hour = "1h"
+    minutes_15 = "15m"
+    minutes_5 = "5m"
+    minute = "1m"
+
+INTERVAL_DURATIONS = {
+    BarIntervals.day.value: np.timedelta64(1, "D"),
+    BarIntervals.hour.value: np.timedelta64(1, "h"),
+    BarIntervals.minutes_15.value: np.timedelta64(15, "m"),
+    BarIntervals.minutes_5.value: np.timedelta64(5, "m"),
+    BarIntervals.minute.value: np.timedelta64(1, "m"),
+}
+
+def empty_bars() -> np.ndarray:
+    return np.empty(0, dtype=BAR_DTYPE)
+
+class BarProvider:
+    """
+    Where the bar store fetches the bars it does not have yet.
+    The store only talks to a provider, so a local fake can be plugged in instead of yfinance.
+    """
+    def get_bars(self, symbol: str, interval: str, start: datetime, end: datetime) -> Union[np.ndarray, None]:
+        """
+        Returns the bars of a symbol opening in [start, end) (naive UTC datetimes) as an array of `BAR_DTYPE` sorted
+        by time, or None if they could not be fetched. No bars (e.g. a range of holidays) is an empty array.
+        """
+        raise NotImplementedError
+
+class YFinanceBarProvider(BarProvider):
+    def get_bars(self, symbol: str, interval: str, start: datetime, end: datetime) -> Union[np.ndarray, None]:
+        history = yf.Ticker(symbol).history(interval=interval, start=start, end=end, auto_adjust=False, raise_errors=True)
+        bars = np.empty(len(history), dtype=BAR_DTYPE)
+        if len(history) == 0:
+            return bars
+        index = history.index
+        if index.tz is not None:
+            # Daily bars are kept at midnight of their trading day, intraday bars at their UTC time
+            index = index.tz_localize(None) if interval == BarIntervals.day.value else index.tz_convert("UTC").tz_localize(None)
+        bars["time"] = index.values.astype("datetime64[s]")
+        for name in ("open", "high", "low", "close", "volume"):
+            bars[name] = history[name.capitalize()].to_numpy(dtype=np.double)
+        return bars
@@ -0,0 +1,219 @@
+"""
+Local store of historical OHLCV bars.
+
+Bars are kept per interval and symbol in a NumPy file (`<path>/<interval>/<SYMBOL>.npy`, an array of `BAR_DTYPE`
+sorted by time), next to the time range it covers (`<SYMBOL>.json`). A request only fetches the parts of its range
+outside the covered one from the provider: the older bars before it, and the newer bars after it starting
+with the last covered bar, which may have still been forming when it was fetched. The covered range is always
+contiguous, so a request far from it fetches the gap as well.
+
+Files are opened memory mapped and read only, requests get slices of them: views that share the mapping, so
+charts and analytics read the bars without copying them. A file is rewritten to a temporary file and moved into
+place, so views handed out earlier keep the bars they were given.
+"""
+from typing import Optional, Union
+from collections import OrderedDict
+from datetime import datetime, timezone
+import json
+import os
+import threading
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.keyed_lock import KeyedLock
+from utils.env_variables import BAR_STORE_PATH, BAR_STORE_REFRESH
+from data.bars.providers import BarProvider, YFinanceBarProvider, BarIntervals, INTERVAL_DURATIONS, empty_bars
+
+# The range served when a request does not give a start
+DEFAULT_LOOKBACKS = {
+    BarIntervals.day.value: np.timedelta64(365, "D"),
+    BarIntervals.hour.value: np.timedelta64(30, "D"),
+    BarIntervals.minutes_15.value: np.timedelta64(5, "D"),
+    BarIntervals.minutes_5.value: np.timedelta64(5, "D"),
+    BarIntervals.minute.value: np.timedelta64(1, "D"),
+}
+
+TimeLike = Union[datetime, np.datetime64, str]
+
+def to_datetime64(value: TimeLike) -> np.datetime64:
+    """ Converts a naive UTC datetime, a NumPy datetime or an ISO string to a NumPy datetime in seconds. """
+    return np.datetime64(value, "s")
+
+class BarStore:
+    """
+    Store of historical bars, fetching what it does not have from a provider.
+
+    Args:
+        path (str): Folder of the bar files.
+        provider (BarProvider): Where missing bars are fetched from.
+        refresh (float): Seconds after which the newest bars are fetched again.
+        max_open (int): Number of files kept memory mapped, least recently used first out.
+    """
+    def __init__(self, path: str, provider: BarProvider, refresh: float, max_open: int = 512):
+        self.path = path
+        self.provider = provider
+        self.refresh = np.timedelta64(int(refresh), "s")
+        self.max_open = max_open
+        self.stats = {"hits": 0, "fetches": 0, "fetched_bars": 0, "errors": 0}
+        # (interval, symbol) -> (bars, (covered start, covered end)) of the open files
+        self._open: OrderedDict[tuple[str, str], tuple[np.ndarray, Optional[tuple[np.datetime64, np.datetime64]]]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Fetches and writes of the same file run one at a time
+        self._file_locks = KeyedLock()
+
+    def set_provider(self, provider: BarProvider) -> None:
+        self.provider = provider
+
+    def _files(self, interval: str, symbol: str) -> tuple[str, str]:
+        folder = os.path.join(self.path, interval)
+        return os.path.join(folder, f"{symbol}.npy"), os.path.join(folder, f"{symbol}.json")
+
+    def _read(self, interval: str, symbol: str) -> tuple[np.ndarray, Optional[tuple[np.datetime64, np.datetime64]]]:
+        """ Get the bars and covered range of a file, opening it if it is not open yet. """
+        key = (interval, symbol)
+        with self._lock:
+            entry = self._open.get(key)
+            if entry is not None:
+                self._open.move_to_end(key)
+                return entry
+
+        bars_file, coverage_file = self._files(interval, symbol)
+        try:
+            with open(coverage_file) as file:
+                start, end = json.load(file)
+            entry = (np.load(bars_file, mmap_mode="r"), (to_datetime64(start), to_datetime64(end)))
+        except FileNotFoundError:
+            entry = (empty_bars(), None)
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: tuple[str, str], entry: tuple) -> None:
+        with self._lock:
+            self._open[key] = entry
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+
+    def _write(self, interval: str, symbol: str, bars: np.ndarray, coverage: tuple[np.datetime64, np.datetime64]) -> np.ndarray:
+        """ Replaces a file's bars and covered range, returns the new bars memory mapped. """
+        bars_file, coverage_file = self._files(interval, symbol)
+        os.makedirs(os.path.dirname(bars_file), exist_ok=True)
+        # The bars are moved into place first, a crash before the range is written only makes it fetch them again
+        with open(f"{bars_file}.tmp", "wb") as file:
+            np.save(file, bars)
+        os.replace(f"{bars_file}.tmp", bars_file)
+        with open(f"{coverage_file}.tmp", "w") as file:
+            json.dump([str(coverage[0]), str(coverage[1])], file)
+        os.replace(f"{coverage_file}.tmp", coverage_file)
+
+        mapped = np.load(bars_file, mmap_mode="r")
+        self._remember((interval, symbol), (mapped, coverage))
+        return mapped
+
+    def _missing_ranges(self, interval: str, coverage: Optional[tuple[np.datetime64, np.datetime64]],
+                        start: np.datetime64, end: np.datetime64) -> list[tuple[np.datetime64, np.datetime64]]:
+        if coverage is None:
+            return [(start, end)]
+        covered_start, covered_end = coverage
+        missing = []
+        if start < covered_start:
+            missing.append((start, covered_start))
+        if end > covered_end + self.refresh:
+            # From the last covered bar on, it may have been fetched before it closed
+            missing.append((covered_end - INTERVAL_DURATIONS[interval], end))
+        return missing
+
+    @staticmethod
+    def _merge(bars: np.ndarray, fetched: np.ndarray, start: np.datetime64, end: np.datetime64) -> np.ndarray:
+        """ Replaces the bars in [start, end) with the fetched bars, newer bars win if both have the same time. """
+        kept = bars[(bars["time"] < start) | (bars["time"] >= end)]
+        merged = np.concatenate((kept, fetched.astype(bars.dtype, copy=False)))
+        merged = merged[np.argsort(merged["time"], kind="stable")]
+        last_of_each_time = np.append(merged["time"][1:] != merged["time"][:-1], True)
+        return merged[last_of_each_time]
+
+    def get_bars(self, symbol: str, interval: str = BarIntervals.day.value,
+                 start: Optional[TimeLike] = None, end: Optional[TimeLike] = None) -> Union[np.ndarray, None]:
+        """
+        Get the bars of a symbol opening in [start, end), fetching the ones the store does not have yet.
+
+        Args:
+            symbol (str): The symbol.
+            interval (str): The bar interval, a value of `BarIntervals`.
+            start (TimeLike, optional): Naive UTC start. Defaults to a lookback from the end that depends on the interval.
+            end (TimeLike, optional): Naive UTC end. Defaults to (and is capped at) now.
+
+        Returns:
+            Union[np.ndarray, None]: A read only view of the stored bars (an array of `BAR_DTYPE` sorted by time),
+                                     or None if the interval is invalid or no bars could be fetched.
+                                     If only part of the range could be fetched, the stored part is returned.
+        """
+        if interval not in INTERVAL_DURATIONS:
+            logger.error(f"Invalid bar interval {interval}")
+            return None
+        symbol = symbol.upper()
+        now = to_datetime64(datetime.now(timezone.utc).replace(tzinfo=None))
+        end = now if end is None else min(to_datetime64(end), now)
+        start = end - DEFAULT_LOOKBACKS[interval] if start is None else to_datetime64(start)
+
+        bars, coverage = self._read(interval, symbol)
+        if self._missing_ranges(interval, coverage, start, end):
+            with self._file_locks.hold((interval, symbol)):
+                # Another request may have fetched the bars while this one waited
+                bars, coverage = self._read(interval, symbol)
+                missing = self._missing_ranges(interval, coverage, start, end)
+                if missing:
+                    bars, coverage = self._fetch(interval, symbol, bars, coverage, missing)
+        else:
+            self.stats["hits"] += 1
+
+        if coverage is None:
+            return None
+        first, last = np.searchsorted(bars["time"], [start, end])
+        return bars[first:last]
+
+    def _fetch(self, interval: str, symbol: str, bars: np.ndarray, coverage: Optional[tuple[np.datetime64, np.datetime64]],
+               missing: list[tuple[np.datetime64, np.datetime64]]) -> tuple[np.ndarray, Optional[tuple[np.datetime64, np.datetime64]]]:
+        """ Fetches the missing ranges and stores them, returns the stored bars and covered range. """
+        merged = np.asarray(bars)
+        new_coverage = coverage
+        for fetch_start, fetch_end in missing:
+            try:
+                fetched = self.provider.get_bars(symbol, interval, fetch_start.astype(datetime), fetch_end.astype(datetime))
+            except Exception as error:
+                fetched = None
+                logger.error(f"Failed to fetch {interval} bars of {symbol} from {fetch_start} to {fetch_end}. Error: {error}")
+            self.stats["fetches"] += 1
+            if fetched is None:
+                self.stats["errors"] += 1
+                # Ranges are only stored if they stay contiguous with the covered range
+                break
+            self.stats["fetched_bars"] += len(fetched)
+            merged = self._merge(merged, fetched, fetch_start, fetch_end)
+            new_coverage = (fetch_start, fetch_end) if new_coverage is None else (min(new_coverage[0], fetch_start), max(new_coverage[1], fetch_end))
+
+        if new_coverage == coverage:
+            return bars, coverage
+        logger.debug(f"Stored {len(merged)} {interval} bars of {symbol} covering {new_coverage[0]} to {new_coverage[1]}")
+        return self._write(interval, symbol, merged, new_coverage), new_coverage
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """ Closes the files of a symbol (or every file), they are opened again from disk on the next request. """
+        with self._lock:
+            if symbol is None:
+                self._open.clear()
+            else:
+                for key in [key for key in self._open if key[1] == symbol.upper()]:
+                    del self._open[key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            open_files = len(self._open)
+        return {**self.stats, "open_files": open_files, "max_open": self.max_open, "path": os.path.abspath(self.path)}
+
+bar_store = BarStore(path=BAR_STORE_PATH, provider=YFinanceBarProvider(), refresh=float(BAR_STORE_REFRESH))
+
+def set_bar_provider(provider: BarProvider) -> None:
+    """ Replaces the provider of the process-wide bar store, e.g. with a fake for tests and benchmarks. """
+    bar_store.set_provider(provider)
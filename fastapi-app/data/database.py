@@ -1,10 +1,12 @@
 from enum import Enum
 
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, event
 from sqlalchemy.orm.session import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from utils.logger_script import logger
+from utils.env_variables import (STORAGE_MODE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE,
+                                 SQLITE_BUSY_TIMEOUT)
 
 # Databae Names
 class DatabasesNames(Enum):
@@ -22,6 +24,59 @@ class DatabasesNames(Enum):
     def __contains__(cls, item):
         return item in (member.value for member in cls)
 
+class StorageModes(Enum):
+    """
+    How the dynamic databases (transactions and portfolios) store their rows.
+
+    Attributes:
+        per_user (str): One table per user, named after the user's UUID.
+        ledger (str): One shared table per database, keyed by a `user_uuid` column.
+    """
+    per_user = "per_user"
+    ledger = "ledger"
+
+class JournalModes(Enum):
+    """
+    Journal modes of the SQLite storage profile.
+
+    Attributes:
+        wal (str): Write-ahead log. Readers and the writer do not block each other and a commit is a single append.
+                   Transactions that write to several attached databases stay atomic within each file,
+                   but a crash of the host in the middle of their commit may leave only some files committed.
+        delete (str): Rollback journal (SQLite's default, and ours). Commits to several attached databases are atomic as a set,
+                      which an order needs, as it writes to the userbase, transactions and portfolios files in one transaction.
+    """
+    wal = "wal"
+    delete = "delete"
+    truncate = "truncate"
+    persist = "persist"
+
+class SynchronousLevels(Enum):
+    """
+    How often SQLite fsyncs. `full` (the default) is durable in every journal mode.
+    `normal` is durable except for the last commits on power loss in the WAL mode, and may corrupt a rollback journal database.
+    """
+    off = "off"
+    normal = "normal"
+    full = "full"
+    extra = "extra"
+
+# Names of the shared tables of the ledger storage mode
+LEDGER_TABLE_NAMES = {
+    DatabasesNames.transactions.value: "transactions",
+    DatabasesNames.portfolios.value: "lots",
+}
+
+storage_mode = StorageModes(STORAGE_MODE)
+
+# Pragmas of the storage profile, set for every database of a connection (including the attached ones)
+SQLITE_PRAGMAS = {
+    "journal_mode": JournalModes(SQLITE_JOURNAL_MODE.lower()).value,
+    "synchronous": SynchronousLevels(SQLITE_SYNCHRONOUS.lower()).value,
+    "mmap_size": int(SQLITE_MMAP_SIZE),
+    "cache_size": int(SQLITE_CACHE_SIZE),
+}
+
 
 def create_database_uri(database_name: str) -> str:
     """
@@ -34,15 +89,44 @@ def create_database_uri(database_name: str) -> str:
         str: A string representing the SQLite URI formatted as 'sqlite:///./<database_name>.sqlite'.
              This URI points to an SQLite file located in the same directory as the script.
     """
-    prefix = "sqlite:///./"
-    suffix = ".sqlite"
+    prefix = "sqlite:///"
 
-    database_uri= f"{prefix}{database_name}{suffix}"
+    database_uri= f"{prefix}{create_database_path(database_name)}"
 
     return database_uri
 
+def create_database_path(database_name: str) -> str:
+    """
+    Generates the path of the SQLite file of a database, relative to the working directory.
+
+    Args:
+        database_name (str): The name of the database.
+
+    Returns:
+        str: A path formatted as './<database_name>.sqlite'.
+    """
+    return f"./{database_name}.sqlite"
+
 default_connect_args = {"check_same_thread": False}
 
+def apply_sqlite_profile(dbapi_connection, schemas: tuple[str, ...] = ("main",)) -> None:
+    """
+    Applies the storage profile (see `SQLITE_PRAGMAS`) to a new DBAPI connection.
+
+    Args:
+        dbapi_connection: The connection, as given to a "connect" event listener.
+        schemas (tuple[str, ...]): The databases of the connection to apply the pragmas to.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT)}")
+    for schema in schemas:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {schema}.{pragma} = {value}")
+    cursor.close()
+
+def _apply_sqlite_profile(dbapi_connection, connection_record):
+    apply_sqlite_profile(dbapi_connection)
+
 # create engine for userbase
 db_engine_userbase = create_engine(
     create_database_uri(DatabasesNames.userbase.value), connect_args=default_connect_args
@@ -65,9 +149,40 @@ db_engine_portfolios = create_engine(
 db_sessionmaker_portfolios = sessionmaker(autocommit=False, autoflush=False, bind=db_engine_portfolios)
 db_metadata_portfolios = MetaData()
 
+event.listen(db_engine_userbase, "connect", _apply_sqlite_profile)
+event.listen(db_engine_transactions, "connect", _apply_sqlite_profile)
+event.listen(db_engine_portfolios, "connect", _apply_sqlite_profile)
+
+# create engine for executing orders
+# It opens the userbase and ATTACHes transactions and portfolios (as schemas of the same names),
+# so the balance, the portfolio and the transaction history of an order are written in one transaction with one commit.
+ATTACHED_DATABASES = (DatabasesNames.transactions.value, DatabasesNames.portfolios.value)
+db_engine_execution = create_engine(
+    create_database_uri(DatabasesNames.userbase.value), connect_args=default_connect_args
+)
+db_sessionmaker_execution = sessionmaker(autocommit=False, autoflush=False, bind=db_engine_execution)
+# Copies of the tables of the attached databases, with their database as their schema
+db_metadata_execution = MetaData()
+
+@event.listens_for(db_engine_execution, "connect")
+def _attach_databases(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself (see below) instead of pysqlite's implicit transactions
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for database_name in ATTACHED_DATABASES:
+        cursor.execute("ATTACH DATABASE ? AS ?", (create_database_path(database_name), database_name))
+    cursor.close()
+    apply_sqlite_profile(dbapi_connection, schemas=("main", *ATTACHED_DATABASES))
+
+@event.listens_for(db_engine_execution, "begin")
+def _begin_immediate(connection):
+    # Take the write lock up front, so the reads of an order (balance, lots) cannot go stale before its writes
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+
 def initialise_all_databases():
     """
     Initializes all necessary databases by setting up tables and reflecting existing schema.
+    In the ledger storage mode only the shared ledger tables are loaded, instead of reflecting every user's table.
 
     Raises:
         Exception: Exceptions occuring while initializing.
@@ -76,8 +191,25 @@ def initialise_all_databases():
         global db_base_userbase, db_engine_userbase, db_metadata_transactions, db_engine_transactions, db_metadata_portfolios, db_engine_portfolios
 
         db_base_userbase.metadata.create_all(bind=db_engine_userbase)
-        db_metadata_transactions.reflect(bind=db_engine_transactions)
-        db_metadata_portfolios.reflect(bind=db_engine_portfolios)
+        if storage_mode is StorageModes.ledger:
+            # Has to be imported here, the models module depends on this one
+            from data.dynamic_databases.models import generate_ledger_table
+            generate_ledger_table(DatabasesNames.transactions.value)
+            generate_ledger_table(DatabasesNames.portfolios.value)
+        else:
+            # Leave out the ledger tables a migration may have created
+            db_metadata_transactions.reflect(
+                bind=db_engine_transactions,
+                only=lambda table_name, _: table_name != LEDGER_TABLE_NAMES[DatabasesNames.transactions.value]
+            )
+            db_metadata_portfolios.reflect(
+                bind=db_engine_portfolios,
+                only=lambda table_name, _: table_name != LEDGER_TABLE_NAMES[DatabasesNames.portfolios.value]
+            )
+        logger.info(f"Initialised databases in {storage_mode.value} storage mode")
+        if SQLITE_PRAGMAS["journal_mode"] == JournalModes.wal.value:
+            logger.warning("The databases use the WAL journal mode, in which an order's commit is atomic in each database file only. "
+                           "A crash of the host in the middle of it may leave the order half applied")
     except Exception as error:
         logger.critical(f"Error initialising databases. Error: {error}")
         raise error
@@ -1,2 +1,2 @@
-__all__ = ["models", "helper"]
+__all__ = ["models", "statements", "lot_index", "helper", "migrate"]
 from . import *
\ No newline at end of file
@@ -1,16 +1,26 @@
 from typing import Union, List, Tuple, Sequence, Any
 from datetime import datetime
 from collections import Counter
+from itertools import groupby
 
 import numpy as np
-from sqlalchemy import insert, Table, select, delete, MetaData, Engine, and_, inspect, func
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import Table, select, delete, MetaData, Engine, and_, func, type_coerce, String
+from sqlalchemy.orm import Session
 from sqlalchemy.engine.row import Row
 
 from utils.logger_script import logger
+from data.database import DatabasesNames, StorageModes, LEDGER_TABLE_NAMES, storage_mode
 from data.dynamic_databases.models import generate_table_by_id_for_selected_database, get_database_variables_by_name
+from data.utils.get_databases import get_user_table, user_rows_filter, user_row_values, get_sessionmaker
+from data.dynamic_databases.statements import select_lots_by_symbol, select_distinct_symbols, select_uid, insert_row
+from data.dynamic_databases.lot_index import lot_index
+from data.utils.data_versions import data_versions
 from records.records import StockRecord
 
+def _get_ledger_table(metadata: MetaData, database_name: str) -> Union[Table, None]:
+    """ Get the shared table of the ledger storage mode from a database's metadata. """
+    return metadata.tables.get(LEDGER_TABLE_NAMES.get(database_name), None)
+
 
 def query_all_tables_in_selected_database(database_name: str, columns: list[str], filters: list[tuple]) -> list:
     """
@@ -32,9 +42,22 @@ def query_all_tables_in_selected_database(database_name: str, columns: list[str]
     metadata: MetaData
     engine: Engine
 
-    session = sessionmaker(bind=engine)()
+    session = get_sessionmaker(engine)()
     try:
         results = []
+        if storage_mode is StorageModes.ledger:
+            # One query over the shared table, split back into a result per user
+            table = _get_ledger_table(metadata, database_name)
+            if table is not None and all(col in table.columns for col in columns):
+                query = select(table.c.user_uuid, *[table.c[col] for col in columns])
+                if filters and all(col in table.columns for col, _, _ in filters):
+                    conditions = [op(table.c[col], val) for col, op, val in filters]
+                    query = query.where(and_(*conditions))
+                rows = session.execute(query.order_by(table.c.user_uuid)).fetchall()
+                for user_uuid, user_rows in groupby(rows, key=lambda row: row[0]):
+                    results.append([user_uuid, [tuple(row[1:]) for row in user_rows]])
+            return results
+
         for table_name in metadata.tables:
             table = metadata.tables[table_name]
             if all(col in table.columns for col in columns):
@@ -72,10 +95,23 @@ def query_all_tables_in_selected_database_for_stock_data(database_name: str, fil
     if metadata is None or engine is None:
         logger.error(f"Table {table_name} does not exist in {database_name}.")
     
-    session = sessionmaker(bind=engine)()
+    session = get_sessionmaker(engine)()
     results = []
     
     try:
+        if storage_mode is StorageModes.ledger:
+            # One query over the shared table, split back into a result per user
+            table = _get_ledger_table(metadata, database_name)
+            if table is not None and all(col in table.columns for col, _, _ in filters):
+                query = select(table.c.user_uuid, *[table.c[name] for name in StockRecord.get_field_names()])
+                if filters:
+                    conditions = [op(table.c[col], val) for col, op, val in filters]
+                    query = query.where(and_(*conditions))
+                rows = session.execute(query.order_by(table.c.user_uuid)).fetchall()
+                for user_uuid, user_rows in groupby(rows, key=lambda row: row[0]):
+                    results.append((user_uuid, [StockRecord.from_tuple(tuple(row[1:])) for row in user_rows]))
+            return results
+
         for table_name in metadata.tables:
             table = metadata.tables[table_name]
             if all(col in table.columns for col, _, _ in filters):
@@ -118,24 +154,24 @@ def query_specific_columns_from_database_table(database_name: str, table_name: s
     # If received no columns - treat as special case where you choose all columns except the uid
     select_all_columns_except_uid = columns is None
         
-    table_object = metadata.tables.get(table_name)
+    table_object = get_user_table(database_name, table_name)
     if table_object is None:
         logger.error(f"Could not retrieve {table_name} from {database_name}.")
         return None
 
     
     if select_all_columns_except_uid:
-        # Fetch column names directly from the table object
-        columns = [column.name for column in inspect(table_object).columns]
+        # Fetch column names from the record format, so columns that are not a part of it (user_uuid) are left out
+        columns = StockRecord.get_field_names()
         # Remove the 'uid' column if it exists
         columns.remove("uid")
 
     logger.warning(f"{columns}")
 
-    session = Session(bind=engine)
+    session = get_sessionmaker(engine)()
     try:
         # Build the query selecting only the specified columns
-        query = select(*[table_object.c[column] for column in columns])        
+        query = select(*[table_object.c[column] for column in columns]).where(user_rows_filter(table_object, table_name))
         result = session.execute(query).fetchall()
     except Exception as error:
         logger.error(f"Exception occurred. Error: {error}")
@@ -166,18 +202,21 @@ def remove_row_by_uid(database_name: str, table_name: str, uid: str) -> bool:
         logger.error(f"Table {table_name} does not exist in {database_name}.")
         return False
 
-    table_object = metadata.tables.get(table_name, None)
+    table_object = get_user_table(database_name, table_name)
     if table_object is None:
         logger.error(f"Table {table_name} was not found in {database_name}")
         return None
 
-    session = sessionmaker(bind=engine)()
+    session = get_sessionmaker(engine)()
+    if database_name == DatabasesNames.portfolios.value:
+        lot_index.invalidate(table_name)
 
     try:
         # Create delete statement for the row with the given UID
-        delete_stmt = delete(table_object).where(table_object.c.uid == uid)
+        delete_stmt = delete(table_object).where((table_object.c.uid == uid) & user_rows_filter(table_object, table_name))
         result = session.execute(delete_stmt)
         session.commit()
+        data_versions.bump(table_name)
 
         if result.rowcount:
             logger.debug(f"Successfully deleted row with UID {uid} from {table_name}.")
@@ -202,33 +241,36 @@ def move_row_between_databases(from_database_name: str, to_database_name: str, t
         return False
 
     # Create sessions for both source and target databases
-    session_from: Session = sessionmaker(bind=engine_from)
+    session_from: Session = get_sessionmaker(engine_from)()
+    if DatabasesNames.portfolios.value in (from_database_name, to_database_name):
+        lot_index.invalidate(table_name)
 
     try:
         # Fetch the row from the source database
-        table_object_from = metadata_from.tables.get(table_name, None)
+        table_object_from = get_user_table(from_database_name, table_name)
         if table_object_from is None:
             logger.error(f"Table {table_name} was not found in {from_database_name}")
             return None
-        query = select(table_object_from).where(table_object_from.c.uid == row_id)
+        query = select(table_object_from).where((table_object_from.c.uid == row_id) & user_rows_filter(table_object_from, table_name))
         row = session_from.execute(query).fetchone()
 
         if row:
             # Check if the target table exists, create if not
-            if table_name not in metadata_to.tables:
+            if get_user_table(to_database_name, table_name) is None:
                 generate_table_by_id_for_selected_database(table_name, to_database_name)
             
             # Prepare data for insertion by converting the row into a dictionary
-            data_to_insert = row
+            data_to_insert = {key: value for key, value in row._mapping.items() if key != "user_uuid"}
 
             # Insert the data into the target database
             add_stock_data_to_selected_database_table(to_database_name, table_name, data_to_insert)
 
             # Optionally delete the original record
             if delete_original:
-                delete_stmt = table_object_from.delete().where(table_object_from.c.uid == row_id)
+                delete_stmt = table_object_from.delete().where((table_object_from.c.uid == row_id) & user_rows_filter(table_object_from, table_name))
                 session_from.execute(delete_stmt)
                 session_from.commit()
+                data_versions.bump(table_name)
                 logger.info(f"Deleted original row with ID {row_id} from {from_database_name}")
 
             logger.info(f"Successfully moved row with ID {row_id} from {from_database_name} to {to_database_name}")
@@ -254,16 +296,15 @@ def does_row_exist_in_table(database_name: str, table_name: str, row_uid: str) -
         bool: True if the UID exists, False otherwise.
     """
     _, metadata, engine = get_database_variables_by_name(database_name)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    session = get_sessionmaker(engine)()
 
     try:
-        if table_name not in metadata.tables:
+        table_object: Table = get_user_table(database_name, table_name)
+        if table_object is None:
             logger.error(f"Table {table_name} does not exist in database {database_name}")
             return False
 
-        table_object: Table = metadata.tables.get(table_name, None)
-        exists = session.query(table_object).filter_by(uid=row_uid).scalar() is not None
+        exists = session.execute(select_uid(table_object, table_name, row_uid)).scalar() is not None
         return exists
     except Exception as error:
         logger.error(f"Error checking UID existence: {error}")
@@ -295,23 +336,23 @@ def get_stock_data_from_selected_database_table(database_name: str, table_name:
 
         
         # Create a session to interact with the database
-        session = sessionmaker(bind=engine)
+        session = get_sessionmaker(engine)()
         
         # Access the specific table from metadata
-        table_object = metadata.tables.get(table_name, None)
+        table_object = get_user_table(database_name, table_name)
         if table_object is None:
             logger.error(f"Table {table_name} was not found in {database_name}")
             return None
 
         # Create a select query to fetch the stock record by UID
-        query = select(table_object).where(table_object.c.uid == stock_data_uid)  # Ensure the column name matches the field name in the dataclass
+        query = select(table_object).where((table_object.c.uid == stock_data_uid) & user_rows_filter(table_object, table_name))  # Ensure the column name matches the field name in the dataclass
         
         # Execute the query
-        result = session.execute(query).scalar_one_or_none()
+        result = session.execute(query).one_or_none()
         
         # Convert the result to a dictionary if found, and instantiate a StockRecord
         if result:
-            return StockRecord.from_dict(dict(result))
+            return StockRecord.from_dict(dict(result._mapping))
         return None
     except Exception as error:
         logger.error(f"Error fetching stock data from {table_name} in {database_name}: {error}")
@@ -347,7 +388,7 @@ def add_stock_data_to_selected_database_table(database_name: str, table_name: st
 
     # Checking if the table exists if not then generate
     while True:
-        table_object = metadata.tables.get(table_name, None)
+        table_object = get_user_table(database_name, table_name)
         if table_object is None:
             logger.warning(f"Table {table_name} was not found in {database_name}")
             generate_table_by_id_for_selected_database(database_name=database_name, uuid=table_name)
@@ -360,17 +401,18 @@ def add_stock_data_to_selected_database_table(database_name: str, table_name: st
 
     # Proceed to add data if UID does not exist
     _, _, engine = get_database_variables_by_name(database_name)
-    Session = sessionmaker(bind=engine)
-    db = Session()
+    db = get_sessionmaker(engine)()
+    if database_name == DatabasesNames.portfolios.value:
+        lot_index.invalidate(table_name)
 
     flag = False
     try:
         
 
         # Insert the stock data
-        stmt = insert(table_object).values(stock_data)
-        db.execute(stmt)
+        db.execute(insert_row(table_object), {**stock_data, **user_row_values(table_object, table_name)})
         db.commit()
+        data_versions.bump(table_name)
         logger.debug(f"Successfully added stock data with UID {uid} to {table_name} in {database_name}.")
         flag = True
     except Exception as error:
@@ -401,25 +443,16 @@ def get_user_shares_by_symbol(database_name: str, uuid: str, symbol: str, includ
         logger.warning(f"Database setup not found for {database_name}")
         return []
 
-    session = Session(bind=engine)
+    session = get_sessionmaker(engine)()
 
     try:
-        table = metadata.tables.get(uuid)
+        table = get_user_table(database_name, uuid)
         if table is None:
             logger.warning(f"No table found for user {uuid} in database {database_name}")
             return []
 
-        # Select columns based on include_uid flag
-        select_columns = [
-            table.c.uid if include_uid else table.c.timestamp,
-            table.c.shares,
-            table.c.cost_per_share
-        ]
-
-        query = select(*select_columns).where(
-            (table.c.symbol == symbol.upper()) & (table.c.side == "buy")
-        )
-        results = session.execute(query).fetchall()
+        # Select the UIDs or the timestamps based on include_uid flag
+        results = session.execute(select_lots_by_symbol(table, uuid, symbol.upper(), include_uid=include_uid)).fetchall()
 
         # Convert results to a list of dictionaries
         if include_uid:
@@ -451,10 +484,26 @@ def get_all_symbols_count(database_name: str, uuid: str, symbols: List[str]) ->
     # Initialize all symbols with a count of 0 to ensure all are included in the output
     symbol_counts = Counter({symbol: 0 for symbol in symbols})
 
-    for symbol in symbols:
-        shares_dicts = get_user_shares_by_symbol(database_name, uuid, symbol, include_uid=False)
-        for entry in shares_dicts:
-            symbol_counts[symbol] += entry['shares']
+    _, metadata, engine = get_database_variables_by_name(database_name)
+    table = get_user_table(database_name, uuid)
+    if metadata is None or engine is None or table is None:
+        logger.warning(f"No table found for user {uuid} in database {database_name}")
+        return list(symbol_counts.items())
+
+    session = get_sessionmaker(engine)()
+    try:
+        # Sum every symbol in a single grouped query instead of a query per symbol
+        query = select(table.c.symbol, func.sum(table.c.shares)).where(
+            user_rows_filter(table, uuid) & (table.c.side == "buy") & table.c.symbol.in_([symbol.upper() for symbol in symbols])
+        ).group_by(table.c.symbol)
+        totals = dict(session.execute(query).fetchall())
+
+        for symbol in symbols:
+            symbol_counts[symbol] += np.double(totals.get(symbol.upper(), 0))
+    except Exception as error:
+        logger.error(f"Failed to count shares for user {uuid}: {error}")
+    finally:
+        session.close()
 
     return list(symbol_counts.items())
 
@@ -474,16 +523,15 @@ def get_unique_symbols_owned(database_name: str, uuid: str):
         logger.warning(f"Database setup not found for {database_name}")
         return []
 
-    session = Session(bind=engine)
+    session = get_sessionmaker(engine)()
 
     try:
-        table = metadata.tables.get(uuid)
+        table = get_user_table(database_name, uuid)
         if table is None:
             logger.warning(f"No table found for user {uuid} in database {database_name}")
             return []
 
-        query = select(table.c.symbol.distinct()).where(table.c.side == "buy")
-        results = session.execute(query).fetchall()
+        results = session.execute(select_distinct_symbols(table, uuid)).fetchall()
         
         symbols = [row.symbol for row in results]
         return symbols
@@ -503,17 +551,205 @@ def compile_user_portfolio(database_name: str, uuid: str) -> dict[str, list[dict
         uuid (str): The UUID of the user.
 
     Returns:
-        dict: A dictionary containing all transaction details by stock symbol.
+        dict: A dictionary containing all transaction details by stock symbol. Every open lot has its UID,
+              which sells with the specific lot selection name in `lot_uids`.
+
+    Notes:
+        All of the user's buy lots are fetched in a single query ordered by symbol, and grouped in memory.
     """
-    symbols = get_unique_symbols_owned(database_name, uuid)  # Assume this function fetches all unique stock symbols the user owns
-    portfolio_summary = {}
+    _, metadata, engine = get_database_variables_by_name(database_name)
+    table = get_user_table(database_name, uuid)
+    if metadata is None or engine is None or table is None:
+        logger.warning(f"No table found for user {uuid} in database {database_name}")
+        return {}
 
-    for symbol in symbols:
-        transactions = get_user_shares_by_symbol(database_name, uuid, symbol, include_uid=False)
-        portfolio_summary[symbol] = transactions
+    session = get_sessionmaker(engine)()
+    try:
+        query = select(table.c.symbol, table.c.uid, table.c.timestamp, table.c.shares, table.c.cost_per_share).where(
+            user_rows_filter(table, uuid) & (table.c.side == "buy")
+        ).order_by(table.c.symbol, table.c.timestamp)
+        results = session.execute(query).fetchall()
+    except Exception as error:
+        logger.error(f"Failed to compile portfolio of user {uuid}: {error}")
+        return {}
+    finally:
+        session.close()
+
+    portfolio_summary = {}
+    for symbol, rows in groupby(results, key=lambda row: row[0]):
+        portfolio_summary[symbol] = [
+            {"uid": uid, "timestamp": timestamp, "shares": np.double(shares), "cost_per_share": np.double(cost_per_share)}
+            for _, uid, timestamp, shares, cost_per_share in rows
+        ]
 
     return portfolio_summary
 
+def load_user_lots_columns(database_name: str, uuid: str) -> dict[str, np.ndarray]:
+    """
+    Loads all of a user's buy lots in a single query as NumPy column arrays, sorted by symbol and timestamp.
+
+    Args:
+        database_name (str): The name of the database.
+        uuid (str): The UUID of the user.
+
+    Returns:
+        dict[str, np.ndarray]: The columns "uid", "symbol", "timestamp" (datetime64[us]), "shares" and "cost_per_share".
+                               The arrays are empty if the user has no lots.
+    """
+    columns = {
+        "uid": np.array([], dtype=object),
+        "symbol": np.array([], dtype=object),
+        "timestamp": np.array([], dtype="datetime64[us]"),
+        "shares": np.array([], dtype=np.double),
+        "cost_per_share": np.array([], dtype=np.double),
+    }
+    _, metadata, engine = get_database_variables_by_name(database_name)
+    table = get_user_table(database_name, uuid)
+    if metadata is None or engine is None or table is None:
+        logger.warning(f"No table found for user {uuid} in database {database_name}")
+        return columns
+
+    session = get_sessionmaker(engine)()
+    try:
+        # Timestamps are read as the stored ISO strings and parsed by NumPy, which is much faster than
+        # SQLAlchemy making a datetime of every row
+        selected = [type_coerce(table.c[name], String) if name == "timestamp" else table.c[name] for name in columns]
+        query = select(*selected).where(
+            user_rows_filter(table, uuid) & (table.c.side == "buy")
+        ).order_by(table.c.symbol, table.c.timestamp)
+        results = session.execute(query).fetchall()
+    except Exception as error:
+        logger.error(f"Failed to load lots of user {uuid}: {error}")
+        return columns
+    finally:
+        session.close()
+
+    if results:
+        uids, symbols, timestamps, shares, costs_per_share = zip(*results)
+        columns["uid"] = np.array(uids, dtype=object)
+        columns["symbol"] = np.array(symbols, dtype=object)
+        columns["timestamp"] = np.array(timestamps, dtype="datetime64[us]")
+        columns["shares"] = np.array(shares, dtype=np.double)
+        columns["cost_per_share"] = np.array(costs_per_share, dtype=np.double)
+    return columns
+
+def load_user_transactions_columns(database_name: str, uuid: str) -> dict[str, np.ndarray]:
+    """
+    Loads a user's whole transaction history in a single query as NumPy column arrays, sorted by timestamp.
+
+    Args:
+        database_name (str): The name of the database, the transactions database.
+        uuid (str): The UUID of the user.
+
+    Returns:
+        dict[str, np.ndarray]: The columns "timestamp" (datetime64[us]), "symbol", "side", "shares" and "cost_per_share".
+                               The arrays are empty if the user has no transactions.
+    """
+    columns = {
+        "timestamp": np.array([], dtype="datetime64[us]"),
+        "symbol": np.array([], dtype=object),
+        "side": np.array([], dtype=object),
+        "shares": np.array([], dtype=np.double),
+        "cost_per_share": np.array([], dtype=np.double),
+    }
+    _, metadata, engine = get_database_variables_by_name(database_name)
+    table = get_user_table(database_name, uuid)
+    if metadata is None or engine is None or table is None:
+        logger.warning(f"No table found for user {uuid} in database {database_name}")
+        return columns
+
+    session = get_sessionmaker(engine)()
+    try:
+        # Timestamps are parsed by NumPy, see `load_user_lots_columns`
+        selected = [type_coerce(table.c[name], String) if name == "timestamp" else table.c[name] for name in columns]
+        query = select(*selected).where(user_rows_filter(table, uuid)).order_by(table.c.timestamp)
+        results = session.execute(query).fetchall()
+    except Exception as error:
+        logger.error(f"Failed to load transactions of user {uuid}: {error}")
+        return columns
+    finally:
+        session.close()
+
+    if results:
+        timestamps, symbols, sides, shares, costs_per_share = zip(*results)
+        columns["timestamp"] = np.array(timestamps, dtype="datetime64[us]")
+        columns["symbol"] = np.array(symbols, dtype=object)
+        columns["side"] = np.array(sides, dtype=object)
+        columns["shares"] = np.array(shares, dtype=np.double)
+        columns["cost_per_share"] = np.array(costs_per_share, dtype=np.double)
+    return columns
+
+def sum_user_transactions_by_symbol(database_name: str, uuid: str) -> dict[str, np.ndarray]:
+    """
+    Sums a user's transaction history by symbol and side in a single aggregate query.
+
+    Args:
+        database_name (str): The name of the database, the transactions database.
+        uuid (str): The UUID of the user.
+
+    Returns:
+        dict[str, np.ndarray]: The columns "symbol", "side", "shares" and "value" (the sum of shares times cost per share).
+                               The arrays are empty if the user has no transactions.
+    """
+    columns = {
+        "symbol": np.array([], dtype=object),
+        "side": np.array([], dtype=object),
+        "shares": np.array([], dtype=np.double),
+        "value": np.array([], dtype=np.double),
+    }
+    _, metadata, engine = get_database_variables_by_name(database_name)
+    table = get_user_table(database_name, uuid)
+    if metadata is None or engine is None or table is None:
+        logger.warning(f"No table found for user {uuid} in database {database_name}")
+        return columns
+
+    session = get_sessionmaker(engine)()
+    try:
+        query = select(
+            table.c.symbol, table.c.side, func.sum(table.c.shares), func.sum(table.c.shares * table.c.cost_per_share)
+        ).where(user_rows_filter(table, uuid)).group_by(table.c.symbol, table.c.side)
+        results = session.execute(query).fetchall()
+    except Exception as error:
+        logger.error(f"Failed to sum transactions of user {uuid}: {error}")
+        return columns
+    finally:
+        session.close()
+
+    if results:
+        symbols, sides, shares, values = zip(*results)
+        columns["symbol"] = np.array(symbols, dtype=object)
+        columns["side"] = np.array(sides, dtype=object)
+        columns["shares"] = np.array(shares, dtype=np.double)
+        columns["value"] = np.array(values, dtype=np.double)
+    return columns
+
+def compile_user_portfolio_arrays(database_name: str, uuid: str) -> dict[str, dict[str, np.ndarray]]:
+    """
+    Columnar variant of `compile_user_portfolio`: the same single query, with every symbol's lots
+    given as NumPy arrays (views into the columns of `load_user_lots_columns`).
+
+    Args:
+        database_name (str): The name of the database.
+        uuid (str): The UUID of the user.
+
+    Returns:
+        dict[str, dict[str, np.ndarray]]: The "timestamp", "shares" and "cost_per_share" arrays of the lots by stock symbol.
+    """
+    columns = load_user_lots_columns(database_name, uuid)
+    symbols = columns["symbol"]
+    if len(symbols) == 0:
+        return {}
+
+    # Rows are sorted by symbol, so each symbol is one contiguous slice
+    boundaries = np.flatnonzero(symbols[1:] != symbols[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(symbols)]))
+
+    return {
+        symbols[start]: {name: columns[name][start:end] for name in ("timestamp", "shares", "cost_per_share")}
+        for start, end in zip(starts, ends)
+    }
+
 # Function that serves a greater purpose than it is actually used for 
 # And has bad logic overall - it is only used for one case
 # def get_summary(database_name: str, table_name: str):
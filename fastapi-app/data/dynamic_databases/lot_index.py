@@ -0,0 +1,252 @@
+"""
+In-memory index of the users' portfolio lots, used by sells to pick the lots to consume with a lot selection
+(FIFO, LIFO, lowest cost, highest cost or specific lots).
+
+The portfolios database stays the ledger: a user's lots are loaded from it on the first sell, in the sell's own
+transaction, and every fill is written through to both. An order that fails or is rolled back drops the user's
+lots from the index, so they are loaded again from the ledger on the next sell.
+
+The index is per process. Lots are only changed by orders (serialized per user, see StockHandler) and the
+helpers of `data.dynamic_databases.helper`, which drop the user from the index.
+"""
+from typing import Optional, Callable, Iterable, Iterator
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+import heapq
+import itertools
+import threading
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.env_variables import LOT_INDEX_MAX_USERS, LOT_SELECTION
+from records.records import LotSelections
+
+
+@dataclass(slots=True)
+class Lot:
+    """ An open buy lot of a user, as kept in the index. """
+    uid: str
+    symbol: str
+    timestamp: datetime
+    shares: np.double
+    cost_per_share: np.double
+    # The order the lot was added to its symbol in, breaks ties between lots opened at the same time
+    sequence: int = 0
+
+class SymbolLots:
+    """
+    The open lots of a user in one symbol, with a heap of them per ordered lot selection.
+
+    A selection's heap is built the first time the selection is used on the symbol and new lots are pushed onto
+    every built heap. Lots consumed through one heap are dropped from the others lazily, as they reach their top.
+    A partially consumed lot keeps its place (no key depends on its shares), so consuming k lots out of n costs
+    O(k log n).
+    """
+    def __init__(self):
+        self.lots: dict[str, Lot] = {}
+        self._heaps: dict[str, list] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.lots)
+
+    def add(self, lot: Lot) -> None:
+        lot.sequence = next(self._sequence)
+        self.lots[lot.uid] = lot
+        for selection in self._heaps:
+            heapq.heappush(self._heaps[selection], (LOT_SELECTIONS[selection].sort_key(lot), lot.sequence, lot))
+
+    def remove(self, lot: Lot) -> None:
+        """ Removes an exhausted lot, its entries in the heaps are skipped once they reach their top. """
+        del self.lots[lot.uid]
+
+    def heap(self, selection: str, sort_key: Callable[[Lot], tuple]) -> list:
+        """ Get the heap of a selection, without the removed lots at its top. """
+        heap = self._heaps.get(selection)
+        # Rebuild the heap if it was never built or mostly holds removed lots
+        if heap is None or len(heap) > 2 * len(self.lots) + 32:
+            heap = [(sort_key(lot), lot.sequence, lot) for lot in self.lots.values()]
+            heapq.heapify(heap)
+            self._heaps[selection] = heap
+        while heap and self.lots.get(heap[0][2].uid) is not heap[0][2]:
+            heapq.heappop(heap)
+        return heap
+
+class LotSelection(ABC):
+    """
+    Strategy of the order in which a sell consumes the lots of a symbol.
+
+    Args:
+        name (str): The name of the selection, a value of `LotSelections`.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    @abstractmethod
+    def pick(self, symbol_lots: SymbolLots, lot_uids: Optional[list[str]]) -> Iterator[Lot]:
+        """ Yields the lots to consume, in order. The consumer stops once the sell is filled. """
+
+    def consume(self, symbol_lots: SymbolLots, shares: np.double, lot_uids: Optional[list[str]] = None) -> tuple[list[tuple[Lot, np.double]], np.double]:
+        """
+        Consumes up to `shares` shares of the lots picked by the selection.
+
+        Args:
+            symbol_lots (SymbolLots): The user's lots of the sold symbol.
+            shares (np.double): The shares to sell.
+            lot_uids (list[str], optional): The UIDs of the lots to sell from, in order, for the specific lot selection.
+
+        Returns:
+            tuple: The consumed lots with the shares taken from each (the lots' shares are already reduced,
+                   exhausted lots have 0 shares and are removed), and the shares that could not be consumed.
+        """
+        consumed = []
+        for lot in self.pick(symbol_lots, lot_uids):
+            if shares <= 0:
+                break
+            taken = min(lot.shares, shares)
+            shares -= taken
+            lot.shares -= taken
+            consumed.append((lot, taken))
+            if lot.shares <= 0:
+                symbol_lots.remove(lot)
+        return consumed, shares
+
+class OrderedLotSelection(LotSelection):
+    """
+    Consumes the lots in the order of a key, from a heap kept per symbol.
+
+    Args:
+        name (str): The name of the selection.
+        sort_key (Callable[[Lot], tuple]): Key of the order in which the lots are consumed, smallest first.
+    """
+    def __init__(self, name: str, sort_key: Callable[[Lot], tuple]):
+        super().__init__(name)
+        self.sort_key = sort_key
+
+    def pick(self, symbol_lots: SymbolLots, lot_uids: Optional[list[str]]) -> Iterator[Lot]:
+        heap = symbol_lots.heap(self.name, self.sort_key)
+        while heap:
+            lot = heap[0][2]
+            yield lot
+            # The lot at the top is only left there if the sell is filled before exhausting it
+            heap = symbol_lots.heap(self.name, self.sort_key)
+
+class SpecificLotSelection(LotSelection):
+    """ Consumes the lots chosen by the user, in the order of their UIDs. Unknown UIDs are skipped. """
+    sort_key = None
+
+    def pick(self, symbol_lots: SymbolLots, lot_uids: Optional[list[str]]) -> Iterator[Lot]:
+        for uid in dict.fromkeys(lot_uids or []):
+            lot = symbol_lots.lots.get(uid)
+            if lot is not None:
+                yield lot
+
+LOT_SELECTIONS: dict[str, LotSelection] = {
+    LotSelections.fifo.value: OrderedLotSelection(LotSelections.fifo.value, lambda lot: (lot.timestamp, lot.sequence)),
+    LotSelections.lifo.value: OrderedLotSelection(LotSelections.lifo.value, lambda lot: (-lot.timestamp.timestamp(), -lot.sequence)),
+    LotSelections.lowest_cost.value: OrderedLotSelection(LotSelections.lowest_cost.value, lambda lot: (lot.cost_per_share,)),
+    LotSelections.highest_cost.value: OrderedLotSelection(LotSelections.highest_cost.value, lambda lot: (-lot.cost_per_share,)),
+    LotSelections.specific.value: SpecificLotSelection(LotSelections.specific.value),
+}
+
+def get_lot_selection(name: Optional[str] = None) -> Optional[LotSelection]:
+    """ Get a lot selection by name (the default selection if no name is given), or None if there is no such selection. """
+    return LOT_SELECTIONS.get(name or LOT_SELECTION)
+
+def get_lot_uids(order: dict) -> Optional[list[str]]:
+    """ Get the UIDs of the lots an order sells from, given as a list or a comma separated string. """
+    lot_uids = order.get("lot_uids")
+    if not lot_uids:
+        return None
+    if isinstance(lot_uids, str):
+        lot_uids = lot_uids.split(",")
+    return [str(uid).strip() for uid in lot_uids if str(uid).strip()]
+
+class LotIndex:
+    """
+    Per user, per symbol index of the open lots, bounded by an LRU over users.
+
+    Args:
+        max_users (int): The number of users whose lots are kept.
+    """
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "invalidations": 0}
+        self._users: OrderedDict[str, dict[str, SymbolLots]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, uuid: str) -> bool:
+        with self._lock:
+            return uuid in self._users
+
+    def build(self, rows: Iterable[tuple]) -> dict[str, SymbolLots]:
+        """ Builds the lots of a user from the (uid, symbol, timestamp, shares, cost_per_share) rows of its lots. """
+        symbols: dict[str, SymbolLots] = {}
+        for uid, symbol, timestamp, shares, cost_per_share in rows:
+            symbol_lots = symbols.get(symbol)
+            if symbol_lots is None:
+                symbol_lots = symbols[symbol] = SymbolLots()
+            symbol_lots.add(Lot(uid, symbol, timestamp, np.double(shares), np.double(cost_per_share)))
+        return symbols
+
+    def get_user_lots(self, uuid: str, load: Callable[[], Iterable[tuple]]) -> dict[str, SymbolLots]:
+        """
+        Get the lots of a user by symbol, loading them with `load` if the user is not in the index.
+
+        Args:
+            uuid (str): The UUID of the user.
+            load (Callable): Returns the user's lots as (uid, symbol, timestamp, shares, cost_per_share) rows.
+                             Called inside the order's transaction, so the lots cannot change while loading.
+        """
+        with self._lock:
+            user_lots = self._users.get(uuid)
+            if user_lots is not None:
+                self._users.move_to_end(uuid)
+                self.stats["hits"] += 1
+                return user_lots
+
+        user_lots = self.build(load())
+        with self._lock:
+            self.stats["loads"] += 1
+            self._users[uuid] = user_lots
+            self._users.move_to_end(uuid)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.stats["evictions"] += 1
+        return user_lots
+
+    def add_lot(self, uuid: str, lot: Lot) -> None:
+        """ Writes a new lot through to the index, if the user's lots are loaded. """
+        with self._lock:
+            user_lots = self._users.get(uuid)
+        if user_lots is None:
+            return
+        symbol_lots = user_lots.get(lot.symbol)
+        if symbol_lots is None:
+            symbol_lots = user_lots[lot.symbol] = SymbolLots()
+        symbol_lots.add(lot)
+
+    def invalidate(self, uuid: Optional[str] = None) -> None:
+        """ Drops a user's lots (or every user's), they are rebuilt from the ledger on the next sell. """
+        with self._lock:
+            if uuid is None:
+                self._users.clear()
+            elif self._users.pop(uuid, None) is None:
+                return
+            self.stats["invalidations"] += 1
+        logger.debug(f"Dropped the lots of {uuid or 'every user'} from the lot index")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "lot_selection": LOT_SELECTION,
+                "lots": sum(len(symbol_lots) for user_lots in self._users.values() for symbol_lots in user_lots.values()),
+            }
+
+lot_index = LotIndex(max_users=int(LOT_INDEX_MAX_USERS))
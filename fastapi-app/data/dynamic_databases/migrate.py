@@ -0,0 +1,122 @@
+"""
+Online migration of the per user tables of transactions and portfolios into the shared ledger tables.
+
+Every run synchronises each user's table into the ledger table (upserting by uid and removing rows
+that no longer exist in the user's table), one small transaction per batch, so it can run while the
+server is still serving in the per user storage mode and be repeated until the switch to
+STORAGE_MODE=ledger. Run it from the fastapi-app folder:
+    python -m data.dynamic_databases.migrate [--batch-size 1000] [--drop-migrated-tables]
+"""
+from typing import Union
+import argparse
+
+from sqlalchemy import MetaData, Table, inspect, select, delete, func
+from sqlalchemy.dialects.sqlite import insert
+
+from utils.logger_script import logger
+from data.database import DatabasesNames, LEDGER_TABLE_NAMES
+from data.dynamic_databases.models import generate_ledger_table
+from data.utils.get_databases import get_database_variables_by_name
+
+
+def _migrate_user_table(source_table: Table, ledger_table: Table, engine, uuid: str, batch_size: int) -> Union[int, None]:
+    """
+    Synchronise a single user's table into the ledger table.
+
+    Returns:
+        Union[int, None]: The number of rows of the user in the ledger, or None if the copy could not be verified.
+    """
+    columns = [column.name for column in source_table.columns if column.name in ledger_table.c]
+    copied_uids = set()
+    last_uid = None
+
+    while True:
+        # Keyset pagination over the primary key keeps each batch (and its write lock) short
+        query = select(*[source_table.c[name] for name in columns]).order_by(source_table.c.uid).limit(batch_size)
+        if last_uid is not None:
+            query = query.where(source_table.c.uid > last_uid)
+
+        with engine.begin() as connection:
+            rows = connection.execute(query).fetchall()
+            if not rows:
+                break
+            values = [{**row._mapping, "user_uuid": uuid} for row in rows]
+            statement = insert(ledger_table).values(values)
+            statement = statement.on_conflict_do_update(
+                index_elements=[ledger_table.c.uid],
+                set_={name: statement.excluded[name] for name in columns if name != "uid"}
+            )
+            connection.execute(statement)
+
+        copied_uids.update(row.uid for row in rows)
+        last_uid = rows[-1].uid
+
+    with engine.begin() as connection:
+        # Rows removed from the user's table since a previous run (e.g. sold lots) are removed from the ledger
+        ledger_uids = connection.execute(select(ledger_table.c.uid).where(ledger_table.c.user_uuid == uuid)).scalars().all()
+        removed_uids = [uid for uid in ledger_uids if uid not in copied_uids]
+        for start in range(0, len(removed_uids), batch_size):
+            connection.execute(delete(ledger_table).where(ledger_table.c.uid.in_(removed_uids[start:start + batch_size])))
+
+        ledger_count = connection.execute(
+            select(func.count()).select_from(ledger_table).where(ledger_table.c.user_uuid == uuid)
+        ).scalar()
+
+    if ledger_count != len(copied_uids):
+        logger.error(f"Ledger has {ledger_count} rows of user {uuid} but {len(copied_uids)} were copied")
+        return None
+    return ledger_count
+
+def migrate_database_to_ledger(database_name: str, batch_size: int = 1000, drop_migrated_tables: bool = False) -> dict[str, int]:
+    """
+    Migrate all per user tables of a dynamic database into its ledger table.
+
+    Args:
+        database_name (str): transactions or portfolios.
+        batch_size (int): Number of rows copied per transaction.
+        drop_migrated_tables (bool): Drop each user's table once its copy is verified.
+                                     Only do this when the server no longer runs in the per user storage mode.
+
+    Returns:
+        dict[str, int]: The number of migrated rows per user UUID.
+    """
+    _, _, engine = get_database_variables_by_name(database_name)
+    ledger_table = generate_ledger_table(database_name)
+    if ledger_table is None:
+        logger.error(f"Cannot migrate {database_name} without a ledger table")
+        return {}
+
+    migrated = {}
+    user_table_names = [name for name in inspect(engine).get_table_names() if name != LEDGER_TABLE_NAMES[database_name]]
+    logger.info(f"Migrating {len(user_table_names)} user tables of {database_name} into {ledger_table.name}")
+
+    for uuid in user_table_names:
+        # Reflect one table at a time into its own metadata instead of reflecting the whole database
+        source_table = Table(uuid, MetaData(), autoload_with=engine)
+        if "uid" not in source_table.c:
+            logger.warning(f"Skipping table {uuid} of {database_name}, it is not a user table")
+            continue
+        try:
+            count = _migrate_user_table(source_table, ledger_table, engine, uuid, batch_size)
+        except Exception as error:
+            logger.error(f"Failed to migrate table {uuid} of {database_name}. Error: {error}")
+            continue
+        if count is None:
+            continue
+
+        migrated[uuid] = count
+        if drop_migrated_tables:
+            source_table.drop(engine)
+            logger.debug(f"Dropped migrated table {uuid} of {database_name}")
+
+    logger.info(f"Migrated {sum(migrated.values())} rows of {len(migrated)} users of {database_name}")
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate per user tables into the shared ledger tables")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-migrated-tables", action="store_true")
+    arguments = parser.parse_args()
+
+    for name in (DatabasesNames.transactions.value, DatabasesNames.portfolios.value):
+        migrate_database_to_ledger(name, batch_size=arguments.batch_size, drop_migrated_tables=arguments.drop_migrated_tables)
@@ -3,17 +3,20 @@ from dataclasses import fields
 from datetime import datetime
 from dataclasses import dataclass
 
-from sqlalchemy import Column, String, Table, DateTime, Double, Engine, MetaData
+from sqlalchemy import Column, String, Table, DateTime, Double, Engine, MetaData, Index
 import numpy as np
 
-from data.database import DatabasesNames
+from data.database import DatabasesNames, StorageModes, LEDGER_TABLE_NAMES, storage_mode
 from data.utils.get_databases import get_database_variables_by_name
 from data.utils.uuid import generate_uuid
 
 from utils.logger_script import logger
-from records.records import StockRecord
 
 def generate_table_by_id_for_selected_database(uuid: str, database_name: str):
+    if storage_mode is StorageModes.ledger:
+        logger.debug(f"Not generating a {database_name} table for user {uuid}, rows are stored in the ledger table")
+        return
+
     table_format, metadata, engine = get_database_variables_by_name(database_name)
     
     if table_format is not None and metadata is not None and engine is not None:
@@ -27,23 +30,15 @@ def generate_table_by_id_for_selected_database(uuid: str, database_name: str):
     else:
         logger.warning(f"Could not start to generate table for {database_name}. table format, metadata or engine may be invalid.")
 
-def _generate_table_by_id_for_selected_database(uuid: str, database_name: str, table_format: dataclass, metadata: MetaData, engine: Engine):
+def _generate_columns_from_table_format(table_format: dataclass) -> list[Column]:
     """
-    Generate a table of a user to store stocks in
-    :param uuid: A user's UUID
+    Reflect dataclass structure in table schema
+    :param table_format: The dataclass the rows of the table are stored as
     """
-    if database_name not in DatabasesNames:
-        logger.error(f"Cannot generate table for database {database_name} because it is not one of the supported databases")
-        return
-
-    logger.info(f"Generating {database_name} table for user {uuid}")
-
-    
-    # Reflect dataclass structure in table schema
     type_hints = get_type_hints(table_format)
     dataclass_columns = []
     try:
-        for field in fields(StockRecord):
+        for field in fields(table_format):
             if field.name.lower() == "uid":
                 dataclass_columns.append(Column("uid", String, primary_key=True, unique=True, default=generate_uuid))
                 continue
@@ -67,6 +62,21 @@ def _generate_table_by_id_for_selected_database(uuid: str, database_name: str, t
             dataclass_columns.append(Column(field.name, column_type, nullable=nullable))
     except Exception as error:
         logger.error(f"Error creating database columns {error}")
+    return dataclass_columns
+
+def _generate_table_by_id_for_selected_database(uuid: str, database_name: str, table_format: dataclass, metadata: MetaData, engine: Engine):
+    """
+    Generate a table of a user to store stocks in
+    :param uuid: A user's UUID
+    """
+    if database_name not in DatabasesNames:
+        logger.error(f"Cannot generate table for database {database_name} because it is not one of the supported databases")
+        return
+
+    logger.info(f"Generating {database_name} table for user {uuid}")
+
+    
+    dataclass_columns = _generate_columns_from_table_format(table_format)
 
     new_table = Table(
         uuid,
@@ -79,4 +89,33 @@ def _generate_table_by_id_for_selected_database(uuid: str, database_name: str, t
         new_table.create(engine)
         logger.debug(f"Successfully added table to {database_name} {uuid}")
     except Exception as error:
-        logger.error(f"Error raised while adding table {uuid} to {database_name}. Error: {error}")
\ No newline at end of file
+        logger.error(f"Error raised while adding table {uuid} to {database_name}. Error: {error}")
+
+def generate_ledger_table(database_name: str) -> Union[Table, None]:
+    """
+    Generate (if needed) the shared table of the ledger storage mode for a dynamic database.
+    It holds the rows of every user, keyed by a `user_uuid` column with a composite index on (user_uuid, symbol, side).
+    :param database_name: transactions or portfolios
+    :returns: The ledger table, or None if it could not be generated
+    """
+    table_format, metadata, engine = get_database_variables_by_name(database_name)
+    table_name = LEDGER_TABLE_NAMES.get(database_name)
+    if table_format is None or table_name is None:
+        logger.error(f"Cannot generate ledger table for database {database_name}")
+        return None
+
+    ledger_table = Table(
+        table_name,
+        metadata,
+        *_generate_columns_from_table_format(table_format),
+        Column("user_uuid", String, nullable=False),
+        Index(f"ix_{table_name}_user_uuid_symbol_side", "user_uuid", "symbol", "side"),
+        extend_existing=True
+    )
+    try:
+        ledger_table.create(engine, checkfirst=True)
+        logger.debug(f"Ledger table {table_name} is ready in {database_name}")
+        return ledger_table
+    except Exception as error:
+        logger.error(f"Error raised while adding ledger table {table_name} to {database_name}. Error: {error}")
+        return None
@@ -0,0 +1,65 @@
+"""
+Cached statements of the hot query shapes of the dynamic databases (transactions and portfolios).
+
+The selects are built with `lambda_stmt`: SQLAlchemy builds and compiles every shape once per table, and afterwards
+only pulls the bound values (uuid, symbol, uid) out of the lambdas' closures, instead of rebuilding the select and
+its cache key on every call. Conditions that depend on the storage mode are decided outside of the lambdas, as
+every lambda has to produce the same SQL each time it runs.
+"""
+from functools import lru_cache
+
+from sqlalchemy import Table, select, insert, lambda_stmt, Insert
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+
+def _where_user(statement: StatementLambdaElement, table: Table, uuid: str) -> StatementLambdaElement:
+    """ Adds the condition of `user_rows_filter`, shared tables of the ledger storage mode hold every user's rows. """
+    if "user_uuid" in table.c:
+        statement += lambda query: query.where(table.c.user_uuid == uuid)
+    return statement
+
+def select_lots_by_symbol(table: Table, uuid: str, symbol: str, include_uid: bool = True) -> StatementLambdaElement:
+    """
+    Select the (uid or timestamp, shares, cost_per_share) of a user's buy lots of a symbol.
+
+    Args:
+        table (Table): The table returned by `get_user_table`.
+        uuid (str): The UUID of the user.
+        symbol (str): The symbol, in upper case.
+        include_uid (bool): Select the lots' UIDs, or their timestamps if False.
+    """
+    if include_uid:
+        statement = lambda_stmt(lambda: select(table.c.uid, table.c.shares, table.c.cost_per_share))
+    else:
+        statement = lambda_stmt(lambda: select(table.c.timestamp, table.c.shares, table.c.cost_per_share))
+    statement = _where_user(statement, table, uuid)
+    statement += lambda query: query.where((table.c.symbol == symbol) & (table.c.side == "buy"))
+    return statement
+
+def select_user_lots(table: Table, uuid: str) -> StatementLambdaElement:
+    """ Select the (uid, symbol, timestamp, shares, cost_per_share) of all of a user's buy lots, as loaded by the lot index. """
+    statement = lambda_stmt(lambda: select(table.c.uid, table.c.symbol, table.c.timestamp, table.c.shares, table.c.cost_per_share))
+    statement = _where_user(statement, table, uuid)
+    statement += lambda query: query.where(table.c.side == "buy")
+    return statement
+
+def select_distinct_symbols(table: Table, uuid: str) -> StatementLambdaElement:
+    """ Select the distinct symbols of a user's buy lots. """
+    statement = lambda_stmt(lambda: select(table.c.symbol.distinct()))
+    statement = _where_user(statement, table, uuid)
+    statement += lambda query: query.where(table.c.side == "buy")
+    return statement
+
+def select_uid(table: Table, uuid: str, uid: str) -> StatementLambdaElement:
+    """ Select the UID of a user's row, to check whether it exists. """
+    statement = lambda_stmt(lambda: select(table.c.uid))
+    statement = _where_user(statement, table, uuid)
+    statement += lambda query: query.where(table.c.uid == uid)
+    return statement
+
+@lru_cache(maxsize=4096)
+def insert_row(table: Table) -> Insert:
+    """
+    Insert of a row into a table. The values are passed as the execution's parameters
+    (`session.execute(insert_row(table), values)`), so the statement is built once per table.
+    """
+    return insert(table)
@@ -0,0 +1,2 @@
+__all__ = ["model", "helper"]
+from . import *
\ No newline at end of file
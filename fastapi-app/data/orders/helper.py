@@ -0,0 +1,233 @@
+from typing import Union
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import select, delete, update
+from sqlalchemy.orm import Session
+
+from data.database import DatabasesNames
+from data.orders.model import PendingOrder
+from data.utils.get_databases import get_db
+
+from utils.logger_script import logger
+from records.records import OrderTypes, TimesInForce
+
+# DAY orders expire at the (regular hours) close of the market
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_CLOSE_HOUR = 16
+
+def utc_now() -> datetime:
+    """ The current UTC time, as the naive datetime stored in the database. """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def get_day_order_expiry(now: datetime = None) -> datetime:
+    """
+    Get the expiry time of a DAY order: the next market close on a weekday.
+
+    Args:
+        now (datetime, optional): Naive UTC time the order was placed at. Defaults to the current time.
+
+    Returns:
+        datetime: The naive UTC expiry time.
+    """
+    now = now or utc_now()
+    local_now = now.replace(tzinfo=timezone.utc).astimezone(MARKET_TIMEZONE)
+    close = local_now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+    if local_now >= close:
+        close += timedelta(days=1)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+    return close.astimezone(timezone.utc).replace(tzinfo=None)
+
+def create_pending_order_model(uuid: str, order: dict) -> tuple[Union[PendingOrder, None], Union[str, None]]:
+    """
+    Validates an order submitted by a user and creates its resting order.
+
+    Args:
+        uuid (str): The UUID of the user.
+        order (dict): The submitted order (symbol, side, order_type, shares, limit_price, stop_price, time_in_force).
+
+    Returns:
+        tuple[Union[PendingOrder, None], Union[str, None]]: The resting order and None,
+                                                            or None and the reason the order is invalid.
+    """
+    order_type = order.get("order_type")
+    if order_type not in (OrderTypes.limit.value, OrderTypes.stop.value, OrderTypes.stop_limit.value):
+        return None, "Invalid or unsupported order type"
+    if order.get("side") not in ("buy", "sell"):
+        return None, "Invalid side"
+
+    try:
+        shares = np.double(order.get("shares"))
+        limit_price = np.double(order["limit_price"]) if order.get("limit_price") is not None else None
+        stop_price = np.double(order["stop_price"]) if order.get("stop_price") is not None else None
+    except (TypeError, ValueError):
+        return None, "Invalid shares or price"
+
+    if not shares > 0:
+        return None, "Cannot place an order for 0 or fewer shares"
+    if order_type in (OrderTypes.limit.value, OrderTypes.stop_limit.value) and not (limit_price and limit_price > 0):
+        return None, f"A {order_type.replace("_", "-")} order needs a limit price"
+    if order_type in (OrderTypes.stop.value, OrderTypes.stop_limit.value) and not (stop_price and stop_price > 0):
+        return None, f"A {order_type.replace("_", "-")} order needs a stop price"
+
+    time_in_force = order.get("time_in_force") or TimesInForce.day.value
+    if time_in_force not in (TimesInForce.day.value, TimesInForce.gtc.value):
+        return None, "Invalid time in force"
+
+    now = utc_now()
+    pending_order = PendingOrder(
+        uuid=uuid,
+        timestamp=now,
+        symbol=str(order.get("symbol", "")).upper(),
+        side=order["side"],
+        order_type=order_type,
+        shares=shares,
+        limit_price=limit_price if order_type != OrderTypes.stop.value else None,
+        stop_price=stop_price if order_type != OrderTypes.limit.value else None,
+        time_in_force=time_in_force,
+        expires_at=get_day_order_expiry(now) if time_in_force == TimesInForce.day.value else None,
+        triggered=False,
+    )
+    return pending_order, None
+
+
+def add_pending_order(pending_order: PendingOrder) -> bool:
+    """
+    Saves a new resting order.
+
+    Args:
+        pending_order (PendingOrder): The order to save.
+
+    Returns:
+        bool: True if the order was saved, False otherwise.
+    """
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        session.add(pending_order)
+        session.commit()
+        # Keep the attributes readable after the session is closed
+        session.refresh(pending_order)
+        session.expunge(pending_order)
+        return True
+    except Exception as error:
+        session.rollback()
+        logger.error(f"Failed to save pending order of user {pending_order.uuid}: {error}")
+        return False
+    finally:
+        session.close()
+
+def add_pending_orders(pending_orders: list[PendingOrder]) -> bool:
+    """
+    Saves new resting orders in one transaction.
+
+    Args:
+        pending_orders (list[PendingOrder]): The orders to save.
+
+    Returns:
+        bool: True if every order was saved, False if none was.
+    """
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    # Keep the attributes readable after the session is closed, without loading every order again
+    session.expire_on_commit = False
+    try:
+        session.add_all(pending_orders)
+        session.commit()
+        session.expunge_all()
+        return True
+    except Exception as error:
+        session.rollback()
+        logger.error(f"Failed to save {len(pending_orders)} pending orders: {error}")
+        return False
+    finally:
+        session.close()
+
+def get_pending_orders(uuid: str = None) -> list[PendingOrder]:
+    """
+    Gets the resting orders of a user, or of every user if no UUID is given, oldest first.
+
+    Args:
+        uuid (str, optional): The UUID of the user.
+
+    Returns:
+        list[PendingOrder]: The orders, detached from their session.
+    """
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        query = select(PendingOrder).order_by(PendingOrder.timestamp)
+        if uuid is not None:
+            query = query.where(PendingOrder.uuid == uuid)
+        pending_orders = session.execute(query).scalars().all()
+        session.expunge_all()
+        return list(pending_orders)
+    except Exception as error:
+        logger.error(f"Failed to get pending orders: {error}")
+        return []
+    finally:
+        session.close()
+
+def delete_pending_orders(uids: list[str], uuid: str = None) -> int:
+    """
+    Deletes resting orders (cancelled or expired).
+
+    Args:
+        uids (list[str]): The UIDs of the orders.
+        uuid (str, optional): Only delete orders of this user.
+
+    Returns:
+        int: The number of deleted orders.
+    """
+    if not uids:
+        return 0
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        statement = delete(PendingOrder).where(PendingOrder.uid.in_(uids))
+        if uuid is not None:
+            statement = statement.where(PendingOrder.uuid == uuid)
+        deleted = session.execute(statement).rowcount
+        session.commit()
+        return deleted
+    except Exception as error:
+        session.rollback()
+        logger.error(f"Failed to delete pending orders {uids}: {error}")
+        return 0
+    finally:
+        session.close()
+
+def mark_pending_orders_triggered(uids: list[str]) -> None:
+    """ Saves that the stop price of stop-limit orders was reached, so they rest as limit orders from now on. """
+    if not uids:
+        return
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        session.execute(update(PendingOrder).where(PendingOrder.uid.in_(uids)).values(triggered=True))
+        session.commit()
+    except Exception as error:
+        session.rollback()
+        logger.error(f"Failed to mark pending orders {uids} as triggered: {error}")
+    finally:
+        session.close()
+
+def delete_expired_pending_orders(now: datetime) -> list[str]:
+    """
+    Deletes the DAY orders that expired by `now` (UTC).
+
+    Returns:
+        list[str]: The UIDs of the deleted orders.
+    """
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        expired_uids = session.execute(
+            select(PendingOrder.uid).where(PendingOrder.expires_at.is_not(None) & (PendingOrder.expires_at <= now))
+        ).scalars().all()
+        if expired_uids:
+            session.execute(delete(PendingOrder).where(PendingOrder.uid.in_(expired_uids)))
+            session.commit()
+        return list(expired_uids)
+    except Exception as error:
+        session.rollback()
+        logger.error(f"Failed to delete expired pending orders: {error}")
+        return []
+    finally:
+        session.close()
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Double, DateTime, Boolean, Index
+
+from data.database import db_base_userbase
+from data.utils.uuid import generate_uuid
+
+
+class PendingOrder(db_base_userbase):
+    """
+    Resting (limit, stop and stop-limit) orders that wait for the market to reach their price.
+    Stored in the userbase, so a fill can remove its order in the same transaction as the rest of the order.
+
+    uid: uuid | uuid: user's uuid | symbol | side | order_type | shares | limit_price | stop_price |
+    time_in_force: day or gtc | expires_at: UTC, None for GTC | triggered: stop of a stop-limit was hit | timestamp
+    """
+    __tablename__ = "pending_orders"
+
+    uid = Column(String, primary_key=True, default=generate_uuid, unique=True)
+    uuid = Column(String, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+
+    symbol = Column(String, nullable=False)
+    side = Column(String, nullable=False)
+    order_type = Column(String, nullable=False)
+    shares = Column(Double, nullable=False)
+    limit_price = Column(Double, nullable=True)
+    stop_price = Column(Double, nullable=True)
+
+    time_in_force = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    triggered = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (Index("ix_pending_orders_uuid", "uuid"),)
+
+    def __str__(self) -> str:
+        return f"{self.uid}: {self.side} {self.shares} {self.symbol} {self.order_type} limit {self.limit_price} stop {self.stop_price} ({self.time_in_force})"
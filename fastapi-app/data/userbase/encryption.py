@@ -1,4 +1,14 @@
+import base64
 import hashlib
+import hmac
+import os
+
+from utils.env_variables import PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+
+# Prefix of the passwords hashed with scrypt, older passwords are unsalted SHA-224 digests
+SCRYPT_PREFIX = "scrypt"
+SCRYPT_SALT_BYTES = 16
+SCRYPT_HASH_BYTES = 32
 
 def _encode_string(string: str, hash_func) -> str:
     """
@@ -33,17 +43,57 @@ def encode_username(string: str) -> str:
     """
     return _encode_string(string, hashlib.sha256)
 
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # scrypt needs 128 * r * (n + p + 2) bytes, which may be more than hashlib's default limit
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=SCRYPT_HASH_BYTES)
+
 def encode_password(string: str) -> str:
     """
-    Encode a given string using the MD5 hashing algorithm.
+    Hash a password with scrypt (memory-hard), using a random salt and the configured cost.
+    Takes tens of milliseconds by design, call it from the auth service's thread pool in request handlers.
 
     Args:
         string (str): The password string to be encoded.
-    
+
     Returns:
-        str: The MD5 encoded string in hexadecimal format.
-    
+        str: `scrypt$n$r$p$salt$hash`, with the salt and hash in base64.
+
     Raises:
         ValueError: If the input string is None.
     """
-    return _encode_string(string, hashlib.sha224)
+    if string is None:
+        raise ValueError("Input string cannot be None")
+    n, r, p = int(PASSWORD_SCRYPT_N), int(PASSWORD_SCRYPT_R), int(PASSWORD_SCRYPT_P)
+    salt = os.urandom(SCRYPT_SALT_BYTES)
+    digest = _scrypt(string, salt, n, r, p)
+    return "$".join((SCRYPT_PREFIX, str(n), str(r), str(p), base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+def verify_password(string: str, encoded_password: str) -> bool:
+    """
+    Check a password against its saved hash, either scrypt or a legacy SHA-224 digest.
+
+    Args:
+        string (str): The password to check.
+        encoded_password (str): The saved hash.
+
+    Returns:
+        bool: Whether the password matches.
+    """
+    if string is None or not encoded_password:
+        return False
+    if not encoded_password.startswith(f"{SCRYPT_PREFIX}$"):
+        return hmac.compare_digest(encoded_password, _encode_string(string, hashlib.sha224))
+    try:
+        _, n, r, p, salt, digest = encoded_password.split("$")
+        expected = base64.b64decode(digest)
+        return hmac.compare_digest(_scrypt(string, base64.b64decode(salt), int(n), int(r), int(p)), expected)
+    except ValueError:
+        return False
+
+def password_needs_rehash(encoded_password: str) -> bool:
+    """ Whether a saved hash is a legacy digest or was made with another cost than the configured one. """
+    if not encoded_password.startswith(f"{SCRYPT_PREFIX}$"):
+        return True
+    parameters = encoded_password.split("$")[1:4]
+    return parameters != [str(int(PASSWORD_SCRYPT_N)), str(int(PASSWORD_SCRYPT_R)), str(int(PASSWORD_SCRYPT_P))]
@@ -1,19 +1,23 @@
 from typing import Optional, Union, Optional,Tuple, Optional
 from data.userbase.model import Userbase
+from data.orders.model import PendingOrder
 
-from sqlalchemy import delete
+from sqlalchemy import delete, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import NoResultFound
 
 from data.database import DatabasesNames
 from data.utils.get_databases import get_database_variables_by_name
-from data.userbase.encryption import encode_username, encode_password
-from data.utils.get_databases import get_db
+from data.userbase.encryption import encode_username, encode_password, verify_password
+from data.utils.get_databases import get_db, get_user_table, user_rows_filter
+from data.dynamic_databases.lot_index import lot_index
+from data.utils.data_versions import data_versions
 
 from utils.logger_script import logger
 from records.records import UserIdentifiers
 
-def create_user_model(email: Optional[str], username: str, password: str) -> Union[Userbase, None]:
+def create_user_model(email: Optional[str], username: str, password: str, password_hash: Optional[str] = None) -> Union[Userbase, None]:
     """
     Creates a new user model by optionally assigning a provided email, and always assigning an 
     encoded username and encoded password.
@@ -22,7 +26,8 @@ def create_user_model(email: Optional[str], username: str, password: str) -> Uni
     Args:
         email (Optional[str]): The email address of the user. It is converted to lowercase before being stored. Can be None.
         username (str): The username of the user. It is encoded using SHA-256 hashing before being stored.
-        password (str): The password of the user. It is encoded using MD5 hashing before being stored.
+        password (str): The password of the user. It is hashed with scrypt before being stored.
+        password_hash (Optional[str]): The password already hashed (e.g. on the auth service's thread pool), used instead of hashing it here.
 
     Returns:
         Userbase or None: Returns a `Userbase` instance initialized with the provided credentials if the required 
@@ -40,7 +45,7 @@ def create_user_model(email: Optional[str], username: str, password: str) -> Uni
         user_model.email = email.lower()  # Normalize email to lowercase
 
     user_model.username = encode_username(username)
-    user_model.password = encode_password(password) 
+    user_model.password = password_hash if password_hash is not None else encode_password(password)
 
     return user_model
 
@@ -118,18 +123,46 @@ def check_uniqueness_of_email_and_or_username(email: Optional[str] = None, usern
     finally:
         session.close()
     
-def password_matches(identifier: str, identifier_value: str, password: str) -> bool:
-    saved_user = get_user_from_userbase(identifier, identifier_value)
+def get_user_credentials(session: Session, identifier: str, value: str) -> Optional[Row]:
+    """
+    Fetches what authenticating a user needs in a single query on the unique (indexed) identifier.
 
-    if saved_user is None:
-        return False
-    else:
-        return saved_user.password == encode_password(password)
+    Args:
+        session (Session): A session of the userbase.
+        identifier (str): 'uuid' or 'username' (encoded).
+        value (str): The value corresponding to the identifier.
+
+    Returns:
+        Row: The user's uuid, email and password hash, None if there is no such user.
+    """
+    if identifier not in (UserIdentifiers.uuid.value, UserIdentifiers.username.value):
+        logger.error(f"Credentials can only be looked up by uuid or username. Chosen identifier: {identifier}.")
+        return None
+    filter_condition = getattr(Userbase, identifier) == value
+    return session.execute(select(Userbase.uuid, Userbase.email, Userbase.password).where(filter_condition)).first()
+
+def set_password_hash(session: Session, uuid: str, password_hash: str) -> None:
+    """ Saves a new hash of a user's password (e.g. an upgraded legacy hash) and commits. """
+    session.execute(update(Userbase).where(Userbase.uuid == uuid).values(password=password_hash))
+    session.commit()
+
+def password_matches(identifier: str, identifier_value: str, password: str) -> bool:
+    """
+    Checks a password against the saved hash of a user, without the auth service's credential cache.
+    Request handlers should use `auth_service.check_password` instead.
+    """
+    session: Session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        credentials = get_user_credentials(session, identifier, identifier_value)
+    finally:
+        session.close()
+    return credentials is not None and verify_password(password, credentials.password)
 
 def delete_user_data_from_database(uuid: str, database_name: str) -> bool:
     """
     Deletes user data from a specified database. If the database is 'userbase', it deletes only the specific user's row.
-    Otherwise, it attempts to delete a table named after the user's UUID (used for transaction and portfolio databases).
+    Otherwise, it attempts to delete the rows of the table named after the user's UUID, or the user's rows
+    in the shared ledger table (used for transaction and portfolio databases).
 
     Args:
         uuid (str): The user's UUID.
@@ -143,7 +176,10 @@ def delete_user_data_from_database(uuid: str, database_name: str) -> bool:
             session = next(get_db(database_name))
             # Execute the delete operation for a specific user in the userbase
             user = session.query(Userbase).filter(Userbase.uuid == uuid).delete()
+            # Along with the user's resting orders (the order book skips orders that no longer exist)
+            session.query(PendingOrder).filter(PendingOrder.uuid == uuid).delete()
             session.commit()
+            data_versions.bump(uuid)
             logger.info(f"Successfully deleted user data for UUID {uuid} from userbase.")
             return True
         else:
@@ -154,12 +190,15 @@ def delete_user_data_from_database(uuid: str, database_name: str) -> bool:
                 return False
 
             session = Session(bind=engine)
-            # Get the table from metadata which is named after the user's UUID
-            user_table = metadata.tables.get(uuid)
+            if database_name == DatabasesNames.portfolios.value:
+                lot_index.invalidate(uuid)
+            # Get the table from metadata which is named after the user's UUID (or the shared ledger table)
+            user_table = get_user_table(database_name, uuid)
             if user_table is not None:
-                # Execute the delete operation for the entire table
-                session.execute(delete(user_table))
+                # Execute the delete operation for all of the user's rows
+                session.execute(delete(user_table).where(user_rows_filter(user_table, uuid)))
                 session.commit()
+                data_versions.bump(uuid)
                 logger.info(f"Successfully deleted all data for user {uuid} from {database_name}.")
                 return True
             else:
@@ -1,2 +1,2 @@
-__all__ = ["uuid", "get_databases"]
+__all__ = ["uuid", "get_databases", "query_counter", "checkpoint"]
 from . import *
\ No newline at end of file
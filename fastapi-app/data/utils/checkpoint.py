@@ -0,0 +1,98 @@
+from typing import Optional
+import threading
+import time
+
+from sqlalchemy import Engine
+
+from data.database import (db_engine_userbase, db_engine_transactions, db_engine_portfolios,
+                           DatabasesNames, JournalModes, SQLITE_PRAGMAS)
+from utils.logger_script import logger
+from utils.env_variables import SQLITE_CHECKPOINT_INTERVAL
+
+
+class WalCheckpointer:
+    """
+    Background loop that checkpoints the write-ahead logs of the databases (in the WAL journal mode).
+
+    SQLite checkpoints on its own once a log reaches 1000 pages, inside whichever commit crosses that size.
+    Checkpointing on a timer moves that work out of the requests and keeps the logs (which readers have to
+    search) short. Checkpoints are passive: they never wait for readers or the writer, and a log that could
+    not be fully copied is simply continued by the next checkpoint.
+
+    Args:
+        engines (dict[str, Engine]): The engines of the databases to checkpoint, by database name.
+        interval (float): Seconds between checkpoints.
+    """
+    def __init__(self, engines: dict[str, Engine], interval: float):
+        self.engines = engines
+        self.interval = interval
+        self.checkpoints = 0
+        # (busy, pages in the log, pages copied to the database) of the last checkpoint, and its duration in ms
+        self.last_checkpoint: dict[str, dict] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def checkpoint(self, mode: str = "PASSIVE") -> dict[str, dict]:
+        """
+        Checkpoints the log of every database.
+
+        Args:
+            mode (str): The checkpoint mode, PASSIVE, FULL, RESTART or TRUNCATE.
+
+        Returns:
+            dict[str, dict]: The result of every database's checkpoint.
+        """
+        results = {}
+        for database_name, engine in self.engines.items():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    busy, log_pages, checkpointed_pages = connection.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one()
+                results[database_name] = {
+                    "busy": bool(busy), "log_pages": log_pages, "checkpointed_pages": checkpointed_pages,
+                    "ms": (time.perf_counter() - start) * 1000,
+                }
+            except Exception as error:
+                logger.error(f"Failed to checkpoint {database_name}. Error: {error}")
+        self.checkpoints += 1
+        self.last_checkpoint = results
+        return results
+
+    def get_stats(self) -> dict:
+        return {
+            "pragmas": SQLITE_PRAGMAS,
+            "interval": self.interval,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "checkpoints": self.checkpoints,
+            "last_checkpoint": self.last_checkpoint,
+        }
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.checkpoint()
+
+    def start(self) -> None:
+        if SQLITE_PRAGMAS["journal_mode"] != JournalModes.wal.value:
+            logger.info(f"Not checkpointing, the databases use the {SQLITE_PRAGMAS['journal_mode']} journal mode")
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+        self._thread.start()
+        logger.info(f"WAL checkpointer started, checkpointing every {self.interval} seconds")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+wal_checkpointer = WalCheckpointer(
+    engines={
+        DatabasesNames.userbase.value: db_engine_userbase,
+        DatabasesNames.transactions.value: db_engine_transactions,
+        DatabasesNames.portfolios.value: db_engine_portfolios,
+    },
+    interval=float(SQLITE_CHECKPOINT_INTERVAL),
+)
@@ -0,0 +1,58 @@
+"""
+Versions of the users' data (balance, transactions and portfolio lots), published at `/get_user/version` so the
+Flask app can keep the pages it renders from them until they change.
+
+A user's version changes after every committed write to their data: fills of orders and batches, the row helpers
+and deletions. Versions are `<epoch>.<counter>`, where the counter only grows and the epoch is random per process
+start, so a version is never reused for other data, even after a restart.
+
+The versions are per process and kept in memory like the lot index. Users that were evicted (or never written
+since the start) share the highest counter evicted so far, which is at least the version they had.
+"""
+from collections import OrderedDict
+import base64
+import os
+import threading
+
+from utils.env_variables import DATA_VERSIONS_MAX_USERS
+
+class DataVersions:
+    """
+    Counter of the writes to every user's data.
+
+    Args:
+        max_users (int): The number of users whose version is kept (least recently written first out).
+    """
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self.epoch = base64.urlsafe_b64encode(os.urandom(6)).decode()
+        self.stats = {"bumps": 0, "evictions": 0}
+        self._counter = 0
+        # The version of every user not in the map
+        self._floor = 0
+        self._versions: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self, uuid: str) -> None:
+        """ Gives a user a new version. Called once the write to their data is committed. """
+        with self._lock:
+            self._counter += 1
+            self._versions[uuid] = self._counter
+            self._versions.move_to_end(uuid)
+            self.stats["bumps"] += 1
+            while len(self._versions) > self.max_users:
+                _, evicted = self._versions.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+                self.stats["evictions"] += 1
+
+    def get(self, uuid: str) -> str:
+        """ The version of a user's data. """
+        with self._lock:
+            return f"{self.epoch}.{self._versions.get(uuid, self._floor)}"
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "epoch": self.epoch, "users": len(self._versions), "max_users": self.max_users,
+                    "counter": self._counter, "floor": self._floor}
+
+data_versions = DataVersions(max_users=int(DATA_VERSIONS_MAX_USERS))
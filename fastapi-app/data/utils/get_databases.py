@@ -1,14 +1,18 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Generator, Union
 import traceback
+import threading
 
-from sqlalchemy import MetaData, Engine, Table
-from sqlalchemy.orm import Session
+from sqlalchemy import MetaData, Engine, Table, true
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.orm import Session, sessionmaker
 
 from data.database import (db_sessionmaker_userbase, db_sessionmaker_transactions, db_sessionmaker_portfolios,
                            db_metadata_transactions, db_engine_transactions,
                            db_metadata_portfolios, db_engine_portfolios,
-                           DatabasesNames)
+                           db_sessionmaker_execution, db_metadata_execution,
+                           DatabasesNames, StorageModes, LEDGER_TABLE_NAMES, storage_mode)
 from records.records import StockRecord
 from utils.logger_script import logger
 
@@ -41,6 +45,21 @@ def get_db_portfolio() -> Generator[Session, any, None]:
     finally:
         db.close()
 
+def get_db_execution() -> Generator[Session, any, None]:
+    """ Session on the userbase with transactions and portfolios attached, for writing orders in one transaction. """
+    try:
+        db = db_sessionmaker_execution()
+        yield db
+    except Exception as error:
+        logger.critical(f"ERROR IN GETTING EXECUTION DATABASE: {error}")
+    finally:
+        db.close()
+
+@lru_cache(maxsize=None)
+def get_sessionmaker(engine: Engine) -> sessionmaker:
+    """ The sessionmaker of an engine, created once per engine instead of for every session. """
+    return sessionmaker(bind=engine)
+
 database_functions = {
     DatabasesNames.userbase.value: get_db_userbase,
     DatabasesNames.transactions.value: get_db_transactions,
@@ -108,7 +127,13 @@ def get_database_variables_by_name(database_name: str):
     return (table_format, metadata, engine)
 
 def get_table_object_from_selected_database_by_name(database_name: str, table_name: str) -> Union[Table, None]:
+    """
+    Get the table object of a table in transactions or portfolios.
+    In the ledger storage mode a user's table is the shared ledger table (filter it with `user_rows_filter`).
+    """
     try:
+        if storage_mode is StorageModes.ledger:
+            table_name = LEDGER_TABLE_NAMES.get(database_name, table_name)
         table_object = None
         match(database_name):
             case DatabasesNames.transactions.value:
@@ -125,3 +150,60 @@ def get_table_object_from_selected_database_by_name(database_name: str, table_na
     except Exception as error:
         logger.error(f"Error occured while trying to get table object with name {table_name} from database {database_name}")
         return None
+
+def get_user_table(database_name: str, uuid: str) -> Union[Table, None]:
+    """
+    Get the table that holds a user's rows in a dynamic database, regardless of the storage mode:
+    the user's own table (named after the UUID) or the shared ledger table.
+
+    Args:
+        database_name (str): The name of the database (transactions or portfolios).
+        uuid (str): The UUID of the user.
+
+    Returns:
+        Union[Table, None]: The table object, or None if it does not exist.
+    """
+    _, metadata, _ = get_database_variables_by_name(database_name) or (None, None, None)
+    if metadata is None:
+        return None
+    if storage_mode is StorageModes.ledger:
+        return metadata.tables.get(LEDGER_TABLE_NAMES[database_name], None)
+    return metadata.tables.get(uuid, None)
+
+def user_rows_filter(table: Table, uuid: str) -> ColumnElement[bool]:
+    """
+    Condition selecting a user's rows of a table returned by `get_user_table`.
+    Tables of the per user storage mode only hold the user's rows, so everything is selected.
+    """
+    if "user_uuid" in table.c:
+        return table.c.user_uuid == uuid
+    return true()
+
+def user_row_values(table: Table, uuid: str) -> dict:
+    """ Extra values a row of a user needs when it is inserted into a table returned by `get_user_table`. """
+    if "user_uuid" in table.c:
+        return {"user_uuid": uuid}
+    return {}
+
+_execution_tables_lock = threading.Lock()
+
+def get_execution_table(database_name: str, uuid: str) -> Union[Table, None]:
+    """
+    Get the table returned by `get_user_table` as seen from the execution engine,
+    where the database is attached as a schema of the same name.
+
+    Args:
+        database_name (str): The name of the database (transactions or portfolios).
+        uuid (str): The UUID of the user.
+
+    Returns:
+        Union[Table, None]: The table object, or None if it does not exist.
+    """
+    table = get_user_table(database_name, uuid)
+    if table is None:
+        return None
+    with _execution_tables_lock:
+        attached_table = db_metadata_execution.tables.get(f"{database_name}.{table.name}", None)
+        if attached_table is None:
+            attached_table = table.to_metadata(db_metadata_execution, schema=database_name)
+    return attached_table
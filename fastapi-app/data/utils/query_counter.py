@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from collections import Counter
+import threading
+
+from sqlalchemy import event, Engine
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements executed on every engine of the process while it is active.
+
+    Attributes:
+        total (int): The number of executed statements.
+        per_database (Counter): The number of executed statements per database file.
+        statements (list[str]): The executed statements, in order.
+    """
+    def __init__(self, thread_only: bool = True):
+        self.total = 0
+        self.per_database = Counter()
+        self.statements = []
+        # Only count the statements of the thread that started counting (e.g. not other requests of the server)
+        self._thread_id = threading.get_ident() if thread_only else None
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = 0
+            self.per_database.clear()
+            self.statements.clear()
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        if self._thread_id is not None and threading.get_ident() != self._thread_id:
+            return
+        with self._lock:
+            self.total += 1
+            self.per_database[connection.engine.url.database] += 1
+            self.statements.append(statement)
+
+@contextmanager
+def count_queries(thread_only: bool = True):
+    """
+    Context manager that counts the SQL statements executed inside it.
+
+    Args:
+        thread_only (bool): Count only the statements executed by the current thread.
+
+    Yields:
+        QueryCounter: The counter, filled while the context is active.
+
+    Example:
+        with count_queries() as counter:
+            compile_user_portfolio("portfolios", uuid)
+        print(counter.total)
+    """
+    counter = QueryCounter(thread_only=thread_only)
+    event.listen(Engine, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, "before_cursor_execute", counter._before_cursor_execute)
@@ -1,8 +1,10 @@
 import uvicorn
 from fastapi import FastAPI
 
-from utils.env_variables import FASTAPI_PORT 
+from utils.env_variables import FASTAPI_PORT
 from data.database import initialise_all_databases
+from data.utils.checkpoint import wal_checkpointer
+from utils.order_matching import order_matcher
 
 from routes import fastapi_router, admin_router
 from utils.middlewares import VerifyClientIPMiddleware
@@ -24,6 +26,10 @@ if __name__ == "__main__":
     papertrading_app.include_router(admin_router)
 
     initialise_all_databases()
+    # Restore the resting orders and start matching them against the quotes
+    order_matcher.load_pending_orders()
+    order_matcher.start()
+    wal_checkpointer.start()
     
     run_app(app=papertrading_app)
         
\ No newline at end of file
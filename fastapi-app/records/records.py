@@ -32,6 +32,49 @@ class Statuses(Enum):
     tracked = "tracked"  
     archived = "archived" 
 
+class OrderTypes(Enum):
+    """
+    Enumeration of the supported order types.
+
+    Attributes:
+        market (str): Executed right away at the current bid (sell) or ask (buy).
+        limit (str): Rests until the ask falls to (buy) or the bid rises to (sell) the limit price.
+        stop (str): Rests until the ask rises to (buy) or the bid falls to (sell) the stop price, then executes as a market order.
+        stop_limit (str): Rests until the stop price is reached, then rests as a limit order.
+    """
+    market = "market"
+    limit = "limit"
+    stop = "stop"
+    stop_limit = "stop_limit"
+
+class TimesInForce(Enum):
+    """
+    Enumeration of how long a resting order stays open.
+
+    Attributes:
+        day (str): Expires at the next market close.
+        gtc (str): Good 'til cancelled.
+    """
+    day = "day"
+    gtc = "gtc"
+
+class LotSelections(Enum):
+    """
+    Enumeration of the orders in which a sell consumes the open lots of a symbol.
+
+    Attributes:
+        fifo (str): First in, first out - the oldest lots first.
+        lifo (str): Last in, first out - the newest lots first.
+        lowest_cost (str): The lots with the lowest cost per share first (realizes the most gain).
+        highest_cost (str): The lots with the highest cost per share first (realizes the least gain).
+        specific (str): The lots chosen by the user, by their UIDs.
+    """
+    fifo = "fifo"
+    lifo = "lifo"
+    lowest_cost = "lowest_cost"
+    highest_cost = "highest_cost"
+    specific = "specific"
+
 @dataclass
 class StockRecord(BetterDataclass):
     """
@@ -58,7 +101,7 @@ class StockRecord(BetterDataclass):
         as they are automatically generated with the creation of an insatnce.
     """
     uid: str = field(init=False)
-    timestamp: datetime = field(init=False, default=datetime.now())
+    timestamp: datetime = field(init=False, default_factory=datetime.now)
     symbol: str 
     side: Literal["buy", "sell"]
     order_type: Literal["market", "limit", "stop", "stop_limit"]
@@ -3,7 +3,16 @@ from fastapi import APIRouter, Request
 # Modules
 from data.database import DatabasesNames
 from data.userbase.helper import get_user_from_userbase, delete_user_data_from_database
+from data.utils.checkpoint import wal_checkpointer
+from data.dynamic_databases.lot_index import lot_index
+from data.utils.data_versions import data_versions
+from data.bars.store import bar_store
 from utils.logger_script import logger
+from utils.quote_cache import quote_cache
+from utils.order_matching import order_matcher
+from utils.risk import return_matrix_cache
+from utils.auth import auth_service
+from utils.tokens import token_service
 from records.records import ServerResponse, UserIdentifiers
 
 
@@ -13,6 +22,8 @@ admin_router = APIRouter()
 def force_delete_user(uuid: str):
     try:
         return_dict = ServerResponse()
+        auth_service.invalidate(uuid)
+        token_service.revoke_user(uuid)
     
         # Attempt to delete user data from userbase, transactions, and portfolios databases
         success_userbase = delete_user_data_from_database(uuid, DatabasesNames.userbase.value)
@@ -29,4 +40,98 @@ def force_delete_user(uuid: str):
     except Exception as error:
         logger.warning(f"Error: {error}")
     finally:
-        return return_dict.to_dict()
\ No newline at end of file
+        return return_dict.to_dict()
+
+@admin_router.get("/quote_cache/stats")
+def quote_cache_stats():
+    return_dict = ServerResponse()
+    return_dict.data = quote_cache.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/bar_store/stats")
+def bar_store_stats():
+    return_dict = ServerResponse()
+    return_dict.data = bar_store.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/auth/stats")
+def auth_stats():
+    return_dict = ServerResponse()
+    return_dict.data = auth_service.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/access_tokens/stats")
+def access_tokens_stats():
+    return_dict = ServerResponse()
+    return_dict.data = token_service.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.post("/access_tokens/rotate")
+def rotate_access_token_key():
+    """ Signs new tokens with a new random key (kept in memory until the restart, set ACCESS_TOKEN_KEYS to keep it). """
+    return_dict = ServerResponse()
+    return_dict.data = token_service.rotate()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.delete("/access_tokens/keys/{key_id}")
+def retire_access_token_key(key_id: str):
+    return_dict = ServerResponse()
+    return_dict.success = token_service.retire(key_id)
+    if not return_dict.success:
+        return_dict.error = "Unknown key, or the key new tokens are signed with"
+    return return_dict.to_dict()
+
+@admin_router.post("/access_tokens/revoke_user")
+def revoke_user_access_tokens(uuid: str):
+    return_dict = ServerResponse()
+    token_service.revoke_user(uuid)
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/risk_cache/stats")
+def risk_cache_stats():
+    return_dict = ServerResponse()
+    return_dict.data = return_matrix_cache.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/order_matcher/stats")
+def order_matcher_stats():
+    return_dict = ServerResponse()
+    return_dict.data = order_matcher.last_cycle
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/sqlite/stats")
+def sqlite_stats():
+    return_dict = ServerResponse()
+    return_dict.data = wal_checkpointer.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/lot_index/stats")
+def lot_index_stats():
+    return_dict = ServerResponse()
+    return_dict.data = lot_index.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.get("/data_versions/stats")
+def data_versions_stats():
+    return_dict = ServerResponse()
+    return_dict.data = data_versions.get_stats()
+    return_dict.success = True
+    return return_dict.to_dict()
+
+@admin_router.post("/lot_index/rebuild")
+def rebuild_lot_index(uuid: str = None):
+    """ Drops the lots of a user (or of every user) from the lot index, they are loaded again from the portfolios on the next sell. """
+    return_dict = ServerResponse()
+    lot_index.invalidate(uuid)
+    return_dict.success = True
+    return return_dict.to_dict()
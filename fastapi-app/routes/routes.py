@@ -1,35 +1,48 @@
 import numpy as np
 import traceback
 
-from fastapi import Depends, HTTPException, APIRouter, Query
+from fastapi import Depends, HTTPException, APIRouter
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-import yfinance as yf
 
 # Modules
 from utils.logger_script import logger
-from utils.stock_handler import StockHandler
-from utils.encryption import decrypt
-
-from records.records import StockRecord, ServerResponse, UserIdentifiers
+from utils.stock_handler import StockHandler, BatchTransaction, MAX_BATCH_TRANSACTIONS
+from utils.order_matching import order_matcher
+from utils.yfinance_helper import get_symbol_info, get_symbols_info
+from utils.parameters import encrypted_parameters
+from utils.pnl import get_user_pnl as compute_user_pnl
+from utils.equity_curve import get_user_equity_curve as compute_user_equity_curve
+from utils.risk import get_user_risk as compute_user_risk, MIN_WINDOW, MAX_WINDOW
+from utils.backtest import run_backtest, STRATEGIES, MAX_SYMBOLS as MAX_BACKTEST_SYMBOLS
+from utils.auth import auth_service
+from utils.tokens import token_service, get_user_uuid, get_access_token, AccessToken
+
+from records.records import StockRecord, ServerResponse, UserIdentifiers, OrderTypes
 
 from data.database import DatabasesNames
 from data.utils.get_databases import get_db, get_db_userbase
+from data.utils.data_versions import data_versions
 from data.userbase.model import Userbase
-from data.userbase.helper import (get_user_from_userbase, create_user_model, password_matches, delete_user_data_from_database, 
+from data.userbase.helper import (get_user_from_userbase, create_user_model, delete_user_data_from_database, 
                                   check_uniqueness_of_email_and_or_username)
-from data.userbase.encryption import encode_username, encode_password
+from data.userbase.encryption import encode_username
+from data.orders.helper import create_pending_order_model, get_pending_orders
 from data.dynamic_databases.helper import query_specific_columns_from_database_table, compile_user_portfolio
+from data.dynamic_databases.lot_index import get_lot_uids
+from data.bars.store import bar_store
+from data.bars.providers import BarIntervals
 
 fastapi_router = APIRouter()
 
 # Fully Done
 @fastapi_router.post("/sign_up")
-def sign_up(email: str, username: str, password: str, db: Session = Depends(get_db_userbase)) -> dict[str, str | bool]:
+def sign_up(parameters: dict = Depends(encrypted_parameters("email", "username", "password")), db: Session = Depends(get_db_userbase)) -> dict[str, str | bool]:
     try: 
         logger.debug(f"Received sign up request")
         return_dict = ServerResponse()
         
-        email, username, password = decrypt(email), decrypt(username), decrypt(password)
+        email, username, password = parameters["email"], parameters["username"], parameters["password"]
 
         # filter out using email or username that is already being used
         is_unique, reasons_for_ununiqueness = check_uniqueness_of_email_and_or_username(username=username, email=email)
@@ -46,7 +59,7 @@ def sign_up(email: str, username: str, password: str, db: Session = Depends(get_
             else:
                 logger.info(f"Email exists: {email}")
                 
-                user_model = create_user_model(email, username, password)
+                user_model = create_user_model(email, username, password, password_hash=auth_service.hash_password(password))
 
                 # add user to database
                 try:
@@ -77,31 +90,23 @@ def sign_up(email: str, username: str, password: str, db: Session = Depends(get_
         return return_dict.to_dict()
 
 @fastapi_router.post("/sign_in")
-def sign_in(username: str, password: str, db: Session = Depends(get_db_userbase)):
+def sign_in(parameters: dict = Depends(encrypted_parameters("username", "password")), db: Session = Depends(get_db_userbase)):
     try: 
         logger.debug(f"Received sign in request")
         return_dict = ServerResponse()
 
-        username, password = decrypt(username), decrypt(password)
-        
-        # Create a user model (encoded)
-        user_model = create_user_model(None, username, password)
-
-        saved_user_unsafe = db.query(Userbase).filter((Userbase.username == user_model.username)).first()
-        if saved_user_unsafe is not None:
-            saved_user = db.query(Userbase).filter((Userbase.username == user_model.username) & (Userbase.password == user_model.password)).first()
-            if saved_user is not None:
-                logger.debug(f"Signed in for user {username} approved")
-                return_dict.success = True
-                extra_data = {}
-                try:
-                    extra_data["uuid"] = saved_user.uuid
-                    extra_data["email"] = saved_user.email
-                    return_dict.data = extra_data
-                except Exception as error:
-                    logger.critical(f"Error while retrieving uuid from saved user: {error}")
-            else:
-                return_dict.error = "Failed to sign in. Password is incorrect"
+        username, password = parameters["username"], parameters["password"]
+
+        # One query on the (unique, indexed) encoded username, the password is verified on the auth pool
+        user, reason = auth_service.sign_in(db, encode_username(username), password)
+        if user is not None:
+            logger.debug(f"Signed in for user {username} approved")
+            return_dict.success = True
+            # The client authenticates its next requests with the access token instead of the uuid
+            token, expires_at = token_service.issue(user["uuid"])
+            return_dict.data = {**user, "token": token, "expires_at": expires_at}
+        elif reason == UserIdentifiers.password.value:
+            return_dict.error = "Failed to sign in. Password is incorrect"
         else:
             logger.debug(f"Signed in for user {username} has failed. User likely doesn't exist.")            
             return_dict.error = "Failed to sign in. User doesn't exist"
@@ -113,12 +118,19 @@ def sign_in(username: str, password: str, db: Session = Depends(get_db_userbase)
         logger.debug(f"sending back data: {return_dict.to_dict()}")
         return return_dict.to_dict()
 
+@fastapi_router.post("/sign_out")
+def sign_out(access_token: AccessToken = Depends(get_access_token)):
+    return_dict = ServerResponse()
+    token_service.revoke(access_token)
+    logger.debug(f"User {access_token.uuid} signed out")
+    return_dict.success = True
+    return return_dict.to_dict()
+
 # Fully Done
 @fastapi_router.get("/get_user/database/{database_name}")
-def get_user_database_table(database_name: str, uuid: str):
+def get_user_database_table(database_name: str, uuid: str = Depends(get_user_uuid)):
     try:
         return_dict = ServerResponse()
-        uuid = decrypt(uuid)
 
         if database_name not in [DatabasesNames.transactions.value, DatabasesNames.portfolios.value]:
             return_dict.error = "Invalid Database Name"
@@ -144,11 +156,18 @@ def get_user_database_table(database_name: str, uuid: str):
     finally:
         return return_dict.to_dict()
 
+@fastapi_router.get("/get_user/version")
+def get_user_version(uuid: str = Depends(get_user_uuid)):
+    """ The version of the user's data, which changes with every fill. Pages rendered from an unchanged version are still valid. """
+    return_dict = ServerResponse()
+    return_dict.data = {"version": data_versions.get(uuid)}
+    return_dict.success = True
+    return return_dict
+
 @fastapi_router.get("/get_user/summary")
-def get_user_summary(uuid: str):
+def get_user_summary(uuid: str = Depends(get_user_uuid)):
     try:
         return_dict = ServerResponse()
-        uuid = decrypt(uuid)
 
         logger.debug(f"Received user portfolio request for user: {uuid}")
 
@@ -176,38 +195,200 @@ def get_user_summary(uuid: str):
     finally:
         return return_dict
 
+@fastapi_router.get("/get_user/pnl")
+def get_user_pnl(uuid: str = Depends(get_user_uuid)):
+    try:
+        return_dict = ServerResponse()
+
+        logger.debug(f"Received P&L request for user: {uuid}")
+        pnl = compute_user_pnl(uuid)
+        if pnl is None:
+            return_dict.error = "Failed to compute P&L"
+        else:
+            return_dict.data = pnl
+            return_dict.success = True
+    except Exception as error:
+        logger.error(f"Unexpected error occured in get P&L: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.get("/get_user/equity_curve")
+def get_user_equity_curve(uuid: str = Depends(get_user_uuid)):
+    try:
+        return_dict = ServerResponse()
+
+        logger.debug(f"Received equity curve request for user: {uuid}")
+        user = get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid)
+        if user is None:
+            return_dict.error = "User not found"
+            return return_dict
+        equity_curve = compute_user_equity_curve(uuid, float(user.balance))
+        if equity_curve is None:
+            return_dict.error = "No transactions to build an equity curve from"
+        else:
+            return_dict.data = equity_curve
+            return_dict.success = True
+    except Exception as error:
+        logger.error(f"Unexpected error occured in get equity curve: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.get("/get_user/risk")
+def get_user_risk(uuid: str = Depends(get_user_uuid), window: int = 252, benchmark: str = None):
+    try:
+        return_dict = ServerResponse()
+
+        logger.debug(f"Received risk request for user: {uuid}")
+        if not MIN_WINDOW <= window <= MAX_WINDOW:
+            return_dict.error = f"Window must be between {MIN_WINDOW} and {MAX_WINDOW} trading days"
+            return return_dict
+        risk = compute_user_risk(uuid, window, benchmark)
+        if risk is None:
+            return_dict.error = "Failed to compute risk"
+        else:
+            return_dict.data = risk
+            return_dict.success = True
+    except Exception as error:
+        logger.error(f"Unexpected error occured in get risk: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.post("/backtest")
+def backtest(parameters: dict = Depends(encrypted_parameters("backtest"))):
+    try:
+        return_dict = ServerResponse()
+        backtest = parameters["backtest"]
+
+        logger.debug(f"Received backtest request of {backtest.get('strategy')}")
+        if backtest.get("strategy") not in STRATEGIES:
+            return_dict.error = f"Unknown strategy, choose one of {', '.join(STRATEGIES)}"
+            return return_dict
+        if not backtest.get("symbols") or len(backtest["symbols"]) > MAX_BACKTEST_SYMBOLS:
+            return_dict.error = f"Backtest between 1 and {MAX_BACKTEST_SYMBOLS} symbols"
+            return return_dict
+        result = run_backtest(backtest)
+        if "error" in result:
+            return_dict.error = result["error"]
+        else:
+            return_dict.data = result
+            return_dict.success = True
+    except Exception as error:
+        logger.error(f"Unexpected error occured in backtest: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.get("/bars/{symbol}")
+def get_bars(symbol: str, interval: str = BarIntervals.day.value, start: str = None, end: str = None):
+    try:
+        return_dict = ServerResponse()
+
+        bars = bar_store.get_bars(symbol, interval, start, end)
+        if bars is None:
+            return_dict.error = "Could not get bars"
+        else:
+            return_dict.data = {name: bars[name].tolist() for name in bars.dtype.names}
+            return_dict.data["time"] = np.datetime_as_string(bars["time"]).tolist()
+            return_dict.success = True
+    except ValueError as error:
+        logger.warning(f"Invalid bar range {start} to {end}: {error}")
+        return_dict.reset()
+        return_dict.error = "Invalid start or end"
+    except Exception as error:
+        logger.error(f"Unexpected error occured in get bars: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.get("/get_user/orders")
+def get_user_orders(uuid: str = Depends(get_user_uuid)):
+    try:
+        return_dict = ServerResponse()
+
+        logger.debug(f"Received resting orders request for user: {uuid}")
+        return_dict.data = [
+            {
+                "uid": pending_order.uid,
+                "timestamp": pending_order.timestamp,
+                "symbol": pending_order.symbol,
+                "side": pending_order.side,
+                "order_type": pending_order.order_type,
+                "shares": pending_order.shares,
+                "limit_price": pending_order.limit_price,
+                "stop_price": pending_order.stop_price,
+                "time_in_force": pending_order.time_in_force,
+                "expires_at": pending_order.expires_at,
+                "triggered": pending_order.triggered,
+            }
+            for pending_order in get_pending_orders(uuid)
+        ]
+        return_dict.success = True
+    except Exception as error:
+        logger.error(f"Unexpected error occured in get orders: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
+@fastapi_router.post("/cancel_order")
+def cancel_order(parameters: dict = Depends(encrypted_parameters("order_uid")), uuid: str = Depends(get_user_uuid)):
+    try:
+        return_dict = ServerResponse()
+        order_uid = parameters["order_uid"]
+
+        if order_matcher.cancel(uuid, order_uid):
+            logger.info(f"User {uuid} cancelled resting order {order_uid}")
+            return_dict.success = True
+        else:
+            return_dict.error = "Order not found. It may have been filled or expired already"
+    except Exception as error:
+        logger.error(f"Unexpected error occured in cancel order: {error}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
+
 @fastapi_router.put("/update/{attribute_to_update}")
-def update_user(attribute_to_update: str, uuid: str, password: str, new_attribute_value: str = Query(alias="value")):
+def update_user(attribute_to_update: str, parameters: dict = Depends(encrypted_parameters("password", "value")), uuid: str = Depends(get_user_uuid)):
     try:
         return_dict = ServerResponse()
-        uuid, password, new_attribute_value = decrypt(uuid), decrypt(password), decrypt(new_attribute_value)
+        password, new_attribute_value = parameters["password"], parameters["value"]
 
         logger.debug(f"Received update request to update {attribute_to_update}")
 
-        if password_matches(identifier=UserIdentifiers.uuid.value, identifier_value=uuid, password=password):
+        if auth_service.check_password(uuid, password):
             try:
                 session: Session = next(get_db(DatabasesNames.userbase.value))
-                update = True
+                # Not named `update`, which would shadow SQLAlchemy's update below
+                can_update = True
 
                 # Verify that attribute_to_update is a valid column name
                 if hasattr(Userbase, attribute_to_update):
                     if attribute_to_update == UserIdentifiers.email.value:
                         is_unique, reasons_for_ununiqueness = check_uniqueness_of_email_and_or_username(email=new_attribute_value)
                         if not is_unique:
-                            update = False
+                            can_update = False
                         else:
                             update_values = {attribute_to_update: new_attribute_value.lower()}
                     elif attribute_to_update == UserIdentifiers.password.value:
-                        update_values = {attribute_to_update: encode_password(new_attribute_value)}
+                        update_values = {attribute_to_update: auth_service.hash_password(new_attribute_value)}
                     elif attribute_to_update == UserIdentifiers.username.value:
                         is_unique, reasons_for_ununiqueness = check_uniqueness_of_email_and_or_username(username=new_attribute_value)
                         if not is_unique:
                             
-                            update = False
+                            can_update = False
                         else:
                             update_values = {attribute_to_update: encode_username(new_attribute_value)}
 
-                    if update:
+                    if can_update:
                         session.execute(
                             update(Userbase).
                             where(Userbase.uuid == uuid).
@@ -215,10 +396,17 @@ def update_user(attribute_to_update: str, uuid: str, password: str, new_attribut
                         )
                         session.commit()
                         session.close()
+                        if attribute_to_update == UserIdentifiers.password.value:
+                            # The old password must not be accepted from the credential cache anymore,
+                            # and the sessions signed in with it are signed out (but this one, which gets a new token)
+                            auth_service.invalidate(uuid)
+                            token_service.revoke_user(uuid)
+                            token, expires_at = token_service.issue(uuid)
+                            return_dict.data = {"token": token, "expires_at": expires_at}
                         
                         return_dict.success = True
                         logger.debug(f"Changing of {attribute_to_update} has been successful")
-                    if not update:
+                    if not can_update:
                         return_dict.error = f"Failed to update user. {str(" ".join(reasons_for_ununiqueness)).capitalize()} associated with existing user"
                         logger.debug(f"Changing of {attribute_to_update} hasn't been as user's input is not unique")
                 
@@ -228,6 +416,7 @@ def update_user(attribute_to_update: str, uuid: str, password: str, new_attribut
                 return_dict.error = "Internal Server Error"
         else:
             logger.warning(f"Couldn't update {attribute_to_update} as password does not match")
+            return_dict.error = "Invalid password."
     except Exception as error:
         logger.error(f"Unexpected error occured in sign up: {error}")
         return_dict.reset()
@@ -236,15 +425,16 @@ def update_user(attribute_to_update: str, uuid: str, password: str, new_attribut
         return return_dict
 
 @fastapi_router.delete("/delete_user")
-def delete_user(uuid: str, password: str):
+def delete_user(parameters: dict = Depends(encrypted_parameters("password")), uuid: str = Depends(get_user_uuid)):
     try:
         return_dict = ServerResponse()
-        # Decrypt the uuid and password
-        uuid, password = decrypt(uuid), decrypt(password)
+        password = parameters["password"]
 
         logger.debug(f"Received delete request for user {uuid}")
 
-        if password_matches(identifier=UserIdentifiers.uuid.value, identifier_value=uuid, password=password):
+        if auth_service.check_password(uuid, password):
+            auth_service.invalidate(uuid)
+            token_service.revoke_user(uuid)
             # Attempt to delete user data from userbase, transactions, and portfolios databases
             success_userbase = delete_user_data_from_database(uuid, DatabasesNames.userbase.value)
             success_transactions = delete_user_data_from_database(uuid, DatabasesNames.transactions.value)
@@ -270,23 +460,22 @@ def delete_user(uuid: str, password: str):
     return return_dict
 
 @fastapi_router.post("/submit_order")
-def submit_order(uuid: str, order: str, db: Session = Depends(get_db_userbase)):
+def submit_order(parameters: dict = Depends(encrypted_parameters("order")), uuid: str = Depends(get_user_uuid), db: Session = Depends(get_db_userbase)):
     try:
-        uuid, order = decrypt(uuid), decrypt(order)
+        order = parameters["order"]
         return_dict = ServerResponse()
 
-        try:
-            info = yf.Ticker(order["symbol"]).info
-        except Exception as error:
-            logger.error(f"Failed to get info of stock from yfinance: {error}")
-
         match(order["order_type"]):
-            case "market":
+            case OrderTypes.market.value:
+                info = get_symbol_info(order["symbol"], fields=["bid", "ask"])
+                price = (info or {}).get("bid" if order["side"] == "sell" else "ask")
+                if price is None:
+                    logger.error(f"Failed to get info of stock from yfinance")
+                    return_dict.error = "Could not fetch the current price"
+                    return return_dict
+
                 return_dict.success = True
-                if order["side"] == "sell":
-                    cost_per_share =  np.double(info["bid"])
-                else:
-                    cost_per_share = np.double(info["ask"])
+                cost_per_share = np.double(price)
                 try:
                     sr = StockRecord(
                         symbol=order["symbol"],
@@ -297,10 +486,22 @@ def submit_order(uuid: str, order: str, db: Session = Depends(get_db_userbase)):
                         notes=None
                     )
                     handler = StockHandler()
-                    handler.deal_with_transaction(sr, uuid)
+                    handler.deal_with_transaction(sr, uuid, lot_selection=order.get("lot_selection"), lot_uids=get_lot_uids(order))
                     return_dict.data = handler.status
+                    if handler.realized_pnl is not None:
+                        return_dict.extra = handler.realized_pnl
                 except Exception as error:
                     logger.error(f"Error creating stock record: {error}")
+            case OrderTypes.limit.value | OrderTypes.stop.value | OrderTypes.stop_limit.value:
+                # Resting orders are saved and filled by the order matcher once the market reaches their price
+                pending_order, reason = create_pending_order_model(uuid, order)
+                if pending_order is None:
+                    return_dict.error = reason
+                elif order_matcher.submit(pending_order):
+                    return_dict.success = True
+                    return_dict.data = f"Placed {pending_order.order_type.replace("_", "-")} order to {pending_order.side} {pending_order.shares} shares of {pending_order.symbol} ({pending_order.time_in_force.upper()})"
+                else:
+                    return_dict.error = "Failed to place order"
             case _:
                 return_dict.error = f"Invalid or unsupported order type"
             
@@ -309,3 +510,97 @@ def submit_order(uuid: str, order: str, db: Session = Depends(get_db_userbase)):
         logger.error(f"Error submitting order. Error: {traceback.format_exc()}")
         return None
 
+@fastapi_router.post("/submit_orders")
+def submit_orders(parameters: dict = Depends(encrypted_parameters("orders")), uuid: str = Depends(get_user_uuid)):
+    """
+    Submits a batch of orders of a user, e.g. orders generated by a strategy.
+    The orders are sent in the body, as a batch does not fit in a URL: in an envelope ({"orders": [order, ...]}),
+    or by older clients as JSON ({"orders": encrypted {"orders": [order, ...]}}). The quotes of all the market orders'
+    symbols are resolved at once, the market orders are filled in order in one transaction
+    (see `StockHandler.deal_with_transactions`) and the resting orders are saved in another.
+    The data is the result of every order, in order, and extra the number of filled, placed and rejected orders.
+    """
+    return_dict = ServerResponse()
+    try:
+        orders = parameters["orders"]
+        if isinstance(orders, dict):
+            # Older clients wrap the list, as a field they encrypt is only decoded as JSON if it is an object
+            orders = orders.get("orders")
+        if not isinstance(orders, list) or not 0 < len(orders) <= MAX_BATCH_TRANSACTIONS:
+            return_dict.error = f"Submit between 1 and {MAX_BATCH_TRANSACTIONS} orders"
+            return return_dict
+
+        results = [ServerResponse() for _ in orders]
+        market_orders, pending_orders = [], []
+        for index, order in enumerate(orders):
+            if not isinstance(order, dict) or not order.get("symbol"):
+                results[index].error = "Invalid order"
+                continue
+            match(order.get("order_type")):
+                case OrderTypes.market.value:
+                    if order.get("side") not in ("buy", "sell"):
+                        results[index].error = "Invalid side"
+                        continue
+                    try:
+                        shares = np.double(order.get("shares"))
+                    except (TypeError, ValueError):
+                        results[index].error = "Invalid shares"
+                        continue
+                    if not shares > 0:
+                        results[index].error = "Cannot trade 0 or fewer shares"
+                        continue
+                    market_orders.append((index, order, shares))
+                case OrderTypes.limit.value | OrderTypes.stop.value | OrderTypes.stop_limit.value:
+                    pending_order, reason = create_pending_order_model(uuid, order)
+                    if pending_order is None:
+                        results[index].error = reason
+                    else:
+                        pending_orders.append((index, pending_order))
+                case _:
+                    results[index].error = f"Invalid or unsupported order type"
+
+        batch = []
+        if market_orders:
+            quotes = get_symbols_info({order["symbol"] for _, order, _ in market_orders}, fields=("bid", "ask"))
+            for index, order, shares in market_orders:
+                price = quotes.get(str(order["symbol"]).upper(), {}).get("bid" if order["side"] == "sell" else "ask")
+                if price is None:
+                    results[index].error = "Failed to fetch current market price"
+                    continue
+                stock_record = StockRecord(symbol=order["symbol"], side=order["side"], order_type=order["order_type"],
+                                           shares=shares, cost_per_share=np.double(price), notes=None)
+                batch.append((index, BatchTransaction(stock_record, order.get("lot_selection"), get_lot_uids(order))))
+        if batch:
+            StockHandler().deal_with_transactions([transaction for _, transaction in batch], uuid)
+            for index, transaction in batch:
+                if transaction.filled:
+                    results[index].success = True
+                    results[index].data = transaction.status
+                    if transaction.realized_pnl is not None:
+                        results[index].extra = transaction.realized_pnl
+                else:
+                    results[index].error = transaction.status
+
+        if pending_orders:
+            placed = order_matcher.submit_many([pending_order for _, pending_order in pending_orders])
+            for index, pending_order in pending_orders:
+                if placed:
+                    results[index].success = True
+                    results[index].data = f"Placed {pending_order.order_type.replace("_", "-")} order to {pending_order.side} {pending_order.shares} shares of {pending_order.symbol} ({pending_order.time_in_force.upper()})"
+                    results[index].extra = pending_order.uid
+                else:
+                    results[index].error = "Failed to place order"
+
+        return_dict.success = True
+        return_dict.data = [result.to_dict() for result in results]
+        return_dict.extra = {
+            "filled": sum(transaction.filled for _, transaction in batch),
+            "placed": len(pending_orders) if pending_orders and placed else 0,
+            "rejected": sum(not result.success for result in results),
+        }
+    except Exception as error:
+        logger.error(f"Error submitting orders. Error: {traceback.format_exc()}")
+        return_dict.reset()
+        return_dict.error = "Internal Server Error"
+    finally:
+        return return_dict
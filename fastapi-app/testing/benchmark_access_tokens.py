@@ -0,0 +1,126 @@
+"""
+Checks and benchmark of the access tokens.
+
+Checks that a token identifies its user, and that tampered, expired, revoked and unknown key tokens are refused.
+Checks that revoking a user refuses their earlier tokens but not the next one. Checks that after a key rotation
+the tokens of the older key stay valid until the key is retired or they expire. Also checks what the route
+dependency answers for tokens and for the encrypted uuid of older clients.
+Then times authenticating a request both ways: verifying a token against decrypting the uuid parameter.
+Run it from the fastapi-app folder:
+    python testing/benchmark_access_tokens.py [--requests 100000]
+"""
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import time
+import uuid as uuid_module
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the access tokens")
+parser.add_argument("--requests", type=int, default=100000, help="Requests authenticated by the benchmark")
+arguments = harness.setup(parser)
+
+from fastapi import HTTPException
+from utils.encryption import decrypt
+from utils.logger_script import logger
+from utils.tokens import TokenService, parse_keys, get_user_uuid, token_service
+from utils.env_variables import ENCRYPTION_KEY
+
+def encrypt(data: str) -> str:
+    """ Encrypts a parameter the way the Flask app does (see flask-app/comms/encryption.py). """
+    binary_data = data.encode("utf-8")
+    padded_data = binary_data + b"\0" * (16 - len(binary_data) % 16)
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(base64.b64decode(ENCRYPTION_KEY)), modes.CBC(iv)).encryptor()
+    encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
+    return f"{base64.b64encode(iv).decode()}${len(binary_data)}${base64.b64encode(encrypted_data).decode()}"
+
+def check_tokens() -> None:
+    service = TokenService({"first": os.urandom(32)}, ttl=3600)
+    uuid = str(uuid_module.uuid4())
+    token, expires_at = service.issue(uuid)
+    access_token = service.verify(token)
+    assert access_token is not None and access_token.uuid == uuid and access_token.expires_at == expires_at, "A token was not verified"
+
+    message, _, signature = token.rpartition(".")
+    other_uuid = str(uuid_module.uuid4())
+    assert service.verify(f"{message.replace(uuid, other_uuid)}.{signature}") is None, "A token of another user was forged"
+    assert service.verify(f"{message}.{signature[:-2]}AA") is None, "A tampered signature was accepted"
+    assert service.verify("not.a.token") is None and service.verify("") is None, "A malformed token was accepted"
+    assert TokenService({"first": os.urandom(32)}, ttl=3600).verify(token) is None, "A token of another key was accepted"
+
+    expired = TokenService({"first": os.urandom(32)}, ttl=0)
+    assert expired.verify(expired.issue(uuid)[0]) is None, "An expired token was accepted"
+
+    service.revoke(access_token)
+    assert service.verify(token) is None, "A revoked token was accepted"
+    first, second = service.issue(uuid)[0], service.issue(other_uuid)[0]
+    service.revoke_user(uuid)
+    assert service.verify(first) is None, "A token issued before its user was revoked was accepted"
+    assert service.verify(second) is not None, "Revoking a user revoked another user's token"
+    assert service.verify(service.issue(uuid)[0]) is not None, "A token issued after its user was revoked was refused"
+    print("Tokens identify their user, tampered, expired, revoked and unknown key tokens are refused")
+
+def check_rotation() -> None:
+    service = TokenService(parse_keys(f"first:{base64.b64encode(os.urandom(32)).decode()}"), ttl=3600)
+    uuid = str(uuid_module.uuid4())
+    old_token = service.issue(uuid)[0]
+    key_id = service.rotate()
+    new_token = service.issue(uuid)[0]
+    assert service.verify(new_token).key_id == key_id, "New tokens are not signed with the new key"
+    assert service.verify(old_token).key_id == "first", "Tokens of the older key were refused after the rotation"
+    assert not service.retire(key_id), "The signing key was retired"
+    assert service.retire("first") and service.verify(old_token) is None, "Tokens of a retired key were accepted"
+    assert service.verify(new_token) is not None
+
+    # Older keys are dropped once the tokens they signed expired
+    service = TokenService({"first": os.urandom(32)}, ttl=3600)
+    old_token = service.issue(uuid)[0]
+    service.rotate("second")
+    service._retiring["first"] = time.time()
+    assert service.verify(old_token) is None and service.get_stats()["keys"] == ["second"], "An expired key was kept"
+    for keys in ("bad.id:" + base64.b64encode(os.urandom(32)).decode(), "short:" + base64.b64encode(os.urandom(16)).decode()):
+        try:
+            parse_keys(keys)
+            raise AssertionError(f"Invalid keys were accepted: {keys}")
+        except ValueError:
+            pass
+    print("Tokens of older keys are accepted until the key is retired or expires")
+
+def check_dependency() -> None:
+    uuid = str(uuid_module.uuid4())
+    token = token_service.issue(uuid)[0]
+    assert asyncio.run(get_user_uuid(uuid=None, authorization=f"Bearer {token}")) == uuid, "The dependency did not read the token"
+    assert asyncio.run(get_user_uuid(uuid=encrypt(uuid), authorization=None)) == uuid, "The dependency did not decrypt the uuid of older clients"
+    for parameters in ({}, {"authorization": f"Basic {token}"}, {"authorization": f"Bearer {token}x"}, {"uuid": "garbage"}):
+        try:
+            asyncio.run(get_user_uuid(**{"uuid": None, "authorization": None, **parameters}))
+            raise AssertionError(f"The dependency accepted {parameters}")
+        except HTTPException as error:
+            assert error.status_code == 401
+    print("The route dependency reads tokens and the uuid of older clients, and answers 401 otherwise")
+
+def benchmark() -> None:
+    uuid = str(uuid_module.uuid4())
+    token = token_service.issue(uuid)[0]
+    encrypted_uuid = encrypt(uuid)
+    timings = {}
+    for name, authenticate in (("decrypt uuid", lambda: decrypt(encrypted_uuid)), ("verify token", lambda: token_service.verify(token).uuid)):
+        begin = time.perf_counter()
+        for _ in range(arguments.requests):
+            authenticate()
+        timings[name] = time.perf_counter() - begin
+        print(f"{name}: {timings[name] / arguments.requests * 1e6:6.2f} us per request")
+    print(f"Verifying a token is {timings['decrypt uuid'] / timings['verify token']:.1f}x faster than decrypting the uuid")
+
+if __name__ == "__main__":
+    logger.setLevel(logging.ERROR)
+    check_tokens()
+    check_rotation()
+    check_dependency()
+    benchmark()
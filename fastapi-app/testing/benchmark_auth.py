@@ -0,0 +1,196 @@
+"""
+Checks and benchmark of the auth service.
+
+Signs users up and in through the routes (with their parameters as the route dependency decrypts them), and checks that
+a sign in is a single query, that wrong passwords and unknown users are refused, that a legacy SHA-224 password
+still signs in and is hashed again with scrypt, that concurrent
+sign ins of a user share one hash, that the account routes are answered from the verified credential cache without
+queries, that a password update (or a deletion) invalidates it, and that no more than the auth workers hash at once.
+Then times sign ins from many threads and the password checks with and without the cache.
+Run it from the fastapi-app folder:
+    python testing/benchmark_auth.py [--users 20] [--threads 16] [--workers 2]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the auth service")
+parser.add_argument("--users", type=int, default=20, help="Users signed in by the benchmark")
+parser.add_argument("--threads", type=int, default=16, help="Threads signing in at once")
+parser.add_argument("--workers", type=int, default=2, help="Threads passwords are hashed on (AUTH_WORKERS)")
+arguments = harness.setup(parser, scratch_prefix="auth_benchmark_")
+os.environ["AUTH_WORKERS"] = str(arguments.workers)
+
+from data.database import DatabasesNames
+from data.utils.get_databases import get_db
+from data.utils.query_counter import count_queries
+from data.userbase import encryption
+from data.userbase.model import Userbase
+from data.userbase.helper import get_user_from_userbase
+from data.dynamic_databases.models import generate_table_by_id_for_selected_database
+from records.records import UserIdentifiers
+from routes.routes import sign_up, sign_in, update_user, delete_user
+from utils.auth import auth_service
+
+class HashingMonitor:
+    """ Wraps scrypt to record the most hashes computed at once, and the threads they were computed on. """
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+        self._scrypt = encryption._scrypt
+        encryption._scrypt = self
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.threads.add(threading.current_thread().name)
+        try:
+            return self._scrypt(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+def sign_up_user(name: str, password: str) -> str:
+    response = sign_up({"email": f"{name}@example.com", "username": name, "password": password}, next(get_db(DatabasesNames.userbase.value)))
+    assert response["success"], response["error"]
+    response = sign_in_user(name, password)
+    assert response["success"], response["error"]
+    return response["data"]["uuid"]
+
+def sign_in_user(name: str, password: str) -> dict:
+    session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        return sign_in({"username": name, "password": password}, session)
+    finally:
+        session.close()
+
+def saved_hash(uuid: str) -> str:
+    return get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid).password
+
+def check_sign_in() -> None:
+    name = f"auth{time.time_ns()}"
+    uuid = sign_up_user(name, "password")
+    assert saved_hash(uuid).startswith("scrypt$"), "The password was not hashed with scrypt"
+
+    auth_service.invalidate()
+    with count_queries() as counter:
+        response = sign_in_user(name, "password")
+    assert response["success"] and response["data"]["uuid"] == uuid, response["error"]
+    assert counter.total == 1, f"A sign in took {counter.total} queries"
+    assert sign_in_user(name, "wrong")["error"] == "Failed to sign in. Password is incorrect"
+    assert sign_in_user(f"{name}x", "password")["error"] == "Failed to sign in. User doesn't exist"
+    print(f"A sign in is {counter.total} query, wrong passwords and unknown users are refused")
+
+def check_legacy_password() -> None:
+    name = f"legacy{time.time_ns()}"
+    session = next(get_db(DatabasesNames.userbase.value))
+    user_model = Userbase(email=f"{name}@example.com", username=encryption.encode_username(name),
+                          password=hashlib.sha224(b"password").hexdigest())
+    session.add(user_model)
+    session.commit()
+    uuid = user_model.uuid
+    session.close()
+
+    assert not sign_in_user(name, "wrong")["success"], "A wrong password matched a legacy hash"
+    assert sign_in_user(name, "password")["success"], "A legacy password did not sign in"
+    assert saved_hash(uuid).startswith("scrypt$"), "The legacy hash was not upgraded"
+    auth_service.invalidate()
+    assert sign_in_user(name, "password")["success"], "The upgraded hash does not sign in"
+    print("A legacy SHA-224 password signs in and is hashed again with scrypt")
+
+def check_coalesced_sign_ins() -> None:
+    name = f"burst{time.time_ns()}"
+    sign_up_user(name, "password")
+    auth_service.invalidate()
+    verifications, coalesced = auth_service.stats["verifications"], auth_service.stats["coalesced"]
+    barrier = threading.Barrier(8)
+    def sign_in_together(_) -> dict:
+        barrier.wait()
+        return sign_in_user(name, "password")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(sign_in_together, range(8)))
+    assert all(response["success"] for response in responses), "A sign in of the burst failed"
+    hashed = auth_service.stats["verifications"] - verifications
+    assert hashed < 8 and auth_service.stats["coalesced"] > coalesced, f"A burst of 8 sign ins hashed the password {hashed} times"
+    print(f"A burst of 8 sign ins of a user hashed the password {hashed} times")
+
+def check_credential_cache() -> None:
+    name = f"cache{time.time_ns()}"
+    uuid = sign_up_user(name, "password")
+    # Deleting a user deletes their tables, which are created by their first order
+    for database_name in (DatabasesNames.transactions.value, DatabasesNames.portfolios.value):
+        generate_table_by_id_for_selected_database(uuid=uuid, database_name=database_name)
+
+    # Verified by the sign in, so the account routes do not query the userbase to check it
+    with count_queries() as counter:
+        assert auth_service.check_password(uuid, "password")
+    assert counter.total == 0, f"A cached password check took {counter.total} queries"
+    assert not auth_service.check_password(uuid, "wrong"), "A wrong password matched a cached credential"
+
+    assert update_user("password", {"password": "password", "value": "new password"}, uuid).success, "The password was not updated"
+    assert not auth_service.check_password(uuid, "password"), "The old password is still accepted after an update"
+    assert not sign_in_user(name, "password")["success"], "The old password still signs in"
+    assert auth_service.check_password(uuid, "new password"), "The new password is refused"
+    assert update_user("email", {"password": "new password", "value": f"new{name}@example.com"}, uuid).success, "The email was not updated"
+
+    assert not delete_user({"password": "password"}, uuid).success, "A user was deleted with the old password"
+    assert delete_user({"password": "new password"}, uuid).success, "The user was not deleted"
+    assert not auth_service.check_password(uuid, "new password"), "A deleted user's password is still accepted"
+    print("Account routes are checked from the credential cache, password updates and deletions invalidate it")
+
+def benchmark(monitor: HashingMonitor) -> None:
+    names = [f"bench{index}_{time.time_ns()}" for index in range(arguments.users)]
+    uuids = [sign_up_user(name, "password") for name in names]
+
+    auth_service.invalidate()
+    latencies = []
+    for name in names:
+        begin = time.perf_counter()
+        assert sign_in_user(name, "password")["success"]
+        latencies.append((time.perf_counter() - begin) * 1000)
+    print(f"Sign in on 1 thread: p50 {np.percentile(latencies, 50):.1f} ms "
+          f"(scrypt n={encryption.PASSWORD_SCRYPT_N} r={encryption.PASSWORD_SCRYPT_R} p={encryption.PASSWORD_SCRYPT_P})")
+
+    auth_service.invalidate()
+    monitor.max_running = 0
+    rounds = max(1, arguments.threads * 2 // len(names))
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.threads) as pool:
+        results = list(pool.map(lambda name: sign_in_user(name, "password"), names * rounds))
+    elapsed = time.perf_counter() - begin
+    assert all(result["success"] for result in results)
+    assert monitor.max_running <= arguments.workers, f"{monitor.max_running} hashes ran at once on {arguments.workers} workers"
+    assert all(thread.startswith("auth") for thread in monitor.threads), f"Hashed outside of the auth pool: {monitor.threads}"
+    print(f"{len(results)} sign ins from {arguments.threads} threads: {len(results) / elapsed:,.1f}/s, "
+          f"at most {monitor.max_running} hashes at once on {arguments.workers} auth workers")
+
+    for name, cached in (("uncached", False), ("cached", True)):
+        timings = []
+        for uuid in uuids:
+            if not cached:
+                auth_service.invalidate(uuid)
+            begin = time.perf_counter()
+            assert auth_service.check_password(uuid, "password")
+            timings.append((time.perf_counter() - begin) * 1000)
+        print(f"Account route password check {name:<8}: p50 {np.percentile(timings, 50):8.3f} ms")
+    print(f"Auth stats: {auth_service.get_stats()}")
+
+if __name__ == "__main__":
+    harness.initialise_databases(logging.ERROR)
+    monitor = HashingMonitor()
+    check_sign_in()
+    check_legacy_password()
+    check_coalesced_sign_ins()
+    check_credential_cache()
+    benchmark(monitor)
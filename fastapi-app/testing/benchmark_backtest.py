@@ -0,0 +1,147 @@
+"""
+Checks and benchmark of the backtesting engine, with the fake bar provider.
+
+Checks that the backtest's in-memory ledger fills orders exactly as `StockHandler` does against the databases:
+the same random buys (some larger than the balance) and sells (some larger than the holdings) are executed through
+both with every lot selection, and the balances, open lots, transaction statuses and realized P&L of every sell must
+match. Checks that a backtest is deterministic and that its cash reconciles with its fills.
+Then times a grid of parameter sets on 1 process and on a process pool, in simulated orders per second.
+Run it from the fastapi-app folder:
+    python testing/benchmark_backtest.py [--orders 500] [--symbols 20] [--years 5] [--workers 4]
+"""
+import argparse
+import copy
+import logging
+import os
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the backtesting engine")
+parser.add_argument("--orders", type=int, default=500, help="Orders of the equivalence check, per lot selection")
+parser.add_argument("--symbols", type=int, default=20, help="Symbols of every benchmarked backtest")
+parser.add_argument("--years", type=int, default=5)
+parser.add_argument("--workers", type=int, default=os.cpu_count())
+arguments = harness.setup(parser, scratch_prefix="backtest_benchmark_", start_balance=10000)
+
+from data.database import DatabasesNames
+from data.userbase.helper import get_user_from_userbase
+from data.utils.get_databases import get_db_execution, get_execution_table, user_rows_filter
+from data.dynamic_databases.lot_index import lot_index, get_lot_selection
+from data.bars.store import set_bar_provider, bar_store
+from records.records import StockRecord, UserIdentifiers, LotSelections
+from sqlalchemy import select
+from utils.quote_cache import QuoteProvider, set_quote_provider, quote_cache
+from utils.stock_handler import StockHandler
+from utils.backtest import BacktestLedger, Backtest, MeanReversion, run_backtest, run_backtests, parameter_grid, resolve_run
+from fake_bar_provider import FakeBarProvider
+
+class SettableQuoteProvider(QuoteProvider):
+    """ Quotes the price it was last given, so a market sell fills at a known bid. """
+    price = 100.0
+
+    def get_info(self, symbol: str) -> dict:
+        return {"symbol": symbol, "bid": self.price, "ask": self.price, "currentPrice": self.price, "regularMarketPrice": self.price}
+
+def database_state(uuid: str) -> tuple[float, list, dict]:
+    """ The balance, open lots and transaction statuses of a user in the databases. """
+    balance = float(get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid).balance)
+    session = next(get_db_execution())
+    try:
+        portfolios = get_execution_table(DatabasesNames.portfolios.value, uuid)
+        lots = session.execute(select(portfolios.c.uid, portfolios.c.symbol, portfolios.c.shares, portfolios.c.cost_per_share)
+                               .where(user_rows_filter(portfolios, uuid))).fetchall()
+        transactions = get_execution_table(DatabasesNames.transactions.value, uuid)
+        statuses = dict(session.execute(select(transactions.c.uid, transactions.c.status).where(user_rows_filter(transactions, uuid))).fetchall())
+    finally:
+        session.close()
+    return balance, sorted((uid, symbol, round(shares, 9), round(cost, 9)) for uid, symbol, shares, cost in lots), statuses
+
+def check_ledger_matches_stock_handler(lot_selection: str, provider: SettableQuoteProvider) -> None:
+    random = np.random.default_rng(len(lot_selection))
+    uuid = harness.create_user(f"backtest_{lot_selection}", tables=(DatabasesNames.transactions.value, DatabasesNames.portfolios.value))
+    ledger = BacktestLedger(get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid).balance)
+    selection = get_lot_selection(lot_selection)
+    symbols = ("AAPL", "MSFT", "NVDA")
+    for _ in range(arguments.orders):
+        symbol = symbols[random.integers(len(symbols))]
+        price = round(float(random.uniform(50, 150)), 2)
+        side = "buy" if random.random() < 0.55 else "sell"
+        # Some buys are larger than the balance and some sells larger than the holdings, both are partially filled
+        stock_record = StockRecord(symbol=symbol, side=side, order_type="market", shares=np.double(round(random.uniform(1, 40), 2)),
+                                   cost_per_share=np.double(price), notes=None)
+        ledger_record = copy.deepcopy(stock_record)
+        lot_uids = None
+        if lot_selection == LotSelections.specific.value and side == "sell" and symbol in ledger.lots:
+            open_uids = list(ledger.lots[symbol].lots)
+            lot_uids = [open_uids[index] for index in random.permutation(len(open_uids))[:3]]
+
+        handler = StockHandler()
+        if side == "buy":
+            handler.deal_with_transaction(stock_record, uuid)
+            ledger.buy(ledger_record)
+        else:
+            provider.price = price
+            quote_cache.invalidate()
+            handler.deal_with_transaction(stock_record, uuid, lot_selection=lot_selection, lot_uids=lot_uids)
+            if handler.status == "No lots were selected":
+                continue
+            fill = ledger.sell(ledger_record, price, selection, lot_uids)
+            assert handler.realized_pnl == fill.realized_pnl, f"Realized P&L differs: {handler.realized_pnl} != {fill.realized_pnl}"
+
+    balance, lots, statuses = database_state(uuid)
+    ledger_lots = sorted((lot.uid, symbol, round(float(lot.shares), 9), round(float(lot.cost_per_share), 9))
+                         for symbol, symbol_lots in ledger.lots.items() for lot in symbol_lots.lots.values())
+    assert np.isclose(balance, ledger.balance), f"Balance {balance} != {ledger.balance}"
+    assert lots == ledger_lots, f"Open lots differ with {lot_selection}"
+    ledger_statuses = {record.uid: record.status for record in ledger.transactions}
+    assert statuses == ledger_statuses, f"Transaction statuses differ with {lot_selection}"
+    lot_index.invalidate(uuid)
+
+def check_backtest(symbols: list[str]) -> None:
+    run = {"strategy": "mean_reversion", "parameters": {"length": 20, "band": 0.01}, "symbols": symbols, "spread": 0.001}
+    first, second = run_backtest(run), run_backtest(run)
+    assert "error" not in first, first.get("error")
+    assert {key: value for key, value in first.items() if not key.endswith("_s") and not key.endswith("_second")} == \
+           {key: value for key, value in second.items() if not key.endswith("_s") and not key.endswith("_second")}, "A backtest is not deterministic"
+    assert first["fills"] > 0, "The backtest did not fill any order"
+
+    # The balance is the starting balance less the buys plus the sells, the equity adds the open shares at the last close
+    run = resolve_run(run)
+    bars = {symbol: bar_store.get_bars(symbol, run["interval"], run["start"], run["end"]) for symbol in symbols}
+    backtest = Backtest(MeanReversion(**run["parameters"]), bars, run["balance"], spread=run["spread"])
+    figures = backtest.run()
+    flows = sum(float(record.total_cost) * (-1 if record.side == "buy" else 1) for record in backtest.ledger.transactions)
+    assert np.isclose(run["balance"] + flows, backtest.ledger.balance), "The balance does not reconcile with the fills"
+    last_closes = {symbol: float(symbol_bars["close"][-1]) for symbol, symbol_bars in bars.items()}
+    open_shares = sum(float(lot.shares) * last_closes[symbol] for symbol, symbol_lots in backtest.ledger.lots.items() for lot in symbol_lots.lots.values())
+    assert np.isclose(figures["final_equity"], backtest.ledger.balance + open_shares), "The final equity does not value the open lots"
+    print(f"Backtest checks passed: {first['bars']} bars, {first['orders']} orders, {first['fills']} fills, return {first['return']:.2%}")
+
+if __name__ == "__main__":
+    harness.initialise_databases(logging.ERROR)
+    provider = SettableQuoteProvider()
+    set_quote_provider(provider)
+    set_bar_provider(FakeBarProvider())
+
+    for lot_selection in LotSelections:
+        check_ledger_matches_stock_handler(lot_selection.value, provider)
+    print(f"The backtest ledger matches StockHandler over {arguments.orders} orders with every lot selection")
+
+    symbols = [f"S{index:03d}" for index in range(arguments.symbols)]
+    start = str(np.datetime64("today") - np.timedelta64(365 * arguments.years, "D"))
+    check_backtest(symbols[:5])
+
+    runs = [
+        {"strategy": "moving_average_cross", "parameters": parameters, "symbols": symbols, "start": start}
+        for parameters in parameter_grid({"fast": [5, 10, 20], "slow": [50, 100]})
+    ] + [
+        {"strategy": "mean_reversion", "parameters": parameters, "symbols": symbols, "start": start}
+        for parameters in parameter_grid({"length": [10, 20], "band": [0.01, 0.02, 0.03]})
+    ]
+    for workers in sorted({1, arguments.workers}):
+        summary = run_backtests(runs, workers)
+        print(f"{summary['runs']} backtests of {arguments.symbols} symbols over {arguments.years} years on {workers} process(es): "
+              f"{summary['elapsed_s']:.2f} s, {summary['bars'] / summary['elapsed_s']:,.0f} bars/s, "
+              f"{summary['orders_per_second']:,.0f} simulated orders/s ({summary['orders']} orders, {summary['fills']} fills)")
@@ -0,0 +1,97 @@
+"""
+Checks and benchmark of the historical bar store, with the fake bar provider.
+
+Checks that only missing ranges are fetched (an earlier start fetches only the older bars, a later end only the
+newer ones from the last stored bar on), that stored bars match fetching the whole range at once, that a new store
+on the same folder serves the bars from disk, and that served bars are views of the memory mapped file.
+Then times serving a year of daily bars (and a week of 5 minute bars) of many symbols when they have to be fetched
+(with a simulated round trip) and once they are stored.
+Run it from the fastapi-app folder:
+    python testing/benchmark_bar_store.py [--symbols 200] [--latency 0.05] [--repeats 20]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the bar store")
+parser.add_argument("--symbols", type=int, default=200)
+parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per fetch")
+parser.add_argument("--repeats", type=int, default=20)
+arguments = harness.setup(parser, scratch_prefix="bar_store_benchmark_")
+
+from data.bars.store import BarStore
+from data.bars.providers import BarIntervals
+from utils.logger_script import logger
+from fake_bar_provider import FakeBarProvider
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def check_incremental_fetching() -> None:
+    provider = FakeBarProvider()
+    store = BarStore("checks", provider, refresh=0)
+    now = utc_now()
+    first_start, first_end = now - timedelta(days=200), now - timedelta(days=20)
+
+    bars = store.get_bars("AAPL", BarIntervals.day.value, first_start, first_end)
+    assert len(provider.requests) == 1 and len(bars) > 0
+    store.get_bars("AAPL", BarIntervals.day.value, first_start + timedelta(days=10), first_end - timedelta(days=10))
+    assert len(provider.requests) == 1, "A covered range was fetched again"
+
+    # An earlier start only fetches the older bars
+    earlier_start = now - timedelta(days=400)
+    store.get_bars("AAPL", BarIntervals.day.value, earlier_start, first_end)
+    _, _, start, end = provider.requests[-1]
+    assert len(provider.requests) == 2 and start == earlier_start.replace(microsecond=0) and end == first_start.replace(microsecond=0)
+
+    # A later end only fetches the newer bars, from the last stored bar on
+    bars = store.get_bars("AAPL", BarIntervals.day.value, earlier_start, now)
+    _, _, start, end = provider.requests[-1]
+    assert len(provider.requests) == 3 and start == (first_end - timedelta(days=1)).replace(microsecond=0)
+
+    expected = FakeBarProvider().get_bars("AAPL", BarIntervals.day.value, earlier_start.replace(microsecond=0), now.replace(microsecond=0))
+    assert np.array_equal(np.asarray(bars), expected), "Stored bars do not match fetching the whole range at once"
+    assert np.all(np.diff(bars["time"].astype(np.int64)) > 0), "Stored bars are not sorted and unique"
+
+    # Served bars are views of the memory mapped file, and so are their columns
+    assert isinstance(bars, np.memmap) and not bars.flags.writeable
+    stored, _ = store._read(BarIntervals.day.value, "AAPL")
+    assert np.shares_memory(bars["close"], stored)
+
+    # A new store on the same folder serves the bars from disk
+    reopened_provider = FakeBarProvider()
+    reopened = BarStore("checks", reopened_provider, refresh=3600).get_bars("AAPL", BarIntervals.day.value, earlier_start, now)
+    assert len(reopened_provider.requests) == 0 and np.array_equal(np.asarray(reopened), np.asarray(bars))
+    print(f"Incremental fetching checks passed ({len(bars)} daily bars in 3 fetches)")
+
+def measure(store: BarStore, symbols: list[str], interval: str, lookback: timedelta) -> np.ndarray:
+    timings = []
+    start = utc_now() - lookback
+    for symbol in symbols:
+        begin = time.perf_counter()
+        bars = store.get_bars(symbol, interval, start)
+        bars["close"].mean()
+        timings.append((time.perf_counter() - begin) * 1000)
+    return np.array(timings)
+
+if __name__ == "__main__":
+    logger.setLevel(logging.WARNING)
+    check_incremental_fetching()
+
+    symbols = [f"S{index:04d}" for index in range(arguments.symbols)]
+    provider = FakeBarProvider(latency=arguments.latency)
+    store = BarStore("bars", provider, refresh=3600)
+    print(f"{arguments.symbols} symbols, {arguments.latency * 1000:.0f} ms per fetch")
+    for interval, lookback in ((BarIntervals.day.value, timedelta(days=365)), (BarIntervals.minutes_5.value, timedelta(days=7))):
+        fetched = measure(store, symbols, interval, lookback)
+        stored = np.concatenate([measure(store, symbols, interval, lookback) for _ in range(arguments.repeats)])
+        store.invalidate()
+        reopened = measure(store, symbols, interval, lookback)
+        for name, timings in (("fetched", fetched), ("stored, open", stored), ("stored, reopened", reopened)):
+            print(f"{interval:>3} {name:<17} p50 {np.percentile(timings, 50):8.3f} ms   p95 {np.percentile(timings, 95):8.3f} ms")
+    print(f"stats: {store.get_stats()}")
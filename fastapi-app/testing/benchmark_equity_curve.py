@@ -0,0 +1,167 @@
+"""
+Checks and benchmark of the equity curve engine, with the fake bar provider.
+
+Writes years of random trades for many users straight into a throwaway set of databases, then checks a few users'
+curves against a per day Python replay of their ledger (cash, positions, equity, time-weighted return), checks that
+the money-weighted return zeroes the flows' net present value, and times the batch over every user.
+Run it from the fastapi-app folder:
+    python testing/benchmark_equity_curve.py [--users 1000] [--years 3] [--trades 200]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the equity curve engine")
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--years", type=int, default=3)
+parser.add_argument("--trades", type=int, default=200, help="Trades per user")
+parser.add_argument("--checks", type=int, default=5, help="Users checked against the per day replay")
+# The ledgers are written from a cash of 1,000,000
+arguments = harness.setup(parser, scratch_prefix="equity_curve_benchmark_", start_balance=1000000)
+
+from data.database import DatabasesNames
+from data.userbase.helper import create_user_model
+from data.utils.get_databases import get_db, get_db_execution, get_execution_table, user_row_values
+from data.dynamic_databases.helper import load_user_transactions_columns
+from data.dynamic_databases.statements import insert_row
+from data.dynamic_databases.models import generate_table_by_id_for_selected_database
+from data.bars.store import set_bar_provider
+from records.records import StockRecord, Statuses
+from utils.equity_curve import business_days, PriceMatrix, compute_equity_curve, compute_equity_curves, TRADING_DAYS_PER_YEAR
+from fake_bar_provider import FakeBarProvider
+
+SYMBOLS = ("AAPL", "MSFT", "NVDA", "AMZN", "GOOG", "META", "TSLA", "JPM")
+
+def write_ledgers(users: int) -> dict[str, float]:
+    """ Writes random buys and sells (never more than held) of every user, returns the users' ending balances. """
+    random = np.random.default_rng(0)
+    provider = FakeBarProvider()
+    start = datetime.now() - timedelta(days=365 * arguments.years)
+    balances = {}
+    session = next(get_db(DatabasesNames.userbase.value))
+    uuids = []
+    for index in range(users):
+        user_model = create_user_model(f"equity{index}@example.com", f"equity{index}", "password")
+        session.add(user_model)
+        uuids.append(user_model)
+    session.commit()
+    uuids = [user_model.uuid for user_model in uuids]
+    session.close()
+    for uuid in uuids:
+        generate_table_by_id_for_selected_database(uuid=uuid, database_name=DatabasesNames.transactions.value)
+
+    for uuid in uuids:
+        transactions_table = get_execution_table(DatabasesNames.transactions.value, uuid)
+        offsets = np.sort(random.uniform(0, 365 * arguments.years, arguments.trades))
+        held = dict.fromkeys(SYMBOLS, 0.0)
+        cash = 1_000_000.0
+        rows = []
+        for offset in offsets:
+            timestamp = start + timedelta(days=float(offset))
+            symbol = SYMBOLS[random.integers(len(SYMBOLS))]
+            bars = provider.get_bars(symbol, "1d", timestamp - timedelta(days=4), timestamp + timedelta(days=1))
+            price = float(bars["close"][-1]) if len(bars) else 100.0
+            if held[symbol] > 0 and random.random() < 0.4:
+                side, shares = "sell", min(held[symbol], round(random.uniform(1, 50), 2))
+                held[symbol] -= shares
+                cash += shares * price
+            else:
+                side, shares = "buy", round(random.uniform(1, 50), 2)
+                held[symbol] += shares
+                cash -= shares * price
+            stock_record = StockRecord(symbol=symbol, side=side, order_type="market", shares=np.double(shares),
+                                       cost_per_share=np.double(price), status=Statuses.archived.value, notes=None)
+            stock_record.timestamp = timestamp
+            rows.append({**stock_record.to_dict(), **user_row_values(transactions_table, uuid)})
+        execution_session = next(get_db_execution())
+        with execution_session.begin():
+            execution_session.execute(insert_row(transactions_table), rows)
+        execution_session.close()
+        balances[uuid] = cash
+    return balances
+
+def replay_per_day(transactions: dict[str, np.ndarray], balance: float, calendar: np.ndarray, prices: PriceMatrix) -> dict:
+    """ The same series with a Python loop over the days and trades. """
+    days = transactions["timestamp"].astype("datetime64[D]")
+    first_day = max(np.searchsorted(calendar, days[0], side="right") - 1, 0)
+    dates = calendar[first_day:]
+    cash = balance + sum(
+        (shares * price if side == "buy" else -shares * price)
+        for side, shares, price in zip(transactions["side"], transactions["shares"], transactions["cost_per_share"])
+    )
+    held, last_trade_price = {}, {}
+    symbols = sorted(set(transactions["symbol"].tolist()))
+    closes = dict(zip(symbols, prices.get(symbols, first_day).T))
+    series = {"cash": [], "equity": [], "twr": []}
+    growth, previous_positions, trade = 1.0, 0.0, 0
+    for index, date in enumerate(dates):
+        next_date = dates[index + 1] if index + 1 < len(dates) else np.datetime64("9999-12-31")
+        buys = sells = 0.0
+        while trade < len(days) and days[trade] < next_date:
+            symbol, shares, price = transactions["symbol"][trade], transactions["shares"][trade], transactions["cost_per_share"][trade]
+            if transactions["side"][trade] == "buy":
+                held[symbol] = held.get(symbol, 0.0) + shares
+                buys += shares * price
+            else:
+                held[symbol] = held.get(symbol, 0.0) - shares
+                sells += shares * price
+            last_trade_price[symbol] = price
+            trade += 1
+        cash += sells - buys
+        positions = 0.0
+        for symbol, shares in held.items():
+            close = closes[symbol][index]
+            positions += shares * (last_trade_price[symbol] if np.isnan(close) else close)
+        if previous_positions + buys > 1e-9:
+            growth *= (positions + sells) / (previous_positions + buys)
+        previous_positions = positions
+        series["cash"].append(cash)
+        series["equity"].append(cash + positions)
+        series["twr"].append(growth - 1)
+    return {name: np.array(values) for name, values in series.items()}
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    set_bar_provider(FakeBarProvider())
+
+    start = time.perf_counter()
+    balances = write_ledgers(arguments.users)
+    print(f"Wrote {arguments.trades} trades over {arguments.years} years for each of {arguments.users} users in {time.perf_counter() - start:.1f} s")
+
+    calendar = business_days(np.datetime64(datetime.now() - timedelta(days=365 * arguments.years + 7)), np.datetime64(datetime.now()))
+    prices = PriceMatrix(calendar)
+    for uuid in list(balances)[:arguments.checks]:
+        transactions = load_user_transactions_columns(DatabasesNames.transactions.value, uuid)
+        curve = compute_equity_curve(transactions, balances[uuid], calendar, prices)
+        expected = replay_per_day(transactions, balances[uuid], calendar, prices)
+        for name in ("cash", "equity", "twr"):
+            assert np.allclose(curve[name], expected[name], rtol=1e-9, atol=1e-6), f"{name} of {uuid} does not match the per day replay"
+        assert np.isclose(curve["cash"][-1], balances[uuid]), "The replay does not end at the user's balance"
+        # The money-weighted return zeroes the net present value of the flows and the final positions
+        daily_rate = (1 + curve["summary"]["money_weighted_return_annualized"]) ** (1 / TRADING_DAYS_PER_YEAR) - 1
+        days_to_end = len(curve["flows"]) - 1 - np.arange(len(curve["flows"]))
+        net_present_value = curve["positions"][-1] - np.sum(curve["flows"] * (1 + daily_rate) ** days_to_end)
+        assert abs(net_present_value) < 1e-6 * np.abs(curve["flows"]).sum(), f"Net present value {net_present_value} at the money-weighted return"
+    print(f"{arguments.checks} users match the per day replay, summary of one: {curve['summary']}")
+
+    uuid = list(balances)[0]
+    transactions = load_user_transactions_columns(DatabasesNames.transactions.value, uuid)
+    timings = {}
+    for name, function in (
+        ("engine", lambda: compute_equity_curve(transactions, balances[uuid], calendar, prices)),
+        ("per day replay", lambda: replay_per_day(transactions, balances[uuid], calendar, prices)),
+    ):
+        begin = time.perf_counter()
+        for _ in range(10):
+            function()
+        timings[name] = (time.perf_counter() - begin) / 10 * 1000
+        print(f"one user, {name:<15} {timings[name]:8.2f} ms")
+
+    begin = time.perf_counter()
+    summaries = compute_equity_curves(balances, start=calendar[0])
+    elapsed = time.perf_counter() - begin
+    print(f"batch of {len(summaries)} users over {len(calendar)} days: {elapsed:.2f} s ({elapsed / len(summaries) * 1000:.2f} ms per user, including loading each ledger)")
@@ -0,0 +1,77 @@
+"""
+Benchmark of sells with the in-memory lot index.
+
+Opens many lots of one symbol at random prices for a user on a throwaway set of databases, then times small sells
+(each consuming a lot or two) with the user's lots kept in the index, and with the user dropped from the index
+before every sell (so every sell loads and orders all of the user's lots again, like before the index).
+Afterwards the remaining lots in the portfolio are checked against a lowest cost first replay of the sells.
+Run it from the fastapi-app folder:
+    python testing/benchmark_lot_index.py [--lots 5000] [--sells 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark sells with the lot index")
+parser.add_argument("--lots", type=int, default=5000)
+parser.add_argument("--sells", type=int, default=200)
+arguments = harness.setup(parser, scratch_prefix="lot_index_benchmark_", start_balance=100000000)
+
+from data.database import DatabasesNames
+from data.dynamic_databases.helper import load_user_lots_columns
+from data.dynamic_databases.lot_index import lot_index
+from records.records import StockRecord
+from utils.stock_handler import StockHandler
+
+def order(uuid: str, side: str, shares: float, cost_per_share: float = 100.0) -> str:
+    stock_record = StockRecord(symbol="AAPL", side=side, order_type="market", shares=np.double(shares), cost_per_share=np.double(cost_per_share), notes=None)
+    handler = StockHandler()
+    handler.deal_with_transaction(stock_record, uuid)
+    return handler.status
+
+def time_sells(uuid: str, drop_from_index: bool) -> np.ndarray:
+    timings = []
+    for _ in range(arguments.sells):
+        if drop_from_index:
+            lot_index.invalidate(uuid)
+        start = time.perf_counter()
+        order(uuid, "sell", 1.5)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    harness.use_fake_quotes()
+    uuid = harness.create_user("lots")
+
+    random = np.random.default_rng(0)
+    prices = np.round(random.uniform(50, 150, arguments.lots), 2)
+    for price in prices:
+        order(uuid, "buy", 1.0, price)
+    print(f"{arguments.lots} lots, {arguments.sells} sells of 1.5 shares per variant")
+
+    cold = time_sells(uuid, drop_from_index=True)
+    warm = time_sells(uuid, drop_from_index=False)
+    for name, timings in (("reloaded every sell", cold), ("kept in the index", warm)):
+        print(f"{name:<22} p50 {np.percentile(timings, 50):7.2f} ms   p95 {np.percentile(timings, 95):7.2f} ms   mean {timings.mean():7.2f} ms")
+    print(f"p50 speedup: {np.percentile(cold, 50) / np.percentile(warm, 50):.1f}x, index: {lot_index.get_stats()}")
+
+    # Replay the sells on the prices: 1.5 shares per sell, from the lowest cost per share
+    remaining = np.sort(prices).tolist()
+    shares = [1.0] * len(remaining)
+    to_sell = 1.5 * 2 * arguments.sells
+    index = 0
+    while to_sell > 0 and index < len(shares):
+        taken = min(shares[index], to_sell)
+        shares[index] -= taken
+        to_sell -= taken
+        if shares[index] <= 0:
+            index += 1
+    expected = sorted((price, share) for price, share in zip(remaining, shares) if share > 0)
+    columns = load_user_lots_columns(DatabasesNames.portfolios.value, uuid)
+    actual = sorted(zip(columns["cost_per_share"].tolist(), columns["shares"].tolist()))
+    assert np.allclose(np.array(expected), np.array(actual)), "The remaining lots do not match a lowest cost first replay"
+    print(f"{len(actual)} remaining lots match a lowest cost first replay")
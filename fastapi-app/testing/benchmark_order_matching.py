@@ -0,0 +1,109 @@
+"""
+Benchmark of the matching cycle of resting orders.
+
+Rests a large number of limit, stop and stop-limit orders on a throwaway set of databases, quotes their
+symbols with the fake quote provider and times the matching cycles. Fills are only counted, so the timings
+are of the matching itself (filling an order is one database transaction, see StockHandler).
+Checks first that a resting order whose fill is rolled back stays in the book, and is filled by a later cycle.
+Run it from the fastapi-app folder:
+    python testing/benchmark_order_matching.py [--orders 100000] [--symbols 500] [--cycles 20]
+"""
+import argparse
+import uuid as uuid_module
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark the order matching cycle")
+parser.add_argument("--orders", type=int, default=100_000)
+parser.add_argument("--symbols", type=int, default=500)
+parser.add_argument("--cycles", type=int, default=20)
+arguments = harness.setup(parser, scratch_prefix="order_matching_benchmark_")
+
+from data.database import DatabasesNames
+from data.orders.helper import create_pending_order_model, get_day_order_expiry, get_pending_orders, utc_now
+from utils.quote_cache import quote_cache
+from utils.order_matching import OrderBook, OrderMatcher, RestingOrder
+from utils.stock_handler import StockHandler
+
+def check_rolled_back_fill() -> None:
+    uuid = harness.create_user("matching", tables=(DatabasesNames.transactions.value, DatabasesNames.portfolios.value))
+    # Marketable as soon as it rests
+    pending_order, error = create_pending_order_model(uuid, {
+        "symbol": "SYM0", "side": "buy", "order_type": "limit", "shares": 1, "limit_price": 1000, "time_in_force": "gtc",
+    })
+    assert error is None, error
+    matcher = OrderMatcher(book=OrderBook(), interval=5)
+    assert matcher.submit(pending_order), "The resting order was not saved"
+
+    def fail_buy(*args, **kwargs):
+        raise RuntimeError("Simulated failure of the fill")
+
+    buy_shares = StockHandler.buy_shares
+    StockHandler.buy_shares = fail_buy
+    try:
+        statistics = matcher.run_cycle()
+    finally:
+        StockHandler.buy_shares = buy_shares
+    assert statistics["fills"] == 1 and statistics["failed"] == 1, statistics
+    assert len(matcher.book) == 1, "The order of a rolled back fill was dropped from the book"
+    assert [order.uid for order in get_pending_orders(uuid)] == [pending_order.uid], "The order of a rolled back fill was not kept saved"
+
+    statistics = matcher.run_cycle()
+    assert statistics["fills"] == 1 and statistics["failed"] == 0, statistics
+    assert len(matcher.book) == 0 and get_pending_orders(uuid) == [], "The filled order was not removed"
+    print("A resting order whose fill is rolled back stays in the book and is filled by a later cycle")
+
+def fill_book(book: OrderBook, base_prices: dict[str, float]) -> None:
+    """ Rests orders a few percent away from the market, on both sides, so only a small share triggers per cycle. """
+    random = np.random.default_rng(0)
+    symbols = list(base_prices)
+    order_types = ("limit", "stop", "stop_limit")
+    expires_at = get_day_order_expiry(utc_now())
+    for index in range(arguments.orders):
+        symbol = symbols[index % len(symbols)]
+        side = "buy" if index % 2 == 0 else "sell"
+        order_type = order_types[index % 3]
+        distance = random.uniform(0.001, 0.1) * base_prices[symbol]
+        # Buy limits rest below the market and buy stops above it (and the other way around for sells)
+        limit_price = base_prices[symbol] - distance if side == "buy" else base_prices[symbol] + distance
+        stop_price = base_prices[symbol] + distance if side == "buy" else base_prices[symbol] - distance
+        book.add(RestingOrder(
+            uid=str(uuid_module.uuid4()), uuid="benchmark", symbol=symbol, side=side, order_type=order_type, shares=1.0,
+            limit_price=limit_price if order_type != "stop" else None,
+            stop_price=stop_price if order_type != "limit" else None,
+            expires_at=expires_at if index % 2 == 0 else None, triggered=False,
+        ))
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    base_prices = {f"SYM{index}": 10.0 + index for index in range(arguments.symbols)}
+    harness.use_fake_quotes(prices=base_prices)
+    check_rolled_back_fill()
+    # Quotes are cached for every cycle, as in between the server's cycles
+    quote_cache.field_ttls = {name: float("inf") for name in quote_cache.field_ttls}
+
+    book = OrderBook()
+    fill_book(book, base_prices)
+    fills = []
+    matcher = OrderMatcher(book=book, interval=5, execute=lambda order, price: fills.append(order.uid))
+    print(f"{len(book)} resting orders over {arguments.symbols} symbols")
+
+    # Warm the quote cache
+    matcher.run_cycle()
+    timings = []
+    for cycle in range(arguments.cycles):
+        # Move the market by a random walk, so every cycle triggers some orders
+        quote_cache.invalidate()
+        statistics = matcher.run_cycle()
+        timings.append(statistics["match_ms"])
+        print(f"cycle {cycle:>3}: {statistics['resting_orders']:>7} resting, {statistics['fills']:>5} fills, "
+              f"{statistics['activated']:>5} activated, quotes {statistics['quotes_ms']:7.2f} ms, match {statistics['match_ms']:7.2f} ms")
+
+    timings = np.array(timings)
+    print(f"match ms: p50 {np.percentile(timings, 50):.2f}, p95 {np.percentile(timings, 95):.2f}, max {timings.max():.2f}")
+
+    # A cycle without any price change only has to look at the top of every heap
+    statistics = matcher.run_cycle()
+    print(f"unchanged quotes: {statistics['fills']} fills, match {statistics['match_ms']:.2f} ms")
@@ -0,0 +1,140 @@
+"""
+Benchmark of the vectorized P&L engine.
+
+First places a few hundred real orders for one user and checks the engine's realized P&L against the sum of the
+realized P&L the sells reported lot by lot. Then writes many lots of many symbols for a second user straight into
+a throwaway set of databases and times loading them, computing the P&L with the engine, and computing the same
+figures with a Python loop over the lots (like the portfolio page used to).
+Run it from the fastapi-app folder:
+    python testing/benchmark_pnl.py [--lots 100000] [--symbols 500] [--repeats 20]
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark the vectorized P&L engine")
+parser.add_argument("--lots", type=int, default=100000)
+parser.add_argument("--symbols", type=int, default=500)
+parser.add_argument("--repeats", type=int, default=20)
+arguments = harness.setup(parser, scratch_prefix="pnl_benchmark_", start_balance=100000000)
+
+from data.database import DatabasesNames
+from data.utils.get_databases import get_db_execution, user_row_values
+from data.dynamic_databases.helper import load_user_lots_columns, sum_user_transactions_by_symbol
+from data.dynamic_databases.statements import insert_row
+from records.records import StockRecord, Statuses
+from utils.stock_handler import StockHandler
+from utils.pnl import compute_pnl, pnl_to_dict
+
+def order(uuid: str, symbol: str, side: str, shares: float, lot_selection: str = None) -> StockHandler:
+    stock_record = StockRecord(symbol=symbol, side=side, order_type="market", shares=np.double(shares), cost_per_share=np.double(100), notes=None)
+    handler = StockHandler()
+    handler.deal_with_transaction(stock_record, uuid, lot_selection=lot_selection)
+    return handler
+
+def check_realized_pnl() -> None:
+    """ Realized P&L of the engine must equal the sum of what the sells reported per consumed lot. """
+    uuid = harness.create_user("realized")
+    random = np.random.default_rng(1)
+    symbols = ("AAPL", "MSFT", "NVDA")
+    reported = defaultdict(float)
+    for _ in range(300):
+        symbol = symbols[random.integers(len(symbols))]
+        if random.random() < 0.6:
+            order(uuid, symbol, "buy", random.uniform(0.5, 3))
+        else:
+            handler = order(uuid, symbol, "sell", random.uniform(0.5, 4), ("fifo", "lifo", "highest_cost")[random.integers(3)])
+            if handler.realized_pnl is not None:
+                reported[symbol] += handler.realized_pnl["total"]
+    pnl = compute_pnl(
+        load_user_lots_columns(DatabasesNames.portfolios.value, uuid),
+        sum_user_transactions_by_symbol(DatabasesNames.transactions.value, uuid),
+        prices={},
+    )
+    engine = dict(zip(pnl["symbols"]["symbol"].tolist(), pnl["symbols"]["realized_pnl"].tolist()))
+    for symbol in symbols:
+        assert np.isclose(engine.get(symbol, 0), reported[symbol], atol=1e-6), f"{symbol}: {engine.get(symbol)} != {reported[symbol]}"
+    print(f"Realized P&L matches the sells' per lot P&L: {({symbol: round(reported[symbol], 2) for symbol in symbols})}")
+
+def write_lots(uuid: str) -> dict[str, float]:
+    """ Writes the lots (and their buy transactions) of a user directly, returns the prices of the symbols. """
+    random = np.random.default_rng(0)
+    symbols = [f"S{index:04d}" for index in range(arguments.symbols)]
+    prices = {symbol: float(price) for symbol, price in zip(symbols, np.round(random.uniform(10, 500, len(symbols)), 2))}
+    start = datetime.now() - timedelta(days=365)
+    portfolios_table = StockHandler.get_order_table(DatabasesNames.portfolios.value, uuid)
+    transactions_table = StockHandler.get_order_table(DatabasesNames.transactions.value, uuid)
+    rows = []
+    for index in range(arguments.lots):
+        symbol = symbols[random.integers(len(symbols))]
+        stock_record = StockRecord(
+            symbol=symbol, side="buy", order_type="market", shares=np.double(round(random.uniform(0.1, 10), 3)),
+            cost_per_share=np.double(round(prices[symbol] * random.uniform(0.7, 1.3), 2)), status=Statuses.tracked.value, notes=None,
+        )
+        stock_record.timestamp = start + timedelta(minutes=5 * index)
+        rows.append({**stock_record.to_dict(), **user_row_values(portfolios_table, uuid)})
+    session = next(get_db_execution())
+    with session.begin():
+        session.execute(insert_row(portfolios_table), rows)
+        session.execute(insert_row(transactions_table), rows)
+    session.close()
+    return prices
+
+def loop_pnl(lots: dict[str, np.ndarray], prices: dict[str, float]) -> dict:
+    """ The same unrealized figures with a Python loop over the lots. """
+    shares, cost_basis = defaultdict(float), defaultdict(float)
+    for symbol, lot_shares, cost_per_share in zip(lots["symbol"].tolist(), lots["shares"].tolist(), lots["cost_per_share"].tolist()):
+        shares[symbol] += lot_shares
+        cost_basis[symbol] += lot_shares * cost_per_share
+    market_values = {symbol: shares[symbol] * prices[symbol] for symbol in shares}
+    total = sum(market_values.values())
+    return {
+        symbol: {
+            "shares": shares[symbol], "average_cost": cost_basis[symbol] / shares[symbol], "market_value": market_values[symbol],
+            "unrealized_pnl": market_values[symbol] - cost_basis[symbol], "weight": market_values[symbol] / total,
+        }
+        for symbol in shares
+    }
+
+def measure(function) -> np.ndarray:
+    timings = []
+    for _ in range(arguments.repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    harness.use_fake_quotes()
+
+    check_realized_pnl()
+
+    uuid = harness.create_user("pnl")
+    prices = write_lots(uuid)
+    lots = load_user_lots_columns(DatabasesNames.portfolios.value, uuid)
+    transactions = sum_user_transactions_by_symbol(DatabasesNames.transactions.value, uuid)
+    print(f"{len(lots['symbol'])} lots of {arguments.symbols} symbols, {arguments.repeats} repeats")
+
+    pnl = pnl_to_dict(compute_pnl(lots, transactions, prices))
+    expected = loop_pnl(lots, prices)
+    for symbol, figures in expected.items():
+        for name, value in figures.items():
+            assert np.isclose(pnl["symbols"][symbol][name], value), f"{symbol} {name}: {pnl['symbols'][symbol][name]} != {value}"
+    print("Engine figures match the Python loop")
+
+    timings = {
+        "load lots (query)": measure(lambda: load_user_lots_columns(DatabasesNames.portfolios.value, uuid)),
+        "sum transactions (query)": measure(lambda: sum_user_transactions_by_symbol(DatabasesNames.transactions.value, uuid)),
+        "engine (compute_pnl)": measure(lambda: compute_pnl(lots, transactions, prices)),
+        "engine + to JSON": measure(lambda: pnl_to_dict(compute_pnl(lots, transactions, prices))),
+        "Python loop": measure(lambda: loop_pnl(lots, prices)),
+    }
+    for name, timing in timings.items():
+        print(f"{name:<26} p50 {np.percentile(timing, 50):8.2f} ms   p95 {np.percentile(timing, 95):8.2f} ms")
+    print(f"compute speedup over the loop: {np.percentile(timings['Python loop'], 50) / np.percentile(timings['engine (compute_pnl)'], 50):.1f}x")
@@ -0,0 +1,80 @@
+"""
+Benchmark of the portfolio compilation behind /get_user/summary.
+
+Fills a throwaway set of databases with one user holding lots in many symbols and compares the old
+per-symbol compilation (one query for the symbols, then one query per symbol) with the single-query
+`compile_user_portfolio` and its NumPy variant. Run it from the fastapi-app folder:
+    python testing/benchmark_portfolio_compilation.py [--symbols 50] [--lots 20] [--repeat 20]
+"""
+import argparse
+import time
+import uuid as uuid_module
+from datetime import datetime, timedelta
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark portfolio compilation")
+parser.add_argument("--symbols", type=int, default=50)
+parser.add_argument("--lots", type=int, default=20, help="Buy lots per symbol")
+parser.add_argument("--repeat", type=int, default=20)
+arguments = harness.setup(parser, scratch_prefix="portfolio_benchmark_")
+
+from data.database import DatabasesNames
+from data.dynamic_databases.helper import (
+    generate_table_by_id_for_selected_database, get_unique_symbols_owned, get_user_shares_by_symbol,
+    compile_user_portfolio, compile_user_portfolio_arrays, get_all_symbols_count, get_user_table
+)
+from data.utils.get_databases import get_database_variables_by_name, user_row_values
+from data.utils.query_counter import count_queries
+
+def fill_portfolio(uuid: str) -> None:
+    generate_table_by_id_for_selected_database(uuid, DatabasesNames.portfolios.value)
+    _, _, engine = get_database_variables_by_name(DatabasesNames.portfolios.value)
+    table = get_user_table(DatabasesNames.portfolios.value, uuid)
+    start = datetime(2024, 1, 1)
+    rows = [
+        {
+            "uid": str(uuid_module.uuid4()), "symbol": f"SYM{symbol}", "side": "buy", "order_type": "market",
+            "shares": 1.0 + lot, "cost_per_share": 10.0 + symbol, "total_cost": (1.0 + lot) * (10.0 + symbol),
+            "status": "tracked", "timestamp": start + timedelta(minutes=lot),
+            **user_row_values(table, uuid),
+        }
+        for symbol in range(arguments.symbols) for lot in range(arguments.lots)
+    ]
+    with engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+
+def compile_per_symbol(uuid: str) -> dict:
+    """ The previous implementation: one query for the owned symbols and one per symbol. """
+    return {
+        symbol: get_user_shares_by_symbol(DatabasesNames.portfolios.value, uuid, symbol, include_uid=False)
+        for symbol in get_unique_symbols_owned(DatabasesNames.portfolios.value, uuid)
+    }
+
+def measure(name: str, function, uuid: str) -> None:
+    with count_queries() as counter:
+        function(uuid)
+    start = time.perf_counter()
+    for _ in range(arguments.repeat):
+        function(uuid)
+    elapsed = (time.perf_counter() - start) / arguments.repeat
+    print(f"{name:<32} queries: {counter.total:>4}   avg: {elapsed * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    uuid = str(uuid_module.uuid4())
+    fill_portfolio(uuid)
+    symbols = [f"SYM{symbol}" for symbol in range(arguments.symbols)]
+
+    print(f"{arguments.symbols} symbols x {arguments.lots} lots, average of {arguments.repeat} runs")
+    measure("per symbol (N+1)", compile_per_symbol, uuid)
+    measure("compile_user_portfolio", lambda uuid: compile_user_portfolio(DatabasesNames.portfolios.value, uuid), uuid)
+    measure("compile_user_portfolio_arrays", lambda uuid: compile_user_portfolio_arrays(DatabasesNames.portfolios.value, uuid), uuid)
+    measure("get_all_symbols_count", lambda uuid: get_all_symbols_count(DatabasesNames.portfolios.value, uuid, symbols), uuid)
+
+    # The per symbol queries do not select the lots' UIDs, which the compiled portfolio carries for the lot selection
+    compiled = {
+        symbol: [{key: value for key, value in lot.items() if key != "uid"} for lot in lots]
+        for symbol, lots in compile_user_portfolio(DatabasesNames.portfolios.value, uuid).items()
+    }
+    assert compile_per_symbol(uuid) == compiled, "Compiled portfolios differ"
@@ -0,0 +1,128 @@
+"""
+Checks and benchmark of the quote cache, against the fake quote provider (which counts its calls).
+
+Checks that concurrent misses of a symbol share one upstream fetch, that a field is fetched again once its TTL
+passed while fresher fields are served from the cache, that the least recently used symbols are evicted, that a
+batch past its timeout serves the expired quotes as stale and that the hit, miss and latency counters follow.
+Then times a batch of cold lookups against the same batch served from the cache.
+Run it from the fastapi-app folder:
+    python testing/benchmark_quote_cache.py [--symbols 200] [--latency 0.02] [--workers 8]
+"""
+import argparse
+import threading
+import time
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the quote cache")
+parser.add_argument("--symbols", type=int, default=200, help="Symbols of the benchmarked batch")
+parser.add_argument("--latency", type=float, default=0.02, help="Seconds per fetch of the fake quote provider")
+parser.add_argument("--workers", type=int, default=8, help="Fetches of a batch running at once")
+arguments = harness.setup(parser)
+
+import logging
+from utils.logger_script import logger
+from utils.quote_cache import QuoteCache
+from fake_quote_provider import FakeQuoteProvider
+
+def create_cache(provider: FakeQuoteProvider, max_symbols: int = 16, volatile_ttl: float = 60, static_ttl: float = 3600) -> QuoteCache:
+    return QuoteCache(provider, max_symbols=max_symbols, volatile_ttl=volatile_ttl, static_ttl=static_ttl, batch_workers=arguments.workers)
+
+def check_coalescing() -> None:
+    provider = FakeQuoteProvider(latency=0.2)
+    cache = create_cache(provider)
+    callers = 16
+    barrier = threading.Barrier(callers)
+    results = []
+
+    def lookup():
+        barrier.wait()
+        results.append(cache.get_info("AAPL"))
+
+    threads = [threading.Thread(target=lookup) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.get_stats()
+    assert provider.calls == 1, f"{callers} concurrent misses made {provider.calls} upstream calls"
+    assert len(results) == callers and all(result == results[0] for result in results), "The callers got different quotes"
+    assert stats["misses"] == callers and stats["coalesced"] == callers - 1 and stats["upstream_fetches"] == 1, stats
+    # The counters time the upstream fetch, not the waits of the coalesced callers
+    assert 200 <= stats["fetch_ms_avg"] <= stats["fetch_ms_max"] < 1000, stats
+    print(f"{callers} concurrent misses of a symbol share one upstream fetch of {stats['fetch_ms_avg']:.0f} ms")
+
+def check_ttls() -> None:
+    provider = FakeQuoteProvider()
+    cache = create_cache(provider, volatile_ttl=0.05)
+    first = cache.get_info("AAPL")
+    assert cache.get_info("AAPL", fields=("bid", "longName")) == first and provider.calls == 1, "A fresh quote was fetched again"
+
+    time.sleep(0.06)
+    assert cache.get_info("AAPL", fields=("longName", "sector"))["longName"] == first["longName"]
+    assert provider.calls == 1, "A field within its TTL was fetched again"
+    cache.get_info("AAPL", fields=("bid",))
+    assert provider.calls == 2, "A field past its TTL was served from the cache"
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["upstream_fetches"]) == (2, 2, 2), stats
+    assert stats["hit_ratio"] == 0.5, stats
+    print("A field is fetched again once its TTL passed, the fields within theirs are served from the cache")
+
+def check_eviction() -> None:
+    provider = FakeQuoteProvider()
+    cache = create_cache(provider, max_symbols=3)
+    for symbol in ("A", "B", "C"):
+        cache.get_info(symbol)
+    # Used again, so B is now the least recently used
+    cache.get_info("A")
+    cache.get_info("D")
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1 and stats["cached_symbols"] == 3, stats
+
+    calls = provider.calls
+    cache.get_info("A")
+    assert provider.calls == calls, "A recently used symbol was evicted"
+    cache.get_info("B")
+    assert provider.calls == calls + 1, "The least recently used symbol was not evicted"
+    assert cache.get_stats()["evictions"] == 2
+    print("The least recently used symbols are evicted past the maximum size")
+
+def check_stale_fallback() -> None:
+    provider = FakeQuoteProvider()
+    cache = create_cache(provider, volatile_ttl=0.05)
+    cached = cache.get_quotes(["AAPL"], fields=("bid", "ask")).quotes["AAPL"]
+    time.sleep(0.06)
+
+    provider.latency = 0.5
+    start = time.perf_counter()
+    result = cache.get_quotes(["AAPL", "MSFT"], fields=("bid", "ask"), timeout=0.05)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.3, f"The batch took {elapsed:.2f} s past its timeout"
+    assert result.stale == {"AAPL"} and result.quotes == {"AAPL": cached}, "The expired quote was not served as stale"
+    assert set(result.errors) == {"AAPL", "MSFT"}, "The late symbols were not reported"
+    print("A batch past its timeout serves the expired quotes as stale, and reports the symbols never cached")
+
+def benchmark() -> None:
+    provider = FakeQuoteProvider(latency=arguments.latency)
+    cache = create_cache(provider, max_symbols=arguments.symbols)
+    symbols = [f"SYM{index}" for index in range(arguments.symbols)]
+    timings = {}
+    for scheme in ("cold", "cached"):
+        start = time.perf_counter()
+        result = cache.get_quotes(symbols, fields=("bid", "ask"))
+        timings[scheme] = time.perf_counter() - start
+        assert len(result.quotes) == arguments.symbols and not result.errors
+        print(f"{scheme}: {timings[scheme] * 1000:9.2f} ms for {arguments.symbols} symbols, {provider.calls} upstream calls in total")
+    print(f"Serving the batch from the cache is {timings['cold'] / timings['cached']:.0f}x faster "
+          f"({arguments.workers} fetches at once of {arguments.latency * 1000:.0f} ms)")
+    print(cache.get_stats())
+
+if __name__ == "__main__":
+    logger.setLevel(logging.WARNING)
+    check_coalescing()
+    check_ttls()
+    check_eviction()
+    check_stale_fallback()
+    benchmark()
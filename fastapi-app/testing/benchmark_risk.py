@@ -0,0 +1,148 @@
+"""
+Checks and benchmark of the risk analytics, with the fake bar provider.
+
+Writes the open lots of a user straight into a throwaway set of databases, then checks the figures against
+a straightforward computation (a loop over the symbols and pairs of symbols, and over the days of the rolling
+volatility), checks that a symbol listed too recently is left out, and that the return matrix is cached.
+Then times building the return matrix of portfolios of growing size and serving them once it is cached.
+Run it from the fastapi-app folder:
+    python testing/benchmark_risk.py [--symbols 10 50 200] [--window 252] [--repeats 20]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the risk analytics")
+parser.add_argument("--symbols", type=int, nargs="+", default=[10, 50, 200], help="Sizes of the benchmarked portfolios")
+parser.add_argument("--window", type=int, default=252)
+parser.add_argument("--repeats", type=int, default=20)
+arguments = harness.setup(parser, scratch_prefix="risk_benchmark_", start_balance=1000000)
+
+from data.database import DatabasesNames
+from data.utils.get_databases import get_db_execution, get_execution_table, user_row_values
+from data.dynamic_databases.statements import insert_row
+from data.bars.store import set_bar_provider, bar_store
+from data.bars.providers import BarIntervals
+from records.records import StockRecord, Statuses
+from utils.risk import get_user_risk, return_matrix_cache, ROLLING_VOLATILITY_DAYS, CONFIDENCE_LEVELS
+from utils.equity_curve import TRADING_DAYS_PER_YEAR
+from fake_bar_provider import FakeBarProvider
+
+class ListedBarProvider(FakeBarProvider):
+    """ The fake bars, except symbols starting with "NEW" are only listed for the last week. """
+    def get_bars(self, symbol, interval, start, end):
+        if symbol.startswith("NEW"):
+            start = max(start, datetime.now() - timedelta(days=7))
+            if start >= end:
+                return FakeBarProvider.get_bars(self, symbol, interval, end, end)
+        return FakeBarProvider.get_bars(self, symbol, interval, start, end)
+
+def create_user_with_lots(holdings: dict[str, float]) -> str:
+    uuid = harness.create_user(f"risk{len(holdings)}_{time.time_ns()}", tables=(DatabasesNames.portfolios.value,))
+
+    portfolios_table = get_execution_table(DatabasesNames.portfolios.value, uuid)
+    rows = []
+    for symbol, shares in holdings.items():
+        # Two lots of every symbol, the risk uses their summed shares
+        for part in (0.25, 0.75):
+            stock_record = StockRecord(symbol=symbol, side="buy", order_type="market", shares=np.double(shares * part),
+                                       cost_per_share=np.double(100), status=Statuses.tracked.value, notes=None)
+            rows.append({**stock_record.to_dict(), **user_row_values(portfolios_table, uuid)})
+    execution_session = next(get_db_execution())
+    with execution_session.begin():
+        execution_session.execute(insert_row(portfolios_table), rows)
+    execution_session.close()
+    return uuid
+
+def expected_risk(holdings: dict[str, float], benchmark: str, window: int) -> dict:
+    """ The same figures a symbol, a pair of symbols and a day at a time. """
+    benchmark_bars = bar_store.get_bars(benchmark, BarIntervals.day.value, datetime.now() - timedelta(days=window * 2), None)
+    days = benchmark_bars["time"].astype("datetime64[D]")[-(window + 1):]
+    closes = {}
+    for symbol in [*holdings, benchmark]:
+        bars = bar_store.get_bars(symbol, BarIntervals.day.value, days[0].astype(datetime), None)
+        by_day = dict(zip(bars["time"].astype("datetime64[D]").tolist(), bars["close"].tolist()))
+        closes[symbol] = np.array([by_day[day] for day in days.tolist()])
+    returns = {symbol: values[1:] / values[:-1] - 1 for symbol, values in closes.items()}
+
+    values = {symbol: shares * closes[symbol][-1] for symbol, shares in holdings.items()}
+    total = sum(values.values())
+    portfolio = sum(returns[symbol] * value / total for symbol, value in values.items())
+    figures = {"symbols": {}, "correlation": {}}
+    for symbol in holdings:
+        covariance = np.cov(returns[symbol], returns[benchmark])
+        figures["symbols"][symbol] = {
+            "volatility_annualized": np.std(returns[symbol], ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR),
+            "beta": covariance[0, 1] / covariance[1, 1],
+        }
+        for other in holdings:
+            figures["correlation"][(symbol, other)] = np.corrcoef(returns[symbol], returns[other])[0, 1]
+    figures["volatility_annualized"] = np.std(portfolio, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+    figures["rolling"] = [np.std(portfolio[end - ROLLING_VOLATILITY_DAYS:end], ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+                          for end in range(ROLLING_VOLATILITY_DAYS, len(portfolio) + 1)]
+    figures["value_at_risk"] = []
+    for confidence in CONFIDENCE_LEVELS:
+        threshold = np.quantile(portfolio, 1 - confidence)
+        z = NormalDist().inv_cdf(1 - confidence)
+        figures["value_at_risk"].append({
+            "historical_var": -threshold * total,
+            "historical_cvar": -np.mean([value for value in portfolio if value <= threshold]) * total,
+            "parametric_var": -(portfolio.mean() + z * np.std(portfolio, ddof=1)) * total,
+        })
+    return figures
+
+def check_figures() -> None:
+    holdings = {"AAPL": 10, "MSFT": 25.5, "NVDA": 3, "JPM": 40, "NEWCO": 5}
+    uuid = create_user_with_lots(holdings)
+    risk = get_user_risk(uuid, 60, "SPY")
+    assert risk is not None and risk["missing_bars"] == ["NEWCO"], f"Recently listed symbols are not left out: {risk and risk['missing_bars']}"
+    del holdings["NEWCO"]
+    expected = expected_risk(holdings, "SPY", 60)
+
+    assert risk["observations"] == 60
+    assert np.isclose(risk["portfolio"]["volatility_annualized"], expected["volatility_annualized"])
+    for symbol, figures in expected["symbols"].items():
+        for name, value in figures.items():
+            assert np.isclose(risk["symbols"][symbol][name], value), f"{name} of {symbol}: {risk['symbols'][symbol][name]} != {value}"
+    symbols = risk["correlation"]["symbols"]
+    for (symbol, other), value in expected["correlation"].items():
+        assert np.isclose(risk["correlation"]["matrix"][symbols.index(symbol)][symbols.index(other)], value, atol=1e-6)
+    assert np.allclose(risk["portfolio"]["rolling_volatility"]["values"], expected["rolling"], atol=1e-6)
+    for level, expected_level in zip(risk["value_at_risk"], expected["value_at_risk"]):
+        for name, value in expected_level.items():
+            assert np.isclose(level[name], value), f"{name} at {level['confidence']}: {level[name]} != {value}"
+    assert np.isclose(sum(figures["risk_contribution"] for figures in risk["symbols"].values()), 1)
+    assert not risk["cached"] and get_user_risk(uuid, 60, "SPY")["cached"], "The return matrix was not cached"
+    print(f"Risk checks passed: volatility {risk['portfolio']['volatility_annualized']:.2%}, beta {risk['portfolio']['beta']:.2f}, "
+          f"95% historical VaR ${risk['value_at_risk'][0]['historical_var']:,.2f}")
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    set_bar_provider(ListedBarProvider())
+    check_figures()
+
+    random = np.random.default_rng(0)
+    for size in arguments.symbols:
+        uuid = create_user_with_lots({f"S{index:04d}": float(random.uniform(1, 100)) for index in range(size)})
+        # Bars fetched once, so the timings are of building the matrix from stored bars
+        get_user_risk(uuid, arguments.window)
+        return_matrix_cache.invalidate()
+        cold = []
+        for _ in range(max(arguments.repeats // 4, 1)):
+            return_matrix_cache.invalidate()
+            begin = time.perf_counter()
+            get_user_risk(uuid, arguments.window)
+            cold.append((time.perf_counter() - begin) * 1000)
+        cached = []
+        for _ in range(arguments.repeats):
+            begin = time.perf_counter()
+            risk = get_user_risk(uuid, arguments.window)
+            cached.append((time.perf_counter() - begin) * 1000)
+        print(f"{size:>4} symbols: matrix built p50 {np.percentile(cold, 50):8.2f} ms   cached p50 {np.percentile(cached, 50):8.2f} ms   "
+              f"(load {risk['timings']['load_ms']:.2f} ms, compute {risk['timings']['compute_ms']:.2f} ms)")
+    print(f"stats: {return_matrix_cache.get_stats()}")
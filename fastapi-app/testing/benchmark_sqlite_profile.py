@@ -0,0 +1,111 @@
+"""
+Benchmark of the SQLite storage profiles under a mixed read/write workload.
+
+Runs the same workload once per profile, every run in its own process (the profile is read when the databases
+are imported) on a throwaway set of databases: threads that either read a user's summary (balance and portfolio)
+or place a market order (a write transaction over the three attached databases), with the fake quote provider.
+Reports the operations per second and the p50/p99 latencies of the reads and the writes.
+Run it from the fastapi-app folder:
+    python testing/benchmark_sqlite_profile.py [--users 20] [--operations 3000] [--threads 16] [--write-ratio 0.2]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark the SQLite storage profiles")
+parser.add_argument("--users", type=int, default=20)
+parser.add_argument("--operations", type=int, default=3000)
+parser.add_argument("--threads", type=int, default=16)
+parser.add_argument("--write-ratio", type=float, default=0.2)
+# Internal: run the workload with the profile of the environment
+parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+# The runs inherit the environment, so their users start with the same balance
+arguments = harness.setup(parser, start_balance=1000000)
+
+# Orders stay atomic across the three database files only with the rollback journal, the WAL profiles trade that for throughput
+PROFILES = {
+    "sqlite defaults": {
+        "SQLITE_JOURNAL_MODE": "delete", "SQLITE_SYNCHRONOUS": "full", "SQLITE_MMAP_SIZE": "0", "SQLITE_CACHE_SIZE": "-2000",
+    },
+    "rollback journal, full (default)": {"SQLITE_JOURNAL_MODE": "delete", "SQLITE_SYNCHRONOUS": "full"},
+    "wal, synchronous=full": {"SQLITE_JOURNAL_MODE": "wal", "SQLITE_SYNCHRONOUS": "full"},
+    "wal, synchronous=normal": {"SQLITE_JOURNAL_MODE": "wal", "SQLITE_SYNCHRONOUS": "normal"},
+}
+SYMBOLS = ("AAPL", "MSFT", "NVDA", "AMZN")
+
+def run_workload() -> None:
+    """ Runs the workload in a throwaway folder and prints its statistics as the last line. """
+    harness.use_scratch_folder("sqlite_profile_benchmark_")
+    from data.database import DatabasesNames
+    from data.utils.get_databases import get_db
+    from data.dynamic_databases.helper import compile_user_portfolio
+    from data.userbase.model import Userbase
+    from records.records import StockRecord
+    from utils.stock_handler import StockHandler
+
+    harness.initialise_databases()
+    harness.use_fake_quotes()
+    uuids = [harness.create_user(f"profile{index}") for index in range(arguments.users)]
+
+    def order(uuid: str, side: str, symbol: str) -> None:
+        stock_record = StockRecord(symbol=symbol, side=side, order_type="market", shares=np.double(1), cost_per_share=np.double(100), notes=None)
+        stock_record.update_total_cost()
+        StockHandler().deal_with_transaction(stock_record, uuid)
+
+    # Every user starts with a few lots, so sells are filled and reads return something
+    for uuid in uuids:
+        for symbol in SYMBOLS:
+            order(uuid, "buy", symbol)
+
+    random = np.random.default_rng(0)
+    operations = [
+        ("write" if random.random() < arguments.write_ratio else "read", uuids[random.integers(len(uuids))],
+         "buy" if random.random() < 0.5 else "sell", SYMBOLS[random.integers(len(SYMBOLS))])
+        for _ in range(arguments.operations)
+    ]
+
+    def run(operation: tuple) -> tuple[str, float]:
+        kind, uuid, side, symbol = operation
+        start = time.perf_counter()
+        if kind == "write":
+            order(uuid, side, symbol)
+        else:
+            session = next(get_db(DatabasesNames.userbase.value))
+            try:
+                session.query(Userbase.balance).filter(Userbase.uuid == uuid).scalar()
+            finally:
+                session.close()
+            compile_user_portfolio(DatabasesNames.portfolios.value, uuid)
+        return kind, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.threads) as executor:
+        results = list(executor.map(run, operations))
+    elapsed = time.perf_counter() - start
+
+    statistics = [f"{len(results) / elapsed:8.1f} ops/s"]
+    for kind in ("read", "write"):
+        latencies = np.array([latency for result_kind, latency in results if result_kind == kind]) * 1000
+        statistics.append(f"{kind}s p50 {np.percentile(latencies, 50):7.2f} p99 {np.percentile(latencies, 99):8.2f} ms")
+    print("   ".join(statistics))
+
+if __name__ == "__main__":
+    if arguments.run:
+        run_workload()
+    else:
+        print(f"{arguments.operations} operations ({arguments.write_ratio:.0%} market orders) of {arguments.users} users on {arguments.threads} threads")
+        for name, profile in PROFILES.items():
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run"],
+                env={**os.environ, **profile},
+                capture_output=True, text=True,
+            )
+            lines = output.stdout.strip().splitlines()
+            print(f"{name:<36} {lines[-1] if output.returncode == 0 and lines else 'failed: ' + output.stderr[-500:]}")
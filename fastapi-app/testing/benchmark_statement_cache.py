@@ -0,0 +1,129 @@
+"""
+Microbenchmark of the per call overhead of the hot query shapes of the dynamic databases.
+
+Compares the previous inline pattern (a new sessionmaker and a freshly built statement on every call) with the
+cached sessionmakers and the lambda statements of `data.dynamic_databases.statements`, on a throwaway set of
+databases holding one user's lots. Both variants are checked to return the same rows. Run it from the fastapi-app
+folder (in either storage mode):
+    [STORAGE_MODE=ledger] python testing/benchmark_statement_cache.py [--symbols 20] [--lots 5] [--calls 2000]
+"""
+import argparse
+import time
+import uuid as uuid_module
+from datetime import datetime, timedelta
+
+import harness
+
+parser = argparse.ArgumentParser(description="Benchmark cached sessionmakers and statements")
+parser.add_argument("--symbols", type=int, default=20)
+parser.add_argument("--lots", type=int, default=5, help="Buy lots per symbol")
+parser.add_argument("--calls", type=int, default=2000)
+arguments = harness.setup(parser, scratch_prefix="statement_benchmark_")
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import sessionmaker
+
+from data.database import DatabasesNames, storage_mode
+from data.dynamic_databases.helper import (
+    generate_table_by_id_for_selected_database, get_user_table, get_user_shares_by_symbol, get_unique_symbols_owned,
+    does_row_exist_in_table
+)
+from data.dynamic_databases.statements import insert_row
+from data.utils.get_databases import get_database_variables_by_name, user_rows_filter, user_row_values, get_sessionmaker
+
+PORTFOLIOS = DatabasesNames.portfolios.value
+
+def lot_values(uuid: str, symbol: int, lot: int) -> dict:
+    return {
+        "uid": str(uuid_module.uuid4()), "symbol": f"SYM{symbol}", "side": "buy", "order_type": "market",
+        "shares": 1.0 + lot, "cost_per_share": 10.0 + symbol, "total_cost": (1.0 + lot) * (10.0 + symbol),
+        "status": "tracked", "timestamp": datetime(2024, 1, 1) + timedelta(minutes=lot), "notes": None,
+    }
+
+# The previous implementations: a sessionmaker per call and a statement built (and its cache key generated) per call
+def inline_lots_by_symbol(uuid: str, symbol: str) -> list:
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    session = sessionmaker(bind=engine)()
+    try:
+        table = get_user_table(PORTFOLIOS, uuid)
+        query = select(table.c.uid, table.c.shares, table.c.cost_per_share).where(
+            user_rows_filter(table, uuid) & (table.c.symbol == symbol.upper()) & (table.c.side == "buy")
+        )
+        return [tuple(row) for row in session.execute(query).fetchall()]
+    finally:
+        session.close()
+
+def inline_distinct_symbols(uuid: str) -> list:
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    session = sessionmaker(bind=engine)()
+    try:
+        table = get_user_table(PORTFOLIOS, uuid)
+        query = select(table.c.symbol.distinct()).where(user_rows_filter(table, uuid) & (table.c.side == "buy"))
+        return [row.symbol for row in session.execute(query).fetchall()]
+    finally:
+        session.close()
+
+def inline_uid_exists(uuid: str, uid: str) -> bool:
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    session = sessionmaker(bind=engine)()
+    try:
+        table = get_user_table(PORTFOLIOS, uuid)
+        query = select(table.c.uid).where((table.c.uid == uid) & user_rows_filter(table, uuid))
+        return session.execute(query).scalar() is not None
+    finally:
+        session.close()
+
+def inline_insert(uuid: str, values: dict) -> None:
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    session = sessionmaker(bind=engine)()
+    try:
+        table = get_user_table(PORTFOLIOS, uuid)
+        session.execute(insert(table).values({**values, **user_row_values(table, uuid)}))
+        session.rollback()
+    finally:
+        session.close()
+
+def cached_insert(uuid: str, values: dict) -> None:
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    session = get_sessionmaker(engine)()
+    try:
+        table = get_user_table(PORTFOLIOS, uuid)
+        session.execute(insert_row(table), {**values, **user_row_values(table, uuid)})
+        session.rollback()
+    finally:
+        session.close()
+
+def measure(name: str, before, after) -> None:
+    timings = []
+    for function in (before, after):
+        function()
+        start = time.perf_counter()
+        for _ in range(arguments.calls):
+            function()
+        timings.append((time.perf_counter() - start) / arguments.calls * 1e6)
+    print(f"{name:<22} inline {timings[0]:8.1f} us/call   cached {timings[1]:8.1f} us/call   ({timings[0] / timings[1]:.2f}x)")
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    uuid = str(uuid_module.uuid4())
+    generate_table_by_id_for_selected_database(uuid, PORTFOLIOS)
+    _, _, engine = get_database_variables_by_name(PORTFOLIOS)
+    table = get_user_table(PORTFOLIOS, uuid)
+    rows = [{**lot_values(uuid, symbol, lot), **user_row_values(table, uuid)} for symbol in range(arguments.symbols) for lot in range(arguments.lots)]
+    with engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+    uid = rows[len(rows) // 2]["uid"]
+
+    # Both variants have to return the same rows
+    cached_lots = [(lot["uid"], lot["shares"], lot["cost_per_share"]) for lot in get_user_shares_by_symbol(PORTFOLIOS, uuid, "SYM3")]
+    assert cached_lots == inline_lots_by_symbol(uuid, "SYM3")
+    assert sorted(get_unique_symbols_owned(PORTFOLIOS, uuid)) == sorted(inline_distinct_symbols(uuid))
+    assert does_row_exist_in_table(PORTFOLIOS, uuid, uid) and inline_uid_exists(uuid, uid)
+    assert not does_row_exist_in_table(PORTFOLIOS, uuid, "missing") and not inline_uid_exists(uuid, "missing")
+
+    print(f"{storage_mode.value} storage mode, {len(rows)} lots, {arguments.calls} calls per shape")
+    measure("lots by symbol", lambda: inline_lots_by_symbol(uuid, "SYM3"), lambda: get_user_shares_by_symbol(PORTFOLIOS, uuid, "SYM3"))
+    measure("distinct symbols", lambda: inline_distinct_symbols(uuid), lambda: get_unique_symbols_owned(PORTFOLIOS, uuid))
+    measure("uid exists", lambda: inline_uid_exists(uuid, uid), lambda: does_row_exist_in_table(PORTFOLIOS, uuid, uid))
+    new_lot = lot_values(uuid, 0, 0)
+    measure("insert (rolled back)", lambda: inline_insert(uuid, new_lot), lambda: cached_insert(uuid, new_lot))
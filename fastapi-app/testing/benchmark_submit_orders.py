@@ -0,0 +1,128 @@
+"""
+Checks and benchmark of the batch order endpoint, with fixed fake quotes.
+
+Submits the same random market orders (buys partially filled by the balance, sells of lots bought earlier in the
+batch, every lot selection) through `/submit_order` one at a time for one user and through `/submit_orders` for
+another, and checks that both users end with the same balance, open lots, transaction history and realized P&L.
+Then times importing orders both ways, in orders per second. Both routes are called in process with their
+parameters as the route dependency decrypts them. Run it from the fastapi-app folder (STORAGE_MODE=ledger for the shared tables):
+    python testing/benchmark_submit_orders.py [--orders 2000] [--batch 500] [--quote-latency 0]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the batch order endpoint")
+parser.add_argument("--orders", type=int, default=2000, help="Orders of the benchmark")
+parser.add_argument("--batch", type=int, default=500, help="Orders per /submit_orders request")
+parser.add_argument("--checks", type=int, default=300, help="Orders of the equivalence check")
+parser.add_argument("--quote-latency", type=float, default=0.0, help="Seconds per fetch of the fake quote provider")
+arguments = harness.setup(parser, scratch_prefix="submit_orders_benchmark_", start_balance=1000000)
+
+from sqlalchemy import select
+from data.database import DatabasesNames
+from data.userbase.helper import get_user_from_userbase
+from data.utils.get_databases import get_db_execution, get_execution_table, user_rows_filter
+from data.orders.helper import get_pending_orders
+from records.records import UserIdentifiers, LotSelections
+from routes.routes import submit_order, submit_orders
+from utils.quote_cache import QuoteProvider, set_quote_provider, quote_cache
+from utils.stock_handler import MAX_BATCH_TRANSACTIONS
+
+SYMBOLS = ("AAPL", "MSFT", "NVDA", "AMZN")
+
+class FixedQuoteProvider(QuoteProvider):
+    """ Quotes that never move, so orders sent at different times fill at the same prices. """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def get_info(self, symbol: str) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        price = 50.0 + 25 * SYMBOLS.index(symbol) if symbol in SYMBOLS else 100.0
+        return {"symbol": symbol, "bid": price - 0.01, "ask": price + 0.01, "currentPrice": price, "regularMarketPrice": price}
+
+def create_user() -> str:
+    return harness.create_user(f"batch{time.time_ns()}", tables=(DatabasesNames.transactions.value, DatabasesNames.portfolios.value))
+
+def random_orders(count: int, seed: int) -> list[dict]:
+    """ Market orders of every lot selection (but specific, whose lot UIDs differ between users), and a few limit orders. """
+    random = np.random.default_rng(seed)
+    selections = [selection.value for selection in LotSelections if selection != LotSelections.specific]
+    orders = []
+    for _ in range(count):
+        order = {"symbol": SYMBOLS[random.integers(len(SYMBOLS))], "side": "buy" if random.random() < 0.6 else "sell",
+                 "order_type": "market", "shares": round(float(random.uniform(1, 2000)), 2)}
+        if order["side"] == "sell":
+            order["lot_selection"] = selections[random.integers(len(selections))]
+        if random.random() < 0.05:
+            order.update(order_type="limit", limit_price=1.0, time_in_force="gtc")
+        orders.append(order)
+    return orders
+
+def user_state(uuid: str) -> tuple:
+    """ The balance, open lots and transaction history of a user, without the UIDs and timestamps that differ between users. """
+    balance = float(get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid).balance)
+    session = next(get_db_execution())
+    try:
+        portfolios = get_execution_table(DatabasesNames.portfolios.value, uuid)
+        lots = session.execute(select(portfolios.c.symbol, portfolios.c.shares, portfolios.c.cost_per_share)
+                               .where(user_rows_filter(portfolios, uuid))).fetchall()
+        transactions = get_execution_table(DatabasesNames.transactions.value, uuid)
+        history = session.execute(select(transactions.c.symbol, transactions.c.side, transactions.c.shares, transactions.c.cost_per_share, transactions.c.status)
+                                  .where(user_rows_filter(transactions, uuid)).order_by(transactions.c.timestamp)).fetchall()
+    finally:
+        session.close()
+    return round(balance, 6), sorted((symbol, round(shares, 6), cost) for symbol, shares, cost in lots), [tuple(row) for row in history]
+
+def submit_one_by_one(uuid: str, orders: list[dict]) -> list[dict]:
+    return [submit_order({"order": order}, uuid).to_dict() for order in orders]
+
+def submit_in_batches(uuid: str, orders: list[dict], batch: int) -> list[dict]:
+    results = []
+    for start in range(0, len(orders), batch):
+        response = submit_orders({"orders": orders[start:start + batch]}, uuid)
+        assert response.success, response.error
+        results.extend(response.data)
+    return results
+
+def check_batch_matches_single_orders() -> None:
+    orders = random_orders(arguments.checks, seed=1)
+    single_uuid, batch_uuid = create_user(), create_user()
+    single_results = submit_one_by_one(single_uuid, orders)
+    batch_results = submit_in_batches(batch_uuid, orders, MAX_BATCH_TRANSACTIONS)
+
+    for order, single, batch in zip(orders, single_results, batch_results):
+        if order["order_type"] == "market" and order["side"] == "sell":
+            single_pnl = single["extra"]["total"] if single["extra"] else None
+            batch_pnl = batch["extra"]["total"] if batch["extra"] else None
+            assert single_pnl is None and batch_pnl is None or np.isclose(single_pnl, batch_pnl), f"Realized P&L {single_pnl} != {batch_pnl}"
+    single_state, batch_state = user_state(single_uuid), user_state(batch_uuid)
+    assert single_state[0] == batch_state[0], f"Balance {single_state[0]} != {batch_state[0]}"
+    assert single_state[1] == batch_state[1], "The open lots differ"
+    assert single_state[2] == batch_state[2], "The transaction histories differ"
+    resting = sum(order["order_type"] == "limit" for order in orders)
+    assert len(get_pending_orders(batch_uuid)) == resting, "The resting orders of the batch were not saved"
+    print(f"A batch of {len(orders)} orders matches them submitted one by one: balance {batch_state[0]:,.2f}, "
+          f"{len(batch_state[1])} open lots, {len(batch_state[2])} transactions, {resting} resting orders")
+
+if __name__ == "__main__":
+    harness.initialise_databases(logging.ERROR)
+    set_quote_provider(FixedQuoteProvider(arguments.quote_latency))
+    check_batch_matches_single_orders()
+
+    orders = random_orders(arguments.orders, seed=2)
+    timings = {}
+    for name, submit in (("one by one", submit_one_by_one), ("in batches", lambda uuid, orders: submit_in_batches(uuid, orders, arguments.batch))):
+        uuid = create_user()
+        # Every way starts with cold quotes
+        quote_cache.invalidate()
+        begin = time.perf_counter()
+        submit(uuid, orders)
+        timings[name] = time.perf_counter() - begin
+        print(f"{len(orders)} orders {name:<10}: {timings[name]:7.2f} s, {len(orders) / timings[name]:9,.0f} orders/s")
+    print(f"Batches of {arguments.batch} are {timings['one by one'] / timings['in batches']:.1f}x faster")
@@ -0,0 +1,53 @@
+from typing import Union
+from datetime import datetime
+import threading
+import time
+
+import numpy as np
+
+from data.bars.providers import BarProvider, BAR_DTYPE, INTERVAL_DURATIONS, BarIntervals
+
+class FakeBarProvider(BarProvider):
+    """
+    Local stand-in for yfinance's history. Bars are a deterministic random walk per symbol (the same bar is the
+    same every time it is fetched), daily bars skip weekends, and every requested range is recorded so the
+    store's incremental fetching can be checked.
+
+    Args:
+        latency (float): Seconds to sleep per fetch, simulating the network round trip.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests: list[tuple[str, str, datetime, datetime]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _times(interval: str, start: datetime, end: datetime) -> np.ndarray:
+        duration = INTERVAL_DURATIONS[interval]
+        first = np.datetime64(start, "s")
+        # Bars open on multiples of the interval
+        first = first + (-first.astype(np.int64)) % duration.astype("timedelta64[s]").astype(np.int64)
+        times = np.arange(first, np.datetime64(end, "s"), duration).astype("datetime64[s]")
+        if interval == BarIntervals.day.value:
+            weekdays = (times.astype("datetime64[D]").astype(np.int64) + 3) % 7
+            times = times[weekdays < 5]
+        return times
+
+    def get_bars(self, symbol: str, interval: str, start: datetime, end: datetime) -> Union[np.ndarray, None]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests.append((symbol, interval, start, end))
+        times = self._times(interval, start, end)
+        bars = np.empty(len(times), dtype=BAR_DTYPE)
+        bars["time"] = times
+        # Seeded by the symbol and each bar's time, so overlapping fetches agree
+        seeds = times.astype(np.int64) + sum(map(ord, symbol)) * 7919
+        noise = np.sin(seeds * 12.9898) * 43758.5453 % 1
+        close = 100 + 20 * np.sin(times.astype(np.int64) / 86400 / 30) + noise
+        bars["open"] = close - noise / 2
+        bars["close"] = close
+        bars["high"] = np.maximum(bars["open"], close) + 0.5
+        bars["low"] = np.minimum(bars["open"], close) - 0.5
+        bars["volume"] = np.round(1e6 * (1 + noise))
+        return bars
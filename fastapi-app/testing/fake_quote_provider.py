@@ -0,0 +1,43 @@
+from typing import Union
+import threading
+import time
+
+import numpy as np
+
+from utils.quote_cache import QuoteProvider
+
+class FakeQuoteProvider(QuoteProvider):
+    """
+    Local stand-in for yfinance. Quotes random-walk around a base price per symbol,
+    and every call is counted so coalescing and caching can be checked.
+
+    Args:
+        prices (dict[str, float], optional): Base price per symbol. Unknown symbols start at 100.
+        latency (float): Seconds to sleep per fetch, simulating the network round trip.
+        spread (float): Absolute bid/ask spread.
+        seed (int): Seed of the random walk.
+    """
+    def __init__(self, prices: dict[str, float] = None, latency: float = 0.0, spread: float = 0.02, seed: int = 0):
+        self.prices = dict(prices or {})
+        self.latency = latency
+        self.spread = spread
+        self.calls = 0
+        self._random = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def get_info(self, symbol: str) -> Union[dict, None]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            price = self.prices.get(symbol, 100.0) * (1 + self._random.normal(0, 0.001))
+            self.prices[symbol] = price
+        return {
+            "symbol": symbol,
+            "longName": f"{symbol} Fake Inc.",
+            "sector": "Technology",
+            "bid": round(price - self.spread / 2, 2),
+            "ask": round(price + self.spread / 2, 2),
+            "currentPrice": round(price, 2),
+            "regularMarketPrice": round(price, 2),
+        }
@@ -0,0 +1,102 @@
+"""
+Shared setup of the checks, benchmarks and load test of this folder.
+
+The app reads its environment variables, and opens its databases and bar files in the working directory, when its
+modules are imported. So a script imports this module first, calls `setup` and only then imports the app:
+
+    import harness
+    arguments = harness.setup(parser, scratch_prefix="lot_index_benchmark_", start_balance=100000000)
+
+    from utils.stock_handler import StockHandler
+
+Run the scripts from the fastapi-app folder, e.g. `python testing/benchmark_lot_index.py --help`.
+"""
+from typing import Iterable, Optional
+import argparse
+import base64
+import logging
+import os
+import sys
+import tempfile
+
+TESTING_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FASTAPI_APP_FOLDER = os.path.dirname(TESTING_FOLDER)
+for folder in (TESTING_FOLDER, FASTAPI_APP_FOLDER):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+def setup(parser: argparse.ArgumentParser, scratch_prefix: Optional[str] = None, start_balance: int = 100000) -> argparse.Namespace:
+    """
+    Parses the arguments of a script and prepares the environment of the app for it.
+
+    Args:
+        parser (ArgumentParser): The arguments of the script.
+        scratch_prefix (str, optional): Prefix of a throwaway working directory to move to (see `use_scratch_folder`).
+        start_balance (int): Balance of new users, unless START_BALANCE is set.
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    arguments = parser.parse_args()
+    # A throwaway key, unless one is set like for the Flask app
+    os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
+    os.environ.setdefault("START_BALANCE", str(start_balance))
+    if scratch_prefix is not None:
+        use_scratch_folder(scratch_prefix)
+    return arguments
+
+def use_scratch_folder(prefix: str) -> str:
+    """ Moves to a new temporary working directory, so the databases and bar files are kept out of the real ones. """
+    folder = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(folder)
+    return folder
+
+def initialise_databases(log_level: int = logging.WARNING) -> None:
+    """ Creates the databases in the working directory. The app's logs are quieted, they would be most of what is timed. """
+    from data.database import initialise_all_databases
+    from utils.logger_script import logger
+
+    logger.setLevel(log_level)
+    initialise_all_databases()
+
+def use_fake_quotes(**kwargs):
+    """
+    Serves the quote cache from a `FakeQuoteProvider` (created with `kwargs`) instead of yfinance.
+
+    Returns:
+        FakeQuoteProvider: The provider, to check its calls.
+    """
+    from utils.quote_cache import set_quote_provider
+    from fake_quote_provider import FakeQuoteProvider
+
+    provider = FakeQuoteProvider(**kwargs)
+    set_quote_provider(provider)
+    return provider
+
+def create_user(name: str, tables: Iterable[str] = ()) -> str:
+    """
+    Adds a user (with the start balance and the password "password") to the userbase.
+
+    Args:
+        name (str): The username, and the name of the user's email.
+        tables (Iterable[str]): Names of the databases to create the user's table in, like their first order does.
+
+    Returns:
+        str: The user's uuid.
+    """
+    from data.database import DatabasesNames
+    from data.utils.get_databases import get_db
+    from data.userbase.helper import create_user_model
+    from data.dynamic_databases.models import generate_table_by_id_for_selected_database
+
+    session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        user_model = create_user_model(f"{name}@example.com", name, "password")
+        session.add(user_model)
+        session.commit()
+        uuid = user_model.uuid
+    finally:
+        session.close()
+    for database_name in tables:
+        generate_table_by_id_for_selected_database(uuid=uuid, database_name=database_name)
+    return uuid
@@ -0,0 +1,249 @@
+"""
+Load test of the trading API.
+
+Starts the FastAPI app in a child process, on a throwaway set of databases and the fake quote provider, then
+drives every endpoint phase after phase at a fixed concurrency (like the Flask app, with the parameters in an encrypted envelope
+and the access tokens of the signed in users over kept-alive connections): sign_up, sign_in, market buys, market sells, get_user/summary and
+get_user/database. For every endpoint it reports the throughput, the p50/p95/p99 latencies, the failures and
+the SQL statements executed per request (counted inside the server), and writes everything as JSON so runs
+can be compared across commits. Run it from the fastapi-app folder:
+    python testing/load_test.py [--storage-mode per_user|ledger] [--users 50]
+                                [--requests 1000] [--concurrency 32] [--quote-latency 0] [--output results.json]
+                                [--compare earlier_results.json]
+"""
+import argparse
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+import numpy as np
+import requests
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import harness
+from harness import FASTAPI_APP_FOLDER
+
+parser = argparse.ArgumentParser(description="Load test the trading API")
+parser.add_argument("--storage-mode", choices=("per_user", "ledger"), default="per_user", help="STORAGE_MODE of the server")
+parser.add_argument("--users", type=int, default=50, help="Users signed up (and requests of the sign_up phase)")
+parser.add_argument("--requests", type=int, default=1000, help="Requests of every other phase")
+parser.add_argument("--concurrency", type=int, default=32)
+parser.add_argument("--quote-latency", type=float, default=0.0, help="Seconds per fetch of the fake quote provider")
+parser.add_argument("--symbols", type=int, default=20)
+parser.add_argument("--port", type=int, default=5902)
+parser.add_argument("--output", default=None, help="Path of the JSON results (default: load_test_<storage mode>_<time>.json)")
+parser.add_argument("--compare", default=None, help="Path of the JSON results of an earlier run to compare with")
+# Internal: run as the server process, in the given folder
+parser.add_argument("--serve", default=None, help=argparse.SUPPRESS)
+# The server inherits the environment of the client, so they share the encryption key
+arguments = harness.setup(parser, start_balance=1000000)
+
+SYMBOLS = [f"LOAD{index}" for index in range(arguments.symbols)]
+
+def serve(folder: str) -> None:
+    """ Runs the app in the load test's folder, with an extra route that reports (and resets) the query counts. """
+    os.chdir(folder)
+    import uvicorn
+    from fastapi import FastAPI
+
+    from routes import fastapi_router
+    from data.utils.query_counter import count_queries
+
+    # Logging every request would be most of what is measured
+    harness.initialise_databases()
+    harness.use_fake_quotes(prices={symbol: 50.0 + index for index, symbol in enumerate(SYMBOLS)}, latency=arguments.quote_latency)
+
+    app = FastAPI()
+    app.include_router(fastapi_router)
+
+    with count_queries(thread_only=False) as counter:
+        @app.post("/load_test/queries")
+        def load_test_queries():
+            """ The statements executed since the last call, per database. """
+            queries = {"total": counter.total, "per_database": {os.path.basename(name): count for name, count in counter.per_database.items()}}
+            counter.reset()
+            return queries
+
+        uvicorn.run(app, host="127.0.0.1", port=arguments.port, log_level="warning")
+
+ENVELOPE_CONTENT_TYPE = "application/vnd.papertrading.envelope"
+
+def seal(payload: dict, cipher: AESGCM, method: str, endpoint: str) -> bytes:
+    """ Seals the parameters of a request the way the Flask app does (see flask-app/comms/encryption.py). """
+    nonce = os.urandom(12)
+    return b"\x01" + nonce + cipher.encrypt(nonce, msgpack.packb(payload, use_bin_type=True), f"{method.upper()} /{endpoint}".encode())
+
+class LoadTestClient:
+    """ Sends the requests of a phase from a thread pool, one kept-alive session per thread. """
+    def __init__(self, base_url: str, key: bytes):
+        self.base_url = base_url
+        self.cipher = AESGCM(hmac.new(key, b"request envelope", hashlib.sha256).digest())
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, method: str, endpoint: str, params: dict) -> tuple[float, dict]:
+        # A "token" is sent as the bearer access token, like the Flask app does, the other params in an envelope
+        token = params.get("token")
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        payload = {name: value for name, value in params.items() if name != "token"}
+        body = None
+        start = time.perf_counter()
+        if payload:
+            headers["Content-Type"] = ENVELOPE_CONTENT_TYPE
+            body = seal(payload, self.cipher, method, endpoint)
+        response = self.session.request(method, f"{self.base_url}/{endpoint}", data=body, headers=headers, timeout=120)
+        elapsed = time.perf_counter() - start
+        try:
+            body = response.json() if response.status_code == 200 else None
+        except ValueError:
+            body = None
+        return elapsed, body
+
+    def queries(self) -> dict:
+        return requests.post(f"{self.base_url}/load_test/queries", timeout=10).json()
+
+def run_phase(client: LoadTestClient, name: str, method: str, endpoint: str, requests_params: list[dict]) -> dict:
+    """ Sends one request per params at the configured concurrency, returns the phase's statistics. """
+    client.queries()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+        results = list(executor.map(lambda params: client.send(method, endpoint, params), requests_params))
+    elapsed = time.perf_counter() - start
+    queries = client.queries()
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    failures = sum(1 for _, body in results if body is None or not body.get("success"))
+    statistics = {
+        "endpoint": endpoint,
+        "requests": len(results),
+        "failures": failures,
+        "seconds": elapsed,
+        "throughput": len(results) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "queries_per_request": queries["total"] / len(results),
+        "queries_per_database": {database: count / len(results) for database, count in queries["per_database"].items()},
+    }
+    print(f"{name:<20} {statistics['throughput']:8.1f} req/s   p50 {statistics['p50_ms']:8.1f}   p95 {statistics['p95_ms']:8.1f}   "
+          f"p99 {statistics['p99_ms']:8.1f} ms   {failures:>4} failed   {statistics['queries_per_request']:6.2f} queries/request")
+    return statistics
+
+def compare(results: dict, path: str) -> None:
+    """ Prints the change of every endpoint's throughput, p99 and queries against an earlier run. """
+    with open(path) as file:
+        earlier = json.load(file)
+    print(f"Compared with {earlier['commit'] or path} ({earlier['configuration']['storage_mode']}):")
+    for name, statistics in results["endpoints"].items():
+        earlier_statistics = earlier["endpoints"].get(name)
+        if earlier_statistics is None:
+            continue
+        print(f"{name:<20} throughput {statistics['throughput'] / earlier_statistics['throughput'] - 1:+7.1%}   "
+              f"p99 {statistics['p99_ms'] / earlier_statistics['p99_ms'] - 1:+7.1%}   "
+              f"queries/request {earlier_statistics['queries_per_request']:.2f} -> {statistics['queries_per_request']:.2f}")
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=FASTAPI_APP_FOLDER, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def start_server(folder: str, environment: dict) -> subprocess.Popen:
+    # The server's logs would drown the results, they are kept next to its databases
+    log_file = open(os.path.join(folder, "server.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--serve", folder],
+        env=environment, cwd=FASTAPI_APP_FOLDER, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode}, see {log_file.name}")
+        try:
+            requests.post(f"http://127.0.0.1:{arguments.port}/load_test/queries", timeout=1)
+            return server
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start in time")
+
+def main() -> None:
+    environment = dict(os.environ, STORAGE_MODE=arguments.storage_mode)
+    key = base64.b64decode(environment["ENCRYPTION_KEY"])
+
+    folder = tempfile.mkdtemp(prefix="load_test_")
+    server = start_server(folder, environment)
+    client = LoadTestClient(f"http://127.0.0.1:{arguments.port}", key)
+    random = np.random.default_rng(0)
+    try:
+        print(f"STORAGE_MODE={arguments.storage_mode}, {arguments.users} users, "
+              f"{arguments.requests} requests per phase at concurrency {arguments.concurrency}")
+        users = [(f"load{index}@example.com", f"load{index}", f"password{index}") for index in range(arguments.users)]
+        phases = {}
+        phases["sign_up"] = run_phase(client, "sign_up", "post", "sign_up", [
+            {"email": email, "username": username, "password": password} for email, username, password in users
+        ])
+
+        sign_ins = [users[index % len(users)] for index in range(arguments.requests)]
+        phases["sign_in"] = run_phase(client, "sign_in", "post", "sign_in", [
+            {"username": username, "password": password} for _, username, password in sign_ins
+        ])
+        tokens = [client.send("post", "sign_in", {"username": username, "password": password})[1]["data"]["token"] for _, username, password in users]
+
+        def orders(side: str, shares: float) -> list[dict]:
+            return [
+                {"token": tokens[index % len(tokens)],
+                 "order": {"symbol": SYMBOLS[random.integers(len(SYMBOLS))], "side": side, "order_type": "market", "shares": shares}}
+                for index in range(arguments.requests)
+            ]
+        # Every user buys more of every symbol than it sells, so the sells are filled
+        for token in tokens:
+            for symbol in SYMBOLS:
+                client.send("post", "submit_order", {"token": token, "order": {"symbol": symbol, "side": "buy", "order_type": "market", "shares": 10}})
+        phases["submit_order_buy"] = run_phase(client, "submit_order (buy)", "post", "submit_order", orders("buy", 1.0))
+        phases["submit_order_sell"] = run_phase(client, "submit_order (sell)", "post", "submit_order", orders("sell", 0.5))
+
+        reads = [{"token": tokens[index % len(tokens)]} for index in range(arguments.requests)]
+        phases["get_user_summary"] = run_phase(client, "get_user/summary", "get", "get_user/summary", reads)
+        phases["get_user_database"] = run_phase(client, "get_user/database", "get", "get_user/database/portfolios", reads)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {
+        "commit": get_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "configuration": {name: value for name, value in vars(arguments).items() if name not in ("serve", "output", "compare", "port")},
+        "endpoints": phases,
+    }
+    output = arguments.output or f"load_test_{arguments.storage_mode}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results written to {os.path.abspath(output)}")
+    if arguments.compare is not None:
+        compare(results, arguments.compare)
+
+if __name__ == "__main__":
+    if arguments.serve is not None:
+        serve(arguments.serve)
+    else:
+        main()
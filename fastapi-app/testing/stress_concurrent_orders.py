@@ -0,0 +1,111 @@
+"""
+Stress test of concurrent order execution.
+
+Fires thousands of concurrent market orders (many at once per user) from a thread pool at a throwaway set of
+databases, then reconciles every user's ledger exactly: the balance has to equal the start balance minus the
+buys plus the sells in the transaction history, the lots in the portfolio have to add up to the shares bought
+minus the shares sold, and no balance may go negative. Run it from the fastapi-app folder:
+    python testing/stress_concurrent_orders.py [--users 20] [--orders 5000] [--threads 64]
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import harness
+
+parser = argparse.ArgumentParser(description="Stress test concurrent orders")
+parser.add_argument("--users", type=int, default=20)
+parser.add_argument("--orders", type=int, default=5000)
+parser.add_argument("--threads", type=int, default=64)
+arguments = harness.setup(parser, scratch_prefix="order_stress_", start_balance=10000)
+
+from sqlalchemy import select
+
+from data.database import DatabasesNames
+from data.userbase.helper import get_user_from_userbase
+from data.utils.get_databases import get_user_table, user_rows_filter, get_database_variables_by_name
+from records.records import StockRecord, UserIdentifiers
+from utils.env_variables import START_BALANCE
+from utils.stock_handler import StockHandler
+
+SYMBOLS = ("AAPL", "MSFT", "NVDA")
+# Tolerance of the float sums of the reconciliation
+TOLERANCE = 1e-6
+
+def place_order(order: tuple[str, str, str, float]) -> str:
+    uuid, symbol, side, shares = order
+    stock_record = StockRecord(symbol=symbol, side=side, order_type="market", shares=np.double(shares), cost_per_share=np.double(0), notes=None)
+    if side == "buy":
+        # Buys are placed at the price the client saw, sells are filled at the current bid by the handler
+        stock_record.cost_per_share = np.double(100 + len(symbol))
+        stock_record.update_total_cost()
+    handler = StockHandler()
+    handler.deal_with_transaction(stock_record, uuid)
+    return handler.status
+
+def reconcile(uuid: str) -> list[str]:
+    """ Returns the problems found in a user's ledger. """
+    problems = []
+    balance = get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid).balance
+
+    totals = defaultdict(float)
+    shares = defaultdict(float)
+    for database_name in (DatabasesNames.transactions.value, DatabasesNames.portfolios.value):
+        _, _, engine = get_database_variables_by_name(database_name)
+        table = get_user_table(database_name, uuid)
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(table.c.symbol, table.c.side, table.c.shares, table.c.total_cost).where(user_rows_filter(table, uuid))
+            ).fetchall()
+        for symbol, side, row_shares, total_cost in rows:
+            if database_name == DatabasesNames.transactions.value:
+                totals[side] += total_cost
+                shares[symbol] += row_shares if side == "buy" else -row_shares
+            else:
+                shares[symbol] -= row_shares
+
+    expected_balance = float(START_BALANCE) - totals["buy"] + totals["sell"]
+    if abs(balance - expected_balance) > TOLERANCE:
+        problems.append(f"balance {balance} != {expected_balance}")
+    if balance < -TOLERANCE:
+        problems.append(f"negative balance {balance}")
+    for symbol, difference in shares.items():
+        if abs(difference) > TOLERANCE:
+            problems.append(f"{symbol} lots are off by {difference} shares")
+    return problems
+
+if __name__ == "__main__":
+    harness.initialise_databases()
+    harness.use_fake_quotes(prices={symbol: 100 + len(symbol) for symbol in SYMBOLS})
+    tables = (DatabasesNames.transactions.value, DatabasesNames.portfolios.value)
+    uuids = [harness.create_user(f"stress{index}", tables=tables) for index in range(arguments.users)]
+
+    # Buys are sized so a user runs out of money half way, which makes the funds check race if it is not serialized
+    random = np.random.default_rng(0)
+    orders = [
+        (uuids[random.integers(len(uuids))], SYMBOLS[random.integers(len(SYMBOLS))],
+         "buy" if random.random() < 0.7 else "sell", float(random.integers(1, 10)))
+        for _ in range(arguments.orders)
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.threads) as executor:
+        statuses = list(executor.map(place_order, orders))
+    elapsed = time.perf_counter() - start
+
+    outcomes = defaultdict(int)
+    for status in statuses:
+        outcomes[status.split(" ")[0]] += 1
+    print(f"{len(orders)} orders of {len(uuids)} users on {arguments.threads} threads in {elapsed:.2f} s ({len(orders) / elapsed:.0f} orders/s)")
+    print(f"outcomes: {dict(outcomes)}")
+
+    failures = {uuid: problems for uuid in uuids if (problems := reconcile(uuid))}
+    if failures:
+        for uuid, problems in failures.items():
+            print(f"{uuid}: {'; '.join(problems)}")
+        sys.exit(1)
+    print(f"All {len(uuids)} ledgers reconcile")
@@ -1,2 +1,2 @@
-__all__ = ["logger_script", "env_variables", "encryption", "stock_handler", "yfinance_helper"]
+__all__ = ["logger_script", "env_variables", "encryption", "keyed_lock", "stock_handler", "order_matching", "quote_cache", "yfinance_helper"]
 from . import *
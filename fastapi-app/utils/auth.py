@@ -0,0 +1,215 @@
+from typing import Callable, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from data.database import DatabasesNames
+from data.utils.get_databases import get_db
+from data.userbase.encryption import encode_password, verify_password, password_needs_rehash
+from data.userbase.helper import get_user_credentials, set_password_hash
+from records.records import UserIdentifiers
+from utils.logger_script import logger
+from utils.env_variables import AUTH_WORKERS, AUTH_CACHE_MAX_USERS, AUTH_CACHE_TTL
+
+@dataclass
+class VerifiedCredential:
+    """
+    A password that was verified against a user's saved hash.
+
+    Attributes:
+        digest (bytes): Keyed SHA-256 of the password, so the password itself is not kept in memory.
+        password_hash (str): The saved hash it was verified against.
+        verified_at (float): When it was verified (monotonic seconds).
+    """
+    digest: bytes
+    password_hash: str
+    verified_at: float
+
+class AuthService:
+    """
+    Verifies passwords on a bounded thread pool and caches the verified credentials by uuid.
+
+    Hashing a password with scrypt takes tens of milliseconds of CPU and megabytes of memory on purpose,
+    so it runs on `workers` threads only: a burst of sign ins queues there instead of taking every request
+    worker. A password verified for a user is then confirmed by a keyed digest for `ttl` seconds, so the
+    account routes (update, delete) that send it again do not query the userbase or hash it again.
+    A digest that does not match falls back to a full verification, so wrong passwords cost the same as before.
+    Concurrent verifications of the same password against the same hash (e.g. a client retrying its sign in)
+    share one hash on the pool. The entry of a user must be invalidated when their password changes or they are deleted.
+
+    Args:
+        workers (int): Threads passwords are hashed on.
+        max_users (int): The number of cached credentials (least recently used first out).
+        ttl (float): Seconds after which a credential is verified again.
+    """
+    def __init__(self, workers: int, max_users: int, ttl: float):
+        self.workers = workers
+        self.max_users = max_users
+        self.ttl = ttl
+        self.stats = {"hashes": 0, "verifications": 0, "failures": 0, "cache_hits": 0, "rehashes": 0, "evictions": 0, "expirations": 0, "coalesced": 0}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self._credentials: OrderedDict[str, VerifiedCredential] = OrderedDict()
+        # Verifications on the pool, by uuid, password digest and hash
+        self._verifying: dict[tuple[str, bytes, str], Future] = {}
+        self._lock = threading.Lock()
+        # Random per process, the digests are useless outside of it
+        self._key = os.urandom(32)
+
+    def _digest(self, password: str) -> bytes:
+        return hmac.new(self._key, password.encode("utf-8"), hashlib.sha256).digest()
+
+    def _submit(self, function: Callable, *args) -> Future:
+        return self._pool.submit(function, *args)
+
+    def hash_password(self, password: str) -> str:
+        """ Hashes a password on the pool (blocking the caller until it is done). """
+        self.stats["hashes"] += 1
+        return self._submit(encode_password, password).result()
+
+    @staticmethod
+    def _verify(password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+        # Runs on the pool, a matching legacy (or outdated) hash is hashed again while the password is at hand
+        if not verify_password(password, password_hash):
+            return False, None
+        return True, encode_password(password) if password_needs_rehash(password_hash) else None
+
+    def _cached(self, uuid: str, password: str, password_hash: Optional[str] = None) -> bool:
+        """ Whether the password was verified for the user within the TTL (against `password_hash`, if given). """
+        digest = self._digest(password)
+        with self._lock:
+            credential = self._credentials.get(uuid)
+            if credential is None:
+                return False
+            if time.monotonic() - credential.verified_at > self.ttl:
+                del self._credentials[uuid]
+                self.stats["expirations"] += 1
+                return False
+            if password_hash is not None and credential.password_hash != password_hash:
+                # The saved hash changed (e.g. by another process), verify it again
+                return False
+            if not hmac.compare_digest(credential.digest, digest):
+                return False
+            self._credentials.move_to_end(uuid)
+            self.stats["cache_hits"] += 1
+            return True
+
+    def _remember(self, uuid: str, password: str, password_hash: str) -> None:
+        with self._lock:
+            self._credentials[uuid] = VerifiedCredential(self._digest(password), password_hash, time.monotonic())
+            self._credentials.move_to_end(uuid)
+            while len(self._credentials) > self.max_users:
+                self._credentials.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _record(self, uuid: str, password: str, password_hash: str, matches: bool, new_hash: Optional[str]) -> None:
+        self.stats["verifications"] += 1
+        if not matches:
+            self.stats["failures"] += 1
+            return
+        if new_hash is not None:
+            self.stats["rehashes"] += 1
+        self._remember(uuid, password, new_hash or password_hash)
+
+    def _verification(self, uuid: str, password: str, password_hash: str) -> tuple[Future, bool]:
+        """ The verification of the password on the pool, and whether it was started by this call (or joined). """
+        key = (uuid, self._digest(password), password_hash)
+        with self._lock:
+            future = self._verifying.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future, False
+            future = self._verifying[key] = self._submit(self._verify, password, password_hash)
+        future.add_done_callback(lambda _: self._forget_verification(key))
+        return future, True
+
+    def _forget_verification(self, key: tuple[str, bytes, str]) -> None:
+        with self._lock:
+            self._verifying.pop(key, None)
+
+    def verify(self, uuid: str, password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+        """
+        Verifies a password against a user's saved hash, from the cache or on the pool.
+
+        Returns:
+            tuple[bool, Optional[str]]: Whether it matches, and a new hash to save in place of a legacy or outdated one.
+        """
+        if self._cached(uuid, password, password_hash):
+            return True, None
+        future, started = self._verification(uuid, password, password_hash)
+        matches, new_hash = future.result()
+        if not started:
+            # Recorded (and any new hash saved) by the call that started it
+            return matches, None
+        self._record(uuid, password, password_hash, matches, new_hash)
+        return matches, new_hash
+
+    def sign_in(self, session: Session, encoded_username: str, password: str) -> tuple[Optional[dict], Optional[str]]:
+        """
+        Authenticates a user with a single query on the username.
+
+        Args:
+            session (Session): A session of the userbase.
+            encoded_username (str): The username, encoded.
+            password (str): The password.
+
+        Returns:
+            tuple[Optional[dict], Optional[str]]: The user's uuid and email (None if not authenticated),
+                                                  and the reason it was not ("user" or "password").
+        """
+        credentials = get_user_credentials(session, UserIdentifiers.username.value, encoded_username)
+        if credentials is None:
+            return None, UserIdentifiers.username.value
+        matches, new_hash = self.verify(credentials.uuid, password, credentials.password)
+        if not matches:
+            return None, UserIdentifiers.password.value
+        if new_hash is not None:
+            try:
+                set_password_hash(session, credentials.uuid, new_hash)
+            except Exception as error:
+                # The old hash still works, it is upgraded on the next sign in
+                logger.error(f"Failed upgrading the password hash of user {credentials.uuid}. Error: {error}")
+                session.rollback()
+                self.invalidate(credentials.uuid)
+        return {"uuid": credentials.uuid, "email": credentials.email}, None
+
+    def check_password(self, uuid: str, password: str) -> bool:
+        """ Whether the password is the user's, without touching the userbase if it was verified recently. """
+        if self._cached(uuid, password):
+            return True
+        session: Session = next(get_db(DatabasesNames.userbase.value))
+        try:
+            credentials = get_user_credentials(session, UserIdentifiers.uuid.value, uuid)
+            if credentials is None:
+                return False
+            matches, new_hash = self.verify(uuid, password, credentials.password)
+            if new_hash is not None:
+                set_password_hash(session, uuid, new_hash)
+            return matches
+        except Exception as error:
+            logger.error(f"Failed checking the password of user {uuid}. Error: {error}")
+            return False
+        finally:
+            session.close()
+
+    def invalidate(self, uuid: Optional[str] = None) -> None:
+        """ Forgets the verified credential of a user (or of every user if None). """
+        with self._lock:
+            if uuid is None:
+                self._credentials.clear()
+            else:
+                self._credentials.pop(uuid, None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            entries = len(self._credentials)
+        return {**self.stats, "entries": entries, "max_users": self.max_users, "ttl": self.ttl, "workers": self.workers,
+                "queued": self._pool._work_queue.qsize()}
+
+auth_service = AuthService(workers=int(AUTH_WORKERS), max_users=int(AUTH_CACHE_MAX_USERS), ttl=float(AUTH_CACHE_TTL))
@@ -0,0 +1,450 @@
+"""
+Offline backtests of trading strategies over the historical bars of the bar store.
+
+A backtest streams the bars of its symbols in time order, and feeds the orders of a strategy through the same fill
+and lot accounting as live orders: buys are reduced to what the balance affords (`fit_buy_to_balance`), sells
+consume lots in the order of the lot selection and realize their profit and loss (`fill_sell`), and resting limit,
+stop and stop-limit orders are triggered by the order matcher's `OrderBook`. The balance, open lots and transaction
+history are kept in a `BacktestLedger` instead of the userbase and the user's tables.
+
+Fills:
+    - Market orders placed on a bar fill at the open of the symbol's next bar (the ask for buys, the bid for sells),
+      so a strategy never trades at a price it has not seen yet. Orders still queued at the end are not filled.
+    - Resting orders are matched against the close of every bar of their symbol, as the order matcher matches them
+      against a quote, and rest until they are filled or cancelled.
+    - The bid and ask are the price minus and plus half the `spread` (a fraction of the price).
+
+Parameter sets run in parallel on a process pool with `run_backtests`. The bars are fetched into the store before
+the workers start, so the workers read them from its memory mapped files instead of each fetching them.
+Run a grid from the fastapi-app folder:
+    python -m utils.backtest moving_average_cross --symbols AAPL MSFT --grid fast=5,10,20 slow=50,100 [--workers 4]
+"""
+from typing import Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.order_matching import OrderBook, RestingOrder
+from utils.stock_handler import fit_buy_to_balance, fill_sell, SellFill
+from records.records import StockRecord, Statuses, OrderTypes
+from data.bars.store import bar_store
+from data.bars.providers import BarIntervals
+from data.dynamic_databases.lot_index import Lot, SymbolLots, LotSelection, get_lot_selection
+from data.utils.uuid import generate_uuid
+
+# Symbols of a backtest run from the API
+MAX_SYMBOLS = 50
+
+class BacktestLedger:
+    """
+    In-memory balance, open lots and transaction history of a backtest, in place of the userbase and a user's tables.
+
+    Args:
+        balance (float): The starting balance.
+    """
+    def __init__(self, balance: float):
+        self.balance = np.double(balance)
+        self.lots: dict[str, SymbolLots] = {}
+        # Open shares by symbol, kept along the lots so strategies and valuations do not sum them
+        self.shares: dict[str, np.double] = {}
+        self.transactions: list[StockRecord] = []
+        self.realized_pnl = 0.0
+        # Buys with open lots, archived once their lot is exhausted
+        self._open_buys: dict[str, StockRecord] = {}
+
+    def buy(self, stock_record: StockRecord) -> bool:
+        """ Buys the shares the balance affords (as `StockHandler.buy_shares`). Returns False if it affords none. """
+        if not fit_buy_to_balance(stock_record, self.balance):
+            return False
+        symbol = stock_record.symbol.upper()
+        self.balance -= stock_record.total_cost
+        stock_record.status = Statuses.tracked.value
+        self.transactions.append(stock_record)
+        self._open_buys[stock_record.uid] = stock_record
+
+        symbol_lots = self.lots.get(symbol)
+        if symbol_lots is None:
+            symbol_lots = self.lots[symbol] = SymbolLots()
+        symbol_lots.add(Lot(stock_record.uid, symbol, stock_record.timestamp, np.double(stock_record.shares), np.double(stock_record.cost_per_share)))
+        self.shares[symbol] = self.shares.get(symbol, np.double(0)) + stock_record.shares
+        return True
+
+    def sell(self, stock_record: StockRecord, price: float, selection: LotSelection, lot_uids: Optional[list[str]] = None) -> SellFill:
+        """ Sells from the open lots in the order of the selection (as `StockHandler.sell_shares`). """
+        symbol = stock_record.symbol.upper()
+        fill = fill_sell(self.lots, symbol, np.double(stock_record.shares), np.double(price), selection, lot_uids)
+        for lot, _ in fill.consumed:
+            if lot.shares <= 0:
+                self._open_buys.pop(lot.uid).status = Statuses.archived.value
+
+        stock_record.shares -= fill.unsold
+        stock_record.cost_per_share = np.double(price)
+        stock_record.update_total_cost()
+        stock_record.status = Statuses.archived.value
+        self.transactions.append(stock_record)
+        self.balance += fill.revenue
+        self.realized_pnl += fill.realized_pnl["total"]
+        if symbol in self.lots:
+            self.shares[symbol] -= stock_record.shares
+        else:
+            self.shares.pop(symbol, None)
+        return fill
+
+class Strategy:
+    """
+    Base of a strategy. `prepare` is called once per symbol with all of its bars, so indicators are computed
+    vectorized, then `on_bar` is called with every bar in time order and places orders through the backtest.
+
+    Args:
+        **parameters: The parameters of the strategy.
+    """
+    def __init__(self, **parameters):
+        self.parameters = parameters
+
+    def prepare(self, symbol: str, bars: np.ndarray) -> None:
+        pass
+
+    def on_bar(self, backtest: 'Backtest', symbol: str, index: int) -> None:
+        raise NotImplementedError
+
+def moving_average(values: np.ndarray, length: int) -> np.ndarray:
+    """ Mean of every `length` consecutive values (NaN before the first `length`), from cumulative sums. """
+    averages = np.full(len(values), np.nan)
+    if len(values) >= length:
+        sums = np.cumsum(np.concatenate(([0.0], values)))
+        averages[length - 1:] = (sums[length:] - sums[:-length]) / length
+    return averages
+
+class MovingAverageCross(Strategy):
+    """
+    Buys `fraction` of the equity when the fast moving average of the closes crosses above the slow one,
+    sells the whole position when it crosses below.
+    """
+    def __init__(self, fast: int = 10, slow: int = 50, fraction: float = 0.1):
+        super().__init__(fast=int(fast), slow=int(slow), fraction=float(fraction))
+        self.fast, self.slow, self.fraction = int(fast), int(slow), float(fraction)
+        self._above: dict[str, list] = {}
+
+    def prepare(self, symbol: str, bars: np.ndarray) -> None:
+        closes = np.asarray(bars["close"], dtype=np.double)
+        with np.errstate(invalid="ignore"):
+            above = moving_average(closes, self.fast) > moving_average(closes, self.slow)
+        self._above[symbol] = above.tolist()
+
+    def on_bar(self, backtest: 'Backtest', symbol: str, index: int) -> None:
+        if index < self.slow:
+            return
+        above, was_above = self._above[symbol][index], self._above[symbol][index - 1]
+        held = backtest.ledger.shares.get(symbol, 0)
+        if above and not was_above and held <= 0:
+            backtest.buy(symbol, self.fraction * backtest.equity() / backtest.last_close[symbol])
+        elif was_above and not above and held > 0:
+            backtest.sell(symbol, held)
+
+class MeanReversion(Strategy):
+    """
+    Rests a buy limit `band` below the moving average of the closes while flat, and a sell limit `band` above it
+    with a sell stop `stop_loss` below it while holding, replaced on every bar.
+    """
+    def __init__(self, length: int = 20, band: float = 0.02, stop_loss: float = 0.05, fraction: float = 0.1):
+        super().__init__(length=int(length), band=float(band), stop_loss=float(stop_loss), fraction=float(fraction))
+        self.length, self.band, self.stop_loss, self.fraction = int(length), float(band), float(stop_loss), float(fraction)
+        self._averages: dict[str, list] = {}
+
+    def prepare(self, symbol: str, bars: np.ndarray) -> None:
+        self._averages[symbol] = moving_average(np.asarray(bars["close"], dtype=np.double), self.length).tolist()
+
+    def on_bar(self, backtest: 'Backtest', symbol: str, index: int) -> None:
+        if index < self.length:
+            return
+        average = self._averages[symbol][index]
+        backtest.cancel_all(symbol)
+        held = backtest.ledger.shares.get(symbol, 0)
+        if held > 0:
+            backtest.place(symbol, "sell", OrderTypes.limit.value, held, limit_price=average * (1 + self.band))
+            backtest.place(symbol, "sell", OrderTypes.stop.value, held, stop_price=average * (1 - self.stop_loss))
+        else:
+            limit_price = average * (1 - self.band)
+            backtest.place(symbol, "buy", OrderTypes.limit.value, self.fraction * backtest.equity() / limit_price, limit_price=limit_price)
+
+STRATEGIES: dict[str, type[Strategy]] = {
+    "moving_average_cross": MovingAverageCross,
+    "mean_reversion": MeanReversion,
+}
+
+class Backtest:
+    """
+    A backtest of a strategy over the bars of symbols.
+
+    Args:
+        strategy (Strategy): The strategy.
+        bars (dict[str, np.ndarray]): The bars of every symbol (arrays of `BAR_DTYPE` sorted by time).
+        balance (float): The starting balance.
+        lot_selection (str, optional): The lot selection of sells. Defaults to the `LOT_SELECTION` environment variable.
+        spread (float): The bid/ask spread, as a fraction of the price.
+    """
+    def __init__(self, strategy: Strategy, bars: dict[str, np.ndarray], balance: float,
+                 lot_selection: Optional[str] = None, spread: float = 0.0):
+        self.strategy = strategy
+        self.bars = bars
+        self.starting_balance = float(balance)
+        self.ledger = BacktestLedger(balance)
+        self.selection = get_lot_selection(lot_selection)
+        if self.selection is None:
+            raise ValueError(f"Invalid lot selection {lot_selection}")
+        self.half_spread = spread / 2
+        self.book = OrderBook()
+        self.last_close: dict[str, float] = {}
+        self.stats = {"orders": 0, "fills": 0, "rejected": 0}
+        self._market_orders: dict[str, list[tuple[str, float, Optional[list[str]]]]] = {}
+        self._resting: dict[str, set[str]] = {}
+        self._time: Optional[datetime] = None
+
+    def buy(self, symbol: str, shares: float) -> None:
+        """ Buys at the open of the symbol's next bar. """
+        self.stats["orders"] += 1
+        self._market_orders.setdefault(symbol, []).append(("buy", shares, None))
+
+    def sell(self, symbol: str, shares: float, lot_uids: Optional[list[str]] = None) -> None:
+        """ Sells at the open of the symbol's next bar. """
+        self.stats["orders"] += 1
+        self._market_orders.setdefault(symbol, []).append(("sell", shares, lot_uids))
+
+    def place(self, symbol: str, side: str, order_type: str, shares: float,
+              limit_price: Optional[float] = None, stop_price: Optional[float] = None) -> str:
+        """ Rests a limit, stop or stop-limit order until it is filled or cancelled. Returns its UID. """
+        self.stats["orders"] += 1
+        uid = generate_uuid()
+        self.book.add(RestingOrder(uid=uid, uuid="backtest", symbol=symbol, side=side, order_type=order_type, shares=shares,
+                                   limit_price=limit_price, stop_price=stop_price, expires_at=None, triggered=False))
+        self._resting.setdefault(symbol, set()).add(uid)
+        return uid
+
+    def cancel(self, symbol: str, uid: str) -> None:
+        self.book.remove(uid)
+        self._resting.get(symbol, set()).discard(uid)
+
+    def cancel_all(self, symbol: str) -> None:
+        for uid in self._resting.pop(symbol, ()):
+            self.book.remove(uid)
+
+    def equity(self) -> float:
+        """ The balance and the open shares at their last close. """
+        return float(self.ledger.balance) + sum(float(shares) * self.last_close[symbol] for symbol, shares in self.ledger.shares.items())
+
+    def _fill(self, symbol: str, side: str, order_type: str, shares: float, price: float, lot_uids: Optional[list[str]] = None) -> None:
+        if shares <= 0:
+            self.stats["rejected"] += 1
+            return
+        stock_record = StockRecord(symbol=symbol, side=side, order_type=order_type, shares=np.double(shares),
+                                   cost_per_share=np.double(price), notes=None)
+        stock_record.timestamp = self._time
+        if side == "buy":
+            filled = self.ledger.buy(stock_record)
+        else:
+            filled = self.ledger.sell(stock_record, price, self.selection, lot_uids).consumed != []
+        self.stats["fills" if filled else "rejected"] += 1
+
+    def run(self) -> dict:
+        """
+        Runs the backtest.
+
+        Returns:
+            dict: The figures of the run: bars, orders, fills and rejected orders, final equity, return, realized P&L,
+                  max drawdown (of the equity at the end of every bar time) and throughput.
+        """
+        start = time.perf_counter()
+        symbols = [symbol for symbol, bars in self.bars.items() if len(bars)]
+        columns = {}
+        for symbol in symbols:
+            bars = self.bars[symbol]
+            self.strategy.prepare(symbol, bars)
+            columns[symbol] = (bars["time"].astype("datetime64[us]").astype(datetime).tolist(), bars["open"].tolist(), bars["close"].tolist())
+
+        # One stream of every symbol's bars in time order, symbols in their given order within the same time
+        times = np.concatenate([self.bars[symbol]["time"] for symbol in symbols]) if symbols else np.array([], dtype="datetime64[s]")
+        codes = np.repeat(np.arange(len(symbols)), [len(self.bars[symbol]) for symbol in symbols])
+        rows = np.concatenate([np.arange(len(self.bars[symbol])) for symbol in symbols]) if symbols else np.array([], dtype=np.intp)
+        order = np.lexsort((codes, times))
+        new_time = np.ones(len(order), dtype=bool)
+        new_time[1:] = times[order][1:] != times[order][:-1]
+
+        equities = []
+        for is_new_time, code, row in zip(new_time.tolist(), codes[order].tolist(), rows[order].tolist()):
+            if is_new_time and self.last_close:
+                equities.append(self.equity())
+            symbol = symbols[code]
+            bar_times, opens, closes = columns[symbol]
+            self._time = bar_times[row]
+
+            queued = self._market_orders.pop(symbol, None)
+            if queued:
+                for side, shares, lot_uids in queued:
+                    price = opens[row] * (1 + self.half_spread if side == "buy" else 1 - self.half_spread)
+                    self._fill(symbol, side, OrderTypes.market.value, shares, price, lot_uids)
+
+            close = closes[row]
+            if self._resting.get(symbol):
+                fills, _ = self.book.match(symbol, close * (1 - self.half_spread), close * (1 + self.half_spread))
+                for resting_order, price in fills:
+                    self._resting[symbol].discard(resting_order.uid)
+                    self._fill(symbol, resting_order.side, resting_order.order_type, resting_order.shares, price)
+
+            self.last_close[symbol] = close
+            self.strategy.on_bar(self, symbol, row)
+        if self.last_close:
+            equities.append(self.equity())
+
+        elapsed = time.perf_counter() - start
+        equities = np.array(equities) if equities else np.array([self.starting_balance])
+        final_equity = float(equities[-1])
+        return {
+            "bars": len(order),
+            **self.stats,
+            "transactions": len(self.ledger.transactions),
+            "starting_balance": self.starting_balance,
+            "final_equity": final_equity,
+            "return": final_equity / self.starting_balance - 1,
+            "realized_pnl": self.ledger.realized_pnl,
+            "max_drawdown": float((equities / np.maximum.accumulate(equities) - 1).min()),
+            "elapsed_s": elapsed,
+            "orders_per_second": self.stats["orders"] / elapsed if elapsed else None,
+            "bars_per_second": len(order) / elapsed if elapsed else None,
+        }
+
+def resolve_run(run: dict) -> dict:
+    """ Fills the defaults of a run: daily bars of the last 5 years, a balance of 100,000 and no spread. """
+    end = np.datetime64(run.get("end") or datetime.now(), "s")
+    start = np.datetime64(run["start"], "s") if run.get("start") else end - np.timedelta64(5 * 365, "D")
+    return {
+        "interval": BarIntervals.day.value,
+        "balance": 100_000.0,
+        "lot_selection": None,
+        "spread": 0.0,
+        "parameters": {},
+        **{name: value for name, value in run.items() if value is not None},
+        "symbols": [symbol.upper() for symbol in run["symbols"]],
+        # Resolved once, so every worker reads the same stored range
+        "start": str(start),
+        "end": str(end),
+    }
+
+def run_backtest(run: dict) -> dict:
+    """
+    Runs one backtest.
+
+    Args:
+        run (dict): "strategy" (a key of `STRATEGIES`), its "parameters", "symbols", and optionally "interval",
+                    "start", "end", "balance", "lot_selection" and "spread" (see `resolve_run` for the defaults).
+
+    Returns:
+        dict: The run's figures (see `Backtest.run`) with its strategy and parameters,
+              or its strategy, parameters and "error" if it could not run.
+    """
+    result = {"strategy": run.get("strategy"), "parameters": run.get("parameters", {})}
+    try:
+        strategy_class = STRATEGIES.get(run.get("strategy"))
+        if strategy_class is None:
+            raise ValueError(f"Unknown strategy {run.get('strategy')}")
+        run = resolve_run(run)
+        bars = {}
+        for symbol in run["symbols"]:
+            symbol_bars = bar_store.get_bars(symbol, run["interval"], run["start"], run["end"])
+            if symbol_bars is None:
+                raise ValueError(f"No {run['interval']} bars of {symbol}")
+            bars[symbol] = symbol_bars
+        backtest = Backtest(strategy_class(**run["parameters"]), bars, run["balance"], run["lot_selection"], run["spread"])
+        return {**result, **backtest.run()}
+    except Exception as error:
+        logger.error(f"Backtest of {run.get('strategy')} with {run.get('parameters')} failed. Error: {error}")
+        return {**result, "error": str(error)}
+
+def parameter_grid(grid: dict[str, list]) -> list[dict]:
+    """ Every combination of the values of the parameters. """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def run_backtests(runs: list[dict], workers: Optional[int] = None) -> dict:
+    """
+    Runs backtests in parallel on a process pool.
+
+    Args:
+        runs (list[dict]): The runs, as taken by `run_backtest`.
+        workers (int, optional): The number of processes, 1 runs them in this process. Defaults to the number of CPUs.
+
+    Returns:
+        dict: The figures of every run under "results", and the total orders, fills, wall time and throughput.
+    """
+    start = time.perf_counter()
+    runs = [resolve_run(run) for run in runs]
+    # Fetch the bars into the store once, so the workers only read the stored files
+    for symbol, interval, bars_start, bars_end in {(symbol, run["interval"], run["start"], run["end"]) for run in runs for symbol in run["symbols"]}:
+        bar_store.get_bars(symbol, interval, bars_start, bars_end)
+    fetched = time.perf_counter()
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(runs) == 1:
+        results = [run_backtest(run) for run in runs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_backtest, runs, chunksize=max(len(runs) // (workers * 4), 1)))
+    elapsed = time.perf_counter() - fetched
+
+    orders = sum(result.get("orders", 0) for result in results)
+    fills = sum(result.get("fills", 0) for result in results)
+    return {
+        "results": results,
+        "runs": len(runs),
+        "failed": sum("error" in result for result in results),
+        "workers": workers,
+        "orders": orders,
+        "fills": fills,
+        "bars": sum(result.get("bars", 0) for result in results),
+        "fetch_s": fetched - start,
+        "elapsed_s": elapsed,
+        "orders_per_second": orders / elapsed if elapsed else None,
+        "fills_per_second": fills / elapsed if elapsed else None,
+    }
+
+def _parse_value(value: str) -> Union[int, float, str]:
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Backtest a strategy over a grid of parameters")
+    arguments.add_argument("strategy", choices=list(STRATEGIES))
+    arguments.add_argument("--symbols", nargs="+", required=True)
+    arguments.add_argument("--grid", nargs="*", default=[], help="Values of a parameter, e.g. fast=5,10,20")
+    arguments.add_argument("--interval", default=BarIntervals.day.value)
+    arguments.add_argument("--start", default=None)
+    arguments.add_argument("--end", default=None)
+    arguments.add_argument("--balance", type=float, default=100_000.0)
+    arguments.add_argument("--lot-selection", default=None)
+    arguments.add_argument("--spread", type=float, default=0.0)
+    arguments.add_argument("--workers", type=int, default=None)
+    arguments.add_argument("--output", default="backtests.json")
+    arguments = arguments.parse_args()
+
+    grid = {name: [_parse_value(value) for value in values.split(",")] for name, values in (item.split("=", 1) for item in arguments.grid)}
+    runs = [
+        {"strategy": arguments.strategy, "parameters": parameters, "symbols": arguments.symbols, "interval": arguments.interval,
+         "start": arguments.start, "end": arguments.end, "balance": arguments.balance, "lot_selection": arguments.lot_selection,
+         "spread": arguments.spread}
+        for parameters in parameter_grid(grid)
+    ]
+    summary = run_backtests(runs, arguments.workers)
+    with open(arguments.output, "w") as file:
+        json.dump(summary, file, indent=2, default=str)
+    logger.info(f"Ran {summary['runs']} backtests ({summary['failed']} failed) on {summary['workers']} processes in {summary['elapsed_s']:.1f} seconds, "
+                f"{summary['orders_per_second']:.0f} simulated orders/s, into {arguments.output}")
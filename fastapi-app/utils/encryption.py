@@ -1,8 +1,14 @@
 from typing import Union
 from base64 import b64decode
+from functools import lru_cache
+import hashlib
+import hmac
 import json
 
+import msgpack
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 from utils.env_variables import ENCRYPTION_KEY
 
@@ -37,4 +43,44 @@ def decrypt(stored_encrypted_data: str) -> Union[dict, str]:
     decrypted_data_decoded = decrypted_data2.decode("utf-8")
     if decrypted_data_decoded.startswith("{"):
         decrypted_data_decoded = json.loads(decrypted_data_decoded)
-    return decrypted_data_decoded
\ No newline at end of file
+    return decrypted_data_decoded
+
+# Request bodies sealed as a single envelope: version byte, 12 byte nonce, AES-256-GCM of the msgpack payload
+ENVELOPE_CONTENT_TYPE = "application/vnd.papertrading.envelope"
+ENVELOPE_VERSION = 1
+ENVELOPE_NONCE_BYTES = 12
+
+@lru_cache(maxsize=1)
+def get_envelope_cipher() -> AESGCM:
+    """ The envelopes' cipher, created once. Its key is derived from the shared key, apart from the per field one. """
+    return AESGCM(hmac.new(b64decode(ENCRYPTION_KEY), b"request envelope", hashlib.sha256).digest())
+
+def envelope_associated_data(method: str, path: str) -> bytes:
+    """ Authenticated with the payload, so an envelope cannot be replayed to another route. """
+    return f"{method.upper()} /{path.lstrip('/')}".encode("utf-8")
+
+def open_envelope(envelope: bytes, method: str, path: str) -> dict:
+    """
+    Decrypt and decode the envelope of a request, sealed by the Flask app (see flask-app/comms/encryption.py).
+
+    Args:
+        envelope (bytes): The request's body.
+        method (str): The request's HTTP method.
+        path (str): The request's path.
+
+    Returns:
+        dict: The payload, with its types (e.g. numbers, lists) as they were sent.
+
+    Raises:
+        ValueError: If the envelope is malformed, or was not sealed with the key for this method and path.
+    """
+    if len(envelope) <= 1 + ENVELOPE_NONCE_BYTES or envelope[0] != ENVELOPE_VERSION:
+        raise ValueError("Malformed envelope")
+    nonce, ciphertext = envelope[1:1 + ENVELOPE_NONCE_BYTES], envelope[1 + ENVELOPE_NONCE_BYTES:]
+    try:
+        payload = msgpack.unpackb(get_envelope_cipher().decrypt(nonce, ciphertext, envelope_associated_data(method, path)), raw=False)
+    except InvalidTag:
+        raise ValueError("The envelope is not authentic")
+    if not isinstance(payload, dict):
+        raise ValueError("The payload of an envelope must be a map")
+    return payload
@@ -11,5 +11,63 @@ START_BALANCE = getenv("START_BALANCE")
 
 ENCRYPTION_KEY = getenv("ENCRYPTION_KEY")
 
+# "per_user" (a table per user) or "ledger" (one shared table per database)
+STORAGE_MODE = getenv("STORAGE_MODE", "per_user")
+
+# SQLite storage profile, applied to every connection of the databases
+# The rollback journal keeps an order's commit to the three attached databases atomic as a set, "wal" does not
+SQLITE_JOURNAL_MODE = getenv("SQLITE_JOURNAL_MODE", "delete")
+SQLITE_SYNCHRONOUS = getenv("SQLITE_SYNCHRONOUS", "full")
+# Bytes, and pages (or KiB if negative)
+SQLITE_MMAP_SIZE = getenv("SQLITE_MMAP_SIZE", "268435456")
+SQLITE_CACHE_SIZE = getenv("SQLITE_CACHE_SIZE", "-65536")
+# Milliseconds a connection waits for a lock before failing
+SQLITE_BUSY_TIMEOUT = getenv("SQLITE_BUSY_TIMEOUT", "10000")
+# Seconds between checkpoints of the write-ahead logs
+SQLITE_CHECKPOINT_INTERVAL = getenv("SQLITE_CHECKPOINT_INTERVAL", "30")
+
+# Quote cache (seconds for TTLs)
+QUOTE_CACHE_MAX_SYMBOLS = getenv("QUOTE_CACHE_MAX_SYMBOLS", "2048")
+QUOTE_TTL_VOLATILE = getenv("QUOTE_TTL_VOLATILE", "2")
+QUOTE_TTL_STATIC = getenv("QUOTE_TTL_STATIC", "3600")
+QUOTE_BATCH_WORKERS = getenv("QUOTE_BATCH_WORKERS", "8")
+
+# Users whose open lots are kept in memory for sells
+LOT_INDEX_MAX_USERS = getenv("LOT_INDEX_MAX_USERS", "1024")
+# Default order in which sells consume lots: "fifo", "lifo", "lowest_cost" or "highest_cost"
+LOT_SELECTION = getenv("LOT_SELECTION", "lowest_cost")
+# Users whose data version (published to the Flask app to cache pages) is kept in memory
+DATA_VERSIONS_MAX_USERS = getenv("DATA_VERSIONS_MAX_USERS", "65536")
+
+# Seconds the P&L endpoint waits for prices, symbols without one are reported without a market value
+PNL_QUOTE_BUDGET = getenv("PNL_QUOTE_BUDGET", "2")
+
+# Folder of the historical bar files, and seconds after which the newest bars are fetched again
+BAR_STORE_PATH = getenv("BAR_STORE_PATH", "./bars")
+BAR_STORE_REFRESH = getenv("BAR_STORE_REFRESH", "60")
+
+# Symbol betas are measured against, and the risk return matrices cache's size and TTL (in seconds)
+RISK_BENCHMARK = getenv("RISK_BENCHMARK", "SPY")
+RISK_CACHE_MAX_ENTRIES = getenv("RISK_CACHE_MAX_ENTRIES", "256")
+RISK_CACHE_TTL = getenv("RISK_CACHE_TTL", "300")
+
+# Seconds between matching cycles of resting (limit, stop and stop-limit) orders
+ORDER_MATCH_INTERVAL = getenv("ORDER_MATCH_INTERVAL", "1")
+
+# scrypt cost, block size and parallelism of password hashes (n is a power of 2, memory is 128 * n * r bytes)
+PASSWORD_SCRYPT_N = getenv("PASSWORD_SCRYPT_N", "16384")
+PASSWORD_SCRYPT_R = getenv("PASSWORD_SCRYPT_R", "8")
+PASSWORD_SCRYPT_P = getenv("PASSWORD_SCRYPT_P", "1")
+# Threads password hashes are computed on, and the verified credential cache's size and TTL (in seconds)
+AUTH_WORKERS = getenv("AUTH_WORKERS", "2")
+AUTH_CACHE_MAX_USERS = getenv("AUTH_CACHE_MAX_USERS", "4096")
+AUTH_CACHE_TTL = getenv("AUTH_CACHE_TTL", "300")
+
+# Keys access tokens are signed with, "<key id>:<base64 key>" separated by commas (the first one signs).
+# Derived from ENCRYPTION_KEY if empty
+ACCESS_TOKEN_KEYS = getenv("ACCESS_TOKEN_KEYS", "")
+# Seconds an access token is valid
+ACCESS_TOKEN_TTL = getenv("ACCESS_TOKEN_TTL", "3600")
+
 if __name__ == "__main__":
     load_dotenv()
\ No newline at end of file
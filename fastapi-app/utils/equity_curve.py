@@ -0,0 +1,254 @@
+"""
+Equity curve of a user's account, replayed from the transaction history against the daily bars of the bar store.
+
+Every figure is computed for all the days at once: the trades are scattered onto a business day calendar and
+accumulated with `cumsum` into positions and cash, positions are valued at the daily closes (forward filled over
+days without a bar, and at the user's last trade price before a symbol's first bar), and the returns and drawdowns
+are cumulative products and maxima over the resulting series.
+
+Returns are of the invested capital: buys are money moved into the positions at the start of their day, sells
+money moved out at its end, so trading cash does not dilute them.
+    - Time-weighted return chains the daily returns (positions + sells) / (previous positions + buys).
+    - Money-weighted return is the annualized internal rate of return of the buys, sells and final positions.
+Drawdowns are of the account's equity (cash + positions), which only changes with prices as there are no deposits.
+
+The closes of a batch of users are loaded into one `PriceMatrix`, so each symbol's bars are only read once.
+Run the batch over every user from the fastapi-app folder:
+    python -m utils.equity_curve [--output equity_curves.json]
+"""
+from typing import Optional, Iterable
+from datetime import datetime
+import argparse
+import json
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from utils.logger_script import logger
+from data.database import DatabasesNames
+from data.utils.get_databases import get_db
+from data.userbase.model import Userbase
+from data.bars.store import bar_store
+from data.bars.providers import BarIntervals
+from data.dynamic_databases.helper import load_user_transactions_columns
+
+TRADING_DAYS_PER_YEAR = 252
+
+def business_days(start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    """ The business days from start (or the business day before it) to end (inclusive) as datetime64[D]. """
+    start = np.busday_offset(start.astype("datetime64[D]"), 0, roll="backward")
+    days = np.arange(start, end.astype("datetime64[D]") + 1, dtype="datetime64[D]")
+    return days[np.is_busday(days)]
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """ Fills the NaNs of every column with the last value before them (leading NaNs stay). """
+    rows = np.arange(len(values))[:, None] if values.ndim == 2 else np.arange(len(values))
+    last_valid = np.maximum.accumulate(np.where(np.isnan(values), -1, rows), axis=0)
+    filled = values[last_valid, np.arange(values.shape[1])] if values.ndim == 2 else values[last_valid]
+    return np.where(last_valid >= 0, filled, np.nan)
+
+class PriceMatrix:
+    """
+    Daily closes of symbols on a calendar, forward filled, loaded from the bar store once per symbol.
+
+    Args:
+        calendar (np.ndarray): The days (datetime64[D]) of the rows.
+    """
+    def __init__(self, calendar: np.ndarray):
+        self.calendar = calendar
+        self._closes: dict[str, np.ndarray] = {}
+
+    def _load(self, symbol: str) -> np.ndarray:
+        closes = np.full(len(self.calendar), np.nan)
+        if len(self.calendar) == 0:
+            return closes
+        bars = bar_store.get_bars(symbol, BarIntervals.day.value, self.calendar[0], self.calendar[-1] + 1)
+        if bars is None or len(bars) == 0:
+            logger.warning(f"No daily bars of {symbol}, its positions are valued at their trade prices")
+            return closes
+        bar_days = bars["time"].astype("datetime64[D]")
+        last_bar = np.searchsorted(bar_days, self.calendar, side="right") - 1
+        return np.where(last_bar >= 0, bars["close"][np.maximum(last_bar, 0)], np.nan)
+
+    def get(self, symbols: Iterable[str], first_day: int = 0) -> np.ndarray:
+        """ The closes of the symbols (a column each) from the calendar's `first_day` on, NaN before a symbol's first bar. """
+        columns = []
+        for symbol in symbols:
+            closes = self._closes.get(symbol)
+            if closes is None:
+                closes = self._closes[symbol] = self._load(symbol)
+            columns.append(closes[first_day:])
+        return np.column_stack(columns) if columns else np.empty((len(self.calendar) - first_day, 0))
+
+def money_weighted_return(flows: np.ndarray, final_value: float, iterations: int = 50) -> Optional[float]:
+    """
+    Annualized internal rate of return of daily flows into an investment (positive = invested) and its final value.
+    Solved with Newton's method on the daily rate, None if it does not converge.
+    """
+    days_to_end = (len(flows) - 1 - np.arange(len(flows))).astype(np.double)
+    invested = flows != 0
+    if not invested.any():
+        return None
+    flows, days_to_end = flows[invested], days_to_end[invested]
+    rate = 0.0
+    for _ in range(iterations):
+        growth = (1 + rate) ** days_to_end
+        value = final_value - np.sum(flows * growth)
+        derivative = -np.sum(flows * days_to_end * growth / (1 + rate))
+        if derivative == 0:
+            return None
+        step = value / derivative
+        rate = max(rate - step, -0.99)
+        if abs(step) < 1e-12:
+            return (1 + rate) ** TRADING_DAYS_PER_YEAR - 1
+    return None
+
+def compute_equity_curve(transactions: dict[str, np.ndarray], balance: float, calendar: np.ndarray, prices: PriceMatrix) -> Optional[dict]:
+    """
+    Replays a user's transaction history into daily series.
+
+    Args:
+        transactions (dict[str, np.ndarray]): The user's transactions, as returned by `load_user_transactions_columns`.
+        balance (float): The user's current cash balance, the cash at the end of the replay.
+        calendar (np.ndarray): The business days of `prices`, the replay starts at the day of the first transaction.
+        prices (PriceMatrix): The daily closes.
+
+    Returns:
+        Optional[dict]: NumPy arrays of the daily "dates", "cash", "positions" (their value), "equity", "flows"
+                        (buys minus sells), "twr" (cumulative time-weighted return) and "drawdown", and a "summary".
+                        None if the user has no transactions.
+    """
+    if len(transactions["timestamp"]) == 0:
+        return None
+    # A trade on a weekend or holiday counts on the business day before it, trades before the calendar on its first day
+    first_day = max(np.searchsorted(calendar, transactions["timestamp"][0].astype("datetime64[D]"), side="right") - 1, 0)
+    dates = calendar[first_day:]
+    days = np.maximum(np.searchsorted(dates, transactions["timestamp"].astype("datetime64[D]"), side="right") - 1, 0)
+    symbols, codes = np.unique(transactions["symbol"], return_inverse=True)
+
+    is_buy = transactions["side"] == "buy"
+    values = transactions["shares"] * transactions["cost_per_share"]
+    buys = np.bincount(days, weights=np.where(is_buy, values, 0), minlength=len(dates))
+    sells = np.bincount(days, weights=np.where(is_buy, 0, values), minlength=len(dates))
+    flows = buys - sells
+
+    share_changes = np.zeros((len(dates), len(symbols)))
+    np.add.at(share_changes, (days, codes), np.where(is_buy, transactions["shares"], -transactions["shares"]))
+    shares = np.cumsum(share_changes, axis=0)
+    # Float sums of buys and sells of the same shares leave dust instead of zero
+    shares[np.abs(shares) < 1e-9] = 0
+
+    # Positions are valued at the closes, or at the last trade price before a symbol's first bar
+    trade_prices = np.full((len(dates), len(symbols)), np.nan)
+    trade_prices[days, codes] = transactions["cost_per_share"]
+    closes = prices.get(symbols.tolist(), first_day)
+    close_or_trade = np.where(np.isnan(closes), forward_fill(trade_prices), closes)
+    positions = np.nansum(shares * close_or_trade, axis=1)
+
+    cash = balance + flows.sum() - np.cumsum(flows)
+    equity = cash + positions
+
+    previous_positions = np.concatenate(([0.0], positions[:-1]))
+    invested = previous_positions + buys
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily_returns = np.where(invested > 1e-9, (positions + sells) / invested - 1, 0.0)
+    twr = np.cumprod(1 + daily_returns) - 1
+
+    peaks = np.maximum.accumulate(equity)
+    drawdown = equity / peaks - 1
+    trough = int(np.argmin(drawdown))
+    peak = int(np.argmax(equity[:trough + 1])) if trough > 0 else 0
+
+    years = len(dates) / TRADING_DAYS_PER_YEAR
+    return {
+        "dates": dates,
+        "cash": cash,
+        "positions": positions,
+        "equity": equity,
+        "flows": flows,
+        "twr": twr,
+        "drawdown": drawdown,
+        "summary": {
+            "start": str(dates[0]),
+            "days": len(dates),
+            "starting_equity": float(balance + flows.sum()),
+            "equity": float(equity[-1]),
+            "time_weighted_return": float(twr[-1]),
+            "time_weighted_return_annualized": float((1 + twr[-1]) ** (1 / years) - 1) if years >= 1 else None,
+            "money_weighted_return_annualized": money_weighted_return(flows, float(positions[-1])),
+            "max_drawdown": float(drawdown[trough]),
+            "max_drawdown_peak": str(dates[peak]),
+            "max_drawdown_trough": str(dates[trough]),
+        },
+    }
+
+def equity_curve_to_dict(curve: dict) -> dict:
+    """ Converts the series of `compute_equity_curve` to JSON serializable lists. """
+    return {
+        "dates": np.datetime_as_string(curve["dates"]).tolist(),
+        **{name: np.round(curve[name], 6).tolist() for name in ("cash", "positions", "equity", "flows", "twr", "drawdown")},
+        "summary": curve["summary"],
+    }
+
+def get_user_equity_curve(uuid: str, balance: float) -> Optional[dict]:
+    """
+    Get the equity curve of a user up to today, as returned by `equity_curve_to_dict`.
+    None if the user has no transactions or it could not be computed.
+    """
+    try:
+        transactions = load_user_transactions_columns(DatabasesNames.transactions.value, uuid)
+        if len(transactions["timestamp"]) == 0:
+            return None
+        calendar = business_days(transactions["timestamp"][0], np.datetime64(datetime.now()))
+        curve = compute_equity_curve(transactions, balance, calendar, PriceMatrix(calendar))
+        return None if curve is None else equity_curve_to_dict(curve)
+    except Exception as error:
+        logger.error(f"Failed to compute the equity curve of user {uuid}. Error: {error}")
+        return None
+
+def compute_equity_curves(balances: dict[str, float], start: Optional[np.datetime64] = None) -> dict[str, dict]:
+    """
+    Batch of equity curves sharing one calendar and one price matrix.
+
+    Args:
+        balances (dict[str, float]): The current balance of every user to compute.
+        start (np.datetime64, optional): The first day of the calendar, the users' history before it is not replayed
+                                         separately but still counts for their positions. Defaults to 10 years ago.
+
+    Returns:
+        dict[str, dict]: The summary of every user that has transactions, by UUID.
+    """
+    today = np.datetime64(datetime.now())
+    calendar = business_days(start if start is not None else today - np.timedelta64(3653, "D"), today)
+    prices = PriceMatrix(calendar)
+    summaries = {}
+    for uuid, balance in balances.items():
+        try:
+            transactions = load_user_transactions_columns(DatabasesNames.transactions.value, uuid)
+            curve = compute_equity_curve(transactions, balance, calendar, prices)
+        except Exception as error:
+            logger.error(f"Failed to compute the equity curve of user {uuid}. Error: {error}")
+            continue
+        if curve is not None:
+            summaries[uuid] = curve["summary"]
+    return summaries
+
+def get_all_balances() -> dict[str, float]:
+    session = next(get_db(DatabasesNames.userbase.value))
+    try:
+        return {uuid: float(balance) for uuid, balance in session.execute(select(Userbase.uuid, Userbase.balance))}
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Compute the equity curve summaries of every user")
+    arguments.add_argument("--output", default="equity_curves.json")
+    arguments = arguments.parse_args()
+
+    start = time.perf_counter()
+    balances = get_all_balances()
+    summaries = compute_equity_curves(balances)
+    with open(arguments.output, "w") as file:
+        json.dump(summaries, file, indent=2)
+    logger.info(f"Computed the equity curves of {len(summaries)} of {len(balances)} users in {time.perf_counter() - start:.1f} seconds into {arguments.output}")
@@ -0,0 +1,38 @@
+from contextlib import contextmanager
+from typing import Hashable
+import threading
+
+
+class KeyedLock:
+    """
+    A lock per key (e.g. per user), so work on the same key runs one at a time while different keys run in parallel.
+    Locks only exist while they are held or waited on, so the number of keys is not bounded by memory.
+    """
+    def __init__(self):
+        # key -> [lock, number of threads holding or waiting for it]
+        self._locks: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = [threading.Lock(), 0]
+                self._locks[key] = entry
+            entry[1] += 1
+
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self) -> int:
+        """ Number of keys currently held or waited on. """
+        with self._lock:
+            return len(self._locks)
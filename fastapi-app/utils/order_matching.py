@@ -0,0 +1,325 @@
+from typing import Union, Optional, Callable
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+import heapq
+import itertools
+import threading
+import time
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.env_variables import ORDER_MATCH_INTERVAL
+from utils.quote_cache import quote_cache
+from utils.stock_handler import StockHandler
+
+from records.records import StockRecord, OrderTypes
+
+from data.orders.model import PendingOrder
+from data.orders.helper import (add_pending_order, add_pending_orders, get_pending_orders, delete_pending_orders,
+                                mark_pending_orders_triggered, delete_expired_pending_orders, utc_now)
+
+
+@dataclass(slots=True)
+class RestingOrder:
+    """ In-memory copy of a `PendingOrder`, as kept in the order book. """
+    uid: str
+    uuid: str
+    symbol: str
+    side: str
+    order_type: str
+    shares: float
+    limit_price: Optional[float]
+    stop_price: Optional[float]
+    expires_at: Optional[datetime]
+    triggered: bool
+
+    @classmethod
+    def from_pending_order(cls, pending_order: PendingOrder) -> 'RestingOrder':
+        return cls(
+            uid=pending_order.uid, uuid=pending_order.uuid, symbol=pending_order.symbol.upper(), side=pending_order.side,
+            order_type=pending_order.order_type, shares=pending_order.shares, limit_price=pending_order.limit_price,
+            stop_price=pending_order.stop_price, expires_at=pending_order.expires_at, triggered=bool(pending_order.triggered),
+        )
+
+    @property
+    def rests_as_limit(self) -> bool:
+        return self.order_type == OrderTypes.limit.value or (self.order_type == OrderTypes.stop_limit.value and self.triggered)
+
+class OrderBook:
+    """
+    Price-indexed resting orders, with four heaps per symbol so only triggered orders are ever looked at.
+
+    Every heap is keyed so its top is the order closest to triggering, and an order triggers when its key
+    is at most the heap's threshold:
+        buy_limit: -limit, triggers when ask <= limit (threshold -ask)
+        sell_limit: limit, triggers when bid >= limit (threshold bid)
+        buy_stop: stop, triggers when ask >= stop (threshold ask)
+        sell_stop: -stop, triggers when bid <= stop (threshold -bid)
+    Cancelled orders are removed lazily: their heap entries are skipped once they reach the top.
+    """
+    def __init__(self):
+        self._orders: dict[str, RestingOrder] = {}
+        self._heaps: dict[str, dict[str, list]] = {}
+        self._symbol_counts = Counter()
+        # (expires_at, sequence, uid) of the DAY orders
+        self._expiries: list = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def symbols(self) -> list[str]:
+        """ The symbols with resting orders. """
+        with self._lock:
+            return list(self._symbol_counts)
+
+    def _push(self, order: RestingOrder) -> None:
+        """ Pushes an order onto the heap it currently rests in. Must hold the lock. """
+        heaps = self._heaps.setdefault(order.symbol, {"buy_limit": [], "sell_limit": [], "buy_stop": [], "sell_stop": []})
+        if order.rests_as_limit:
+            heap_name, price = f"{order.side}_limit", order.limit_price
+            key = -price if order.side == "buy" else price
+        else:
+            heap_name, price = f"{order.side}_stop", order.stop_price
+            key = price if order.side == "buy" else -price
+        heapq.heappush(heaps[heap_name], (key, next(self._sequence), order.uid))
+
+    def _discard(self, uid: str) -> Union[RestingOrder, None]:
+        """ Removes an order from the book, dropping the heaps of symbols without orders. Must hold the lock. """
+        order = self._orders.pop(uid, None)
+        if order is not None:
+            self._symbol_counts[order.symbol] -= 1
+            if self._symbol_counts[order.symbol] <= 0:
+                del self._symbol_counts[order.symbol]
+                self._heaps.pop(order.symbol, None)
+        return order
+
+    def add(self, order: RestingOrder) -> None:
+        with self._lock:
+            if order.uid in self._orders:
+                return
+            self._orders[order.uid] = order
+            self._symbol_counts[order.symbol] += 1
+            self._push(order)
+            if order.expires_at is not None:
+                heapq.heappush(self._expiries, (order.expires_at, next(self._sequence), order.uid))
+
+    def remove(self, uid: str) -> Union[RestingOrder, None]:
+        """ Removes a (cancelled) order from the book. """
+        with self._lock:
+            return self._discard(uid)
+
+    def _pop_triggered(self, heap: list, threshold: float) -> list[RestingOrder]:
+        """ Pops every live order of a heap whose key is at most the threshold. Must hold the lock. """
+        triggered = []
+        while heap and heap[0][0] <= threshold:
+            _, _, uid = heapq.heappop(heap)
+            order = self._orders.get(uid)
+            if order is not None:
+                triggered.append(order)
+        return triggered
+
+    def match(self, symbol: str, bid: Optional[float], ask: Optional[float]) -> tuple[list[tuple[RestingOrder, float]], list[RestingOrder]]:
+        """
+        Pops the orders of a symbol that the quote triggers.
+
+        Args:
+            symbol (str): The symbol that was quoted.
+            bid (float, optional): The bid, sell orders are not matched without it.
+            ask (float, optional): The ask, buy orders are not matched without it.
+
+        Returns:
+            tuple: The orders to fill with their fill price (removed from the book),
+                   and the stop-limit orders whose stop was reached and now rest as limit orders.
+        """
+        fills, activated = [], []
+        with self._lock:
+            heaps = self._heaps.get(symbol)
+            if heaps is None:
+                return fills, activated
+
+            for side, price in (("buy", ask), ("sell", bid)):
+                if price is None:
+                    continue
+                sign = 1 if side == "buy" else -1
+                # Stops first, a stop-limit whose stop is reached may already be marketable as a limit order
+                for order in self._pop_triggered(heaps[f"{side}_stop"], sign * price):
+                    if order.order_type == OrderTypes.stop.value:
+                        fills.append((order, price))
+                        self._discard(order.uid)
+                    else:
+                        order.triggered = True
+                        activated.append(order)
+                        self._push(order)
+                # The heaps are dropped with the last order of a symbol
+                if symbol not in self._heaps:
+                    break
+                for order in self._pop_triggered(heaps[f"{side}_limit"], -sign * price):
+                    fills.append((order, price))
+                    self._discard(order.uid)
+                if symbol not in self._heaps:
+                    break
+
+        return fills, activated
+
+    def expire(self, now: datetime) -> list[RestingOrder]:
+        """ Removes and returns the DAY orders that expired by `now` (naive UTC). """
+        expired = []
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                _, _, uid = heapq.heappop(self._expiries)
+                order = self._discard(uid)
+                if order is not None:
+                    expired.append(order)
+        return expired
+
+def execute_resting_order(order: RestingOrder, price: float) -> str:
+    """
+    Fills a triggered resting order at the matched quote. The resting order is removed in the same transaction,
+    so an order that was cancelled in the meantime is not filled.
+
+    Returns:
+        str: The status of the fill.
+
+    Raises:
+        RuntimeError: If the fill was rolled back, the resting order is then still saved.
+    """
+    stock_record = StockRecord(
+        symbol=order.symbol,
+        side=order.side,
+        order_type=order.order_type,
+        shares=np.double(order.shares),
+        cost_per_share=np.double(price),
+        notes=None
+    )
+    handler = StockHandler()
+    handler.deal_with_transaction(stock_record, order.uuid, resting_order_uid=order.uid)
+    if handler.failed:
+        raise RuntimeError(f"Fill at {price} was rolled back: {handler.status}")
+    logger.info(f"Resting {order.order_type} order {order.uid} of user {order.uuid} triggered at {price}: {handler.status}")
+    return handler.status
+
+class OrderMatcher:
+    """
+    Background loop that matches the order book against the quote cache.
+
+    Every cycle looks up the quotes of the symbols with resting orders in one batch, pops the triggered
+    orders off the book, fills them and expires DAY orders, so its cost grows with the number of symbols
+    and triggered orders instead of with the number of resting orders.
+    """
+    def __init__(self, book: OrderBook, interval: float, execute: Callable[[RestingOrder, float], str] = execute_resting_order):
+        self.book = book
+        self.interval = interval
+        self.execute = execute
+        self.last_cycle: dict = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load_pending_orders(self) -> int:
+        """ Loads the saved resting orders into the book (e.g. on startup), dropping the expired ones. """
+        delete_expired_pending_orders(utc_now())
+        pending_orders = get_pending_orders()
+        for pending_order in pending_orders:
+            self.book.add(RestingOrder.from_pending_order(pending_order))
+        logger.info(f"Loaded {len(pending_orders)} resting orders into the order book")
+        return len(pending_orders)
+
+    def submit(self, pending_order: PendingOrder) -> bool:
+        """ Saves a new resting order and adds it to the book. """
+        if not add_pending_order(pending_order):
+            return False
+        self.book.add(RestingOrder.from_pending_order(pending_order))
+        return True
+
+    def submit_many(self, pending_orders: list[PendingOrder]) -> bool:
+        """ Saves new resting orders in one transaction and adds them to the book. """
+        if not add_pending_orders(pending_orders):
+            return False
+        for pending_order in pending_orders:
+            self.book.add(RestingOrder.from_pending_order(pending_order))
+        return True
+
+    def cancel(self, uuid: str, uid: str) -> bool:
+        """ Cancels a resting order of a user. Returns False if the user has no such (unfilled) order. """
+        if delete_pending_orders([uid], uuid=uuid) == 0:
+            return False
+        self.book.remove(uid)
+        return True
+
+    def run_cycle(self) -> dict:
+        """
+        Runs one matching cycle.
+
+        Returns:
+            dict: The cycle's statistics (symbols, fills, failed fills, activated stop-limits, expired orders and timings in ms).
+        """
+        start = time.perf_counter()
+        symbols = self.book.symbols()
+        quotes = quote_cache.get_quotes(symbols, fields=("bid", "ask"), timeout=self.interval) if symbols else None
+        quotes_done = time.perf_counter()
+
+        fills, activated = [], []
+        if quotes is not None:
+            for symbol, quote in quotes.quotes.items():
+                # Never trigger orders off an expired quote
+                if symbol in quotes.stale:
+                    continue
+                symbol_fills, symbol_activated = self.book.match(symbol, quote.get("bid"), quote.get("ask"))
+                fills.extend(symbol_fills)
+                activated.extend(symbol_activated)
+        matched = time.perf_counter()
+
+        mark_pending_orders_triggered([order.uid for order in activated])
+        failed = 0
+        for order, price in fills:
+            try:
+                self.execute(order, price)
+            except Exception as error:
+                logger.error(f"Failed to fill resting order {order.uid}. Error: {error}")
+                # It is still saved, back in the book it is matched again next cycle
+                self.book.add(order)
+                failed += 1
+
+        expired = self.book.expire(utc_now())
+        if expired:
+            delete_pending_orders([order.uid for order in expired])
+            logger.info(f"Expired {len(expired)} DAY orders")
+
+        self.last_cycle = {
+            "resting_orders": len(self.book),
+            "symbols": len(symbols),
+            "fills": len(fills),
+            "failed": failed,
+            "activated": len(activated),
+            "expired": len(expired),
+            "quotes_ms": (quotes_done - start) * 1000,
+            "match_ms": (matched - quotes_done) * 1000,
+            "total_ms": (time.perf_counter() - start) * 1000,
+        }
+        return self.last_cycle
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_cycle()
+            except Exception as error:
+                logger.error(f"Order matching cycle failed. Error: {error}")
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="order-matcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Order matcher started, matching every {self.interval} seconds")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+order_matcher = OrderMatcher(book=OrderBook(), interval=float(ORDER_MATCH_INTERVAL))
@@ -0,0 +1,69 @@
+from typing import Callable
+
+from fastapi import HTTPException, Request
+
+from records.records import ServerResponse
+from utils.encryption import decrypt, open_envelope, ENVELOPE_CONTENT_TYPE
+from utils.logger_script import logger
+
+def _invalid_request(status_code: int, error: str) -> HTTPException:
+    return_dict = ServerResponse()
+    return_dict.error = error
+    return HTTPException(status_code=status_code, detail=return_dict.to_dict())
+
+async def _read_fields(request: Request) -> dict:
+    """ The encrypted fields of older clients: in the query parameters, or in a JSON body (e.g. batches of orders). """
+    fields = dict(request.query_params)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise _invalid_request(400, "Invalid JSON body")
+        if isinstance(body, dict):
+            fields.update(body)
+    return fields
+
+def encrypted_parameters(*required: str, optional: tuple[str, ...] = ()) -> Callable:
+    """
+    Creates the dependency of a route reading its encrypted parameters.
+
+    The Flask app sends the whole payload of a request as one envelope in the body (see `open_envelope`), decrypted
+    once with its values keeping their types. Older clients encrypt every field on its own (see `decrypt`), those
+    are still accepted from the query parameters or a JSON body.
+
+    Args:
+        *required (str): Names of the parameters the route needs, answered with 422 if missing.
+        optional (tuple[str, ...], optional): Names of the parameters it may get.
+
+    Returns:
+        Callable: An async dependency returning the decrypted parameters by name.
+    """
+    names = (*required, *optional)
+
+    # Async, as opening an envelope takes microseconds and FastAPI would run a sync dependency in its thread pool
+    async def dependency(request: Request) -> dict:
+        if request.headers.get("content-type", "").split(";")[0].strip() == ENVELOPE_CONTENT_TYPE:
+            try:
+                payload = open_envelope(await request.body(), request.method, request.url.path)
+            except ValueError as error:
+                logger.error(f"Failed opening envelope of {request.method} {request.url.path}. Error: {error}")
+                raise _invalid_request(400, "Invalid envelope")
+            parameters = {name: payload[name] for name in names if name in payload}
+        else:
+            fields = await _read_fields(request)
+            parameters = {}
+            for name in names:
+                if name not in fields:
+                    continue
+                try:
+                    parameters[name] = decrypt(fields[name])
+                except Exception as error:
+                    logger.error(f"Failed decrypting parameter {name}. Error: {error}")
+                    raise _invalid_request(400, f"Invalid {name}")
+
+        missing = [name for name in required if name not in parameters]
+        if missing:
+            raise _invalid_request(422, f"Missing {', '.join(missing)}")
+        return parameters
+
+    return dependency
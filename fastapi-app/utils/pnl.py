@@ -0,0 +1,163 @@
+"""
+Vectorized profit and loss of a user's portfolio.
+
+The open lots are loaded as NumPy columns and the transaction history is summed by symbol and side in SQL.
+Every figure is then computed for all the symbols at once, with `np.bincount` over the symbol code of each lot,
+instead of looping over the lots in Python.
+
+Realized P&L of a symbol is what its sells brought in, minus the cost basis of the sold shares: everything paid
+for the symbol's buys minus the cost basis still open. It includes symbols that are no longer held.
+"""
+from typing import Optional
+from datetime import datetime
+import time
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.yfinance_helper import get_current_prices
+from utils.env_variables import PNL_QUOTE_BUDGET
+from data.database import DatabasesNames
+from data.dynamic_databases.helper import load_user_lots_columns, sum_user_transactions_by_symbol
+
+SECONDS_PER_DAY = 86400
+
+def encode_symbols(symbols: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the distinct symbols and the code (index into them) of every row.
+
+    Args:
+        symbols (np.ndarray): The symbols, with equal symbols next to each other (as sorted by the queries).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The distinct symbols, in order, and the code of every row.
+    """
+    if len(symbols) == 0:
+        return np.array([], dtype=object), np.array([], dtype=np.intp)
+    changes = symbols[1:] != symbols[:-1]
+    codes = np.concatenate(([0], np.cumsum(changes))).astype(np.intp)
+    return symbols[np.concatenate(([True], changes))], codes
+
+def compute_pnl(lots: dict[str, np.ndarray], transactions: dict[str, np.ndarray],
+                prices: dict[str, Optional[float]], now: Optional[np.datetime64] = None) -> dict:
+    """
+    Computes the P&L of a portfolio.
+
+    Args:
+        lots (dict[str, np.ndarray]): The open lots, as returned by `load_user_lots_columns`.
+        transactions (dict[str, np.ndarray]): The transaction history summed by symbol and side, as returned by
+                                              `sum_user_transactions_by_symbol`.
+        prices (dict[str, Optional[float]]): The current price of every held symbol, None if it is unknown.
+        now (np.datetime64, optional): The time the age of the lots is measured at. Defaults to now.
+
+    Returns:
+        dict: Columns of the per symbol figures under "symbols" (every column is a NumPy array, aligned with
+              the "symbol" column), and the totals under "totals". Figures that need a missing price are NaN.
+    """
+    if now is None:
+        # The lots' timestamps are naive local times
+        now = np.datetime64(datetime.now(), "us")
+
+    lot_symbols, lot_codes = encode_symbols(lots["symbol"])
+    # Symbols that were traded but are no longer held only have realized P&L
+    symbols = np.array(sorted(set(lot_symbols.tolist()) | set(transactions["symbol"].tolist())), dtype=object)
+    count = len(symbols)
+    lot_codes = np.searchsorted(symbols, lot_symbols)[lot_codes] if count else lot_codes
+    transaction_codes = np.searchsorted(symbols, transactions["symbol"]) if count else np.array([], dtype=np.intp)
+
+    shares = np.bincount(lot_codes, weights=lots["shares"], minlength=count)
+    cost_basis = np.bincount(lot_codes, weights=lots["shares"] * lots["cost_per_share"], minlength=count)
+    ages = (now - lots["timestamp"]) / np.timedelta64(1, "s") / SECONDS_PER_DAY
+    share_days = np.bincount(lot_codes, weights=lots["shares"] * ages, minlength=count)
+
+    is_buy = transactions["side"] == "buy"
+    bought = np.bincount(transaction_codes[is_buy], weights=transactions["value"][is_buy], minlength=count)
+    sold = np.bincount(transaction_codes[~is_buy], weights=transactions["value"][~is_buy], minlength=count)
+    realized_pnl = sold - (bought - cost_basis)
+
+    price = np.array([np.nan if prices.get(symbol) is None else prices[symbol] for symbol in symbols], dtype=np.double)
+    held = shares > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_cost = np.where(held, cost_basis / shares, np.nan)
+        average_age_days = np.where(held, share_days / shares, np.nan)
+        market_value = np.where(held, shares * price, 0.0)
+        unrealized_pnl = market_value - cost_basis
+        unrealized_pnl_percent = np.where(held, unrealized_pnl / cost_basis * 100, np.nan)
+        # Symbols without a price are left out of the totals (and listed under "missing_prices")
+        total_market_value = np.nansum(market_value)
+        weight = market_value / total_market_value
+
+    totals = {
+        "cost_basis": cost_basis.sum(),
+        "market_value": total_market_value,
+        "unrealized_pnl": np.nansum(unrealized_pnl),
+        "realized_pnl": realized_pnl.sum(),
+    }
+    totals["total_pnl"] = totals["unrealized_pnl"] + totals["realized_pnl"]
+    return {
+        "symbols": {
+            "symbol": symbols,
+            "shares": shares,
+            "average_cost": average_cost,
+            "cost_basis": cost_basis,
+            "price": price,
+            "market_value": market_value,
+            "unrealized_pnl": unrealized_pnl,
+            "unrealized_pnl_percent": unrealized_pnl_percent,
+            "realized_pnl": realized_pnl,
+            "weight": weight,
+            "average_age_days": average_age_days,
+        },
+        "totals": totals,
+        "missing_prices": symbols[held & np.isnan(price)].tolist(),
+    }
+
+def _json_number(value: float) -> Optional[float]:
+    """ NaN (a figure that needs a missing price) is not valid JSON, it is given as None. """
+    value = float(value)
+    return None if np.isnan(value) else value
+
+def pnl_to_dict(pnl: dict) -> dict:
+    """ Converts the columns of `compute_pnl` to JSON serializable dictionaries, one per symbol. """
+    columns = pnl["symbols"]
+    names = [name for name in columns if name != "symbol"]
+    return {
+        "symbols": {
+            symbol: {name: _json_number(columns[name][index]) for name in names}
+            for index, symbol in enumerate(columns["symbol"].tolist())
+        },
+        "totals": {name: _json_number(value) for name, value in pnl["totals"].items()},
+        "missing_prices": pnl["missing_prices"],
+    }
+
+def get_user_pnl(uuid: str) -> Optional[dict]:
+    """
+    Get the P&L of a user's portfolio at the current prices.
+
+    Args:
+        uuid (str): The UUID of the user.
+
+    Returns:
+        Optional[dict]: The P&L as returned by `pnl_to_dict`, with the milliseconds spent loading, pricing and computing
+                        under "timings", or None if it could not be computed.
+    """
+    try:
+        start = time.perf_counter()
+        lots = load_user_lots_columns(DatabasesNames.portfolios.value, uuid)
+        transactions = sum_user_transactions_by_symbol(DatabasesNames.transactions.value, uuid)
+        loaded = time.perf_counter()
+        held_symbols, _ = encode_symbols(lots["symbol"])
+        prices = get_current_prices(held_symbols.tolist(), timeout=float(PNL_QUOTE_BUDGET)) if len(held_symbols) else {}
+        priced = time.perf_counter()
+        pnl = pnl_to_dict(compute_pnl(lots, transactions, prices))
+        computed = time.perf_counter()
+    except Exception as error:
+        logger.error(f"Failed to compute P&L of user {uuid}. Error: {error}")
+        return None
+
+    pnl["timings"] = {
+        "load_ms": (loaded - start) * 1000,
+        "prices_ms": (priced - loaded) * 1000,
+        "compute_ms": (computed - priced) * 1000,
+    }
+    return pnl
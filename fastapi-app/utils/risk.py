@@ -0,0 +1,327 @@
+"""
+Risk analytics of a user's holdings, from the daily closes of the bar store.
+
+The daily returns of the held symbols and of a benchmark over a window of trading days are aligned into one
+matrix (a row per trading day of the benchmark, a column per symbol). Everything that does not depend on how much
+of each symbol is held is computed from it with matrix products: the covariance and correlation matrices and every
+symbol's volatility and beta. These are cached per (symbols, benchmark, window), so repeated loads of a dashboard
+(and users holding the same symbols) only pay for the products of their weights with them:
+    - Volatility: annualized standard deviation of the daily returns, of the portfolio also over a rolling window.
+    - Beta: covariance of the returns with the benchmark's over the variance of the benchmark's.
+    - Value at risk and expected shortfall (CVaR) of one day, historical (quantile and mean of the tail of the
+      portfolio's daily returns) and parametric (normal returns with the portfolio's mean and volatility).
+    - Risk contribution: the share of the portfolio's variance that comes from each symbol.
+Positions are the open lots of the portfolios ledger, valued at the last close.
+"""
+from typing import Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from statistics import NormalDist
+import threading
+import time
+
+import numpy as np
+
+from utils.logger_script import logger
+from utils.keyed_lock import KeyedLock
+from utils.pnl import encode_symbols, _json_number
+from utils.equity_curve import PriceMatrix, TRADING_DAYS_PER_YEAR
+from utils.env_variables import RISK_BENCHMARK, RISK_CACHE_MAX_ENTRIES, RISK_CACHE_TTL
+from data.database import DatabasesNames
+from data.bars.store import bar_store
+from data.bars.providers import BarIntervals
+from data.dynamic_databases.helper import load_user_lots_columns
+
+CONFIDENCE_LEVELS = (0.95, 0.99)
+ROLLING_VOLATILITY_DAYS = 21
+MIN_WINDOW = 20
+MAX_WINDOW = 2520
+# Symbols listed for fewer days than this are left out instead of shortening everyone's window
+MIN_RETURNS = 20
+
+@dataclass
+class ReturnMatrix:
+    """
+    Aligned daily returns of symbols and a benchmark, and the statistics that do not depend on weights.
+
+    Attributes:
+        symbols (list[str]): The symbols of the columns.
+        missing (list[str]): Requested symbols left out, as they do not have enough daily bars.
+        dates (np.ndarray): The day (datetime64[D]) each row of returns ends on.
+        returns (np.ndarray): Daily returns, a row per day and a column per symbol.
+        benchmark_returns (np.ndarray): Daily returns of the benchmark.
+        last_closes (np.ndarray): The last close of every symbol.
+        mean (np.ndarray): Mean daily return of every symbol.
+        covariance (np.ndarray): Covariance matrix of the daily returns of the symbols.
+        volatility (np.ndarray): Daily standard deviation of every symbol.
+        correlation (np.ndarray): Correlation matrix of the symbols.
+        betas (np.ndarray): Beta of every symbol to the benchmark.
+        built_at (float): Monotonic time the matrix was built at.
+    """
+    symbols: list[str]
+    missing: list[str]
+    dates: np.ndarray
+    returns: np.ndarray
+    benchmark_returns: np.ndarray
+    last_closes: np.ndarray
+    mean: np.ndarray
+    covariance: np.ndarray
+    volatility: np.ndarray
+    correlation: np.ndarray
+    betas: np.ndarray
+    built_at: float
+
+def build_return_matrix(symbols: list[str], benchmark: str, window: int) -> Optional[ReturnMatrix]:
+    """
+    Builds the return matrix of symbols over the last `window` trading days of the benchmark.
+    None if the benchmark does not have enough daily bars.
+    """
+    today = np.datetime64(datetime.now(), "D")
+    # Calendar days covering the trading days, with room for holidays
+    start = today - np.timedelta64(window * 7 // 5 + 14, "D")
+    benchmark_bars = bar_store.get_bars(benchmark, BarIntervals.day.value, start, today + 1)
+    if benchmark_bars is None or len(benchmark_bars) <= MIN_RETURNS:
+        logger.warning(f"Not enough daily bars of the benchmark {benchmark} for risk analytics")
+        return None
+    calendar = np.unique(benchmark_bars["time"].astype("datetime64[D]"))[-(window + 1):]
+
+    closes = PriceMatrix(calendar).get([*symbols, benchmark])
+    # Leading NaNs are days before a symbol's first bar
+    first_valid = np.argmax(~np.isnan(closes), axis=0)
+    first_valid[np.isnan(closes).all(axis=0)] = len(calendar)
+    enough = first_valid[:-1] <= len(calendar) - 1 - MIN_RETURNS
+    kept = np.append(enough, True)
+    closes = closes[:, kept]
+    closes = closes[first_valid[kept].max():]
+
+    returns = closes[1:] / closes[:-1] - 1
+    mean = returns.mean(axis=0)
+    centered = returns - mean
+    # Covariance of the symbols and the benchmark (the last column) in one product
+    covariance = centered.T @ centered / (len(returns) - 1)
+    volatility = np.sqrt(np.diag(covariance))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = covariance / np.outer(volatility, volatility)
+        betas = covariance[:-1, -1] / covariance[-1, -1]
+
+    return ReturnMatrix(
+        symbols=[symbol for symbol, is_kept in zip(symbols, enough) if is_kept],
+        missing=[symbol for symbol, is_kept in zip(symbols, enough) if not is_kept],
+        dates=calendar[-len(returns):],
+        returns=returns[:, :-1],
+        benchmark_returns=returns[:, -1],
+        last_closes=closes[-1, :-1],
+        mean=mean[:-1],
+        covariance=covariance[:-1, :-1],
+        volatility=volatility[:-1],
+        correlation=correlation[:-1, :-1],
+        betas=betas,
+        built_at=time.monotonic(),
+    )
+
+class ReturnMatrixCache:
+    """
+    LRU cache of return matrices by (symbols, benchmark, window).
+
+    Args:
+        max_entries (int): The number of matrices kept.
+        ttl (float): Seconds after which a matrix is built again, so it picks up the newest closes.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {"hits": 0, "builds": 0, "evictions": 0, "expirations": 0}
+        self._matrices: OrderedDict[tuple, ReturnMatrix] = OrderedDict()
+        self._lock = threading.Lock()
+        # Requests for the same matrix wait for one build instead of each building it
+        self._build_locks = KeyedLock()
+
+    def _get_fresh(self, key: tuple) -> Optional[ReturnMatrix]:
+        with self._lock:
+            matrix = self._matrices.get(key)
+            if matrix is None:
+                return None
+            if time.monotonic() - matrix.built_at > self.ttl:
+                del self._matrices[key]
+                self.stats["expirations"] += 1
+                return None
+            self._matrices.move_to_end(key)
+            self.stats["hits"] += 1
+            return matrix
+
+    def get(self, symbols: list[str], benchmark: str, window: int) -> tuple[Optional[ReturnMatrix], bool]:
+        """
+        Get the return matrix of the symbols, building it if it is not cached (or expired).
+
+        Returns:
+            tuple[Optional[ReturnMatrix], bool]: The matrix (None if it could not be built), and whether it was cached.
+        """
+        key = (tuple(sorted(symbols)), benchmark, window)
+        matrix = self._get_fresh(key)
+        if matrix is not None:
+            return matrix, True
+
+        with self._build_locks.hold(key):
+            # Another request may have built it while this one waited
+            matrix = self._get_fresh(key)
+            if matrix is not None:
+                return matrix, True
+            matrix = build_return_matrix(list(key[0]), benchmark, window)
+            if matrix is None:
+                return None, False
+            with self._lock:
+                self.stats["builds"] += 1
+                self._matrices[key] = matrix
+                self._matrices.move_to_end(key)
+                while len(self._matrices) > self.max_entries:
+                    self._matrices.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return matrix, False
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._matrices.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            entries = len(self._matrices)
+        return {**self.stats, "entries": entries, "max_entries": self.max_entries, "ttl": self.ttl}
+
+return_matrix_cache = ReturnMatrixCache(max_entries=int(RISK_CACHE_MAX_ENTRIES), ttl=float(RISK_CACHE_TTL))
+
+def rolling_volatility(returns: np.ndarray, days: int) -> np.ndarray:
+    """ Annualized standard deviation of every `days` consecutive returns, from cumulative sums. """
+    if len(returns) < days:
+        return np.array([], dtype=np.double)
+    sums = np.cumsum(np.concatenate(([0.0], returns)))
+    squares = np.cumsum(np.concatenate(([0.0], returns ** 2)))
+    window_sums = sums[days:] - sums[:-days]
+    window_squares = squares[days:] - squares[:-days]
+    variance = np.maximum((window_squares - window_sums ** 2 / days) / (days - 1), 0)
+    return np.sqrt(variance * TRADING_DAYS_PER_YEAR)
+
+def _json_matrix(values: np.ndarray) -> list[list[Optional[float]]]:
+    """ Nested lists of a matrix with NaN as None, through `tolist` as converting every number on its own is slow. """
+    return [[None if value != value else value for value in row] for row in values.tolist()]
+
+def compute_risk(matrix: ReturnMatrix, shares: np.ndarray) -> dict:
+    """
+    Computes the risk of holding `shares` of the matrix's symbols.
+
+    Args:
+        matrix (ReturnMatrix): The return matrix of the held symbols.
+        shares (np.ndarray): The shares held of every symbol of the matrix.
+
+    Returns:
+        dict: The portfolio's figures, the value at risk at every confidence level, the figures of every symbol
+              and the correlation matrix, JSON serializable.
+    """
+    values = shares * matrix.last_closes
+    total_value = float(values.sum())
+    weights = values / total_value
+
+    portfolio_returns = matrix.returns @ weights
+    covariance_weights = matrix.covariance @ weights
+    variance = float(weights @ covariance_weights)
+    volatility = np.sqrt(variance)
+    mean = float(weights @ matrix.mean)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_contribution = weights * covariance_weights / variance
+
+    value_at_risk = []
+    normal = NormalDist()
+    for confidence in CONFIDENCE_LEVELS:
+        threshold = np.quantile(portfolio_returns, 1 - confidence)
+        z = normal.inv_cdf(1 - confidence)
+        value_at_risk.append({
+            "confidence": confidence,
+            "historical_var": -threshold * total_value,
+            "historical_cvar": -portfolio_returns[portfolio_returns <= threshold].mean() * total_value,
+            "parametric_var": -(mean + z * volatility) * total_value,
+            "parametric_cvar": -(mean - volatility * normal.pdf(z) / (1 - confidence)) * total_value,
+        })
+
+    rolling = rolling_volatility(portfolio_returns, ROLLING_VOLATILITY_DAYS)
+    annualize = np.sqrt(TRADING_DAYS_PER_YEAR)
+    return {
+        "start": str(matrix.dates[0]),
+        "end": str(matrix.dates[-1]),
+        "observations": len(portfolio_returns),
+        "portfolio": {
+            "value": total_value,
+            "volatility_annualized": _json_number(volatility * annualize),
+            "beta": _json_number(weights @ matrix.betas),
+            "benchmark_volatility_annualized": _json_number(matrix.benchmark_returns.std(ddof=1) * annualize),
+            "rolling_volatility": {
+                "days": ROLLING_VOLATILITY_DAYS,
+                "dates": np.datetime_as_string(matrix.dates[len(matrix.dates) - len(rolling):]).tolist(),
+                "values": np.round(rolling, 6).tolist(),
+            },
+        },
+        "value_at_risk": [{name: _json_number(value) for name, value in level.items()} for level in value_at_risk],
+        "symbols": {
+            symbol: {
+                "shares": _json_number(shares[index]),
+                "price": _json_number(matrix.last_closes[index]),
+                "value": _json_number(values[index]),
+                "weight": _json_number(weights[index]),
+                "volatility_annualized": _json_number(matrix.volatility[index] * annualize),
+                "beta": _json_number(matrix.betas[index]),
+                "risk_contribution": _json_number(risk_contribution[index]),
+            }
+            for index, symbol in enumerate(matrix.symbols)
+        },
+        "correlation": {
+            "symbols": matrix.symbols,
+            "matrix": _json_matrix(np.round(matrix.correlation, 6)),
+        },
+    }
+
+def get_user_risk(uuid: str, window: int, benchmark: Optional[str] = None) -> Optional[dict]:
+    """
+    Get the risk of a user's current holdings.
+
+    Args:
+        uuid (str): The UUID of the user.
+        window (int): The number of trading days of returns.
+        benchmark (str, optional): The symbol betas are measured against. Defaults to `RISK_BENCHMARK`.
+
+    Returns:
+        Optional[dict]: The risk as returned by `compute_risk` (empty "symbols" if the user holds nothing), with the
+                        benchmark, the window, the held symbols without enough bars under "missing_bars", whether the
+                        return matrix was cached and the milliseconds spent under "timings".
+                        None if it could not be computed.
+    """
+    benchmark = (benchmark or RISK_BENCHMARK).upper()
+    try:
+        start = time.perf_counter()
+        lots = load_user_lots_columns(DatabasesNames.portfolios.value, uuid)
+        held_symbols, codes = encode_symbols(lots["symbol"])
+        held_shares = np.bincount(codes, weights=lots["shares"], minlength=len(held_symbols))
+        held = dict(zip(held_symbols.tolist(), held_shares))
+        loaded = time.perf_counter()
+
+        result = {"benchmark": benchmark, "window": window, "symbols": {}, "missing_bars": [], "cached": False}
+        if held:
+            matrix, cached = return_matrix_cache.get(list(held), benchmark, window)
+            if matrix is None:
+                return None
+            prepared = time.perf_counter()
+            if matrix.symbols:
+                result.update(compute_risk(matrix, np.array([held[symbol] for symbol in matrix.symbols])))
+            result["missing_bars"] = matrix.missing
+            result["cached"] = cached
+        else:
+            prepared = loaded
+        computed = time.perf_counter()
+    except Exception as error:
+        logger.error(f"Failed to compute risk of user {uuid}. Error: {error}")
+        return None
+
+    result["timings"] = {
+        "load_ms": (loaded - start) * 1000,
+        "return_matrix_ms": (prepared - loaded) * 1000,
+        "compute_ms": (computed - prepared) * 1000,
+    }
+    return result
@@ -1,29 +1,165 @@
-from typing import Union
-import copy 
+from typing import Union, Optional
+from dataclasses import dataclass
+from datetime import datetime
 
-from sqlalchemy import update
+from sqlalchemy import update, delete, select, bindparam, Table
 from sqlalchemy.orm.session import Session
 import numpy as np
 
 # Modules
 from utils.logger_script import logger
 from utils.yfinance_helper import get_symbol_info
+from utils.keyed_lock import KeyedLock
 
-from records.records import StockRecord, Statuses, UserIdentifiers
+from records.records import StockRecord, Statuses, LotSelections
 
 from data.database import DatabasesNames
 from data.userbase.model import Userbase
-from data.utils.get_databases import get_db
-from data.utils.get_databases import get_table_object_from_selected_database_by_name
-from data.dynamic_databases.helper import add_stock_data_to_selected_database_table, remove_row_by_uid, get_user_shares_by_symbol
-from data.userbase.helper import get_user_from_userbase
-
+from data.orders.model import PendingOrder
+from data.utils.get_databases import get_db_execution, get_execution_table, user_row_values
+from data.dynamic_databases.models import generate_table_by_id_for_selected_database
+from data.dynamic_databases.statements import select_user_lots, insert_row
+from data.dynamic_databases.lot_index import lot_index, Lot, SymbolLots, LotSelection, get_lot_selection
+from data.utils.data_versions import data_versions
+
+
+# Orders of the same user are executed one at a time, orders of different users in parallel
+user_order_locks = KeyedLock()
+# Transactions of a batch, so a single request cannot hold a user's lock for too long
+MAX_BATCH_TRANSACTIONS = 1000
+
+def fit_buy_to_balance(stock_record: StockRecord, balance: np.double) -> bool:
+    """
+    Reduces a buy to the shares the balance affords, if it cannot afford them all.
+
+    Returns:
+        bool: False if the balance does not afford any amount of shares.
+    """
+    if balance >= stock_record.total_cost:
+        return True
+    max_shares = np.double(balance / stock_record.cost_per_share)
+    # Rounding must not make the shares cost more than the balance
+    while max_shares > 0 and max_shares * stock_record.cost_per_share > balance:
+        max_shares = np.nextafter(max_shares, 0)
+    if max_shares <= 0:
+        return False
+    stock_record.shares = max_shares
+    stock_record.update_total_cost()
+    return True
+
+@dataclass
+class SellFill:
+    """
+    The lots a sell consumed, as computed by `fill_sell`.
+
+    Attributes:
+        consumed (list[tuple[Lot, np.double]]): The consumed lots with the shares taken from each. The lots' shares are
+                                                already reduced, exhausted lots have 0 shares.
+        unsold (np.double): The shares that could not be sold, as there were no more lots.
+        revenue (np.double): What the sold shares brought in.
+        realized_pnl (dict): The realized profit and loss of every consumed lot under "lots", and their "total".
+    """
+    consumed: list[tuple[Lot, np.double]]
+    unsold: np.double
+    revenue: np.double
+    realized_pnl: dict
+
+@dataclass
+class BatchTransaction:
+    """
+    A transaction of a batch dealt with by `StockHandler.deal_with_transactions`, and its result.
+
+    Attributes:
+        stock_record (StockRecord): The transaction, with the price it is filled at.
+        lot_selection (str, optional): The lot selection of a sell.
+        lot_uids (list[str], optional): The UIDs of the lots a sell consumes, for the specific lot selection.
+        filled (bool): Whether the transaction was filled.
+        status (str): The status of the transaction.
+        realized_pnl (dict, optional): The realized profit and loss of a filled sell, by consumed lot.
+    """
+    stock_record: StockRecord
+    lot_selection: Optional[str] = None
+    lot_uids: Optional[list[str]] = None
+    filled: bool = False
+    status: str = ""
+    realized_pnl: Optional[dict] = None
+
+def fill_sell(user_lots: dict[str, SymbolLots], symbol: str, shares: np.double, price: np.double,
+              selection: LotSelection, lot_uids: Optional[list[str]] = None) -> SellFill:
+    """
+    Consumes the lots of a sell from a user's lots by symbol (of the lot index, or of a backtest's ledger),
+    in the order of the lot selection. A symbol whose lots are all consumed is removed from `user_lots`.
+    """
+    symbol_lots = user_lots.get(symbol)
+    if symbol_lots is None:
+        consumed, unsold = [], shares
+    else:
+        consumed, unsold = selection.consume(symbol_lots, shares, lot_uids)
+        if len(symbol_lots) == 0:
+            del user_lots[symbol]
+
+    revenue = np.double(0)
+    realized_lots = []
+    for lot, shares_taken in consumed:
+        revenue += shares_taken * price
+        realized_lots.append({
+            "uid": lot.uid,
+            "opened": lot.timestamp.isoformat() if isinstance(lot.timestamp, datetime) else str(lot.timestamp),
+            "shares": float(shares_taken),
+            "cost_per_share": float(lot.cost_per_share),
+            "price": float(price),
+            "realized_pnl": float(shares_taken * (price - lot.cost_per_share)),
+        })
+    realized_pnl = {
+        "lot_selection": selection.name,
+        "lots": realized_lots,
+        "total": sum(realized_lot["realized_pnl"] for realized_lot in realized_lots),
+    }
+    return SellFill(consumed, unsold, revenue, realized_pnl)
+
+def validate_transaction(stock_record: StockRecord, uuid: str, lot_selection: Optional[str],
+                         lot_uids: Optional[list[str]]) -> tuple[Optional[LotSelection], Optional[str]]:
+    """
+    Checks the side of a transaction, and the shares and lot selection of a sell.
+
+    Returns:
+        tuple[Optional[LotSelection], Optional[str]]: The lot selection of a sell (None for a buy) and None,
+                                                      or None and the status of the invalid transaction.
+    """
+    if stock_record.side == "buy":
+        return None, None
+    if stock_record.side != "sell":
+        logger.error(f"Invalid side {stock_record.side} of transaction from user {uuid}")
+        return None, "Invalid side"
+    if stock_record.shares <= 0:
+        logger.warning(f"Transaction from user {uuid} attempted to sell 0 or fewer shares")
+        return None, "Cannot sell 0 or fewer shares"
+
+    selection = get_lot_selection(lot_selection)
+    if selection is None:
+        logger.warning(f"Transaction from user {uuid} has an invalid lot selection {lot_selection}")
+        return None, "Invalid lot selection"
+    if selection.name == LotSelections.specific.value and not lot_uids:
+        logger.warning(f"Transaction from user {uuid} selected specific lots without their UIDs")
+        return None, "No lots were selected"
+    return selection, None
+
+def bought_status(stock_record: StockRecord) -> str:
+    return f"Successfully bought {int(stock_record.shares * 100) / 100} shares, each for {stock_record.cost_per_share} and in total {int(stock_record.total_cost * 100) / 100}"
+
+def sold_status(stock_record: StockRecord, revenue: np.double) -> str:
+    return f"Successully sold {stock_record.shares} shares for a revenue of {int(revenue * 100) / 100}. Each share for a price of {int(stock_record.cost_per_share * 100) / 100}"
 
 class StockHandler:
     def __init__(self):
         self.status = ""
+        # Realized profit and loss of a filled sell, by consumed lot
+        self.realized_pnl: Optional[dict] = None
+        # Whether the order failed on the server's side (so nothing of it was written) rather than being refused
+        self.failed = False
 
-    def deal_with_transaction(self, stock_record: StockRecord, uuid: str):
+    def deal_with_transaction(self, stock_record: StockRecord, uuid: str, resting_order_uid: Optional[str] = None,
+                              lot_selection: Optional[str] = None, lot_uids: Optional[list[str]] = None):
         """
         Processes a stock transaction for a given user identified by UUID. This involves checking the user's balance,
         updating their portfolio, and logging the transaction. The method handles both buying and selling of shares.
@@ -32,217 +168,333 @@ class StockHandler:
             stock_record (StockRecord): An instance of StockRecord that contains details about the transaction such as
                                         the number of shares, the cost per share, and whether the transaction is a buy or sell.
             uuid (str): The unique identifier for a user in the userbase.
+            resting_order_uid (str, optional): The UID of the resting order this transaction fills. The order is filled at the
+                                               record's cost per share and removed in the same transaction,
+                                               unless it was cancelled already, in which case nothing is done.
+            lot_selection (str, optional): The order in which a sell consumes the lots, a value of `LotSelections`.
+                                           Defaults to the `LOT_SELECTION` environment variable.
+            lot_uids (list[str], optional): The UIDs of the lots to sell from, in order, for the specific lot selection.
 
         Returns:
             None: This method updates the database directly and sets the class variable 'status' with the result of the transaction.
                 It does not return any value but logs errors or success messages directly.
-
-        Raises:
-            Exception: If there are issues converting the stock record to a dictionary or if the database operations fail,
-                        an exception is logged and the status is updated to 'Internal Server Error'.
+                The realized profit and loss of a sell is set in the class variable 'realized_pnl',
+                and 'failed' is set if the order was rolled back.
 
         Notes:
-            This method uses transactions to ensure all database operations are completed successfully before committing the changes.
+            The whole order (balance, portfolio lots and transaction history) is applied in a single transaction
+            on the execution engine, which has the transactions and portfolios databases attached to the userbase.
+            It is committed once, and rolled back as a whole if any part fails, so an order is never half applied.
             It also handles partial transactions where a user may not have enough funds to buy the intended number of shares or
             there are not enough shares available to sell.
+            Orders of the same user are serialized with a per user lock, and the balance is only ever changed relatively
+            (debits are conditional on the balance covering them), so concurrent orders cannot overwrite each other's balance.
         """
-        saved_user: Union[Userbase, None] = get_user_from_userbase(identifier=UserIdentifiers.uuid.value, value=uuid)
+        with user_order_locks.hold(uuid):
+            self._deal_with_transaction(stock_record, uuid, resting_order_uid, lot_selection, lot_uids)
+
+    def _deal_with_transaction(self, stock_record: StockRecord, uuid: str, resting_order_uid: Optional[str],
+                               lot_selection: Optional[str], lot_uids: Optional[list[str]]):
+        selection, error = validate_transaction(stock_record, uuid, lot_selection, lot_uids)
+        if error is not None:
+            self.status = error
+            return
+
+        if stock_record.side == "sell":
+            if resting_order_uid is not None:
+                current_price = np.double(stock_record.cost_per_share)
+            else:
+                # Fetch the market price before taking the write lock of the transaction
+                symbol_info = get_symbol_info(stock_record.symbol, fields=["bid"])
+                if not symbol_info or symbol_info.get("bid") is None:
+                    logger.error("Failed to fetch current market price.")
+                    self.status = "Could not sell shares. Failed to fetch current market price"
+                    return
+                current_price = np.double(symbol_info["bid"])
 
-        if saved_user is None:
-            logger.error(f"Could not retrieve user from userbase")
+        transactions_table = self.get_order_table(DatabasesNames.transactions.value, uuid)
+        portfolios_table = self.get_order_table(DatabasesNames.portfolios.value, uuid)
+        if transactions_table is None or portfolios_table is None:
+            logger.error(f"Could not retrieve the transactions and portfolio tables of user {uuid}")
             self.status = "Internal Server Error"
+            self.failed = True
             return
 
-        user_balance = saved_user.balance
-
-        if stock_record.side == "buy":
-            if user_balance >= stock_record.total_cost:                
-                # Update transaction to be tracked
-                stock_record.status = Statuses.tracked.value
-                # Output stock record to dict
-                try:
-                    stock_record_dict = stock_record.to_dict()
-                except Exception as error:
-                    logger.error(f"Could not output stock record into a dictionary. Error: {error}")
-                    self.status = "Internal Server Error"
-                    return 
-                success_transactions = add_stock_data_to_selected_database_table(
-                    database_name=DatabasesNames.transactions.value,
-                    table_name=uuid,
-                    stock_data=stock_record_dict
-                )
-                success_portfolio = add_stock_data_to_selected_database_table(
-                    database_name=DatabasesNames.portfolios.value,
-                    table_name=uuid,
-                    stock_data=stock_record_dict
-                )
-
-                if success_transactions and success_portfolio:
-                    logger.debug(f"Successfully added transaction to transaction history and active portfolio of user {uuid}")
-                    status = f"Successfully bought {int(stock_record.shares * 100) / 100} shares, each for {stock_record.cost_per_share} and in total {int(stock_record.total_cost * 100) / 100}"
-                    logger.info(f"{uuid} {status}")
-                    self.status = status
-                    # Remove cost of shares from user's balance
-                    user_balance -= stock_record.total_cost
-                else:
-                    logger.error(f"Transaction from user {uuid} was not succcessful")
+        # Whether the order wrote to the user's data: removed its resting order, or filled
+        wrote = resting_order_uid is not None
+        session: Session = next(get_db_execution())
+        try:
+            with session.begin():
+                if resting_order_uid is not None:
+                    removed = session.execute(delete(PendingOrder).where(PendingOrder.uid == resting_order_uid)).rowcount
+                    if removed == 0:
+                        logger.info(f"Resting order {resting_order_uid} of user {uuid} was cancelled before it was filled")
+                        self.status = "Order was cancelled"
+                        return
+
+                user_balance = session.execute(select(Userbase.balance).where(Userbase.uuid == uuid)).scalar()
+                if user_balance is None:
+                    logger.error(f"Could not retrieve user from userbase")
                     self.status = "Internal Server Error"
-            else:
-                # Sell the amount of stocks the user can buy
-                logger.warning(f"User {uuid} doesn't have enough money to buy {stock_record.shares} shares of {stock_record.symbol}. \
-                               As they cost {stock_record.total_cost} and the user only has {user_balance}")
-                max_shares = np.double(user_balance / stock_record.cost_per_share)
-                logger.error(f"max shares: {max_shares}")
-                
-                if max_shares > 0:
-                    stock_record.shares = max_shares
-                    stock_record.update_total_cost()
-                    logger.error(f"calling again")
-                    self.deal_with_transaction(stock_record, uuid)
                     return
+
+                if stock_record.side == "buy":
+                    self.status = self.buy_shares(session, transactions_table, portfolios_table, stock_record, uuid, user_balance)
+                    # Only tracked once the buy was written, a buy the balance does not cover writes nothing
+                    wrote = wrote or stock_record.status == Statuses.tracked.value
                 else:
-                    logger.warning(f"The user doesn't have enough money to buy any amount of shares")
-                    self.status = "Insufficient funds"
-        elif stock_record.side == "sell":      
-            # Get the portfolio's table object for querying
-            table_object = get_table_object_from_selected_database_by_name(table_name=uuid, database_name=DatabasesNames.transactions.value)
-
-            if table_object is None:
-                logger.error(f"Could not retrieve portfolio table object")
-                return
-
-            if stock_record.shares <= 0:
-                logger.warning(f"Transaction from user {uuid} attempted to sell 0 or fewer shares")
-                self.status = "Cannot buy 0 or fewer shares"
-                return
-            
-            # Sell the shares of the symbol form the portfolio
-            revenue, unsold_shares = self.sell_shares(uuid=uuid, symbol=stock_record.symbol, shares=stock_record.shares)
-
-            # Add to user balance
-            user_balance += revenue
- 
-            stock_record.shares -= unsold_shares
-            stock_record.status = Statuses.archived.value
-
-            try:
-                stock_record_dict = stock_record.to_dict()
-            except Exception as error:
-                logger.error(f"Could not output stock record into a dictionary. Error: {error}")
-            
-            flag = add_stock_data_to_selected_database_table(
-                database_name=DatabasesNames.transactions.value,
-                table_name=uuid,
-                stock_data=stock_record_dict
-            )
-            if flag:
-                status = f"Successully sold {stock_record.shares} shares for a revenue of {int(revenue * 100) / 100}. Each share for a price of {int(stock_record.cost_per_share * 100) / 100}"
-                logger.info(status)
-                self.status = status
-            else:
-                logger.info(f"Failed to update transactions database with the sell transaction data")
-                self.status = "Could not sell shares. Internal Server Error"
-        
+                    self.status = self.sell_shares(session, transactions_table, portfolios_table, stock_record, uuid, current_price, selection, lot_uids)
+                    wrote = True
+            if wrote:
+                # Committed, pages rendered from the user's earlier data are stale
+                data_versions.bump(uuid)
+            logger.info(f"{uuid} {self.status}")
+        except Exception as error:
+            logger.error(f"Order of user {uuid} was rolled back. Error: {error}")
+            # The index may hold the rolled back fill, the user's lots are loaded again from the ledger
+            lot_index.invalidate(uuid)
+            self.realized_pnl = None
+            self.status = "Internal Server Error"
+            self.failed = True
+        finally:
+            session.close()
 
-        # Update user balance 
-        session: Session = next(get_db(DatabasesNames.userbase.value))
-        session.execute(
-            update(Userbase).
-            where(Userbase.uuid == uuid).
-            values(balance=user_balance)
-        )
-        session.commit() 
-        session.close()
-            
-    def sell_shares(self, uuid: str, symbol: str, shares: np.double) -> np.double:
+    def deal_with_transactions(self, batch: list[BatchTransaction], uuid: str) -> None:
         """
-        Handles the selling of shares from a user's portfolio. It fetches the user's shares from the database,
-        calculates the potential revenue based on current market prices, and updates the user's portfolio.
+        Processes a batch of transactions of a user, in order, at the prices of their stock records.
+        Every transaction is filled as `deal_with_transaction` would (buys are reduced to what the balance affords
+        at that point of the batch, sells consume the lots of their lot selection, including lots bought earlier
+        in the batch), but all of them are applied in one transaction: the balance is read once and changed once,
+        and the transactions and lots are written with one statement per kind of change.
 
         Args:
-            uuid (str): The unique identifier of the user who is selling the shares.
-            symbol (str): The stock symbol for which shares are being sold.
-            shares (np.double): The number of shares to sell.
+            batch (list[BatchTransaction]): The transactions. Their results are set on them.
+            uuid (str): The unique identifier for a user in the userbase.
 
         Returns:
-            Tuple[np.double, np.double]: A tuple containing two elements:
-                - Revenue generated from the sold shares.
-                - The number of shares that could not be sold (if any).
+            None: The class variable 'status' is set with the result of the batch, and each transaction's status with its own.
+                  If the batch fails, it is rolled back as a whole and no transaction is filled.
         """
-        shares_to_sell = copy.copy(shares)
-        if shares_to_sell <= 0:
-            logger.warning("Attempted to sell zero or fewer shares.")
-            return (0, shares)
+        with user_order_locks.hold(uuid):
+            self._deal_with_transactions(batch, uuid)
+
+    def _deal_with_transactions(self, batch: list[BatchTransaction], uuid: str) -> None:
+        valid: list[tuple[BatchTransaction, Optional[LotSelection]]] = []
+        for transaction in batch:
+            selection, error = validate_transaction(transaction.stock_record, uuid, transaction.lot_selection, transaction.lot_uids)
+            if error is not None:
+                transaction.status = error
+            else:
+                valid.append((transaction, selection))
+        if not valid:
+            self.status = "No valid transactions"
+            return
 
-        # Fetch the current market price for the symbol
-        symbol_info = get_symbol_info(symbol)
-        if not symbol_info or 'bid' not in symbol_info:
-            logger.error("Failed to fetch current market price.")
-            return (0, shares)
+        transactions_table = self.get_order_table(DatabasesNames.transactions.value, uuid)
+        portfolios_table = self.get_order_table(DatabasesNames.portfolios.value, uuid)
+        if transactions_table is None or portfolios_table is None:
+            logger.error(f"Could not retrieve the transactions and portfolio tables of user {uuid}")
+            self.status = "Internal Server Error"
+            self.failed = True
+            return
+        transactions_values = user_row_values(transactions_table, uuid)
+        portfolios_values = user_row_values(portfolios_table, uuid)
 
-        current_price = symbol_info['bid']
+        session: Session = next(get_db_execution())
+        try:
+            with session.begin():
+                user_balance = session.execute(select(Userbase.balance).where(Userbase.uuid == uuid)).scalar()
+                if user_balance is None:
+                    raise ValueError("Could not retrieve user from userbase")
+                balance = np.double(user_balance)
+
+                user_lots = None
+                if any(transaction.stock_record.side == "sell" for transaction, _ in valid):
+                    # Loaded before the buys, so the batch's own lots are in the index when it sells them
+                    user_lots = lot_index.get_user_lots(uuid, lambda: session.execute(select_user_lots(portfolios_table, uuid)).fetchall())
+
+                transaction_rows: dict[str, dict] = {}
+                # Lots opened by the batch, and lots opened before it that the batch sold from
+                new_lots: dict[str, tuple[Lot, dict]] = {}
+                consumed_lots: dict[str, Lot] = {}
+                for transaction, selection in valid:
+                    stock_record = transaction.stock_record
+                    if stock_record.side == "buy":
+                        if not fit_buy_to_balance(stock_record, balance):
+                            transaction.status = "Insufficient funds"
+                            continue
+                        balance -= stock_record.total_cost
+                        stock_record.status = Statuses.tracked.value
+                        stock_record_dict = stock_record.to_dict()
+                        transaction_rows[stock_record.uid] = {**stock_record_dict, **transactions_values}
+                        lot = Lot(stock_record.uid, stock_record.symbol, stock_record.timestamp, np.double(stock_record.shares), np.double(stock_record.cost_per_share))
+                        new_lots[lot.uid] = (lot, stock_record_dict)
+                        if user_lots is not None:
+                            user_lots.setdefault(lot.symbol, SymbolLots()).add(lot)
+                        else:
+                            lot_index.add_lot(uuid, lot)
+                        transaction.status = bought_status(stock_record)
+                    else:
+                        price = np.double(stock_record.cost_per_share)
+                        fill = fill_sell(user_lots, stock_record.symbol.upper(), np.double(stock_record.shares), price, selection, transaction.lot_uids)
+                        for lot, _ in fill.consumed:
+                            if lot.uid not in new_lots:
+                                consumed_lots[lot.uid] = lot
+                        stock_record.shares -= fill.unsold
+                        stock_record.cost_per_share = price
+                        stock_record.update_total_cost()
+                        stock_record.status = Statuses.archived.value
+                        transaction_rows[stock_record.uid] = {**stock_record.to_dict(), **transactions_values}
+                        balance += fill.revenue
+                        transaction.realized_pnl = fill.realized_pnl
+                        transaction.status = sold_status(stock_record, fill.revenue)
+                    transaction.filled = True
+
+                portfolio_rows = []
+                for uid, (lot, stock_record_dict) in new_lots.items():
+                    if lot.shares > 0:
+                        portfolio_rows.append({**stock_record_dict, "shares": lot.shares, **portfolios_values})
+                    else:
+                        # Bought and sold within the batch
+                        transaction_rows[uid]["status"] = Statuses.archived.value
+                reduced = [{"lot_uid": uid, "lot_shares": lot.shares} for uid, lot in consumed_lots.items() if lot.shares > 0]
+                exhausted_uids = [uid for uid, lot in consumed_lots.items() if lot.shares <= 0]
+
+                if reduced:
+                    session.execute(update(portfolios_table).where(portfolios_table.c.uid == bindparam("lot_uid")).values(shares=bindparam("lot_shares")), reduced)
+                if exhausted_uids:
+                    session.execute(update(transactions_table).where(transactions_table.c.uid.in_(exhausted_uids)).values(status=Statuses.archived.value))
+                    session.execute(delete(portfolios_table).where(portfolios_table.c.uid.in_(exhausted_uids)))
+                if transaction_rows:
+                    session.execute(insert_row(transactions_table), list(transaction_rows.values()))
+                if portfolio_rows:
+                    session.execute(insert_row(portfolios_table), portfolio_rows)
+
+                change = balance - np.double(user_balance)
+                if change != 0:
+                    # Only ever changed relatively, and only if the balance still covers the batch
+                    updated = session.execute(
+                        update(Userbase).
+                        where((Userbase.uuid == uuid) & (Userbase.balance + change >= 0)).
+                        values(balance=Userbase.balance + change)
+                    ).rowcount
+                    if updated != 1:
+                        raise ValueError(f"Balance no longer covers a change of {change}")
+
+            filled = sum(transaction.filled for transaction in batch)
+            if filled:
+                data_versions.bump(uuid)
+            self.status = f"Filled {filled} of {len(batch)} transactions"
+            logger.info(f"{uuid} {self.status}")
+        except Exception as error:
+            logger.error(f"Batch of user {uuid} was rolled back. Error: {error}")
+            lot_index.invalidate(uuid)
+            for transaction, _ in valid:
+                transaction.filled = False
+                transaction.realized_pnl = None
+                transaction.status = "Internal Server Error"
+            self.status = "Internal Server Error"
+            self.failed = True
+        finally:
+            session.close()
+
+    @staticmethod
+    def get_order_table(database_name: str, uuid: str) -> Union[Table, None]:
+        """ Get a user's table in the execution engine, generating the user's table first if it is missing. """
+        table = get_execution_table(database_name, uuid)
+        if table is None:
+            logger.warning(f"Table {uuid} was not found in {database_name}")
+            generate_table_by_id_for_selected_database(uuid=uuid, database_name=database_name)
+            table = get_execution_table(database_name, uuid)
+        return table
+
+    def buy_shares(self, session: Session, transactions_table: Table, portfolios_table: Table,
+                   stock_record: StockRecord, uuid: str, user_balance: np.double) -> str:
+        """
+        Buys shares inside the order's transaction: appends the transaction, opens a lot and debits the balance.
+        If the user cannot afford all the shares, the amount of shares the user can afford is bought.
 
-        portfolio_session: Session = next(get_db(DatabasesNames.portfolios.value))
-        transaction_session: Session = next(get_db(DatabasesNames.transactions.value))
+        Returns:
+            str: The status of the order.
+        """
+        if user_balance < stock_record.total_cost:
+            logger.warning(f"User {uuid} doesn't have enough money to buy {stock_record.shares} shares of {stock_record.symbol}. \
+                           As they cost {stock_record.total_cost} and the user only has {user_balance}")
+        if not fit_buy_to_balance(stock_record, user_balance):
+            logger.warning(f"The user doesn't have enough money to buy any amount of shares")
+            return "Insufficient funds"
+
+        # Remove cost of shares from user's balance, only if the balance still covers it
+        debited = session.execute(
+            update(Userbase).
+            where((Userbase.uuid == uuid) & (Userbase.balance >= stock_record.total_cost)).
+            values(balance=Userbase.balance - stock_record.total_cost)
+        ).rowcount
+        if debited != 1:
+            logger.warning(f"Balance of user {uuid} no longer covers {stock_record.total_cost}")
+            return "Insufficient funds"
+
+        # Update transaction to be tracked
+        stock_record.status = Statuses.tracked.value
+        stock_record_dict = stock_record.to_dict()
+
+        session.execute(insert_row(transactions_table), {**stock_record_dict, **user_row_values(transactions_table, uuid)})
+        session.execute(insert_row(portfolios_table), {**stock_record_dict, **user_row_values(portfolios_table, uuid)})
+        lot_index.add_lot(uuid, Lot(stock_record.uid, stock_record.symbol, stock_record.timestamp, np.double(stock_record.shares), np.double(stock_record.cost_per_share)))
+        logger.debug(f"Added transaction to transaction history and active portfolio of user {uuid}")
+
+        return bought_status(stock_record)
+
+    def sell_shares(self, session: Session, transactions_table: Table, portfolios_table: Table,
+                    stock_record: StockRecord, uuid: str, current_price: np.double,
+                    selection: LotSelection, lot_uids: Optional[list[str]] = None) -> str:
+        """
+        Sells shares inside the order's transaction. Lots are consumed in the order of the lot selection,
+        as picked from the user's lots in the lot index (loaded from the portfolio on the user's first sell),
+        exhausted lots are removed from the portfolio and archived in the transaction history,
+        the sell transaction is appended and the revenue is credited to the balance.
+        The realized profit and loss of every consumed lot is set in `realized_pnl`.
 
-        try:
-            shares_list = get_user_shares_by_symbol(DatabasesNames.portfolios.value, uuid, symbol, include_uid=True)
-            total_shares = sum([entry['shares'] for entry in shares_list])
-
-            revenue = 0
-
-            # Sort transactions by lowest cost per share when bought
-            shares_list.sort(key=lambda x: abs(x['cost_per_share']))
-
-            table_object_portfolios = get_table_object_from_selected_database_by_name(table_name=uuid, database_name=DatabasesNames.portfolios.value)
-            table_object_transactions = get_table_object_from_selected_database_by_name(table_name=uuid, database_name=DatabasesNames.transactions.value)
-
-            rows_uids_to_remove = []
-            for entry in shares_list:
-                uid = entry['uid']
-                shares = entry['shares']
-                if shares_to_sell <= 0:
-                    logger.debug(f"Done selling all shares")
-                    break
-
-                shares_to_reduce = min(shares, shares_to_sell)
-                revenue += shares_to_reduce * current_price
-                shares_to_sell -= shares_to_reduce
-
-                # Update the shares count in the database
-                new_share_count = shares - shares_to_reduce
-                if new_share_count > 0:
-                    update_stmt = update(table_object_portfolios).where(table_object_portfolios.c.uid == uid).values(shares=new_share_count)
-                    portfolio_session.execute(update_stmt)
-                    logger.info(f"Reduced {shares_to_reduce} shares from UID {uid} in transaction.")
-                else:
-                    # Archive the transaction if no shares remain
-                    archive_stmt = update(table_object_transactions).where(table_object_transactions.c.uid == uid).values(status=Statuses.archived.value)
-                    transaction_session.execute(archive_stmt)
-                    logger.info(f"Transaction UID {uid} archived as all shares are sold. {shares}")
+        Returns:
+            str: The status of the order.
+        """
+        user_lots = lot_index.get_user_lots(uuid, lambda: session.execute(select_user_lots(portfolios_table, uuid)).fetchall())
+        fill = fill_sell(user_lots, stock_record.symbol.upper(), np.double(stock_record.shares), current_price, selection, lot_uids)
+        shares_to_sell, revenue = fill.unsold, fill.revenue
+
+        exhausted_uids = []
+        for lot, shares_to_reduce in fill.consumed:
+            if lot.shares > 0:
+                session.execute(update(portfolios_table).where(portfolios_table.c.uid == lot.uid).values(shares=lot.shares))
+                logger.info(f"Reduced {shares_to_reduce} shares from UID {lot.uid} in transaction.")
+            else:
+                exhausted_uids.append(lot.uid)
 
-                    rows_uids_to_remove.append(uid)
+        if exhausted_uids:
+            # Archive the transactions whose shares were all sold and remove them from the portfolio
+            session.execute(update(transactions_table).where(transactions_table.c.uid.in_(exhausted_uids)).values(status=Statuses.archived.value))
+            session.execute(delete(portfolios_table).where(portfolios_table.c.uid.in_(exhausted_uids)))
+            logger.info(f"Transactions {exhausted_uids} archived as all of their shares are sold")
 
-            portfolio_session.commit()
-            transaction_session.commit()
-            
-            for row_uid in rows_uids_to_remove:
-                remove_row_by_uid(DatabasesNames.portfolios.value, uuid, row_uid)
+        if shares_to_sell > 0:
+            logger.warning(f"Not all shares could be sold; {shares_to_sell} shares remain unsold.")
 
-            if shares_to_sell > 0:
-                logger.warning(f"Not all shares could be sold; {shares_to_sell} shares remain unsold.")
+        stock_record.shares -= shares_to_sell
+        stock_record.cost_per_share = current_price
+        stock_record.update_total_cost()
+        stock_record.status = Statuses.archived.value
+        session.execute(insert_row(transactions_table), {**stock_record.to_dict(), **user_row_values(transactions_table, uuid)})
 
-            return revenue, shares_to_sell
-        except Exception as error:
-            import traceback
-            portfolio_session.rollback()
-            transaction_session.rollback()
-            logger.error(f"Error while trying to sell shares for user {uuid}: {error}")
-            logger.error(traceback.format_exc())
-            return (0,shares)
-        finally:
-            portfolio_session.close()
-            transaction_session.close()
+        self.realized_pnl = fill.realized_pnl
+
+        # Add to user balance
+        session.execute(
+            update(Userbase).
+            where(Userbase.uuid == uuid).
+            values(balance=Userbase.balance + revenue)
+        )
+
+        return sold_status(stock_record, revenue)
 
 
 # for scheduler example see previous commits for a function that was here
\ No newline at end of file
@@ -0,0 +1,255 @@
+from typing import Optional
+from dataclasses import dataclass
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+
+from fastapi import Header, HTTPException
+
+from records.records import ServerResponse
+from utils.encryption import decrypt
+from utils.logger_script import logger
+from utils.env_variables import ACCESS_TOKEN_KEYS, ACCESS_TOKEN_TTL, ENCRYPTION_KEY
+
+TOKEN_VERSION = "v1"
+# Key IDs end up in the tokens, which are split on dots
+KEY_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+@dataclass
+class AccessToken:
+    """
+    The claims of a verified access token.
+
+    Attributes:
+        uuid (str): The user the token was issued to.
+        issued_at (int): When it was issued (microseconds since the epoch).
+        expires_at (int): When it expires (seconds since the epoch).
+        token_id (str): Unique ID of the token, used to revoke it.
+        key_id (str): ID of the key it was signed with.
+    """
+    uuid: str
+    issued_at: int
+    expires_at: int
+    token_id: str
+    key_id: str
+
+def _base64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def parse_keys(keys: str) -> dict[str, bytes]:
+    """
+    Parses `<key id>:<base64 key>` pairs separated by commas, in order (the first one signs).
+
+    Raises:
+        ValueError: If a key ID is not made of letters, digits, `_` and `-`, or a key is shorter than 32 bytes.
+    """
+    parsed = {}
+    for pair in filter(None, (pair.strip() for pair in keys.split(","))):
+        key_id, _, key = pair.partition(":")
+        if not KEY_ID_PATTERN.match(key_id):
+            raise ValueError(f"Invalid access token key ID: {key_id}")
+        key = base64.b64decode(key)
+        if len(key) < 32:
+            raise ValueError(f"Access token key {key_id} is shorter than 32 bytes")
+        parsed[key_id] = key
+    return parsed
+
+class TokenService:
+    """
+    Issues and verifies signed, expiring access tokens, so a user is authenticated by one HMAC check of the token
+    instead of decrypting their uuid on every request, and without any database access.
+
+    A token is `v1.<key id>.<uuid>.<issued at>.<expires at>.<token id>.<HMAC-SHA256 of the rest>`.
+    The keys are held in memory by ID: `rotate` starts signing with a new key while tokens signed with the older
+    ones stay valid until they expire (after which the older keys are dropped), and `retire` drops a key at once.
+    Revoked tokens and users (all of a user's tokens issued until then, e.g. after a password change) are kept
+    in memory until the tokens they cover expire. Every server process has its own keys and revocations, so
+    running several processes needs the same `ACCESS_TOKEN_KEYS` (and revocations do not cross processes).
+
+    Args:
+        keys (dict[str, bytes]): Keys by ID, the first one signs.
+        ttl (int): Seconds a token is valid.
+    """
+    def __init__(self, keys: dict[str, bytes], ttl: int):
+        if not keys:
+            raise ValueError("Access tokens need at least one key")
+        self.ttl = ttl
+        self.stats = {"issued": 0, "verified": 0, "invalid": 0, "expired": 0, "revoked": 0, "rotations": 0}
+        self._keys = dict(keys)
+        self._active_key_id = next(iter(keys))
+        # Key IDs by the time (seconds since the epoch) after which they are dropped
+        self._retiring: dict[str, float] = {}
+        self._revoked_tokens: dict[str, int] = {}
+        self._revoked_users: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sign(self, key: bytes, message: str) -> str:
+        return _base64url(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+    def issue(self, uuid: str) -> tuple[str, int]:
+        """
+        Issues an access token to a user.
+
+        Returns:
+            tuple[str, int]: The token, and when it expires (seconds since the epoch).
+        """
+        with self._lock:
+            key_id = self._active_key_id
+            key = self._keys[key_id]
+            # Later than the user's last revocation, even within the same microsecond
+            issued_at = max(time.time_ns() // 1000, self._revoked_users.get(uuid, 0) + 1)
+            self.stats["issued"] += 1
+        expires_at = issued_at // 1_000_000 + self.ttl
+        message = ".".join((TOKEN_VERSION, key_id, uuid, str(issued_at), str(expires_at), _base64url(os.urandom(12))))
+        return f"{message}.{self._sign(key, message)}", expires_at
+
+    def verify(self, token: str) -> Optional[AccessToken]:
+        """
+        Verifies an access token.
+
+        Returns:
+            AccessToken: The token's claims, None if it is malformed, signed with an unknown key, expired or revoked.
+        """
+        message, _, signature = token.rpartition(".")
+        parts = message.split(".")
+        if len(parts) != 6 or parts[0] != TOKEN_VERSION:
+            self.stats["invalid"] += 1
+            return None
+        _, key_id, uuid, issued_at, expires_at, token_id = parts
+        now = time.time()
+        with self._lock:
+            key = self._keys.get(key_id)
+            retire_at = self._retiring.get(key_id)
+            if retire_at is not None and now >= retire_at:
+                self._drop_key(key_id)
+                key = None
+        if key is None or not hmac.compare_digest(self._sign(key, message), signature):
+            self.stats["invalid"] += 1
+            return None
+
+        access_token = AccessToken(uuid, int(issued_at), int(expires_at), token_id, key_id)
+        if access_token.expires_at <= now:
+            self.stats["expired"] += 1
+            return None
+        with self._lock:
+            revoked = token_id in self._revoked_tokens or access_token.issued_at <= self._revoked_users.get(uuid, 0)
+        if revoked:
+            self.stats["revoked"] += 1
+            return None
+        self.stats["verified"] += 1
+        return access_token
+
+    def revoke(self, access_token: AccessToken) -> None:
+        """ Revokes a token (e.g. when its user signs out). """
+        with self._lock:
+            self._prune()
+            self._revoked_tokens[access_token.token_id] = access_token.expires_at
+
+    def revoke_user(self, uuid: str) -> None:
+        """ Revokes every token issued to a user until now (e.g. when their password changes or they are deleted). """
+        with self._lock:
+            self._prune()
+            self._revoked_users[uuid] = time.time_ns() // 1000
+
+    def rotate(self, key_id: Optional[str] = None, key: Optional[bytes] = None) -> str:
+        """
+        Starts signing with a new key. Tokens signed with the older keys stay valid until they expire.
+
+        Args:
+            key_id (str, optional): ID of the new key, generated if None.
+            key (bytes, optional): The new key, at least 32 bytes, random if None.
+
+        Returns:
+            str: The ID of the new key.
+        """
+        key_id = key_id or _base64url(os.urandom(6))
+        key = key or os.urandom(32)
+        if not KEY_ID_PATTERN.match(key_id) or len(key) < 32:
+            raise ValueError("Invalid access token key")
+        with self._lock:
+            if key_id in self._keys:
+                raise ValueError(f"Access token key {key_id} already exists")
+            retire_at = time.time() + self.ttl
+            for older_key_id in self._keys:
+                self._retiring.setdefault(older_key_id, retire_at)
+            self._keys[key_id] = key
+            self._active_key_id = key_id
+            self.stats["rotations"] += 1
+        logger.info(f"Access tokens are now signed with key {key_id}")
+        return key_id
+
+    def retire(self, key_id: str) -> bool:
+        """ Drops a key at once, invalidating every token signed with it. The signing key cannot be retired. """
+        with self._lock:
+            if key_id == self._active_key_id or key_id not in self._keys:
+                return False
+            self._drop_key(key_id)
+            return True
+
+    def _drop_key(self, key_id: str) -> None:
+        self._keys.pop(key_id, None)
+        self._retiring.pop(key_id, None)
+        logger.info(f"Dropped access token key {key_id}")
+
+    def _prune(self) -> None:
+        # Revocations are kept until the tokens they cover expire
+        now = time.time()
+        self._revoked_tokens = {token_id: expires_at for token_id, expires_at in self._revoked_tokens.items() if expires_at > now}
+        oldest_valid = (time.time_ns() // 1000) - self.ttl * 1_000_000
+        self._revoked_users = {uuid: revoked_at for uuid, revoked_at in self._revoked_users.items() if revoked_at > oldest_valid}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "ttl": self.ttl,
+                "active_key": self._active_key_id,
+                "keys": list(self._keys),
+                "retiring": dict(self._retiring),
+                "revoked_tokens": len(self._revoked_tokens),
+                "revoked_users": len(self._revoked_users),
+            }
+
+def _create_token_service() -> TokenService:
+    keys = parse_keys(ACCESS_TOKEN_KEYS)
+    if not keys:
+        # Derived from the shared key, so the tokens survive restarts without configuring a key of their own
+        keys = {"default": hmac.new(base64.b64decode(ENCRYPTION_KEY), b"access tokens", hashlib.sha256).digest()}
+    return TokenService(keys, ttl=int(ACCESS_TOKEN_TTL))
+
+token_service = _create_token_service()
+
+def _unauthorized(error: str) -> HTTPException:
+    return_dict = ServerResponse()
+    return_dict.error = error
+    return HTTPException(status_code=401, detail=return_dict.to_dict(), headers={"WWW-Authenticate": "Bearer"})
+
+# The dependencies are async as checking a token takes microseconds, FastAPI would run sync ones in its thread pool
+async def get_access_token(authorization: Optional[str] = Header(default=None)) -> AccessToken:
+    """ Dependency of the routes that need an access token: the verified token of the `Authorization: Bearer` header. """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _unauthorized("Missing access token. Sign in again")
+    access_token = token_service.verify(token.strip())
+    if access_token is None:
+        raise _unauthorized("Invalid or expired access token. Sign in again")
+    return access_token
+
+async def get_user_uuid(uuid: Optional[str] = None, authorization: Optional[str] = Header(default=None)) -> str:
+    """
+    Dependency of the user routes: the uuid of the requesting user, from the access token of the
+    `Authorization: Bearer` header, or from the encrypted `uuid` parameter sent by older clients.
+    """
+    if authorization is not None:
+        return (await get_access_token(authorization)).uuid
+    if uuid is None:
+        raise _unauthorized("Missing access token. Sign in again")
+    try:
+        return decrypt(uuid)
+    except Exception as error:
+        logger.error(f"Failed decrypting uuid parameter. Error: {error}")
+        raise _unauthorized("Invalid uuid")
@@ -1,25 +1,56 @@
-from typing import Union
-
-import yfinance as yf
+from typing import Union, Optional, Iterable
 
 from utils.logger_script import logger
+from utils.quote_cache import quote_cache, PRICE_FIELDS
 
 
-def get_symbol_info(symbol: str) -> Union[dict, None]:
+def get_symbol_info(symbol: str, fields: Optional[Iterable[str]] = None) -> Union[dict, None]:
     """
     Get yfinance's "info" for a symbol. Returns a dict if valid for most symbols, 
     sometimes the dictionary will be invalid and an error should pop up.
+    The info is served from the process-wide quote cache, pass `fields` to only require those to be fresh.
     """
     if symbol is None:
         logger.error(f"Entered symbol is None")
+        return None
     try:
-        ticker = yf.Ticker(symbol)
+        return quote_cache.get_info(symbol, fields=fields)
     except Exception as error:
         logger.error(f"Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
         return None
+
+
+async def get_symbol_info_async(symbol: str, fields: Optional[Iterable[str]] = None) -> Union[dict, None]:
+    """ Async variant of `get_symbol_info`, for callers on an event loop. A miss is fetched without blocking the loop. """
+    if symbol is None:
+        logger.error(f"Entered symbol is None")
+        return None
     try:
-        info = ticker.info
-        return info
+        return await quote_cache.get_info_async(symbol, fields=fields)
     except Exception as error:
-        logger.error(f"222 Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
-        return None
\ No newline at end of file
+        logger.error(f"Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
+        return None
+
+
+def get_current_prices(symbols: Iterable[str], timeout: Optional[float] = None) -> dict[str, Union[float, None]]:
+    """
+    Get the current price of a list of symbols in one batched pass of the quote cache.
+    Symbols whose price could not be fetched within `timeout` seconds get their last known price if there is one, otherwise None.
+    """
+    symbols = list(symbols)
+    batch = quote_cache.get_quotes(symbols, fields=PRICE_FIELDS, timeout=timeout)
+    for symbol, error in batch.errors.items():
+        if symbol not in batch.stale:
+            logger.error(f"Couldn't get current price for {symbol}. {error}")
+    return {symbol: batch.quotes.get(symbol.upper(), {}).get("currentPrice") for symbol in symbols}
+
+
+def get_symbols_info(symbols: Iterable[str], fields: Iterable[str]) -> dict[str, dict]:
+    """
+    Get the same fields of a list of symbols in one batched pass of the quote cache, by upper case symbol.
+    Symbols whose fields could not be fetched are left out.
+    """
+    batch = quote_cache.get_quotes(symbols, fields=fields)
+    for symbol, error in batch.errors.items():
+        logger.error(f"Couldn't get info of {symbol}. {error}")
+    return batch.quotes
@@ -0,0 +1,163 @@
+from typing import Optional
+from bisect import bisect_left
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.logger_script import logger
+from utils.env_variables import FASTAPI_IP, FASTAPI_PORT, BACKEND_POOL_SIZE, BACKEND_RETRIES, BACKEND_RETRY_BACKOFF, BACKEND_TIMEOUT
+
+# Only these are retried, a retried POST could submit an order twice
+IDEMPOTENT_METHODS = frozenset({"GET", "PUT", "DELETE", "HEAD", "OPTIONS"})
+# Upper bounds (in milliseconds) of the buckets of the latency histograms
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+class LatencyHistogram:
+    """ Fixed bucket histogram of request latencies. Percentiles are reported as the upper bound of their bucket. """
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, milliseconds: float, failed: bool = False) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+        self.count += 1
+        self.errors += int(failed)
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+
+    def percentile(self, fraction: float) -> float:
+        target = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "buckets": {f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts) if count},
+        }
+
+class BackendClient:
+    """
+    Client of the FastAPI server, sharing one pooled `requests.Session` per process.
+
+    Connections (and their TLS sessions) are kept alive and reused instead of being opened for every request,
+    idempotent requests are retried with exponential backoff, and the latency of every endpoint is recorded.
+
+    Args:
+        base_url (str): URL of the FastAPI server.
+        pool_size (int): Maximum number of kept-alive connections per process.
+        retries (int): Number of retries of idempotent requests that failed to connect or got a 502/503/504.
+        backoff (float): Backoff factor in seconds between retries (backoff * 2 ** (retry - 1)).
+        timeout (float): Timeout of a single request in seconds.
+    """
+    def __init__(self, base_url: str, pool_size: int, retries: int, backoff: float, timeout: float):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._histograms: dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        # Connections must not be shared with forked worker processes
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = self._create_session()
+                self._session_pid = os.getpid()
+                logger.debug(f"Created backend session with a pool of {self.pool_size} connections")
+            return self._session
+
+    def request(self, method: str, endpoint: str, params: dict = None, headers: dict = None, data: bytes = None) -> requests.Response:
+        """
+        Sends a request to an endpoint of the FastAPI server.
+
+        Args:
+            method (str): The HTTP method.
+            endpoint (str): The endpoint, relative to the server's URL.
+            params (dict, optional): The query parameters.
+            headers (dict, optional): Headers of this request (e.g. the user's access token).
+            data (bytes, optional): The body (e.g. the envelope of the request's parameters).
+
+        Returns:
+            requests.Response: The server's response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request failed after its retries.
+        """
+        method = method.upper()
+        start = time.perf_counter()
+        failed = True
+        try:
+            # The FastAPI server uses a self signed certificate. Passed per request, as a CA bundle
+            # environment variable would take precedence over the session's setting
+            response = self.session.request(method, f"{self.base_url}/{endpoint}", params=params, headers=headers, data=data, timeout=self.timeout, verify=False)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._record(f"{method} {endpoint}", (time.perf_counter() - start) * 1000, failed)
+
+    def _record(self, key: str, milliseconds: float, failed: bool) -> None:
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._histograms[key] = histogram
+            histogram.record(milliseconds, failed)
+
+    def get_stats(self) -> dict:
+        """ The latency histogram of every endpoint, and the client's configuration. """
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "retries": self.retries,
+                "timeout": self.timeout,
+                "endpoints": {key: histogram.to_dict() for key, histogram in sorted(self._histograms.items())},
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+backend_client = BackendClient(
+    base_url=f"{FASTAPI_IP}:{FASTAPI_PORT}",
+    pool_size=int(BACKEND_POOL_SIZE),
+    retries=int(BACKEND_RETRIES),
+    backoff=float(BACKEND_RETRY_BACKOFF),
+    timeout=float(BACKEND_TIMEOUT),
+)
@@ -1,23 +1,39 @@
 from enum import Enum
-from typing import Union, Any
 import requests
 from urllib3.exceptions import MaxRetryError
 
 from flask import session
 
 from utils import logger
-from utils.env_variables import FASTAPI_IP, FASTAPI_PORT
-from comms.encryption import encrypt
-
-FASTAPI_SERVER_URL = f"{FASTAPI_IP}:{FASTAPI_PORT}"
+from comms.encryption import encrypt, seal, ENVELOPE_CONTENT_TYPE
+from comms.backend_client import backend_client
+from utils.fragment_cache import fragment_cache
 
 class FastAPIRoutes(Enum):
     sign_up = "sign_up"
     sign_in = "sign_in"
+    sign_out = "sign_out"
     update_user = "update" # add attribute to update at the end
     submit_order = "submit_order"
     get_portfolio ="get_user/summary"
+    get_version = "get_user/version"
     get_database = "get_user/database"
+    get_pnl = "get_user/pnl"
+    get_equity_curve = "get_user/equity_curve"
+    get_risk = "get_user/risk"
+    get_bars = "bars" # add symbol at the end
+
+# Keys of the session set at sign in
+USER_SESSION_KEYS = ("username", "uuid", "email", "token", "token_expires_at")
+
+def clear_user_session() -> None:
+    """ Signs the user out of the Flask app, by removing what was saved in their session at sign in. """
+    if "uuid" in session:
+        fragment_cache.invalidate(session["uuid"])
+    for key in USER_SESSION_KEYS:
+        session.pop(key, None)
+    # Saved by older versions
+    session.pop("password", None)
 
 def get_response(endpoint: str, method: str, data_to_send: dict = {}) -> dict:
     """
@@ -38,43 +54,48 @@ def get_response(endpoint: str, method: str, data_to_send: dict = {}) -> dict:
         HTTPException: If the request fails for reasons such as network errors or server-side issues.
 
     Notes:
-        - The function automatically handles encryption of the data sent based on predefined requirements.
-        - It also manages specific routing and parameter inclusion for certain types of requests identified by their endpoints.
+        - The data is serialized and encrypted once, as a single envelope sent in the body (see `seal`).
+        - Requests of the user's own data carry the access token received at sign in, in the `Authorization` header.
+          If the server refuses it (expired or revoked), the user is signed out.
+        - Requests go through the pooled `backend_client`, which keeps connections alive and retries idempotent requests.
     """
     try:
-        
-        routes_that_need_uuid = [FastAPIRoutes.get_portfolio.value, FastAPIRoutes.submit_order.value, FastAPIRoutes.update_user.value, FastAPIRoutes.get_database.value]
-        # Add uuid for special endpoints
-        if any(endpoint.startswith(route) for route in routes_that_need_uuid):
-            data_to_send["uuid"] = session["uuid"]
-        if endpoint.startswith(FastAPIRoutes.update_user.value):
-            data_to_send["password"] = session["password"]
-
-        # Encrypt each value in the data_to_send dictionary before sending
-        encrypted_data = {key: encrypt(value) for key, value in data_to_send.items()}
-
-        # Get the correct requests method based on the string
-        method_func: Union[requests.get, requests.post, requests.delete, requests.put] = getattr(requests, method.lower(), None)
+        routes_that_need_user = [FastAPIRoutes.get_portfolio.value, FastAPIRoutes.get_version.value, FastAPIRoutes.submit_order.value, FastAPIRoutes.update_user.value, FastAPIRoutes.get_database.value, FastAPIRoutes.get_pnl.value, FastAPIRoutes.get_equity_curve.value, FastAPIRoutes.get_risk.value, FastAPIRoutes.sign_out.value]
+        headers = {}
+        params = None
+        # Identify the user of special endpoints by the access token they were given at sign in
+        if any(endpoint.startswith(route) for route in routes_that_need_user):
+            if "token" in session:
+                headers["Authorization"] = f"Bearer {session["token"]}"
+            else:
+                # Signed in before access tokens, the server reads the uuid from the parameters
+                params = {"uuid": encrypt(session["uuid"])}
 
-        if not method_func:
+        if method.lower() not in ['get', 'delete', 'post', 'put']:
             raise ValueError(f"Unsupported HTTP method: {method}")
 
-        # Prepare the URL
-        url = f"{FASTAPI_SERVER_URL}/{endpoint}"
+        # Serialize and encrypt the whole data once, instead of every value on its own
+        body = None
+        if data_to_send:
+            headers["Content-Type"] = ENVELOPE_CONTENT_TYPE
+            body = seal(data_to_send, method, endpoint)
 
-        # Depending on the method, we may need to send data differently
-        if method.lower() in ['get', 'delete', 'post', 'put']:
-            response = method_func(url, params=encrypted_data, verify=False, timeout=5)
+        response = backend_client.request(method, endpoint, params=params, headers=headers or None, data=body)
         
         try:
             logger.debug(f"Got response from fastAPI server: {response.status_code}")
             response_json: dict = response.json()
+            if response.status_code == 401:
+                # The access token expired or was revoked, so the user has to sign in again
+                logger.info(f"Access token of user {session.get("username")} was refused, signing them out")
+                clear_user_session()
+                return response_json.get("detail", response_json)
             logger.debug(f"Data: {response_json}")
             return response_json 
         except Exception as error:
             logger.error(f"Failed to get json of response")
             return None
-    except MaxRetryError as error:
+    except (MaxRetryError, requests.exceptions.RetryError) as error:
         logger.error(f"Got too many retries for server: {error}")
         return {"internal_error": error}
     except Exception as error:
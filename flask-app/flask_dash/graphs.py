@@ -1,6 +1,7 @@
 from dash import dcc
 import dash_bootstrap_components as dbc
 from plotly import express as px
+from plotly import graph_objects as go
 
 from .flask_dash_integrator import FlaskDash
 
@@ -42,6 +43,34 @@ class GraphCreator:
         )
         return page_layout
 
+    @staticmethod
+    def create_chart_line(x_values: list = None, lines: dict = None):
+        """
+        Generates a line chart of one or more series sharing the same x values.
+
+        Parameters:
+            x_values (list, optional): The x values, e.g. dates.
+            lines (dict, optional): A dictionary where keys are the names of the lines and
+                                values are their y values, one for each x value.
+
+        Returns:
+            dbc.Container: A Dash Bootstrap Container component that includes the generated line chart.
+        """
+        if x_values is None or lines is None:
+            x_values = [0, 1, 2, 3, 4]
+            lines = {"default": [1, 2, 3, 4, 5]}
+
+        # A trace per line, so each keeps its name in the legend
+        fig = go.Figure([go.Scatter(x=x_values, y=values, mode="lines", name=name) for name, values in lines.items()])
+
+        page_layout = dbc.Container(
+            [
+                dcc.Graph(figure=fig) 
+            ],
+            fluid=True,
+        )
+        return page_layout
+
 class DashPieChart:
     def __init__(self, server, route: str, data: dict = None):
         self.flask_dash_app = FlaskDash(
@@ -51,4 +80,15 @@ class DashPieChart:
         self.change_page_layout(data)
 
     def change_page_layout(self, data_for_graph: dict):
-        self.flask_dash_app.layout = GraphCreator.create_chart_pie(data_for_graph)
\ No newline at end of file
+        self.flask_dash_app.layout = GraphCreator.create_chart_pie(data_for_graph)
+
+class DashLineChart:
+    def __init__(self, server, route: str, x_values: list = None, lines: dict = None):
+        self.flask_dash_app = FlaskDash(
+            server=server,
+            routes_pathname_prefix=route,
+        )
+        self.change_page_layout(x_values, lines)
+
+    def change_page_layout(self, x_values: list, lines: dict):
+        self.flask_dash_app.layout = GraphCreator.create_chart_line(x_values, lines)
\ No newline at end of file
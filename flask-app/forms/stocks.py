@@ -1,7 +1,7 @@
 from typing import override
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, DecimalField, SelectField, BooleanField, RadioField, FloatField, SubmitField
+from wtforms import StringField, DecimalField, SelectField, SelectMultipleField, BooleanField, RadioField, FloatField, SubmitField
 from wtforms.validators import DataRequired, Optional, NumberRange 
 
 from forms.helper import DefaultFormValidators
@@ -15,8 +15,8 @@ class SymbolPickForm(FlaskForm):
 
 class TradeForm(FlaskForm):
     """
-    The platform only allows for market orders for now, so this form is
-    supporting different order types but only market types are allowed.
+    Market orders are executed right away. Limit, stop and stop-limit orders rest on the server
+    until the market reaches their price, or until the market closes for DAY orders.
     """
     order_type = SelectField(
         "Order Type", 
@@ -40,6 +40,21 @@ class TradeForm(FlaskForm):
         "Stop Price", 
         validators=[Optional(), NumberRange(min=0, message=DefaultFormValidators.number_error_message)]
     )
+    lot_selection = SelectField(
+        "Lots to Sell",
+        choices=[
+            ('', 'Default'), ('fifo', 'First In, First Out'), ('lifo', 'Last In, First Out'),
+            ('lowest_cost', 'Lowest Cost'), ('highest_cost', 'Highest Cost'), ('specific', 'Specific Lots'),
+        ],
+        validators=[Optional()],
+        default='',
+    )
+    # Choices are the user's open lots of the symbol (oldest first, the order they are sold from), set by the stock dashboard
+    lot_uids = SelectMultipleField(
+        "Lots to Sell From",
+        choices=[],
+        validators=[Optional()],
+    )
     time_in_force = SelectField(
         "Time in Force", 
         choices=[('day', 'Day'), ('gtc', 'GTC')], 
@@ -3,6 +3,11 @@ from requests import Response
 from flask import current_app as flask_app, jsonify, render_template, abort
 from werkzeug.utils import import_string
 
+from utils.quote_cache import quote_cache
+from utils.quote_stream import quote_hub
+from utils.fragment_cache import fragment_cache
+from comms.backend_client import backend_client
+
 
 @flask_app.route('/routes', methods=['GET'])
 def routes_info():
@@ -31,4 +36,44 @@ def routes_info():
                 flask_app.logger.error("Error processing rule: %s" % rule.rule, exc_info=True)
                 routes.append((rule.rule, 'ERROR', 'Invalid route definition!'))
 
-    return render_template('admin/routes.html', routes=routes)
\ No newline at end of file
+    return render_template('admin/routes.html', routes=routes)
+
+@flask_app.route('/quote_cache', methods=['GET'])
+def quote_cache_stats():
+    """
+    Show the hit/miss/latency counters of the quote cache only when in debug mode.
+    """
+    if not flask_app.config.get('DEBUG', False):
+        abort(403, description="Access denied: Quote cache statistics are available only in debug mode.")
+
+    return jsonify(quote_cache.get_stats())
+
+@flask_app.route('/quote_stream', methods=['GET'])
+def quote_stream_stats():
+    """
+    Show the viewers, polls and fan-out counters of the live quote streams only when in debug mode.
+    """
+    if not flask_app.config.get('DEBUG', False):
+        abort(403, description="Access denied: Quote stream statistics are available only in debug mode.")
+
+    return jsonify(quote_hub.get_stats())
+
+@flask_app.route('/backend_latency', methods=['GET'])
+def backend_latency_stats():
+    """
+    Show the per endpoint latency histograms of the requests to the FastAPI server only when in debug mode.
+    """
+    if not flask_app.config.get('DEBUG', False):
+        abort(403, description="Access denied: Backend latency statistics are available only in debug mode.")
+
+    return jsonify(backend_client.get_stats())
+
+@flask_app.route('/fragment_cache', methods=['GET'])
+def fragment_cache_stats():
+    """
+    Show the hit/miss/render counters of the cached page fragments only when in debug mode.
+    """
+    if not flask_app.config.get('DEBUG', False):
+        abort(403, description="Access denied: Fragment cache statistics are available only in debug mode.")
+
+    return jsonify(fragment_cache.get_stats())
@@ -1,7 +1,10 @@
 from flask import current_app as flask_app
 
-from flask_dash.graphs import DashPieChart
+from flask_dash.graphs import DashPieChart, DashLineChart
 
 # The following components are actually routes in the website and used as iFrames
 shares_graph = DashPieChart(flask_app, r"/my/portfolio/graphs/shares/")
-worths_graph = DashPieChart(flask_app, r"/my/portfolio/graphs/worths/")
\ No newline at end of file
+worths_graph = DashPieChart(flask_app, r"/my/portfolio/graphs/worths/")
+volatility_graph = DashLineChart(flask_app, r"/my/portfolio/graphs/volatility/")
+equity_graph = DashLineChart(flask_app, r"/my/dashboard/graphs/equity/")
+returns_graph = DashLineChart(flask_app, r"/my/dashboard/graphs/returns/")
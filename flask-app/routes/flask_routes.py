@@ -1,9 +1,10 @@
 from datetime import timedelta
-from typing import Union
+from typing import Union, Callable
 from collections import defaultdict
+from functools import partial
 
 from flask import current_app as flask_app
-from flask import render_template, redirect, session, request
+from flask import render_template, redirect, session, request, Response, abort, make_response
 from flask.helpers import url_for
 from wtforms import SubmitField
 
@@ -11,15 +12,18 @@ from wtforms import SubmitField
 from utils.render_readme import get_rendered_readme 
 from utils.logger_script import logger
 from utils.yfinance_helper import get_current_prices_of_symbol_list, get_symbol_info
+from utils.quote_stream import quote_hub, stream_events
+from utils.fragment_cache import fragment_cache, get_etag, PRICE_TTL, RISK_TTL
 
 from forms.userbase import SignUpForm, SignInForm, UpdateUserForm
 from forms.stocks import SymbolPickForm, TradeForm, get_locked_trade_form
 
-from comms.communications import get_response, FastAPIRoutes
+from comms.communications import get_response, FastAPIRoutes, clear_user_session
 
 from routes.utils.user_feedbacks import UserFeedbacks
 from routes.utils.auth import _signed_in, sign_in_required, redirect_to_access_denied
-from routes.dash_routes import shares_graph, worths_graph
+from templates.utils import format_iso_datetime
+from routes.dash_routes import shares_graph, worths_graph, volatility_graph, equity_graph, returns_graph
 
 class InternalError(Exception):
     """
@@ -87,9 +91,10 @@ def stock_dashboard(symbol: str = None):
         
         # Tradeform part
         trade_form = TradeForm()
+        set_lot_choices(trade_form, symbol)
         
         # Verify symbol exists / is compatable with website
-        info = get_symbol_info(symbol)
+        info = get_symbol_info(symbol, fields=["bid", "ask"])
         info_keys_list = list(info.keys())
         if "bid" not in info_keys_list or "ask" not in info_keys_list:
             info = None
@@ -102,6 +107,16 @@ def stock_dashboard(symbol: str = None):
             logger.debug(f"Trade form submitted")
             order = trade_form.data
             order["symbol"] = symbol
+            # Decimal fields are not JSON serializable
+            for price_field in ("limit_price", "stop_price"):
+                if order[price_field] is not None:
+                    order[price_field] = float(order[price_field])
+            # Lots are only picked by market sells, the server's default selection is used if none is chosen
+            if order["side"] != "sell" or order["order_type"] != "market" or not order["lot_selection"]:
+                order.pop("lot_selection")
+                order.pop("lot_uids")
+            elif order["lot_selection"] != "specific":
+                order.pop("lot_uids")
             logger.debug(f"Submitting form to server: {order}")
             # Submit order to server
             response = get_response(
@@ -116,6 +131,8 @@ def stock_dashboard(symbol: str = None):
                 if response["success"] is True:
                     logger.info(f"Order for {order["shares"]} shares of {order["symbol"]} has been successful")
                     trade_feedback = response["data"]
+                    if isinstance(response.get("extra"), dict) and response["extra"].get("lots"):
+                        trade_feedback += f". Realized P&L of {len(response["extra"]["lots"])} lots: {response["extra"]["total"]:.2f}"
                     keep_form_data = False
                 else:
                     logger.error(f"Order {order} has failed")
@@ -134,6 +151,8 @@ def stock_dashboard(symbol: str = None):
         
         if not keep_form_data:
             trade_form = TradeForm(formdata=None)
+            # The order may have opened or sold lots
+            set_lot_choices(trade_form, symbol)
         
         return render_template(
             "stocks/stock_dashboard.html", 
@@ -155,6 +174,125 @@ def stock_dashboard(symbol: str = None):
             trade_feedback=trade_feedback
         )
 
+def set_lot_choices(trade_form: TradeForm, symbol: str) -> None:
+    """
+    Sets the signed in user's open lots of a symbol as the lots a sell can pick, oldest first.
+    The lots are the ones of the cached portfolio summary, so the dashboard asks the server only for the data version.
+    """
+    if session.get("uuid") is None:
+        return
+    try:
+        summary = fragment_cache.render(session["uuid"], "portfolio_summary", get_data_version(), render_portfolio_summary)
+        lots = summary.context["symbols"].get(symbol, [])
+    except Exception as error:
+        logger.error(f"Failed to get the lots of {symbol}, specific lots cannot be picked. Error: {error}")
+        return
+    trade_form.lot_uids.choices = [
+        (lot["uid"], f"{lot["shares"]:.2f} shares at ${lot["cost_per_share"]:.2f}, bought {format_iso_datetime(lot["timestamp"])}")
+        for lot in lots if "uid" in lot
+    ]
+
+@flask_app.route("/stream/quotes/<symbol>", methods=["GET"])
+def stream_quotes(symbol: str):
+    """
+    Streams the live bid and ask of a symbol to the stock dashboard as Server-Sent Events:
+    a snapshot of the quote, then only the fields that changed. Every viewer of a symbol shares one upstream poll.
+
+    Args:
+        symbol (str): The stock symbol to stream.
+    Returns:
+        A text/event-stream response that stays open until the client disconnects.
+    """
+    if not symbol or len(symbol) > 15 or not all(character.isalnum() or character in ".-^=" for character in symbol):
+        abort(400, description="Invalid symbol")
+    return Response(
+        stream_events(quote_hub, symbol),
+        mimetype="text/event-stream",
+        # Never cached, and not buffered by a reverse proxy
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def get_pnl() -> Union[dict, None]:
+    """ Get the P&L of the signed in user's portfolio from the server, or None if it failed. """
+    response = get_response(endpoint=FastAPIRoutes.get_pnl.value, method="get")
+    if "internal_error" in response.keys() or not response.get("success"):
+        logger.error(f"Failed to get P&L: {response.get("internal_error") or response.get("error")}")
+        return None
+    return response["data"]
+
+def get_risk() -> Union[dict, None]:
+    """ Get the risk analytics of the signed in user's holdings from the server, or None if it failed. """
+    response = get_response(endpoint=FastAPIRoutes.get_risk.value, method="get")
+    if "internal_error" in response.keys() or not response.get("success"):
+        logger.error(f"Failed to get risk: {response.get("internal_error") or response.get("error")}")
+        return None
+    return response["data"]
+
+def get_data_version() -> Union[str, None]:
+    """ The version of the signed in user's data from the server, which changes with every fill, or None if it failed. """
+    response = get_response(endpoint=FastAPIRoutes.get_version.value, method="get")
+    if not isinstance(response, dict) or "internal_error" in response.keys() or not response.get("success"):
+        logger.error(f"Failed to get data version, rendering without the fragment cache")
+        return None
+    return response["data"]["version"]
+
+def cached_page(etag: str, render: Callable[[], str]) -> Response:
+    """
+    Answers 304 if the browser has the page of this entity tag, renders the page otherwise.
+    The browser must check the page again on every visit, as its tag changes with the user's data and the prices.
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def render_portfolio_summary() -> tuple[str, dict, bool]:
+    """ The balance of the signed in user, with their transactions by symbol as the context. """
+    response = get_response(endpoint=FastAPIRoutes.get_portfolio.value, method="get")
+    if "internal_error" in response.keys():
+        raise InternalError(response["internal_error"])
+    if not response["success"]:
+        raise ValueError(f"Failed to retrieve portfolio data: {response["error"]}")
+    context = {"balance": response["data"]["balance"], "symbols": response["data"]["symbols"]}
+    return render_template("partials/portfolio_summary.html", balance=context["balance"]), context, True
+
+def render_portfolio_valuation(symbols: dict[str, list[dict[str, Union[str, float]]]]) -> tuple[str, dict, bool]:
+    """ The worth and P&L of the signed in user's portfolio, with the shares and worth of every symbol as the context. """
+    # The server computes the shares, worths and P&L of every symbol at once
+    pnl = get_pnl()
+    if pnl is not None:
+        held = {key_symbol: figures for key_symbol, figures in pnl["symbols"].items() if key_symbol in symbols}
+        total_shares: dict[str, float] = {key_symbol: figures["shares"] for key_symbol, figures in held.items()}
+        # A price missing after the latency budget counts as no worth instead of failing the page
+        total_worths: dict[str, float] = {key_symbol: figures["market_value"] or 0 for key_symbol, figures in held.items()}
+    else:
+        current_prices = get_current_prices_of_symbol_list(symbols.keys())
+        # Calculate the total shares for each symbol                     
+        total_shares: dict[str, float] = defaultdict(float)
+        for key_symbol, transactions in symbols.items():
+            for transaction in transactions:
+                total_shares[key_symbol] += transaction["shares"]
+        
+        # Calculate the total worth for each symbol
+        total_worths: dict[str, float] = {}
+        for key_symbol, shares in total_shares.items():
+            total_worths[key_symbol] = shares * (current_prices.get(key_symbol) or 0)
+
+    context = {"total_shares": dict(total_shares), "total_worths": total_worths, "pnl": pnl}
+    return render_template("partials/portfolio_valuation.html", **context), context, True
+
+def render_portfolio_risk() -> tuple[str, dict, bool]:
+    """ The risk analytics of the signed in user's holdings, with the rolling volatility as the context. """
+    risk = get_risk()
+    context = {}
+    if risk is not None and risk["symbols"]:
+        context["rolling_volatility"] = risk["portfolio"]["rolling_volatility"]
+    # A failure is not kept for the risk TTL, the next visit asks the server again
+    return render_template("partials/portfolio_risk.html", risk=risk), context, risk is not None
+
 @flask_app.route('/my/portfolio', methods=['GET'])            
 @flask_app.route('/my/portfolio/', methods=['GET'])      
 @flask_app.route('/my/portfolio/<symbol>', methods=['GET'])    
@@ -165,6 +303,10 @@ def portfolio(symbol: str = None):
     it redirects to a template with the summary of the symbol, if not it renders 
     it displays the entire portfolio.
 
+    The page is assembled from fragments cached by the version of the user's data (see `fragment_cache`):
+    the balance until the next fill, the worths and P&L (which depend on prices) for a few seconds more at most,
+    and the risk analytics for minutes. An unchanged page is answered with 304 to the browser that has it.
+
     Args:
         symbol (str, optional): Specific stock symbol to display detailed transactions.
     Returns:
@@ -172,58 +314,65 @@ def portfolio(symbol: str = None):
     """
     if symbol is not None:
         symbol = symbol.upper()
-    response = get_response(endpoint=FastAPIRoutes.get_portfolio.value, method="get")
+    uuid = session["uuid"]
+    # Asked before the data, so a fragment is never kept under a version newer than the data it was rendered from
+    version = get_data_version()
     try:
-        if "internal_error" in response.keys():
-            raise InternalError
-        if response["success"]:
-            current_prices = get_current_prices_of_symbol_list(response["data"]["symbols"].keys())
-            if symbol is None:
-                symbols: dict[str, list[dict[str, Union[str, float]]]]= response["data"]["symbols"]           
-
-                # Calculate the total shares for each symbol                     
-                total_shares: dict[str, float] = defaultdict(float)
-                for key_symbol, transactions in symbols.items():
-                    for transaction in transactions:
-                        total_shares[key_symbol] += transaction["shares"]
-                
-                # Calculate the total worth for each symbol
-                total_worths: dict[str, float] = {}
-                for key_symbol, shares in total_shares.items():
-                    total_worths[key_symbol] = shares * current_prices[key_symbol]
-                
-                # Create pie charts for use in jinja template
-                shares_graph.change_page_layout(total_shares)
-                worths_graph.change_page_layout(total_worths)
-
-                return render_template(
-                    "stocks/portfolio.html",
-                    balance=response["data"]["balance"],
-                    symbols=response["data"]["symbols"],
-                    total_shares=total_shares,
-                    total_worths=total_worths
-                )
-            elif symbol in response["data"]["symbols"]:
-                return render_template(
-                    "stocks/stock_summary.html",
-                    balance=response["data"]["balance"],
-                    symbol=symbol,
-                    transactions=response["data"]["symbols"][symbol],
-                    current_prices=current_prices
+        summary = fragment_cache.render(uuid, "portfolio_summary", version, render_portfolio_summary)
+        symbols: dict[str, list[dict[str, Union[str, float]]]] = summary.context["symbols"]
+        if symbol is None:
+            valuation = risk = holdings = None
+            if symbols:
+                valuation = fragment_cache.render(uuid, "portfolio_valuation", version, partial(render_portfolio_valuation, symbols), ttl=PRICE_TTL)
+                # Rendered from the valuation's figures, so again whenever the valuation is
+                holdings = fragment_cache.render(
+                    uuid, "portfolio_holdings", version and f"{version}@{valuation.rendered_at}",
+                    lambda: (render_template("partials/portfolio_holdings.html", symbols=symbols, **valuation.context), {}, True)
                 )
-            else:
-                logger.error(f"Got unowned symbol ({symbol})")
-                return redirect(url_for("portfolio"))
+                risk = fragment_cache.render(uuid, "portfolio_risk", version, render_portfolio_risk, ttl=RISK_TTL)
+
+                # The graphs are shared by the users, so they are updated even when the page is cached
+                shares_graph.change_page_layout(valuation.context["total_shares"])
+                worths_graph.change_page_layout(valuation.context["total_worths"])
+                if "rolling_volatility" in risk.context:
+                    rolling_volatility = risk.context["rolling_volatility"]
+                    volatility_graph.change_page_layout(rolling_volatility["dates"], {
+                        f"{rolling_volatility['days']} day volatility (%)": [value * 100 for value in rolling_volatility["values"]],
+                    })
+
+            fragments = [fragment for fragment in (summary, valuation, risk, holdings) if fragment is not None]
+            # The navigation bar shows the username
+            etag = get_etag(session.get("username"), *(fragment.etag for fragment in fragments))
+            return cached_page(etag, lambda: render_template(
+                "stocks/portfolio.html",
+                summary=summary.html,
+                has_symbols=bool(symbols),
+                valuation=valuation.html if valuation else "",
+                risk=risk.html if risk else "",
+                holdings=holdings.html if holdings else ""
+            ))
+        elif symbol in symbols:
+            current_prices = get_current_prices_of_symbol_list([symbol])
+            return render_template(
+                "stocks/stock_summary.html",
+                balance=summary.context["balance"],
+                symbol=symbol,
+                transactions=symbols[symbol],
+                current_prices=current_prices
+            )
         else:
-            logger.error("Failed to retrieve portfolio data: " + response["error"])
-            return redirect(url_for('index'))
-    except InternalError:
-        logger.debug(f"Communication between servers has failed: {response["internal_error"]}")
+            logger.error(f"Got unowned symbol ({symbol})")
+            return redirect(url_for("portfolio"))
+    except InternalError as error:
+        logger.debug(f"Communication between servers has failed: {error}")
         return render_template(
             "stocks/portfolio.html",
-            balance=0,
-            symbols=None
+            summary=render_template("partials/portfolio_summary.html", balance=0),
+            has_symbols=False
         )
+    except ValueError as error:
+        logger.error(error)
+        return redirect(url_for('index'))
     except KeyError as error:
         logger.error(f"Own server error. Error: {error}")
         return redirect(url_for("portfolio"))
@@ -232,6 +381,17 @@ def portfolio(symbol: str = None):
     
     return redirect(url_for('index'))
 
+def render_database_records(database_name: str) -> tuple[str, dict, bool]:
+    """ The records of one of the signed in user's databases. """
+    # Get database without secret database information
+    response = get_response(endpoint=f"{FastAPIRoutes.get_database.value}/{database_name}", method="get")
+    if "internal_error" in response.keys():
+        raise InternalError(response["internal_error"])
+    if response["success"] is not True:
+        raise ValueError(f"Failed getting user's {database_name} records")
+    logger.info(f"Outputting {database_name} database to html...")
+    return render_template("partials/database_records.html", records=response["data"]), {}, True
+
 @flask_app.route('/my/database/<database_name>', methods=["GET"])
 @sign_in_required()
 def view_database(database_name: str):
@@ -239,6 +399,7 @@ def view_database(database_name: str):
     Provides a view of a specified database (either 'transactions' or 'portfolios' 
     for security reasons).
     Redirects to an access denied page if the database name is not valid.
+    The records are cached until the user's data changes, and answered with 304 to the browser that has them.
 
     Args:
         database_name (str): The name of the database to view.
@@ -248,22 +409,20 @@ def view_database(database_name: str):
     if database_name not in ["transactions", "portfolios"]:
         return redirect_to_access_denied(reason="Invalid Database Name")
     else:        
-        # Get database without secret database information
-        response = get_response(endpoint=f"{FastAPIRoutes.get_database.value}/{database_name}", method="get")
-            
-        try:                
-            if response["success"] is True:
-                logger.info(f"Outputting {database_name} database to html...")
-                return render_template(
-                    "misc/view_database.html", 
-                    database_name=database_name.capitalize(),
-                    records=response["data"]
-                )
-            else:
-                logger.error(f"Failed getting user's transaction history")
-                feedback = UserFeedbacks.internal_error.value
+        version = get_data_version()
+        try:
+            records = fragment_cache.render(session["uuid"], f"database_{database_name}", version, partial(render_database_records, database_name))
+            etag = get_etag(session.get("username"), database_name, records.etag)
+            return cached_page(etag, lambda: render_template(
+                "misc/view_database.html", 
+                database_name=database_name.capitalize(),
+                records_table=records.html
+            ))
         except InternalError as error:
-            logger.debug(f"Communication between servers has failed: {response["internal_error"]}")
+            logger.debug(f"Communication between servers has failed: {error}")
+            feedback = UserFeedbacks.internal_error.value
+        except ValueError as error:
+            logger.error(error)
             feedback = UserFeedbacks.internal_error.value
         except KeyError as error:
             logger.error(f"Got bad response from other server: {error}")
@@ -277,7 +436,23 @@ def view_database(database_name: str):
 @flask_app.route('/my/dashboard')
 @sign_in_required()
 def profile():
-    return render_template("users/profile.html")
+    """
+    Displays the user's profile, with the equity curve, returns and drawdowns of their account if they have traded.
+    """
+    response = get_response(endpoint=FastAPIRoutes.get_equity_curve.value, method="get")
+    if "internal_error" in response.keys():
+        logger.error(f"Failed to get equity curve: {response['internal_error']}")
+    # Users without transactions have no curve
+    if "internal_error" in response.keys() or not response.get("success"):
+        return render_template("users/profile.html", equity_summary=None)
+
+    curve = response["data"]
+    equity_graph.change_page_layout(curve["dates"], {"Equity": curve["equity"], "Cash": curve["cash"]})
+    returns_graph.change_page_layout(curve["dates"], {
+        "Time-weighted return (%)": [value * 100 for value in curve["twr"]],
+        "Drawdown (%)": [value * 100 for value in curve["drawdown"]],
+    })
+    return render_template("users/profile.html", equity_summary=curve["summary"])
 
 # Fully Complete
 @flask_app.route("/sign_in", methods=["GET", "POST"])
@@ -313,7 +488,9 @@ def sign_in() -> str:
                 session["uuid"] = response["data"]["uuid"]
                 session["email"] = response["data"]["email"]
                 session["username"] = sign_in_form.username.data
-                session["password"] = sign_in_form.password.data
+                # The next requests are authenticated by the access token, the password is not kept
+                session["token"] = response["data"]["token"]
+                session["token_expires_at"] = response["data"]["expires_at"]
 
                 logger.debug(f"User {sign_in_form.username.data} sign in has been successful")
                 feedback = "Sign In Has Been Successful"
@@ -356,10 +533,10 @@ def sign_out():
     Returns:
         Redirection to the index page after successful sign-out.
     """
-    session.pop("username", None)
-    session.pop("password", None)
-    session.pop("uuid", None)
-    session.pop("email", None)
+    if "token" in session:
+        # Revoke the access token, the user is signed out here whatever the answer
+        get_response(endpoint=FastAPIRoutes.sign_out.value, method="post")
+    clear_user_session()
 
     return redirect(url_for("index"))
 
@@ -443,39 +620,40 @@ def update_user():
     keep_form_data = True
 
     if request.method == "POST" and update_form.validate_on_submit():
-        if update_form.password.data != session["password"]:
-            logger.warning(f"Password does not match session")
-            feedback = UserFeedbacks.password_not_match.value
-        else:
-            attribute_to_update = update_form.attribute_to_update.data.lower()
-            attribute_value = update_form.data[f"new_{attribute_to_update}"]
+        attribute_to_update = update_form.attribute_to_update.data.lower()
+        attribute_value = update_form.data[f"new_{attribute_to_update}"]
 
-            # Communicate with fastAPI server to update the user
-            response = get_response(
-                endpoint=f"{FastAPIRoutes.update_user.value}/{attribute_to_update}", 
-                method="put", 
-                data_to_send={"value": attribute_value}
-            )
+        # Communicate with fastAPI server to update the user, which checks the password
+        response = get_response(
+            endpoint=f"{FastAPIRoutes.update_user.value}/{attribute_to_update}", 
+            method="put", 
+            data_to_send={"value": attribute_value, "password": update_form.password.data}
+        )
 
-            try:
-                if response["success"] == True:
-                    session[attribute_to_update] = attribute_value
-                    logger.debug(f"User {session["username"]}'s update of {attribute_to_update} has been successful")
-                    logger.debug(f"User {attribute_to_update.capitalize()} is now {session[attribute_to_update]}")
-                    feedback = f"Successfully changed {attribute_to_update.capitalize()}"
-                    keep_form_data = False
+        try:
+            if response["success"] == True:
+                if attribute_to_update == "password":
+                    # The user's other tokens were revoked, this session continues with a new one
+                    session["token"] = response["data"]["token"]
+                    session["token_expires_at"] = response["data"]["expires_at"]
                 else:
-                    logger.error(f"User {session["username"]} update of {update_form.attribute_to_update.data} has failed")
-                    feedback = response["error"]
-            except InternalError as error:
-                logger.debug(f"Communication between servers has failed: {response["internal_error"]}")
-                feedback = UserFeedbacks.internal_error.value
-            except KeyError as error:
-                logger.error(f"Got bad response from other server: {error}")
-                feedback = UserFeedbacks.internal_error.value
-            except Exception as error:
-                logger.error(f"Error: {error}")
-                feedback = UserFeedbacks.internal_error.value
+                    session[attribute_to_update] = attribute_value
+                    logger.debug(f"User {attribute_to_update.capitalize()} is now {attribute_value}")
+                logger.debug(f"User {session["username"]}'s update of {attribute_to_update} has been successful")
+                feedback = f"Successfully changed {attribute_to_update.capitalize()}"
+                keep_form_data = False
+            else:
+                logger.error(f"User {session["username"]} update of {update_form.attribute_to_update.data} has failed")
+                feedback = response["error"]
+        except InternalError as error:
+            logger.debug(f"Communication between servers has failed: {response["internal_error"]}")
+            feedback = UserFeedbacks.internal_error.value
+        except KeyError as error:
+            logger.error(f"Got bad response from other server: {error}")
+            feedback = UserFeedbacks.internal_error.value
+        except Exception as error:
+            logger.error(f"Error: {error}")
+            feedback = UserFeedbacks.internal_error.value
     elif request.method == "GET":
         return render_template("users/update_user.html", form=update_form)
     else:
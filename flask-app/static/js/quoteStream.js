@@ -0,0 +1,39 @@
+document.addEventListener('DOMContentLoaded', function() {
+  const quoteBox = document.querySelector('[data-quote-stream]');
+  if (!quoteBox || !window.EventSource) {
+    return;
+  }
+  const bidElement = document.getElementById('quote_bid');
+  const askElement = document.getElementById('quote_ask');
+  const spreadElement = document.getElementById('quote_spread');
+  // Starts from the rendered quote, then the snapshot replaces it and the deltas patch it
+  const quote = {
+    bid: parseFloat(bidElement.textContent),
+    ask: parseFloat(askElement.textContent),
+  };
+  let lastSeq = 0;
+
+  function render() {
+    bidElement.textContent = quote.bid;
+    askElement.textContent = quote.ask;
+    spreadElement.textContent = (quote.ask - quote.bid).toFixed(2);
+  }
+
+  function apply(event) {
+    const message = JSON.parse(event.data);
+    // A snapshot after a reconnect or a resync starts a new sequence
+    if (event.type === 'delta' && message.seq <= lastSeq) {
+      return;
+    }
+    Object.assign(quote, message.quote);
+    lastSeq = message.seq;
+    render();
+  }
+
+  const source = new EventSource(quoteBox.dataset.quoteStream);
+  source.addEventListener('snapshot', apply);
+  source.addEventListener('delta', apply);
+  window.addEventListener('beforeunload', function() {
+    source.close();
+  });
+});
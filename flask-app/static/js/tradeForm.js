@@ -5,6 +5,25 @@ document.addEventListener('DOMContentLoaded', function() {
   const limitPriceInput = document.getElementById('limit_price');
   const stopPriceInput = document.getElementById('stop_price');
   const tradeButton = document.getElementById('trade_form_submit');
+  const lotSelectionField = document.querySelector('.lot-selection-field');
+  const lotUidsField = document.querySelector('.lot-uids-field');
+  const lotSelectionSelect = document.getElementById('lot_selection');
+  const lotUidsInput = document.getElementById('lot_uids');
+  const sideInputs = document.querySelectorAll('input[name="side"]');
+
+  function selectedSide() {
+    const checked = document.querySelector('input[name="side"]:checked');
+    return checked ? checked.value : 'buy';
+  }
+
+  function updateLotVisibility() {
+    // Lots are only picked by market sells
+    const pickLots = selectedSide() === 'sell' && orderTypeSelect.value === 'market';
+    lotSelectionField.classList.toggle('hidden', !pickLots);
+    const pickSpecificLots = pickLots && lotSelectionSelect.value === 'specific';
+    lotUidsField.classList.toggle('hidden', !pickSpecificLots);
+    lotUidsInput.required = pickSpecificLots;
+  }
 
   function updateVisibility(selectedOrderType) {
     limitPriceField.classList.add('hidden');
@@ -30,11 +49,18 @@ document.addEventListener('DOMContentLoaded', function() {
 
   // Initial calls to set the correct display state when the page loads
   updateVisibility(orderTypeSelect.value);
+  updateLotVisibility();
   checkOrderTypeDisabled();
 
   // Event listener for when the select value changes
   orderTypeSelect.addEventListener('change', function() {
     updateVisibility(this.value);
+    updateLotVisibility();
     checkOrderTypeDisabled();
   });
+
+  sideInputs.forEach(function(sideInput) {
+    sideInput.addEventListener('change', updateLotVisibility);
+  });
+  lotSelectionSelect.addEventListener('change', updateLotVisibility);
 });
\ No newline at end of file
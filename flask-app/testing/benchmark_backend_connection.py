@@ -0,0 +1,95 @@
+"""
+Benchmark of the connection to the FastAPI server: a new connection per request (the module-level
+`requests` functions) against the pooled, kept-alive `BackendClient`.
+
+Starts a local FastAPI instance over HTTPS (with a throwaway self signed certificate, like the real server)
+and times the same request with both clients. Run it from the flask-app folder:
+    python testing/benchmark_backend_connection.py [--requests 300]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+import urllib3
+import uvicorn
+from fastapi import FastAPI
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import harness
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+parser = argparse.ArgumentParser(description="Benchmark the Flask to FastAPI connection")
+parser.add_argument("--requests", type=int, default=300)
+parser.add_argument("--port", type=int, default=5899)
+arguments = harness.setup(parser)
+
+from comms.backend_client import BackendClient
+
+def create_certificate(folder: str) -> tuple[str, str]:
+    """ Writes a self signed certificate for localhost, returns the paths of the key and the certificate. """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_path, certificate_path = os.path.join(folder, "key.pem"), os.path.join(folder, "cert.pem")
+    with open(key_path, "wb") as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+    with open(certificate_path, "wb") as file:
+        file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return key_path, certificate_path
+
+def start_server() -> uvicorn.Server:
+    app = FastAPI()
+
+    @app.get("/get_user/summary")
+    def summary(uuid: str = ""):
+        return {"success": True, "error": "", "data": {"balance": 10000, "symbols": {}}}
+
+    key_path, certificate_path = create_certificate(tempfile.mkdtemp(prefix="backend_benchmark_"))
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=arguments.port, ssl_keyfile=key_path, ssl_certfile=certificate_path, log_level="warning"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def measure(name: str, send) -> np.ndarray:
+    timings = []
+    for _ in range(arguments.requests):
+        start = time.perf_counter()
+        response = send()
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    timings = np.array(timings)
+    print(f"{name:<28} p50 {np.percentile(timings, 50):6.2f} ms   p95 {np.percentile(timings, 95):6.2f} ms   p99 {np.percentile(timings, 99):6.2f} ms")
+    return timings
+
+if __name__ == "__main__":
+    server = start_server()
+    base_url = f"https://127.0.0.1:{arguments.port}"
+    params = {"uuid": "benchmark"}
+
+    unpooled = measure(
+        "new connection per request",
+        lambda: requests.get(f"{base_url}/get_user/summary", params=params, verify=False, timeout=5)
+    )
+    client = BackendClient(base_url=base_url, pool_size=10, retries=2, backoff=0.2, timeout=5)
+    pooled = measure("pooled keep-alive client", lambda: client.request("get", "get_user/summary", params=params))
+
+    print(f"p50 speedup: {np.percentile(unpooled, 50) / np.percentile(pooled, 50):.1f}x")
+    print(f"client histogram: {client.get_stats()['endpoints']}")
+    server.should_exit = True
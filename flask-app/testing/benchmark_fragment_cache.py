@@ -0,0 +1,147 @@
+"""
+Checks and benchmark of the cache of rendered page fragments.
+
+Checks that a fragment is served until the version of the user's data changes, and for fragments that depend on
+prices only until their TTL passes, that fragments of equal HTML have the same tag, that fragments which failed
+to load (or of an unknown version) are not kept, that the least recently used fragments are evicted and that
+dropping a user's fragments keeps the other users'.
+Then times rendering the fragments of a portfolio page (from the templates of the app) against serving them cached.
+Run it from the flask-app folder:
+    python testing/benchmark_fragment_cache.py [--symbols 20] [--records 500] [--pages 2000]
+"""
+import argparse
+import os
+import random
+import time
+
+from flask import Flask, render_template
+
+import harness
+
+
+parser = argparse.ArgumentParser(description="Check and benchmark the fragment cache")
+parser.add_argument("--symbols", type=int, default=20, help="Symbols held in the benchmarked portfolio")
+parser.add_argument("--records", type=int, default=500, help="Records of the benchmarked database page")
+parser.add_argument("--pages", type=int, default=2000, help="Pages assembled per scheme")
+arguments = harness.setup(parser)
+
+import logging
+from utils.fragment_cache import FragmentCache, fragment_cache, get_etag
+from utils.logger_script import logger
+
+def render_counted(html: str, calls: list, cacheable: bool = True):
+    """ A render callable counting its calls in `calls`. """
+    def render():
+        calls.append(html)
+        return html, {"html": html}, cacheable
+    return render
+
+def check_versions() -> None:
+    cache = FragmentCache(max_entries=16)
+    calls = []
+    first = cache.render("user", "summary", "epoch.1", render_counted("<p>1</p>", calls))
+    again = cache.render("user", "summary", "epoch.1", render_counted("<p>1</p>", calls))
+    assert again is first and len(calls) == 1, "A fragment of an unchanged version was rendered again"
+    changed = cache.render("user", "summary", "epoch.2", render_counted("<p>2</p>", calls))
+    assert len(calls) == 2 and changed.html == "<p>2</p>", "A fragment of an older version was served"
+    assert cache.render("other", "summary", "epoch.2", render_counted("<p>3</p>", calls)).html == "<p>3</p>", "A fragment of another user was served"
+
+    # Of equal HTML, a fragment rendered again keeps its tag (so the page's tag does too)
+    rerendered = cache.render("user", "summary", "epoch.3", render_counted("<p>2</p>", calls))
+    assert rerendered.etag == changed.etag and rerendered.etag != first.etag, "Tags do not follow the HTML"
+    print("Fragments are served until the user's version changes, and tagged by their HTML")
+
+def check_ttl() -> None:
+    cache = FragmentCache(max_entries=16)
+    calls = []
+    fresh = cache.render("user", "valuation", "epoch.1", render_counted("<p>worth</p>", calls), ttl=60)
+    assert cache.render("user", "valuation", "epoch.1", render_counted("<p>worth</p>", calls), ttl=60) is fresh
+    fresh.rendered_at -= 61
+    cache.render("user", "valuation", "epoch.1", render_counted("<p>worth</p>", calls), ttl=60)
+    assert len(calls) == 2 and cache.get_stats()["stale"] == 1, "A fragment was served past its TTL"
+    print("Fragments that depend on prices are rendered again once their TTL passed")
+
+def check_uncached() -> None:
+    cache = FragmentCache(max_entries=16)
+    calls = []
+    for _ in range(2):
+        cache.render("user", "risk", "epoch.1", render_counted("<p>failed</p>", calls, cacheable=False))
+        cache.render("user", "summary", None, render_counted("<p>unknown</p>", calls))
+    assert len(calls) == 4 and cache.get_stats()["fragments"] == 0, "A failed or unversioned fragment was kept"
+    print("Fragments that failed to load or of an unknown version are not kept")
+
+def check_eviction_and_invalidation() -> None:
+    cache = FragmentCache(max_entries=3)
+    calls = []
+    for name in ("a", "b", "c"):
+        cache.render("user", name, "epoch.1", render_counted(name, calls))
+    cache.render("user", "a", "epoch.1", render_counted("a", calls))
+    cache.render("other", "d", "epoch.1", render_counted("d", calls))
+    assert cache.get("user", "b", "epoch.1") is None, "The least recently used fragment was not evicted"
+    assert cache.get("user", "a", "epoch.1") is not None and cache.get_stats()["evictions"] == 1
+
+    cache.invalidate("user")
+    assert cache.get("user", "a", "epoch.1") is None and cache.get("other", "d", "epoch.1") is not None, "Invalidation dropped other users' fragments"
+    cache.invalidate()
+    assert cache.get_stats()["fragments"] == 0
+    print("The least recently used fragments are evicted, and signing out drops only the user's fragments")
+
+def create_app() -> Flask:
+    """ A bare app rendering the templates of the Flask app (its full app needs the Dash pages). """
+    flask_app = Flask(__name__, template_folder=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"))
+    with flask_app.app_context():
+        # Imported only for its side effect: like in main.py, the import registers the Jinja filters on the current app
+        from templates.utils import template_filters  # noqa: F401
+    return flask_app
+
+def create_portfolio() -> tuple[float, dict, dict]:
+    """ The balance, the transactions by symbol and the P&L of a portfolio, like the server returns them. """
+    random.seed(7)
+    symbols, pnl_symbols = {}, {}
+    for index in range(arguments.symbols):
+        symbol = f"SYM{index}"
+        symbols[symbol] = [{"shares": random.randint(1, 50), "cost_per_share": random.uniform(10, 500)} for _ in range(5)]
+        shares = sum(transaction["shares"] for transaction in symbols[symbol])
+        pnl_symbols[symbol] = {"shares": shares, "market_value": shares * 100.0, "average_cost": 95.0, "unrealized_pnl": shares * 5.0,
+                               "realized_pnl": 12.5, "weight": 1 / arguments.symbols}
+    pnl = {"symbols": pnl_symbols, "totals": {"unrealized_pnl": sum(figures["unrealized_pnl"] for figures in pnl_symbols.values()), "realized_pnl": 12.5 * arguments.symbols}}
+    return 100000.0, symbols, pnl
+
+def benchmark() -> None:
+    flask_app = create_app()
+    balance, symbols, pnl = create_portfolio()
+    valuation_context = {
+        "total_shares": {symbol: figures["shares"] for symbol, figures in pnl["symbols"].items()},
+        "total_worths": {symbol: figures["market_value"] for symbol, figures in pnl["symbols"].items()},
+        "pnl": pnl,
+    }
+    records = [{"timestamp": "2024-05-01T10:00:00", "symbol": f"SYM{index % 40}", "side": "buy", "order_type": "market",
+                "shares": 3.0, "cost_per_share": 101.5, "total_cost": 304.5, "status": "filled"} for index in range(arguments.records)]
+    fragments = {
+        "portfolio_summary": lambda: (render_template("partials/portfolio_summary.html", balance=balance), {}, True),
+        "portfolio_valuation": lambda: (render_template("partials/portfolio_valuation.html", **valuation_context), valuation_context, True),
+        "portfolio_holdings": lambda: (render_template("partials/portfolio_holdings.html", symbols=symbols, **valuation_context), {}, True),
+        "database_transactions": lambda: (render_template("partials/database_records.html", records=records), {}, True),
+    }
+
+    with flask_app.test_request_context():
+        timings = {}
+        for scheme, version in (("rendered", None), ("cached", "epoch.1")):
+            fragment_cache.invalidate()
+            begin = time.perf_counter()
+            for _ in range(arguments.pages):
+                page = [fragment_cache.render("user", name, version, render) for name, render in fragments.items()]
+                get_etag(*(fragment.etag for fragment in page))
+            timings[scheme] = time.perf_counter() - begin
+            print(f"{scheme}: {timings[scheme] / arguments.pages * 1e6:9.1f} us per page "
+                  f"({arguments.symbols} symbols, {arguments.records} records, {sum(len(fragment.html) for fragment in page):,} bytes)")
+    print(f"Serving the cached fragments is {timings['rendered'] / timings['cached']:.1f}x faster than rendering them")
+    print(fragment_cache.get_stats())
+
+if __name__ == "__main__":
+    logger.setLevel(logging.WARNING)
+    check_versions()
+    check_ttl()
+    check_uncached()
+    check_eviction_and_invalidation()
+    benchmark()
@@ -0,0 +1,180 @@
+"""
+Checks and benchmark of the live quote streams, with a scripted quote source.
+
+The source replays a scripted series of quotes per symbol and counts its fetches. Checks that a symbol is fetched
+once per poll no matter how many viewers it has, that a viewer applying the snapshot and the deltas it is sent
+always holds the scripted quote, that unchanged quotes send nothing, and that a viewer that stops reading is
+resynced with a snapshot instead of queuing without bound or holding back the others.
+Then streams to many viewers on threads (through the same generator as the Flask route) and times the fan-out.
+Run it from the flask-app folder:
+    python testing/benchmark_quote_stream.py [--viewers 1000] [--steps 200] [--threads 200]
+"""
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+import harness
+
+
+parser = argparse.ArgumentParser(description="Check and benchmark the live quote streams")
+parser.add_argument("--viewers", type=int, default=1000, help="Viewers of one symbol in the fan-out checks")
+parser.add_argument("--steps", type=int, default=200, help="Scripted quotes per symbol")
+parser.add_argument("--threads", type=int, default=200, help="Viewers streaming on their own thread")
+arguments = harness.setup(parser)
+
+import logging
+from utils.logger_script import logger
+from utils.quote_cache import QuoteCache, QuoteProvider
+from utils.quote_stream import QuoteHub, STREAM_FIELDS, stream_events
+
+class ScriptedQuoteProvider(QuoteProvider):
+    """ Serves the current step of a scripted series of quotes per symbol, and counts the fetches of every symbol. """
+    def __init__(self, script: dict[str, list[dict]]):
+        self.script = script
+        self.step = 0
+        self.calls: dict[str, int] = {symbol: 0 for symbol in script}
+        self._lock = threading.Lock()
+
+    def get_info(self, symbol: str) -> dict:
+        with self._lock:
+            self.calls[symbol] += 1
+        quotes = self.script[symbol]
+        return {"symbol": symbol, **quotes[min(self.step, len(quotes) - 1)]}
+
+def create_script(symbols: list[str], steps: int) -> dict[str, list[dict]]:
+    """ Random walks in cents, where the bid and ask often keep their value from one step to the next. """
+    random = np.random.default_rng(0)
+    script = {}
+    for symbol in symbols:
+        price = 100.0
+        quotes = []
+        for _ in range(steps):
+            price = round(price + float(random.choice([-0.01, 0, 0, 0.01])), 2)
+            quotes.append({"bid": round(price - 0.01, 2), "ask": round(price + 0.01, 2), "currentPrice": price,
+                           "longName": f"{symbol} Inc.", "sector": "Technology"})
+        script[symbol] = quotes
+    return script
+
+def parse_events(chunk: bytes) -> list[tuple[str, dict]]:
+    """ The (event, data) of every event of a chunk of a Server-Sent Events stream, comments left out. """
+    events = []
+    for block in chunk.decode("utf-8").split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if line and not line.startswith(":") and ": " in line)
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+class Viewer:
+    """ Holds the quote of a viewer, as the dashboard's script does. """
+    def __init__(self):
+        self.quote: dict = {}
+        self.seq = 0
+        self.snapshots = 0
+        self.deltas = 0
+        self.bytes = 0
+
+    def apply(self, chunk: bytes) -> None:
+        self.bytes += len(chunk)
+        for event, data in parse_events(chunk):
+            if event == "snapshot":
+                self.quote = dict(data["quote"])
+                self.snapshots += 1
+            else:
+                assert data["seq"] == self.seq + 1, f"Delta {data['seq']} after {self.seq}"
+                self.quote.update(data["quote"])
+                self.deltas += 1
+            self.seq = data["seq"]
+
+def expected_quote(provider: ScriptedQuoteProvider, symbol: str) -> dict:
+    quote = provider.script[symbol][min(provider.step, len(provider.script[symbol]) - 1)]
+    return {name: quote[name] for name in STREAM_FIELDS}
+
+def check_fan_out_and_deltas() -> None:
+    provider = ScriptedQuoteProvider(create_script(["AAPL", "MSFT"], arguments.steps))
+    # Quotes never stay fresh, so every poll goes to the source unless the hub coalesces the viewers
+    hub = QuoteHub(QuoteCache(provider, max_symbols=100, volatile_ttl=0, static_ttl=3600, batch_workers=4), interval=1.0, max_queue=8, autostart=False)
+
+    reader = hub.subscribe("AAPL")
+    reader_view = Viewer()
+    stalled = hub.subscribe("AAPL")
+    other = hub.subscribe("MSFT")
+    other_view = Viewer()
+    viewers = [hub.subscribe("AAPL") for _ in range(arguments.viewers - 2)]
+    publish_ms = []
+    for step in range(arguments.steps):
+        provider.step = step
+        begin = time.perf_counter()
+        hub.poll()
+        publish_ms.append((time.perf_counter() - begin) * 1000)
+        reader_view.apply(b"".join(reader.get(0)))
+        other_view.apply(b"".join(other.get(0)))
+        if step == 0:
+            # Reads its snapshot, then stops reading
+            stalled.get(0)
+        assert reader_view.quote == expected_quote(provider, "AAPL"), f"The viewer's quote differs at step {step}"
+        assert other_view.quote == expected_quote(provider, "MSFT"), f"The other symbol's viewer differs at step {step}"
+        # The idle viewers drain nothing, but their queues stay bounded
+        assert len(stalled._queue) <= hub.max_queue
+
+    assert provider.calls["AAPL"] == arguments.steps, f"AAPL was fetched {provider.calls['AAPL']} times in {arguments.steps} polls for {arguments.viewers} viewers"
+    assert reader_view.snapshots == 1 and stalled.resyncs > 0, "The stalled viewer was not resynced"
+    stalled_view = Viewer()
+    stalled_view.apply(b"".join(stalled.get(0)))
+    assert stalled_view.snapshots == 1 and stalled_view.quote == expected_quote(provider, "AAPL"), "The resync snapshot is not the latest quote"
+
+    # Nothing is sent while the quote does not change
+    assert hub.poll() == 0 and reader.get(0) == [], "An unchanged quote was sent"
+    snapshot_bytes = len(hub._streams["AAPL"].snapshot[1])
+    delta_bytes = (reader_view.bytes - snapshot_bytes) / max(reader_view.deltas, 1)
+    print(f"{arguments.viewers} viewers of AAPL over {arguments.steps} polls: {provider.calls['AAPL']} upstream fetches, "
+          f"{reader_view.deltas} deltas, {stalled.resyncs} resyncs of the stalled viewer")
+    print(f"snapshot {snapshot_bytes} bytes, delta {delta_bytes:.0f} bytes on average, "
+          f"poll and fan-out p50 {np.percentile(publish_ms, 50):.2f} ms, p99 {np.percentile(publish_ms, 99):.2f} ms")
+    for subscription in [reader, stalled, other, *viewers]:
+        hub.unsubscribe(subscription)
+    assert hub.get_stats()["symbols"] == 0, "A symbol without viewers is still polled"
+
+def check_threaded_streams() -> None:
+    """ Every viewer consumes the Flask route's generator on its own thread while the hub's poller runs. """
+    provider = ScriptedQuoteProvider(create_script(["AAPL"], arguments.steps))
+    hub = QuoteHub(QuoteCache(provider, max_symbols=100, volatile_ttl=0, static_ttl=3600, batch_workers=4), interval=0.01, max_queue=64)
+    views = [Viewer() for _ in range(arguments.threads)]
+    finished = threading.Event()
+
+    def watch(view: Viewer) -> None:
+        events = stream_events(hub, "AAPL", heartbeat=0.05)
+        for chunk in events:
+            view.apply(chunk)
+            if finished.is_set() and view.quote == expected_quote(provider, "AAPL"):
+                break
+        # Closing the generator unsubscribes the viewer, as when a client disconnects
+        events.close()
+
+    threads = [threading.Thread(target=watch, args=(view,)) for view in views]
+    for thread in threads:
+        thread.start()
+    begin = time.perf_counter()
+    for step in range(arguments.steps):
+        provider.step = step
+        time.sleep(0.01)
+    finished.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    elapsed = time.perf_counter() - begin
+
+    assert not any(thread.is_alive() for thread in threads), "A viewer never reached the last quote"
+    stats = hub.get_stats()
+    assert stats["viewers"] == 0, "Viewers were not unsubscribed when their stream was closed"
+    time.sleep(0.1)
+    assert not hub.get_stats()["running"], "The poller kept running without viewers"
+    print(f"{arguments.threads} threaded viewers reached the last quote in {elapsed:.2f} s: {stats['polls']} polls, "
+          f"{provider.calls['AAPL']} upstream fetches, {stats['delivered']:,} deltas delivered, "
+          f"{sum(view.snapshots for view in views) - len(views)} resyncs")
+
+if __name__ == "__main__":
+    logger.setLevel(logging.WARNING)
+    check_fan_out_and_deltas()
+    check_threaded_streams()
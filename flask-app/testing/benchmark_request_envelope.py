@@ -0,0 +1,124 @@
+"""
+Checks and benchmark of the request envelopes, against encrypting every parameter on its own.
+
+Checks that an envelope sealed by the Flask app opens to the same payload, with its types, on the FastAPI server
+(whose decoding is copied here, as both apps have a `utils` package), and that an envelope that was tampered with,
+sent to another route or of an unknown version is refused. Then times, for typical requests (a sign in, an order,
+a batch of orders), the work of the Flask app (encrypting and encoding the parameters) and of the server (parsing
+and decrypting them), and compares the bytes sent.
+Run it from the flask-app folder:
+    python testing/benchmark_request_envelope.py [--requests 2000] [--batch 500]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode, parse_qsl
+
+import msgpack
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import harness
+
+parser = argparse.ArgumentParser(description="Check and benchmark the request envelopes")
+parser.add_argument("--requests", type=int, default=2000, help="Requests timed per payload and scheme")
+parser.add_argument("--batch", type=int, default=500, help="Orders of the batch payload")
+arguments = harness.setup(parser)
+
+import logging
+from comms.encryption import encrypt, seal, ENVELOPE_VERSION
+from utils.env_variables import SECRET_KEY
+from utils.logger_script import logger
+
+KEY = base64.b64decode(SECRET_KEY)
+SERVER_ENVELOPE_CIPHER = AESGCM(hmac.new(KEY, b"request envelope", hashlib.sha256).digest())
+
+def decrypt(stored_encrypted_data: str):
+    """ Decrypts a parameter the way the FastAPI server does (see fastapi-app/utils/encryption.py). """
+    iv, binary_data_length, encrypted_data = stored_encrypted_data.split("$")
+    decryptor = Cipher(algorithms.AES(KEY), modes.CBC(base64.b64decode(iv))).decryptor()
+    decrypted_data = (decryptor.update(base64.b64decode(encrypted_data)) + decryptor.finalize())[:int(binary_data_length)].decode("utf-8")
+    return json.loads(decrypted_data) if decrypted_data.startswith("{") else decrypted_data
+
+def open_envelope(envelope: bytes, method: str, path: str) -> dict:
+    """ Opens an envelope the way the FastAPI server does (see fastapi-app/utils/encryption.py). """
+    if len(envelope) <= 13 or envelope[0] != ENVELOPE_VERSION:
+        raise ValueError("Malformed envelope")
+    try:
+        payload = msgpack.unpackb(SERVER_ENVELOPE_CIPHER.decrypt(envelope[1:13], envelope[13:], f"{method.upper()} /{path}".encode()), raw=False)
+    except InvalidTag:
+        raise ValueError("The envelope is not authentic")
+    return payload
+
+def create_payloads() -> list[tuple[str, str, str, dict]]:
+    """ (name, method, endpoint, payload) of typical requests. """
+    order = {"symbol": "AAPL", "side": "buy", "order_type": "limit", "shares": 12.5, "limit_price": 187.25,
+             "stop_price": None, "time_in_force": "gtc"}
+    orders = [{**order, "symbol": f"SYM{index % 40}", "shares": float(index % 17 + 1)} for index in range(arguments.batch)]
+    return [
+        ("sign in", "post", "sign_in", {"username": "trader", "password": "correct horse battery staple"}),
+        ("update", "put", "update/email", {"value": "trader@example.com", "password": "correct horse battery staple"}),
+        ("order", "post", "submit_order", {"order": order}),
+        (f"batch of {arguments.batch}", "post", "submit_orders", {"orders": orders}),
+    ]
+
+def send_per_field(method: str, endpoint: str, payload: dict) -> bytes:
+    """ The bytes older clients send: every value encrypted on its own, in the query string (a batch in a JSON body). """
+    if endpoint == "submit_orders":
+        # Only JSON objects are decoded by `decrypt`, so older clients wrap the list
+        return json.dumps({"orders": encrypt({"orders": payload["orders"]})}).encode()
+    return urlencode({key: encrypt(value) for key, value in payload.items()}).encode()
+
+def receive_per_field(endpoint: str, sent: bytes) -> dict:
+    if endpoint == "submit_orders":
+        return {"orders": decrypt(json.loads(sent)["orders"])["orders"]}
+    return {key: decrypt(value) for key, value in parse_qsl(sent.decode())}
+
+def check_envelopes() -> None:
+    for name, method, endpoint, payload in create_payloads():
+        envelope = seal(payload, method, endpoint)
+        assert open_envelope(envelope, method, endpoint) == payload, f"The {name} payload changed in its envelope"
+        assert receive_per_field(endpoint, send_per_field(method, endpoint, payload)) == payload, f"The {name} payload changed per field"
+        assert seal(payload, method, endpoint) != envelope, "Two envelopes of the same payload are equal"
+
+    envelope = seal({"username": "trader", "password": "password"}, "post", "sign_in")
+    tampered = bytearray(envelope)
+    tampered[-20] ^= 1
+    for refused, (method, path) in ((bytes(tampered), ("post", "sign_in")), (envelope, ("post", "sign_up")),
+                                    (envelope, ("put", "sign_in")), (b"\x02" + envelope[1:], ("post", "sign_in")), (envelope[:12], ("post", "sign_in"))):
+        try:
+            open_envelope(refused, method, path)
+            raise AssertionError(f"An envelope was opened as {method} /{path}")
+        except ValueError:
+            pass
+    print("Envelopes open to the payload they were sealed with, tampered, replayed to another route and unknown ones are refused")
+
+def measure(function, *args) -> float:
+    """ Microseconds per call. """
+    begin = time.perf_counter()
+    for _ in range(arguments.requests):
+        function(*args)
+    return (time.perf_counter() - begin) / arguments.requests * 1e6
+
+def benchmark() -> None:
+    print(f"{'request':<14} {'scheme':<10} {'flask us':>10} {'server us':>10} {'bytes':>9}")
+    for name, method, endpoint, payload in create_payloads():
+        per_field = send_per_field(method, endpoint, payload)
+        envelope = seal(payload, method, endpoint)
+        timings = {
+            "per field": (measure(send_per_field, method, endpoint, payload), measure(receive_per_field, endpoint, per_field), len(per_field)),
+            "envelope": (measure(seal, payload, method, endpoint), measure(open_envelope, envelope, method, endpoint), len(envelope)),
+        }
+        for scheme, (client, server, size) in timings.items():
+            print(f"{name:<14} {scheme:<10} {client:10.1f} {server:10.1f} {size:9,}")
+        (old_client, old_server, old_size), (new_client, new_server, new_size) = timings.values()
+        print(f"{'':<14} {'':<10} {old_client / new_client:9.1f}x {old_server / new_server:9.1f}x {old_size / new_size:8.2f}x")
+
+if __name__ == "__main__":
+    logger.setLevel(logging.WARNING)
+    check_envelopes()
+    benchmark()
@@ -0,0 +1,38 @@
+"""
+Shared setup of the checks and benchmarks of this folder.
+
+The app reads its environment variables (and loads its Flask config) when its modules are imported. So a script
+imports this module first, calls `setup` and only then imports the app:
+
+    import harness
+    arguments = harness.setup(parser)
+
+    from utils.fragment_cache import FragmentCache
+
+Run the scripts from the flask-app folder, e.g. `python testing/benchmark_fragment_cache.py --help`.
+"""
+import argparse
+import base64
+import os
+import sys
+
+TESTING_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FLASK_APP_FOLDER = os.path.dirname(TESTING_FOLDER)
+if FLASK_APP_FOLDER not in sys.path:
+    sys.path.insert(0, FLASK_APP_FOLDER)
+
+def setup(parser: argparse.ArgumentParser) -> argparse.Namespace:
+    """
+    Parses the arguments of a script and prepares the environment of the app for it.
+
+    Args:
+        parser (ArgumentParser): The arguments of the script.
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    arguments = parser.parse_args()
+    # The utils package loads the Flask config, which needs the debug flag. A throwaway key, unless one is set
+    os.environ.setdefault("FLASK_DEBUG", "0")
+    os.environ.setdefault("SECRET_KEY", base64.b64encode(os.urandom(32)).decode())
+    return arguments
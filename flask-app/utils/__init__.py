@@ -1,4 +1,4 @@
-__all__ = ["render_readme", "logger_script", "yfinance_helper", "config", "logger_script"]
+__all__ = ["render_readme", "logger_script", "quote_cache", "quote_stream", "yfinance_helper", "config", "logger_script"]
 from . import *
 from .logger_script import logger
 from .cookies import ItsdangerousSession, ItsdangerousSessionInterface
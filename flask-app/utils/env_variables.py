@@ -3,4 +3,30 @@ from os import environ
 SECRET_KEY =  environ.get("SECRET_KEY")
 FASTAPI_IP = environ.get("FASTAPI_IP")
 FASTAPI_PORT = environ.get('FASTAPI_PORT')
-PORT = environ.get("FLASK_PORT")
\ No newline at end of file
+PORT = environ.get("FLASK_PORT")
+
+# Quote cache (seconds for TTLs)
+QUOTE_CACHE_MAX_SYMBOLS = environ.get("QUOTE_CACHE_MAX_SYMBOLS", "2048")
+QUOTE_TTL_VOLATILE = environ.get("QUOTE_TTL_VOLATILE", "2")
+QUOTE_TTL_STATIC = environ.get("QUOTE_TTL_STATIC", "3600")
+QUOTE_BATCH_WORKERS = environ.get("QUOTE_BATCH_WORKERS", "8")
+# Seconds the portfolio page waits for prices before rendering with what it has
+PORTFOLIO_QUOTE_BUDGET = environ.get("PORTFOLIO_QUOTE_BUDGET", "2")
+
+# Connection to the FastAPI server (kept-alive connections per process, retries of idempotent requests, seconds)
+BACKEND_POOL_SIZE = environ.get("BACKEND_POOL_SIZE", "10")
+BACKEND_RETRIES = environ.get("BACKEND_RETRIES", "2")
+BACKEND_RETRY_BACKOFF = environ.get("BACKEND_RETRY_BACKOFF", "0.2")
+BACKEND_TIMEOUT = environ.get("BACKEND_TIMEOUT", "5")
+
+# Live quotes pushed to the stock dashboard (seconds between polls of the viewed symbols, pending changes
+# after which a slow viewer is resynced with a snapshot, seconds between heartbeats of an idle stream)
+QUOTE_STREAM_INTERVAL = environ.get("QUOTE_STREAM_INTERVAL", "1")
+QUOTE_STREAM_QUEUE = environ.get("QUOTE_STREAM_QUEUE", "64")
+QUOTE_STREAM_HEARTBEAT = environ.get("QUOTE_STREAM_HEARTBEAT", "15")
+
+# Rendered page fragments kept per user until their data changes, and the seconds the fragments that depend on
+# prices and on the risk analytics are served before they are rendered again
+FRAGMENT_CACHE_MAX_ENTRIES = environ.get("FRAGMENT_CACHE_MAX_ENTRIES", "4096")
+FRAGMENT_TTL_PRICES = environ.get("FRAGMENT_TTL_PRICES", "5")
+FRAGMENT_TTL_RISK = environ.get("FRAGMENT_TTL_RISK", "300")
@@ -0,0 +1,131 @@
+from typing import Callable, Optional
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+import threading
+import time
+
+from markupsafe import Markup
+
+from utils.logger_script import logger
+from utils.env_variables import FRAGMENT_CACHE_MAX_ENTRIES, FRAGMENT_TTL_PRICES, FRAGMENT_TTL_RISK
+
+# Seconds the fragments that depend on prices, and on the risk analytics (of daily bars), are served
+PRICE_TTL = float(FRAGMENT_TTL_PRICES)
+RISK_TTL = float(FRAGMENT_TTL_RISK)
+
+def get_etag(*parts: str) -> str:
+    """ A strong entity tag of the given parts (e.g. HTML, or the tags of the fragments of a page). """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+@dataclass
+class Fragment:
+    """
+    A rendered fragment of a page.
+
+    Attributes:
+        html (Markup): The rendered HTML.
+        etag (str): Tag of the HTML, equal for equal HTML.
+        version (str): Version of the data it was rendered from.
+        rendered_at (float): When it was rendered (monotonic seconds).
+        context (dict): Data it was rendered from that the page needs too (e.g. the values of its graphs).
+    """
+    html: Markup
+    etag: str
+    version: str
+    rendered_at: float
+    context: dict = field(default_factory=dict)
+
+class FragmentCache:
+    """
+    Rendered HTML fragments of the users' pages, kept by user and fragment name with the version of the user's data
+    they were rendered from (published by the FastAPI server, which changes it with every fill).
+
+    A fragment is served until the version changes, and fragments that depend on prices only for `ttl` seconds,
+    after which they are rendered again (with the same tag if the HTML did not change). The server must be asked
+    for the version on every request, which is answered from its memory, instead of every fragment's data.
+    Fragments are per process, and dropped when their user signs out.
+
+    Args:
+        max_entries (int): The number of cached fragments (least recently used first out).
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "uncached": 0, "renders": 0, "evictions": 0, "render_seconds_total": 0.0}
+        self._fragments: OrderedDict[tuple[str, str], Fragment] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uuid: str, name: str, version: str, ttl: Optional[float] = None) -> Optional[Fragment]:
+        """ The fragment of a user if it was rendered from this version (within `ttl` seconds, if given). """
+        with self._lock:
+            fragment = self._fragments.get((uuid, name))
+            if fragment is None or fragment.version != version:
+                self.stats["misses"] += 1
+                return None
+            if ttl is not None and time.monotonic() - fragment.rendered_at > ttl:
+                self.stats["stale"] += 1
+                return None
+            self._fragments.move_to_end((uuid, name))
+            self.stats["hits"] += 1
+            return fragment
+
+    def put(self, uuid: str, name: str, fragment: Fragment) -> None:
+        with self._lock:
+            self._fragments[(uuid, name)] = fragment
+            self._fragments.move_to_end((uuid, name))
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def render(self, uuid: str, name: str, version: Optional[str], render: Callable[[], tuple[str, dict, bool]], ttl: Optional[float] = None) -> Fragment:
+        """
+        The cached fragment of a user, or renders it.
+
+        Args:
+            uuid (str): The user's uuid.
+            name (str): Name of the fragment.
+            version (str, optional): Version of the user's data. If None (unknown), the fragment is rendered and not cached.
+            render (Callable[[], tuple[str, dict, bool]]): Renders the fragment, returns its HTML, its context and whether
+                                                           it may be cached (e.g. not if some of its data failed to load).
+            ttl (float, optional): Seconds the fragment is served, for fragments that depend on prices.
+
+        Returns:
+            Fragment: The fragment.
+        """
+        if version is not None:
+            fragment = self.get(uuid, name, version, ttl)
+            if fragment is not None:
+                return fragment
+
+        start = time.perf_counter()
+        html, context, cacheable = render()
+        with self._lock:
+            self.stats["renders"] += 1
+            self.stats["render_seconds_total"] += time.perf_counter() - start
+            if version is None or not cacheable:
+                self.stats["uncached"] += 1
+        fragment = Fragment(Markup(html), get_etag(html), version, time.monotonic(), context)
+        if version is not None and cacheable:
+            self.put(uuid, name, fragment)
+        return fragment
+
+    def invalidate(self, uuid: Optional[str] = None) -> None:
+        """ Drops the fragments of a user (or of every user if None). """
+        with self._lock:
+            if uuid is None:
+                self._fragments.clear()
+            else:
+                for key in [key for key in self._fragments if key[0] == uuid]:
+                    del self._fragments[key]
+        logger.debug(f"Dropped the cached fragments of {uuid or 'every user'}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "fragments": len(self._fragments), "max_entries": self.max_entries,
+                    "price_ttl": PRICE_TTL, "risk_ttl": RISK_TTL}
+
+fragment_cache = FragmentCache(max_entries=int(FRAGMENT_CACHE_MAX_ENTRIES))
@@ -0,0 +1,355 @@
+from typing import Union, Optional, Iterable
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import partial
+import asyncio
+import threading
+import time
+
+import yfinance as yf
+
+from utils.logger_script import logger
+from utils.env_variables import QUOTE_CACHE_MAX_SYMBOLS, QUOTE_TTL_VOLATILE, QUOTE_TTL_STATIC, QUOTE_BATCH_WORKERS
+
+# Fields that move with the market. Everything else in yfinance's "info"
+# (name, sector, exchange...) is treated as static metadata.
+VOLATILE_FIELDS = (
+    "bid", "ask", "bidSize", "askSize",
+    "currentPrice", "regularMarketPrice",
+    "dayHigh", "dayLow", "regularMarketDayHigh", "regularMarketDayLow",
+    "volume", "regularMarketVolume",
+)
+# Fields a provider can serve without downloading the full info of a symbol
+PRICE_FIELDS = ("currentPrice", "regularMarketPrice")
+
+class QuoteProvider(ABC):
+    """
+    Interface of an upstream quote source.
+    The cache only talks to a provider, so a local fake can be plugged in instead of yfinance.
+    """
+    @abstractmethod
+    def get_info(self, symbol: str) -> Union[dict, None]:
+        """ Returns the full info dictionary of a symbol, or None if it could not be fetched. """
+
+    def get_prices(self, symbol: str) -> Union[dict, None]:
+        """ Returns only the `PRICE_FIELDS` of a symbol. Defaults to picking them out of the full info. """
+        info = self.get_info(symbol)
+        if info is None:
+            return None
+        return {name: info[name] for name in PRICE_FIELDS if name in info}
+
+class YFinanceQuoteProvider(QuoteProvider):
+    def get_info(self, symbol: str) -> Union[dict, None]:
+        return yf.Ticker(symbol).info
+
+    def get_prices(self, symbol: str) -> Union[dict, None]:
+        # fast_info only downloads the latest prices instead of the whole info page
+        last_price = yf.Ticker(symbol).fast_info["lastPrice"]
+        return {name: last_price for name in PRICE_FIELDS}
+
+@dataclass
+class CachedQuote:
+    """
+    A cached quote of a single symbol.
+
+    Attributes:
+        values (dict): The last known value of every field.
+        field_times (dict[str, float]): Monotonic time at which each field was last refreshed.
+        full_fetched_at (float): Monotonic time of the last full info fetch.
+    """
+    values: dict = field(default_factory=dict)
+    field_times: dict[str, float] = field(default_factory=dict)
+    full_fetched_at: Optional[float] = None
+
+@dataclass
+class BatchQuoteResult:
+    """
+    Result of a batched quote lookup.
+
+    Attributes:
+        quotes (dict[str, dict]): The requested fields per symbol that could be resolved.
+        errors (dict[str, str]): Why a symbol could not be resolved (freshly).
+        stale (set[str]): Symbols that timed out and are served from an expired cache entry instead.
+    """
+    quotes: dict[str, dict] = field(default_factory=dict)
+    errors: dict[str, str] = field(default_factory=dict)
+    stale: set[str] = field(default_factory=set)
+
+@dataclass
+class QuoteCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    errors: int = 0
+    evictions: int = 0
+    upstream_fetches: int = 0
+    fetch_seconds_total: float = 0.0
+    fetch_seconds_max: float = 0.0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "evictions": self.evictions,
+            "upstream_fetches": self.upstream_fetches,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "fetch_ms_avg": self.fetch_seconds_total / self.upstream_fetches * 1000 if self.upstream_fetches else 0.0,
+            "fetch_ms_max": self.fetch_seconds_max * 1000,
+        }
+
+class QuoteCache:
+    """
+    Process-wide cache in front of a quote provider.
+
+    Every field has its own TTL (bid/ask expire fast, static metadata slowly), the cache is bounded
+    by LRU eviction over symbols, and concurrent misses for the same symbol share one upstream fetch.
+    """
+    def __init__(self, provider: QuoteProvider, max_symbols: int, volatile_ttl: float, static_ttl: float, batch_workers: int):
+        self.provider = provider
+        self.max_symbols = max_symbols
+        self.static_ttl = static_ttl
+        self.field_ttls: dict[str, float] = {name: volatile_ttl for name in VOLATILE_FIELDS}
+
+        self.stats = QuoteCacheStats()
+        self._entries: OrderedDict[str, CachedQuote] = OrderedDict()
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        # Bounds the fan-out of batched lookups
+        self._executor = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="quote-fetch")
+
+    def ttl_of(self, field_name: str) -> float:
+        return self.field_ttls.get(field_name, self.static_ttl)
+
+    def _is_fresh(self, entry: CachedQuote, fields: Optional[Iterable[str]], now: float) -> bool:
+        """
+        Checks whether the requested fields of an entry are still within their TTL.
+        A field that is missing from a fresh full fetch counts as a fresh "missing" value.
+        """
+        if fields is None:
+            if entry.full_fetched_at is None or now - entry.full_fetched_at >= self.static_ttl:
+                return False
+            fields = self.field_ttls.keys()
+
+        for field_name in fields:
+            refreshed_at = entry.field_times.get(field_name, entry.full_fetched_at)
+            if refreshed_at is None or now - refreshed_at >= self.ttl_of(field_name):
+                return False
+        return True
+
+    def _store(self, symbol: str, values: dict, full: bool) -> None:
+        """ Merges freshly fetched values into the cache and applies LRU eviction. Must hold the lock. """
+        now = time.monotonic()
+        entry = self._entries.get(symbol)
+        if entry is None or full:
+            entry = CachedQuote()
+            self._entries[symbol] = entry
+        entry.values.update(values)
+        if full:
+            entry.full_fetched_at = now
+            entry.field_times = {name: now for name in self.field_ttls if name in values}
+        else:
+            entry.field_times.update({name: now for name in values})
+        self._entries.move_to_end(symbol)
+
+        while len(self._entries) > self.max_symbols:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _lookup(self, symbol: str, fields: Optional[Iterable[str]]) -> Union[dict, None]:
+        """ Returns a copy of the cached values if fresh. Must hold the lock. """
+        entry = self._entries.get(symbol)
+        if entry is not None and self._is_fresh(entry, fields, time.monotonic()):
+            self._entries.move_to_end(symbol)
+            return dict(entry.values)
+        return None
+
+    def _fetch_single_flight(self, key: str, fetch) -> Union[dict, None]:
+        """
+        Runs `fetch` once for all concurrent callers asking for the same key.
+
+        Returns:
+            Union[dict, None]: The fetched values, or None if the upstream fetch failed.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.stats.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        values = None
+        try:
+            start = time.perf_counter()
+            try:
+                values = fetch()
+            except Exception as error:
+                logger.error(f"Upstream quote fetch for {key} failed. Error: {error}")
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.stats.upstream_fetches += 1
+                self.stats.fetch_seconds_total += elapsed
+                self.stats.fetch_seconds_max = max(self.stats.fetch_seconds_max, elapsed)
+                if values is None:
+                    self.stats.errors += 1
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_result(values)
+        return values
+
+    def get_info(self, symbol: str, fields: Optional[Iterable[str]] = None) -> Union[dict, None]:
+        """
+        Get the info of a symbol from the cache, fetching it upstream if any requested field is stale.
+
+        Args:
+            symbol (str): The symbol to get info for.
+            fields (Iterable[str], optional): The fields the caller needs. Only their TTLs are checked.
+                                              If None, the whole info dictionary has to be fresh.
+
+        Returns:
+            Union[dict, None]: A copy of the symbol's info, or None if it could not be fetched.
+        """
+        symbol = symbol.upper()
+        with self._lock:
+            cached = self._lookup(symbol, fields)
+            if cached is not None:
+                self.stats.hits += 1
+                return cached
+            self.stats.misses += 1
+
+        def fetch_full_info() -> Union[dict, None]:
+            info = self.provider.get_info(symbol)
+            if info is not None:
+                with self._lock:
+                    self._store(symbol, info, full=True)
+            return info
+
+        info = self._fetch_single_flight(f"info:{symbol}", fetch_full_info)
+        return dict(info) if info is not None else None
+
+    async def get_info_async(self, symbol: str, fields: Optional[Iterable[str]] = None) -> Union[dict, None]:
+        """
+        Async variant of `get_info`. Cache hits are answered right away on the event loop,
+        misses are fetched on the cache's bounded pool so the event loop is never blocked by the provider.
+        Callers of a symbol that is already being fetched wait on the event loop instead of on a thread.
+        """
+        with self._lock:
+            cached = self._lookup(symbol.upper(), fields)
+            if cached is not None:
+                self.stats.hits += 1
+                return cached
+            in_flight = self._in_flight.get(f"info:{symbol.upper()}")
+            if in_flight is not None:
+                self.stats.misses += 1
+                self.stats.coalesced += 1
+
+        if in_flight is not None:
+            info = await asyncio.wrap_future(in_flight)
+            return dict(info) if info is not None else None
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.get_info, symbol, fields)
+
+    def get_quotes(self, symbols: Iterable[str], fields: Iterable[str] = PRICE_FIELDS, timeout: Optional[float] = None) -> BatchQuoteResult:
+        """
+        Resolve the same fields for a whole list of symbols in one pass.
+        Cached symbols are answered directly and the misses are fetched concurrently on a bounded pool.
+        If only `PRICE_FIELDS` are requested, the provider's lightweight price lookup is used.
+
+        Args:
+            symbols (Iterable[str]): The symbols to resolve.
+            fields (Iterable[str]): The fields needed for every symbol.
+            timeout (float, optional): Latency budget in seconds. Symbols not fetched by then are
+                                       reported as errors (and served stale if they were ever cached).
+
+        Returns:
+            BatchQuoteResult: Partial results with per-symbol errors.
+        """
+        fields = tuple(fields)
+        only_prices = set(fields) <= set(PRICE_FIELDS)
+        result = BatchQuoteResult()
+
+        misses = []
+        with self._lock:
+            for symbol in dict.fromkeys(symbol.upper() for symbol in symbols):
+                cached = self._lookup(symbol, fields)
+                if cached is not None:
+                    self.stats.hits += 1
+                    result.quotes[symbol] = {name: cached.get(name) for name in fields}
+                else:
+                    self.stats.misses += 1
+                    misses.append(symbol)
+
+        def fetch(symbol: str) -> Union[dict, None]:
+            values = self.provider.get_prices(symbol) if only_prices else self.provider.get_info(symbol)
+            if values is not None:
+                with self._lock:
+                    self._store(symbol, values, full=not only_prices)
+            return values
+
+        key_prefix = "prices" if only_prices else "info"
+        futures = {
+            self._executor.submit(self._fetch_single_flight, f"{key_prefix}:{symbol}", partial(fetch, symbol)): symbol
+            for symbol in misses
+        }
+        done, not_done = wait(futures, timeout=timeout)
+
+        for future in done:
+            symbol = futures[future]
+            values = future.result()
+            if values is None:
+                result.errors[symbol] = "Could not fetch quote"
+            else:
+                result.quotes[symbol] = {name: values.get(name) for name in fields}
+
+        for future in not_done:
+            symbol = futures[future]
+            result.errors[symbol] = f"Quote was not fetched within {timeout} seconds"
+            with self._lock:
+                entry = self._entries.get(symbol)
+                if entry is not None:
+                    result.quotes[symbol] = {name: entry.values.get(name) for name in fields}
+                    result.stale.add(symbol)
+
+        return result
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """ Drops one symbol from the cache, or everything if no symbol is given. """
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol.upper(), None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = self.stats.to_dict()
+            stats["cached_symbols"] = len(self._entries)
+            stats["max_symbols"] = self.max_symbols
+        return stats
+
+quote_cache = QuoteCache(
+    provider=YFinanceQuoteProvider(),
+    max_symbols=int(QUOTE_CACHE_MAX_SYMBOLS),
+    volatile_ttl=float(QUOTE_TTL_VOLATILE),
+    static_ttl=float(QUOTE_TTL_STATIC),
+    batch_workers=int(QUOTE_BATCH_WORKERS),
+)
+
+def set_quote_provider(provider: QuoteProvider) -> None:
+    """
+    Swap the upstream provider of the process-wide quote cache (e.g. for a local fake provider).
+    The cache is emptied so no values of the previous provider are served.
+    """
+    quote_cache.provider = provider
+    quote_cache.invalidate()
+    logger.info(f"Quote provider set to {provider.__class__.__name__}")
@@ -0,0 +1,252 @@
+from typing import Optional
+from collections import deque
+from dataclasses import dataclass, field
+import json
+import threading
+import time
+
+from utils.logger_script import logger
+from utils.quote_cache import QuoteCache, quote_cache
+from utils.env_variables import QUOTE_STREAM_INTERVAL, QUOTE_STREAM_QUEUE, QUOTE_STREAM_HEARTBEAT
+
+# Fields of a symbol pushed to the viewers of its stream
+STREAM_FIELDS = ("bid", "ask", "currentPrice")
+
+def encode_event(event: str, data: dict, event_id: Optional[int] = None) -> bytes:
+    """ Encodes a Server-Sent Event. """
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+# Sent when there was nothing to push for a while, so proxies keep the connection open
+HEARTBEAT = b": heartbeat\n\n"
+
+@dataclass
+class SymbolStream:
+    """
+    The shared state of a streamed symbol.
+
+    Attributes:
+        symbol (str): The symbol.
+        quote (dict): The last published value of every field.
+        seq (int): The sequence number of the last published change.
+        snapshot (tuple[int, bytes], optional): The sequence number and encoded snapshot event of the last published state,
+                                                shared by every (re)syncing viewer.
+        subscriptions (set[Subscription]): The viewers of the symbol.
+    """
+    symbol: str
+    quote: dict = field(default_factory=dict)
+    seq: int = 0
+    snapshot: Optional[tuple[int, bytes]] = None
+    subscriptions: set = field(default_factory=set)
+
+class Subscription:
+    """
+    A viewer of a symbol's stream, with its own bounded queue of encoded delta events.
+
+    A viewer that does not keep up is not allowed to hold back the others or to grow without bound:
+    once its queue is full, its pending deltas are dropped and it is sent a fresh snapshot instead,
+    so it skips straight to the latest state.
+
+    Args:
+        stream (SymbolStream): The stream of the symbol.
+        max_queue (int): The number of pending deltas after which the viewer is resynced.
+    """
+    def __init__(self, stream: SymbolStream, max_queue: int):
+        self.stream = stream
+        self.max_queue = max_queue
+        self.resyncs = 0
+        self._queue: deque[tuple[int, bytes]] = deque()
+        self._needs_snapshot = True
+        self._last_seq = 0
+        self._condition = threading.Condition()
+
+    def push(self, seq: int, message: bytes) -> None:
+        """ Queues a delta event, called by the poller. """
+        with self._condition:
+            # A viewer waiting for a snapshot gets this change with it
+            if not self._needs_snapshot:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.clear()
+                    self._needs_snapshot = True
+                    self.resyncs += 1
+                else:
+                    self._queue.append((seq, message))
+            self._condition.notify()
+
+    def get(self, timeout: float) -> list[bytes]:
+        """
+        Waits up to `timeout` seconds for events to send.
+
+        Returns:
+            list[bytes]: The snapshot (on the first call and after falling behind) or the pending deltas,
+                         empty if there was nothing to send within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._needs_snapshot:
+                    # The poller publishes the snapshot before pushing the deltas it includes
+                    snapshot = self.stream.snapshot
+                    if snapshot is not None:
+                        self._needs_snapshot = False
+                        self._queue.clear()
+                        self._last_seq, message = snapshot
+                        return [message]
+                elif self._queue:
+                    messages = [message for seq, message in self._queue if seq > self._last_seq]
+                    self._last_seq = self._queue[-1][0]
+                    self._queue.clear()
+                    if messages:
+                        return messages
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+
+class QuoteHub:
+    """
+    Fans out live quotes to every viewer of a symbol.
+
+    A single poller thread runs while any symbol has viewers. Every `interval` seconds it resolves the
+    quotes of all the viewed symbols in one batched pass of the quote cache, so a symbol is fetched
+    at most once per interval no matter how many viewers it has, and then pushes only the fields that
+    changed (encoded once and shared by all the symbol's viewers).
+
+    Args:
+        cache (QuoteCache): The quote cache quotes are resolved through.
+        interval (float): Seconds between polls.
+        max_queue (int): Pending deltas per viewer after which the viewer is resynced with a snapshot.
+        autostart (bool): Whether the poller thread is started by the first subscription.
+                          If False, `poll` is called by the owner (e.g. with a scripted quote source).
+    """
+    def __init__(self, cache: QuoteCache, interval: float, max_queue: int, autostart: bool = True):
+        self.cache = cache
+        self.interval = interval
+        self.max_queue = max_queue
+        self.autostart = autostart
+        self.stats = {"polls": 0, "upstream_errors": 0, "deltas": 0, "unchanged": 0, "delivered": 0, "poll_ms_max": 0.0}
+        self._streams: dict[str, SymbolStream] = {}
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+
+    def subscribe(self, symbol: str) -> Subscription:
+        """ Subscribes a viewer to a symbol. Its first event is a snapshot of the symbol's quote. """
+        symbol = symbol.upper()
+        with self._lock:
+            stream = self._streams.get(symbol)
+            if stream is None:
+                stream = self._streams[symbol] = SymbolStream(symbol)
+            subscription = Subscription(stream, self.max_queue)
+            stream.subscriptions.add(subscription)
+            if self.autostart and (self._poller is None or not self._poller.is_alive()):
+                self._poller = threading.Thread(target=self._run, name="quote-stream", daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """ Removes a viewer. A symbol without viewers is no longer polled. """
+        with self._lock:
+            stream = subscription.stream
+            stream.subscriptions.discard(subscription)
+            if not stream.subscriptions and self._streams.get(stream.symbol) is stream:
+                del self._streams[stream.symbol]
+
+    def poll(self) -> int:
+        """
+        Polls the viewed symbols once and publishes their changes.
+
+        Returns:
+            int: The number of symbols that changed.
+        """
+        with self._lock:
+            streams = dict(self._streams)
+        if not streams:
+            return 0
+
+        start = time.perf_counter()
+        # Symbols not fetched within the interval are skipped this time, instead of holding back the others
+        batch = self.cache.get_quotes(streams, fields=STREAM_FIELDS, timeout=self.interval)
+        changed = 0
+        for symbol, stream in streams.items():
+            quote = batch.quotes.get(symbol)
+            if quote is None or symbol in batch.stale:
+                self.stats["upstream_errors"] += 1
+                continue
+            if self._publish(stream, quote):
+                changed += 1
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats["polls"] += 1
+        self.stats["poll_ms_max"] = max(self.stats["poll_ms_max"], elapsed_ms)
+        return changed
+
+    def _publish(self, stream: SymbolStream, quote: dict) -> bool:
+        delta = {name: value for name, value in quote.items() if value is not None and stream.quote.get(name) != value}
+        if not delta:
+            self.stats["unchanged"] += 1
+            return False
+
+        now = time.time()
+        with self._lock:
+            stream.quote.update(delta)
+            stream.seq += 1
+            seq = stream.seq
+            stream.snapshot = (seq, encode_event("snapshot", {"symbol": stream.symbol, "seq": seq, "time": now, "quote": stream.quote}, seq))
+            subscriptions = list(stream.subscriptions)
+        message = encode_event("delta", {"symbol": stream.symbol, "seq": seq, "time": now, "quote": delta}, seq)
+        for subscription in subscriptions:
+            subscription.push(seq, message)
+        self.stats["deltas"] += 1
+        self.stats["delivered"] += len(subscriptions)
+        return True
+
+    def _run(self) -> None:
+        logger.info("Quote stream poller started")
+        while True:
+            with self._lock:
+                if not self._streams:
+                    self._poller = None
+                    break
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception as error:
+                logger.error(f"Quote stream poll failed. Error: {error}")
+            time.sleep(max(self.interval - (time.monotonic() - start), 0))
+        logger.info("Quote stream poller stopped, no symbol is viewed")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            streams = list(self._streams.values())
+            running = self._poller is not None and self._poller.is_alive()
+        return {
+            **self.stats,
+            "running": running,
+            "symbols": len(streams),
+            "viewers": sum(len(stream.subscriptions) for stream in streams),
+            "resyncs": sum(subscription.resyncs for stream in streams for subscription in list(stream.subscriptions)),
+        }
+
+def stream_events(hub: QuoteHub, symbol: str, heartbeat: float = float(QUOTE_STREAM_HEARTBEAT)):
+    """
+    Generates the Server-Sent Events of a viewer of a symbol: a snapshot, then the changes as they happen,
+    and a heartbeat comment whenever nothing was sent for `heartbeat` seconds.
+    The viewer is unsubscribed once the client disconnects (the generator is closed).
+    """
+    subscription = hub.subscribe(symbol)
+    try:
+        # Reconnect after a second if the connection drops, the new connection starts with a snapshot
+        yield b"retry: 1000\n\n"
+        while True:
+            messages = subscription.get(heartbeat)
+            yield b"".join(messages) if messages else HEARTBEAT
+    finally:
+        hub.unsubscribe(subscription)
+
+quote_hub = QuoteHub(
+    cache=quote_cache,
+    interval=float(QUOTE_STREAM_INTERVAL),
+    max_queue=int(QUOTE_STREAM_QUEUE),
+)
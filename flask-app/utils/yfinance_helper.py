@@ -1,15 +1,17 @@
-from typing import Union
-
-import yfinance as yf
+from typing import Union, Optional, Iterable
 
 from utils.logger_script import logger
+from utils.quote_cache import quote_cache
+from utils.env_variables import PORTFOLIO_QUOTE_BUDGET
 
-def get_symbol_info(symbol: str) -> Union[dict, None]:
+def get_symbol_info(symbol: str, fields: Optional[Iterable[str]] = None) -> Union[dict, None]:
     """
     Retrieves detailed financial information about a given symbol using yfinance's info attribute.
+    The information is served from the process-wide quote cache.
 
     Parameters:
         symbol (str): The stock symbol to retrieve information for.
+        fields (Iterable[str], optional): The fields the caller needs to be fresh. If None, the whole info has to be fresh.
 
     Returns:
         Union[dict, None]: A dictionary containing financial details about the symbol if successful, None otherwise.
@@ -19,45 +21,36 @@ def get_symbol_info(symbol: str) -> Union[dict, None]:
     """
     if symbol is None:
         logger.error(f"Entered symbol is None")
-    try:
-        ticker = yf.Ticker(symbol)
-    except Exception as error:
-        logger.error(f"Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
         return None
     try:
-        info = ticker.info
-        return info
+        return quote_cache.get_info(symbol, fields=fields)
     except Exception as error:
-        logger.error(f"222 Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
+        logger.error(f"Tried getting info for probably non-existent symbol: {symbol}.\nError:{error}")
         return None
 
-def get_current_prices_of_symbol_list(symbols: list[str]) -> dict[str, float]:
+def get_current_prices_of_symbol_list(symbols: list[str], timeout: float = float(PORTFOLIO_QUOTE_BUDGET)) -> dict[str, Union[float, None]]:
     """
-    Retrieves the current price for a list of stock symbols.
+    Retrieves the current price for a list of stock symbols in one batched pass.
 
     Parameters:
         symbols (list[str]): A list of stock symbols to retrieve current prices for.
+        timeout (float): Latency budget in seconds for fetching the prices that are not cached.
 
     Returns:
         dict[str, Union[float, None]]: A dictionary mapping each symbol to its current price or None if an error occurred.
     
     Notes:
-        - If an error occurs during fetching, the value for that symbol is set to None.
+        - Only the price fields are fetched, not the whole info of every symbol.
+        - If a price could not be fetched within the budget, the last known price is used when there is one,
+          otherwise the value for that symbol is set to None.
     """
-    
-    values = []
-    for symbol in symbols:
-        try:
-            symbol_info = get_symbol_info(symbol)
-            try:
-                current_price = symbol_info["currentPrice"]
-                values.append(current_price)
-            except Exception as error:
-                logger.error(f"Couldn't get current price for {symbol}")
-                values.append(None)
-        except Exception as error:
-            logger.error(f"Couldn't get symbol info for {symbol}")
-            values.append(None)
-            
-    return dict(zip(symbols,values))
+    symbols = list(symbols)
+    batch = quote_cache.get_quotes(symbols, fields=["currentPrice"], timeout=timeout)
+
+    for symbol, error in batch.errors.items():
+        if symbol in batch.stale:
+            logger.warning(f"Using last known price for {symbol}. {error}")
+        else:
+            logger.error(f"Couldn't get current price for {symbol}. {error}")
 
+    return {symbol: batch.quotes.get(symbol.upper(), {}).get("currentPrice") for symbol in symbols}